@@ -1,138 +1,95 @@
 import sys
-import threading
 import time
 import os
-from datetime import datetime
+from collections import deque
+
+# Riferimento per la timeline di avvio (--startup-timeline)
+_T_AVVIO = time.perf_counter()
 
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QVBoxLayout, QProgressBar, QFrame,
     QPushButton, QHBoxLayout, QTabWidget, QListWidget, QListWidgetItem,
-    QStyle, QStyleFactory, QMdiArea, QMdiSubWindow
+    QStyleFactory, QMdiArea, QMdiSubWindow
 )
-from PyQt5.QtGui import QFont, QPixmap, QWindow, QGuiApplication, QIcon, QPalette, QColor, QLinearGradient
-from PyQt5.QtCore import Qt, pyqtSignal, QObject, QProcess, QTimer
-
-# Optional imports / platform-specific
-try:
-    import serial
-except Exception:
-    serial = None
-
-import subprocess
-import psutil
-
-# pycaw for Windows volume control
-try:
-    from ctypes import POINTER, cast
-    from comtypes import CLSCTX_ALL
-    from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
-    pycaw_available = True
-except Exception:
-    pycaw_available = False
-
-# pywin32 for window embedding (Windows)
-try:
-    import win32gui
-    import win32process
-    win32_available = True
-except Exception:
-    win32_available = False
-
-# Import del monitor della batteria (se presente)
-try:
-    from can_monitor import create_battery_monitor
-except Exception:
-    create_battery_monitor = None
+from PyQt5.QtGui import QFont, QPixmap, QPalette, QColor, QLinearGradient
+from PyQt5.QtCore import Qt, pyqtSignal, QObject, QTimer
+
+from pipeline import TripPipeline
+from efficienza import NOMI_FASCE
+import theme
+from theme import set_ruolo
+import metrics
+import logconfig
+import profiler
+
+log = logconfig.get("gui")
 
 # Variabile per la modalità test (0 = normale, 1 = testing grafico)
 test = 1  # Imposta a 1 per testing grafico senza connessioni reali
 
-# Inizializzazione della comunicazione seriale con modulo esterno per trip (solo se non in modalità test)
-ser = None
-if test == 0 and serial is not None:
-    try:
-        ser = serial.Serial('COM201', 9600, timeout=1)
-    except Exception as e:
-        print(f"Errore connessione seriale: {e}")
-        ser = None
-
-# Variabili globali per la gestione del viaggio e autonomia
-inizializzato = 0
-inizio = 100
-media = 0
-last = 0
-trip_km = 0.0
-start_time = None
-
-# Creazione e avvio del monitor della batteria (solo se non in modalità test)
-monitorBAT = None
-if test == 0 and create_battery_monitor is not None:
-    try:
-        monitorBAT = create_battery_monitor()
-        monitorBAT.start()
-    except Exception as e:
-        print(f"Errore inizializzazione monitor batteria: {e}")
-        monitorBAT = None
+ICON_PATH = "bluecar_icon.png"
+ICON_CACHE = "cache/bluecar_icon_240x140.png"
+STARTUP_BUDGET = 1.0  # Secondi entro cui la tab Trip deve essere visibile
+MAX_TRACK = 20000     # Fix tenuti finché la tab Mappa non esiste (la mappa ne tiene al massimo mapview.MAX_TRACK)
 
+# I moduli pesanti e specifici di Windows (pycaw/comtypes, pywin32) e quelli
+# delle tab costruite in ritardo (mapview con NumPy, mapembed, bluetooth)
+# vengono importati solo al primo utilizzo per non rallentare l'avvio
 
-def algokm(attuale):
-    """
-    Calcola l'autonomia residua basata sul consumo della batteria e le statistiche del viaggio.
-    """
-    global inizializzato, inizio, media, trip_km, start_time
-
-    if test == 1:
-        time.sleep(1)
-        import random
-        trip_km = random.uniform(5.0, 50.0)
-        media = random.uniform(30.0, 80.0)
-        if inizializzato == 0 and attuale > 0:
-            inizializzato = 1
-            inizio = attuale
-            start_time = datetime.now()
-        percento = inizio - attuale
-        if percento > 1:
-            kmrim = (trip_km / percento) * attuale
-        else:
-            kmrim = 0.0
-        return round(kmrim, 1)
 
-    trip_distance_km = 0
-    trip_avg_speed_kmh = 0
-    trip_speed_kmh = 0
+class StartupTimeline:
+    """Tempi delle fasi di avvio, stampati al primo frame con --startup-timeline"""
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.fasi = []
+        self.ultimo = _T_AVVIO
+        self.reported = False
 
-    if (inizializzato == 0) and attuale > 0:
-        if ser is not None:
-            try:
-                ser.write(b'R')
-            except Exception:
-                pass
-        inizializzato = 1
-        inizio = attuale
-        start_time = datetime.now()
+    def mark(self, fase):
+        if not self.enabled:
+            return
+        adesso = time.perf_counter()
+        self.fasi.append((fase, adesso - self.ultimo, adesso - _T_AVVIO))
+        self.ultimo = adesso
 
-    time.sleep(1)
+    def report(self):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        print("Timeline di avvio:")
+        for fase, durata, totale in self.fasi:
+            print(f"  {fase:28s} {durata * 1000:8.1f} ms   (t = {totale * 1000:7.1f} ms)")
+        totale = self.fasi[-1][2] if self.fasi else 0.0
+        esito = "OK" if totale <= STARTUP_BUDGET else "OLTRE IL BUDGET"
+        print(f"  Trip visibile in {totale:.3f} s (budget {STARTUP_BUDGET:.1f} s): {esito}")
 
-    if ser is not None:
-        try:
-            line = ser.readline().decode().strip()
-            if line.startswith("STATS"):
-                parts = line.split(',')
-                trip_distance_km = float(parts[2]) / 1000
-                trip_avg_speed_kmh = float(parts[4]) * 3.6
-                trip_km = trip_distance_km
-                trip_speed_kmh = trip_avg_speed_kmh
-        except Exception:
-            pass
 
-    media = trip_speed_kmh
-    percento = inizio - attuale
-    if percento > 1:
-        kmrim = (trip_km / percento) * attuale
-    else:
-        kmrim = 0.0
+timeline = StartupTimeline("--startup-timeline" in sys.argv)
+timeline.mark("import moduli")
 
-    return round(kmrim, 1)
+# Finestra principale attiva (cambia dopo un riavvio soft)
+finestra = None
+
+
+def load_car_icon():
+    """
+    Restituisce l'icona dell'auto già scalata a 240x140.
+    La versione scalata viene salvata in cache per evitare di ridimensionare
+    ad ogni avvio il PNG originale da 1.5 MB.
+    """
+    try:
+        if (os.path.exists(ICON_CACHE) and
+                os.path.getmtime(ICON_CACHE) >= os.path.getmtime(ICON_PATH)):
+            pixmap = QPixmap(ICON_CACHE)
+            if not pixmap.isNull():
+                return pixmap
+    except OSError:
+        pass
+    pixmap = QPixmap(ICON_PATH).scaled(240, 140, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    if not pixmap.isNull():
+        os.makedirs(os.path.dirname(ICON_CACHE), exist_ok=True)
+        pixmap.save(ICON_CACHE)
+    return pixmap
 
 
 class DataSignals(QObject):
@@ -167,15 +124,6 @@ class TripTab(QWidget):
         battery_frame = QFrame()
         battery_frame.setFixedWidth(100)
         battery_frame.setObjectName("batteryFrame")
-        battery_frame.setStyleSheet("""
-            QFrame#batteryFrame {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #2a3b4d, stop: 1 #1e2a38);
-                border: 2px solid #3a5066;
-                border-radius: 12px;
-                padding: 5px;
-            }
-        """)
         battery_layout = QVBoxLayout(battery_frame)
         battery_layout.setContentsMargins(8, 8, 8, 8)
         battery_layout.setSpacing(10)
@@ -183,29 +131,14 @@ class TripTab(QWidget):
         battery_label = QLabel("BATTERIA")
         battery_label.setFont(QFont("Arial", 10,5, QFont.Bold))
         battery_label.setAlignment(Qt.AlignCenter)
-        battery_label.setStyleSheet("color: #e0e0e0; background: transparent;")
+        set_ruolo(battery_label, "testo")
 
         self.battery_progress = QProgressBar()
         self.battery_progress.setOrientation(Qt.Vertical)
         self.battery_progress.setTextVisible(True)
         self.battery_progress.setFixedSize(70, 220)
         self.battery_progress.setFormat("%p%")
-        self.battery_progress.setStyleSheet("""
-            QProgressBar {
-                background: #1a2530;
-                border: 2px solid #3a5066;
-                border-radius: 8px;
-                text-align: center;
-                color: white;
-                font-weight: bold;
-            }
-            QProgressBar::chunk {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #00ff88, stop: 0.5 #00cc66, stop: 1 #00aa44);
-                border-radius: 6px;
-                margin: 2px;
-            }
-        """)
+        self.battery_progress.setObjectName("batteryProgress")
 
         battery_layout.addWidget(battery_label)
         battery_layout.addWidget(self.battery_progress, 0, Qt.AlignCenter)
@@ -221,42 +154,23 @@ class TripTab(QWidget):
         title = QLabel("BLUECAR MONITOR")
         title.setFont(QFont("Arial", 24, QFont.Bold))
         title.setAlignment(Qt.AlignCenter)
-        title.setStyleSheet("""
-            color: #00ccff;
-            background: transparent;
-            text-shadow: 1px 1px 2px #000000;
-        """)
+        set_ruolo(title, "titolo")
 
         car_image = QLabel()
         if test == 1:
             car_image.setText("🚗 BLUECAR\n(Modalità Test)")
             car_image.setAlignment(Qt.AlignCenter)
             car_image.setFixedSize(240, 140)
-            car_image.setStyleSheet("""
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #3a5066, stop: 1 #2a3b4d);
-                color: #00ccff;
-                border: 2px solid #4a6580;
-                border-radius: 12px;
-                font-weight: bold;
-                font-size: 14px;
-            """)
+            car_image.setObjectName("carPlaceholder")
         else:
             try:
-                pixmap = QPixmap("bluecar_icon.png").scaled(240, 140, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                pixmap = load_car_icon()
                 car_image.setPixmap(pixmap)
                 car_image.setAlignment(Qt.AlignCenter)
-                car_image.setStyleSheet("background: transparent;")
+                car_image.setObjectName("carImage")
             except Exception:
                 car_image.setText("🚗 BLUECAR")
-                car_image.setStyleSheet("""
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #3a5066, stop: 1 #2a3b4d);
-                    color: #00ccff;
-                    border: 2px solid #4a6580;
-                    border-radius: 12px;
-                    font-weight: bold;
-                """)
+                car_image.setObjectName("carPlaceholder")
 
         center_column.addWidget(title)
         center_column.addWidget(car_image)
@@ -268,15 +182,6 @@ class TripTab(QWidget):
 
         range_frame = QFrame()
         range_frame.setObjectName("rangeFrame")
-        range_frame.setStyleSheet("""
-            QFrame#rangeFrame {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #2a3b4d, stop: 1 #1e2a38);
-                border: 2px solid #3a5066;
-                border-radius: 12px;
-                padding: 10px;
-            }
-        """)
         range_layout = QVBoxLayout(range_frame)
         range_layout.setContentsMargins(8, 8, 8, 8)
         range_layout.setSpacing(10)
@@ -284,40 +189,31 @@ class TripTab(QWidget):
         range_title = QLabel("AUTONOMIA")
         range_title.setFont(QFont("Arial", 16, QFont.Bold))
         range_title.setAlignment(Qt.AlignCenter)
-        range_title.setStyleSheet("color: #00ccff; background: transparent;")
+        set_ruolo(range_title, "titolo")
 
         self.range_km = QLabel("-- km")
         self.range_km.setFont(QFont("Arial", 28, QFont.Bold))
         self.range_km.setAlignment(Qt.AlignCenter)
-        self.range_km.setStyleSheet("color: #00ff88; background: transparent;")
+        set_ruolo(self.range_km, "valore")
 
         range_wltp_label = QLabel("WLTP: -- km")
         range_wltp_label.setFont(QFont("Arial", 12))
         range_wltp_label.setAlignment(Qt.AlignCenter)
-        range_wltp_label.setStyleSheet("color: #a0a0a0; background: transparent;")
+        set_ruolo(range_wltp_label, "secondario")
 
-        range_calc_label = QLabel("Calcolato: -- km")
-        range_calc_label.setFont(QFont("Arial", 12, QFont.Bold))
-        range_calc_label.setAlignment(Qt.AlignCenter)
-        range_calc_label.setStyleSheet("color: #00ccff; background: transparent;")
+        self.range_calc_label = QLabel("Calcolato: -- km")
+        self.range_calc_label.setFont(QFont("Arial", 12, QFont.Bold))
+        self.range_calc_label.setAlignment(Qt.AlignCenter)
+        set_ruolo(self.range_calc_label, "titolo")
 
         range_layout.addWidget(range_title)
         range_layout.addWidget(self.range_km)
         range_layout.addWidget(range_wltp_label)
-        range_layout.addWidget(range_calc_label)
+        range_layout.addWidget(self.range_calc_label)
         range_layout.addStretch()
 
         info_frame = QFrame()
         info_frame.setObjectName("infoFrame")
-        info_frame.setStyleSheet("""
-            QFrame#infoFrame {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #006633, stop: 1 #004422);
-                border: 2px solid #008855;
-                border-radius: 12px;
-                padding: 10px;
-            }
-        """)
         info_layout = QVBoxLayout(info_frame)
         info_layout.setContentsMargins(8, 8, 8, 8)
         info_layout.setSpacing(10)
@@ -325,13 +221,13 @@ class TripTab(QWidget):
         info_title = QLabel("INFO VIAGGIO")
         info_title.setFont(QFont("Arial", 14, QFont.Bold))
         info_title.setAlignment(Qt.AlignCenter)
-        info_title.setStyleSheet("color: #ffffff; background: transparent;")
+        set_ruolo(info_title, "infoTitolo")
 
         self.info_text = QLabel()
         self.info_text.setFont(QFont("Arial", 12))
         self.info_text.setAlignment(Qt.AlignLeft)
         self.info_text.setWordWrap(True)
-        self.info_text.setStyleSheet("color: #e0ffe0; background: transparent;")
+        set_ruolo(self.info_text, "infoTesto")
 
         info_layout.addWidget(info_title)
         info_layout.addWidget(self.info_text)
@@ -340,26 +236,7 @@ class TripTab(QWidget):
         reset_button = QPushButton("🔄 RESET TRIP")
         reset_button.setFixedHeight(45)
         reset_button.setFont(QFont("Arial", 12, QFont.Bold))
-        reset_button.setStyleSheet("""
-            QPushButton {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #ff5555, stop: 1 #cc3333);
-                color: white;
-                border: 2px solid #ff7777;
-                border-radius: 8px;
-                padding: 5px;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #ff7777, stop: 1 #dd5555);
-                border: 2px solid #ff9999;
-            }
-            QPushButton:pressed {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #cc3333, stop: 1 #aa2222);
-            }
-        """)
+        set_ruolo(reset_button, "pericolo")
         reset_button.clicked.connect(self.reset_trip)
 
         right_column.addWidget(range_frame)
@@ -373,109 +250,45 @@ class TripTab(QWidget):
 
         self.setLayout(main_layout)
 
-    def refresh_ui(self, battery_value, est_range_km, wltp_range_km, avg_speed, trip_km):
+    def refresh_ui(self, battery_value, est_range_km, wltp_range_km, avg_speed, trip_km, range_band=None,
+                   efficienza=None, percorso=None):
         self.range_km.setText(f"{est_range_km:.1f} km")
+        if range_band is not None:
+            self.range_calc_label.setText(f"Calcolato: {range_band[0]:.0f}-{range_band[1]:.0f} km")
         self.battery_progress.setValue(int(battery_value))
-        self.info_text.setText(f"Velocità media: {avg_speed:.1f} km/h\nTrip km: {trip_km:.2f} km\nWLTP: {int((battery_value/100)*wltp_range_km)} km")
+        testo = f"Velocità media: {avg_speed:.1f} km/h\nTrip km: {trip_km:.2f} km\nWLTP: {int((battery_value/100)*wltp_range_km)} km"
+        if efficienza is not None and efficienza.wh_km is not None:
+            fasce = " · ".join(f"{nome} {wh_km:.0f}" for nome, wh_km in zip(NOMI_FASCE[1:], efficienza.fasce[1:])
+                               if wh_km is not None)
+            testo += (f"\nConsumo: {efficienza.wh_km:.0f} Wh/km, fermo {efficienza.quota_fermo * 100:.0f}% "
+                      f"({efficienza.fermate} soste)\nRecupero: {efficienza.recupero_wh:.0f} Wh "
+                      f"(+{efficienza.recupero_km:.1f} km)\nWh/km per fascia: {fasce}")
+        if percorso is not None:
+            km, arrivo, viaggi = percorso
+            testo += f"\nPercorso noto ({viaggi} viaggi): {km:.1f} km, arrivo al {max(0.0, arrivo):.0f}%"
+        self.info_text.setText(testo)
 
     def reset_trip(self):
-        global inizializzato, inizio, trip_km, start_time
-        end_time = datetime.now()
-        if start_time is not None and trip_km > 0:
-            percent_consumed = inizio - self.parent.battery_value
-            self.log_trip(start_time, end_time, trip_km, percent_consumed)
-        inizializzato = 0
-        trip_km = 0.0
+        self.parent.pipeline.richiedi_reset()
         self.parent.trip_km = 0.0
         self.parent.est_range_km = 0
-        start_time = None
+        self.parent.range_band = None
         self.refresh_ui(self.parent.battery_value, self.parent.est_range_km,
                         self.parent.wltp_range_km, self.parent.avg_speed, self.parent.trip_km)
-
-    def log_trip(self, start, end, km, percent):
-        os.makedirs("logtrip", exist_ok=True)
-        with open("logtrip/oldtrip.txt", "a") as f:
-            line = f"{start.strftime('%Y-%m-%d %H:%M')} | {end.strftime('%Y-%m-%d %H:%M')} | {km:.2f} km | {percent:.1f}% consumati\n"
-            f.write(line)
-
-
-def rileva_dispositivi():
-    """
-    Chiama bluetoothc.exe dispositivi e restituisce lista di (nome, id).
-    Legge output iniziale con timeout per evitare blocco.
-    """
-    dispositivi_rilevati = []
-    try:
-        proc = subprocess.Popen(
-            ["bluetoothc.exe", "dispositivi"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',  # Aggiungi encoding esplicito
-            errors='ignore'    # Ignora errori di decoding
-        )
-        try:
-            output, error = proc.communicate(timeout=5)  # Aumenta timeout a 5 secondi
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            output, error = proc.communicate()
-
-        # Debug: stampa l'output per vedere cosa viene ricevuto
-        print(f"Output completo: {repr(output)}")
-        print(f"Errori: {repr(error)}")
-
-        for riga in output.splitlines():
-            riga = riga.strip()
-            print(f"Riga elaborata: {repr(riga)}")  # Debug
-            
-            # Salta righe vuote o di stato
-            if not riga or riga.startswith("Ricerca dispositivi"):
-                continue
-            
-            # Cerca il formato nome@id
-            if '@' in riga:
-                try:
-                    # Dividi al primo @
-                    parts = riga.split('@', 1)
-                    nome = parts[0].strip()
-                    dev_id = '@' + parts[1].strip()  # Aggiungi @ all'inizio dell'ID
-                    
-                    # Filtra dispositivi non validi
-                    if nome and dev_id and len(dev_id) > 1:
-                        dispositivi_rilevati.append((nome, dev_id))
-                        print(f"Dispositivo trovato: {nome} -> {dev_id}")  # Debug
-                except Exception as e:
-                    print(f"Errore parsing riga '{riga}': {e}")
-                    continue
-            
-            # Alternative: potrebbero esserci altri formati
-            elif '\\' in riga and any(keyword in riga for keyword in ['BTHENUM', 'VID', 'PID']):
-                # Probabilmente è un ID dispositivo diretto
-                nome = "Dispositivo Sconosciuto"
-                dev_id = riga.strip()
-                dispositivi_rilevati.append((nome, dev_id))
-                print(f"Dispositivo trovato (formato alternativo): {nome} -> {dev_id}")
-
-    except FileNotFoundError:
-        print("⚠️ bluetoothc.exe non trovato!")
-    except Exception as e:
-        print(f"Errore rileva_dispositivi: {e}")
-    
-    print(f"Dispositivi finali: {dispositivi_rilevati}")  # Debug
-    return dispositivi_rilevati
-
-
-
-
-
+        self.range_calc_label.setText("Calcolato: -- km")
 
 
 class MediaTab(QWidget):
     """Tab per la gestione dei media e del Bluetooth"""
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, supervisor=None):
         super().__init__(parent)
-        self.connected_process = None
+        from bluetooth import DeviceCache, DeviceDiscovery, ConnectionSupervisor
+        self.supervisor = supervisor if supervisor is not None else ConnectionSupervisor(self)
         self.volume = None
+        self.device_cache = DeviceCache()
+        self.discovery = DeviceDiscovery(self)
+        self.discovery.device_found.connect(self.on_device_found)
+        self.discovery.finished.connect(self.on_discovery_finished)
         
         # Sfondo con gradiente automotive
         self.setAutoFillBackground(True)
@@ -496,64 +309,30 @@ class MediaTab(QWidget):
         title = QLabel("🎵 MEDIA & BLUETOOTH")
         title.setFont(QFont("Arial", 10, QFont.Bold))
         title.setAlignment(Qt.AlignCenter)
-        title.setStyleSheet("""
-            color: #00ccff;
-            background: transparent;
-            text-shadow: 1px 1px 2px #000000;
-        """)
+        set_ruolo(title, "titolo")
         layout.addWidget(title)
 
         devices_label = QLabel("Dispositivi Bluetooth:")
         devices_label.setFont(QFont("Arial", 12, QFont.Bold))
-        devices_label.setStyleSheet("color: #e0e0e0; background: transparent;")
+        set_ruolo(devices_label, "testo")
         layout.addWidget(devices_label)
 
         self.devices_list = QListWidget()
         self.devices_list.setFont(QFont("Arial", 10))
-        self.devices_list.setStyleSheet("""
-            QListWidget {
-                background: #1a2530;
-                color: #e0e0e0;
-                border: 2px solid #3a5066;
-                border-radius: 8px;
-                padding: 5px;
-            }
-            QListWidget::item {
-                padding: 6px;
-                border-bottom: 1px solid #2a3b4d;
-            }
-            QListWidget::item:selected {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #00ccff, stop: 1 #0088cc);
-                color: white;
-                border-radius: 4px;
-            }
-        """)
+        self.devices_list.setObjectName("devicesList")
         layout.addWidget(self.devices_list)
 
+        self.bt_status = QLabel()
+        self.bt_status.setFont(QFont("Arial", 11))
+        set_ruolo(self.bt_status, "secondario")
+        layout.addWidget(self.bt_status)
+        self.supervisor.state_changed.connect(self.on_bt_state)
+        self.on_bt_state(self.supervisor.stato, self.supervisor.desiderato[0] if self.supervisor.desiderato else "")
+
         refresh_btn = QPushButton("🔄 AGGIORNA")
         refresh_btn.setFixedHeight(50)
         refresh_btn.setFont(QFont("Arial", 14, QFont.Bold))
-        refresh_btn.setStyleSheet("""
-            QPushButton {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #3a5066, stop: 1 #2a3b4d);
-                color: #00ccff;
-                border: 2px solid #4a6580;
-                border-radius: 8px;
-                padding: 5px;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #4a6580, stop: 1 #3a5066);
-                border: 2px solid #5a7590;
-            }
-            QPushButton:pressed {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #2a3b4d, stop: 1 #1e2a38);
-            }
-        """)
+        set_ruolo(refresh_btn, "secondario")
         refresh_btn.clicked.connect(self.refresh_devices)
         layout.addWidget(refresh_btn)
 
@@ -564,26 +343,7 @@ class MediaTab(QWidget):
         for btn in [self.connect_btn, self.disconnect_btn]:
             btn.setFixedHeight(50)
             btn.setFont(QFont("Arial", 14, QFont.Bold))
-            btn.setStyleSheet("""
-                QPushButton {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #00cc66, stop: 1 #00aa44);
-                    color: white;
-                    border: 2px solid #00ee77;
-                    border-radius: 8px;
-                    padding: 5px;
-                    font-weight: bold;
-                }
-                QPushButton:hover {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #00ee77, stop: 1 #00cc66);
-                    border: 2px solid #00ff88;
-                }
-                QPushButton:pressed {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #00aa44, stop: 1 #008833);
-                }
-            """)
+            set_ruolo(btn, "azione")
         bt_buttons_layout.addWidget(self.connect_btn)
         bt_buttons_layout.addWidget(self.disconnect_btn)
         layout.addLayout(bt_buttons_layout)
@@ -595,7 +355,7 @@ class MediaTab(QWidget):
         volume_label = QLabel("🔊 VOLUME")
         volume_label.setFont(QFont("Arial", 18, QFont.Bold))
         volume_label.setAlignment(Qt.AlignCenter)
-        volume_label.setStyleSheet("color: #00ccff; background: transparent;")
+        set_ruolo(volume_label, "titolo")
         layout.addWidget(volume_label)
 
         volume_layout = QHBoxLayout()
@@ -605,25 +365,7 @@ class MediaTab(QWidget):
         for btn in [self.volume_down, self.volume_up]:
             btn.setFixedSize(80, 80)
             btn.setFont(QFont("Arial", 18, QFont.Bold))
-            btn.setStyleSheet("""
-                QPushButton {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #3a5066, stop: 1 #2a3b4d);
-                    color: #00ccff;
-                    border: 2px solid #4a6580;
-                    border-radius: 40px;
-                    font-weight: bold;
-                }
-                QPushButton:hover {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #4a6580, stop: 1 #3a5066);
-                    border: 2px solid #5a7590;
-                }
-                QPushButton:pressed {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #2a3b4d, stop: 1 #1e2a38);
-                }
-            """)
+            set_ruolo(btn, "volume")
         volume_layout.addStretch()
         volume_layout.addWidget(self.volume_down)
         volume_layout.addWidget(self.volume_up)
@@ -632,54 +374,74 @@ class MediaTab(QWidget):
 
         self.setLayout(layout)
 
-        # Setup
+        # Setup: prima i dispositivi noti dalla cache, poi la scansione in background
+        for nome, dev_id in self.device_cache.items():
+            self.add_device(nome, dev_id, noto=True)
         self.refresh_devices()
         self.init_volume_control()
         self.volume_down.clicked.connect(self.decrease_volume)
         self.volume_up.clicked.connect(self.increase_volume)
 
     def refresh_devices(self):
-        self.devices_list.clear()
-        dispositivi = rileva_dispositivi()
-        for nome, dev_id in dispositivi:
-            # Pulisci il nome da caratteri speciali
-            nome_pulito = nome.replace('@', '').replace('\\', '').strip()
-            if not nome_pulito:
-                nome_pulito = "Dispositivo Sconosciuto"
-        
-            item = QListWidgetItem(f"📱 {nome_pulito}")
+        """Avvia una scansione asincrona; i dispositivi arrivano uno alla volta"""
+        if not self.discovery.start():
+            return
+        # I dispositivi già in lista restano visibili, in grigio finché non vengono ritrovati
+        for i in range(self.devices_list.count()):
+            self.devices_list.item(i).setForeground(QColor(128, 128, 128))
+
+    def add_device(self, nome, dev_id, noto=False):
+        # Pulisci il nome da caratteri speciali
+        nome_pulito = nome.replace('@', '').replace('\\', '').strip()
+        if not nome_pulito:
+            nome_pulito = "Dispositivo Sconosciuto"
+
+        for i in range(self.devices_list.count()):
+            item = self.devices_list.item(i)
+            if item.data(Qt.UserRole) == dev_id:
+                break
+        else:
+            item = QListWidgetItem()
             item.setFont(QFont("Arial", 12))
             item.setData(Qt.UserRole, dev_id)
             self.devices_list.addItem(item)
-            print(f"Aggiunto alla lista: {nome_pulito} -> {dev_id}")  # Debug
+        item.setText(f"📱 {nome_pulito}")
+        item.setForeground(QColor(128, 128, 128) if noto else QColor(224, 224, 224))
+
+    def on_device_found(self, nome, dev_id):
+        self.add_device(nome, dev_id)
+        self.device_cache.update(nome, dev_id)
+
+    def on_discovery_finished(self, dispositivi):
+        if dispositivi:
+            self.device_cache.save()
 
     def connect_device(self):
         item = self.devices_list.currentItem()
         if item:
             dev_id = item.data(Qt.UserRole)[1:]
-           
-            try:
-                proc = subprocess.Popen(
-                    ["bluetoothc.exe", "dispositivi", "connetti", dev_id]
-                )
-                self.connected_process = proc
-                print(f"✅ Connesso a {item.text()} ({dev_id})")
-            except Exception as e:
-                print("Errore nella connessione:", e)
+            self.supervisor.connect_device(item.text().replace("📱", "").strip(), dev_id)
 
     def disconnect_device(self):
-        for proc in psutil.process_iter(['pid', 'name']):
-            try:
-                if proc.info['name'] and proc.info['name'].lower() == "bluetoothc.exe":
-                    proc.kill()
-            except Exception:
-                pass
-        self.connected_process = None
-        print("💥 Disconnesso (processo bluetoothc.exe chiuso)")
+        self.supervisor.disconnect_device()
+        log.info("Disconnesso (processo bluetoothc chiuso)")
+
+    def on_bt_state(self, stato, nome):
+        testi = {
+            "disconnesso": "Nessun dispositivo connesso",
+            "connessione": f"Connessione a {nome}...",
+            "connesso": f"Connesso a {nome}",
+            "attesa": f"Connessione a {nome} persa, nuovo tentativo a breve",
+        }
+        self.bt_status.setText(testi.get(stato, stato))
 
     def init_volume_control(self):
-        if not pycaw_available:
-            print("pycaw non disponibile: controllo volume disabilitato")
+        try:
+            from ctypes import POINTER, cast
+            from comtypes import CLSCTX_ALL
+            from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+        except Exception:
+            log.warning("pycaw non disponibile: controllo volume disabilitato")
             self.volume = None
             return
         try:
@@ -687,7 +449,7 @@ class MediaTab(QWidget):
             interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
             self.volume = cast(interface, POINTER(IAudioEndpointVolume))
         except Exception as e:
-            print("Impossibile inizializzare controllo volume:", e)
+            log.error("Impossibile inizializzare controllo volume: %s", e)
             self.volume = None
 
     def increase_volume(self):
@@ -711,12 +473,18 @@ class MediaTab(QWidget):
 
 class MapTab(QWidget):
     """Tab per la visualizzazione della mappa di navigazione con MDI"""
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, finder=None):
         super().__init__(parent)
         self.parent = parent
-        self.process = None
         self.container = None
         self.sub_window = None
+
+        # Avvio e ricerca della finestra senza bloccare il thread della UI
+        from mapembed import WindowEmbedder, default_finder
+        self.embedder = WindowEmbedder(self, finder if finder is not None else default_finder(),
+                                       instrument=timeline.enabled)
+        self.embedder.window_ready.connect(self._embed_window)
+        self.embedder.failed.connect(lambda motivo: log.warning("Mappa: %s", motivo))
         
         # Sfondo nero per contrasto con la mappa
         self.setAutoFillBackground(True)
@@ -736,16 +504,7 @@ class MapTab(QWidget):
         self.mdi_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
         self.mdi_area.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
         self.mdi_area.setViewMode(QMdiArea.SubWindowView)
-        self.mdi_area.setStyleSheet("""
-            QMdiArea {
-                background-color: #000000;
-                border: none;
-            }
-            QMdiSubWindow {
-                background: transparent;
-                border: none;
-            }
-        """)
+        self.mdi_area.setObjectName("mapArea")
         
         layout.addWidget(self.mdi_area)
         self.setLayout(layout)
@@ -755,97 +514,23 @@ class MapTab(QWidget):
             QTimer.singleShot(1000, self.start_map)
 
     def start_map(self):
-        """Avvia mspaint.exe e lo integra nell'area MDI"""
-        exe_path = "mspaint.exe"
-
-        if not win32_available:
-            try:
-                subprocess.Popen([exe_path])
-            except Exception:
-                pass
-            return
+        """Avvia l'app di navigazione e la integra nell'area MDI appena compare la finestra"""
+        from mapembed import MAP_EXE
+        self._remove_subwindows()
+        self.embedder.start(MAP_EXE)
 
+    def _embed_window(self, container):
+        """Chiamata sul thread della UI quando la finestra esterna è pronta"""
         try:
-            if self.process is not None:
-                try:
-                    pid_running = int(self.process.processId()) if self.process.processId() else None
-                    if pid_running:
-                        for p in psutil.process_iter(['pid', 'name']):
-                            if p.info['pid'] == pid_running:
-                                p.kill()
-                except Exception:
-                    pass
-
-            self.process = QProcess(self)
-            self.process.started.connect(self._on_process_started)
-            self.process.start(exe_path)
-        except Exception:
-            pass
-
-    def _on_process_started(self):
-        """Dopo lo start, prova a trovare la window handle e integrarla in MDI"""
-        QTimer.singleShot(1000, self._try_embed_window)
-
-    def _find_hwnd_for_pid(self, pid, timeout=5.0):
-        """Cerca una finestra top-level per il PID specificato"""
-        end = time.time() + timeout
-        found = []
-
-        def enum_cb(hwnd, _):
-            try:
-                if not win32gui.IsWindowVisible(hwnd):
-                    return
-                _, wid_pid = win32process.GetWindowThreadProcessId(hwnd)
-                if wid_pid == pid:
-                    found.append(hwnd)
-            except Exception:
-                                pass
-
-        while time.time() < end and not found:
-            try:
-                win32gui.EnumWindows(enum_cb, None)
-            except Exception:
-                pass
-            if found:
-                return found[0]
-            time.sleep(0.15)
-        return None
-
-    def _try_embed_window(self):
-        try:
-            pid = int(self.process.processId())
-        except Exception:
-            pid = None
-
-        if not pid:
-            return
-
-        hwnd = self._find_hwnd_for_pid(pid, timeout=3.0)
-        if not hwnd:
-            return
-
-        # Crea un QWindow dal native handle
-        try:
-            app_window = QWindow.fromWinId(hwnd)
-            
-            # Crea un widget container per la finestra
-            container = QWidget.createWindowContainer(app_window)
             container.setMinimumSize(780, 430)
             
             # Crea una subwindow MDI e aggiungi il container
+            self.container = container
             self.sub_window = QMdiSubWindow()
             self.sub_window.setWidget(container)
             self.sub_window.setWindowFlags(Qt.FramelessWindowHint)
             self.sub_window.setWindowState(Qt.WindowMaximized)
             
-            # Rimuovi bordi e titolo dalla subwindow
-            self.sub_window.setStyleSheet("""
-                QMdiSubWindow {
-                    background: transparent;
-                    border: none;
-                }
-            """)
-            
             # Aggiungi la subwindow all'area MDI
             self.mdi_area.addSubWindow(self.sub_window)
             self.sub_window.showMaximized()
@@ -853,24 +538,18 @@ class MapTab(QWidget):
         except Exception:
             pass
 
+    def _remove_subwindows(self):
+        for sub_window in self.mdi_area.subWindowList():
+            self.mdi_area.removeSubWindow(sub_window)
+            sub_window.deleteLater()
+        self.sub_window = None
+        self.container = None
+
     def close_map(self):
         """Chiude il processo della mappa"""
         try:
-            if self.process:
-                try:
-                    pid = int(self.process.processId())
-                    for p in psutil.process_iter(['pid', 'name']):
-                        if p.info['pid'] == pid:
-                            p.kill()
-                except Exception:
-                    pass
-                self.process = None
-            
-            # Rimuovi tutte le subwindows
-            for sub_window in self.mdi_area.subWindowList():
-                self.mdi_area.removeSubWindow(sub_window)
-                sub_window.deleteLater()
-                
+            self.embedder.close()
+            self._remove_subwindows()
         except Exception:
             pass
 
@@ -901,11 +580,7 @@ class SettingsTab(QWidget):
         title = QLabel("⚙️ IMPOSTAZIONI")
         title.setFont(QFont("Arial", 22, QFont.Bold))
         title.setAlignment(Qt.AlignCenter)
-        title.setStyleSheet("""
-            color: #00ccff;
-            background: transparent;
-            text-shadow: 1px 1px 2px #000000;
-        """)
+        set_ruolo(title, "titolo")
         layout.addWidget(title)
 
         # Pulsanti principali
@@ -913,138 +588,104 @@ class SettingsTab(QWidget):
         close_app_btn = QPushButton("⏹️ CHIUDI APP")
         mod_ice_btn = QPushButton("❄️ MOD ICE")
         restart_btn = QPushButton("🔄 RIAVVIA")
+        diag_btn = QPushButton("📊 DIAGNOSTICA")
         
 
-        buttons = [test_pl_btn, close_app_btn, mod_ice_btn, restart_btn,]
+        buttons = [test_pl_btn, close_app_btn, mod_ice_btn, restart_btn, diag_btn]
 
         for btn in buttons:
             btn.setFixedHeight(60)
             btn.setFont(QFont("Arial", 16, QFont.Bold))
-            btn.setStyleSheet("""
-                QPushButton {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #3a5066, stop: 1 #2a3b4d);
-                    color: #00ccff;
-                    border: 2px solid #4a6580;
-                    border-radius: 10px;
-                    padding: 5px;
-                    font-weight: bold;
-                }
-                QPushButton:hover {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #4a6580, stop: 1 #3a5066);
-                    border: 2px solid #5a7590;
-                }
-                QPushButton:pressed {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #2a3b4d, stop: 1 #1e2a38);
-                }
-            """)
+            set_ruolo(btn, "impostazioni")
             layout.addWidget(btn)
 
         close_app_btn.clicked.connect(self.close_app)
         restart_btn.clicked.connect(self.restart_app)
-        
+        diag_btn.clicked.connect(self.toggle_diagnostica)
+        self.altri_pulsanti = buttons[:-1]
+
+        # Pannello metriche: aggiornato solo mentre è visibile
+        self.diagnostica = QLabel()
+        self.diagnostica.setObjectName("diagnostica")
+        self.diagnostica.setFont(QFont("Consolas", 10))
+        self.diagnostica.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.diagnostica.hide()
+        layout.addWidget(self.diagnostica)
+        self.timer_diagnostica = QTimer(self)
+        self.timer_diagnostica.timeout.connect(self.refresh_diagnostica)
 
         layout.addStretch()
         self.setLayout(layout)
 
+    def toggle_diagnostica(self):
+        visibile = not self.diagnostica.isVisible()
+        for btn in self.altri_pulsanti:
+            btn.setVisible(not visibile)
+        self.diagnostica.setVisible(visibile)
+        if visibile:
+            self.refresh_diagnostica()
+            self.timer_diagnostica.start(1000)
+        else:
+            self.timer_diagnostica.stop()
+
+    def refresh_diagnostica(self):
+        self.diagnostica.setText("\n".join(metrics.registry.summary()) or "Nessuna metrica")
+
     def close_app(self):
         QApplication.quit()
 
     def restart_app(self):
+        # Riavvio soft: niente os.execv, il viaggio e le connessioni sane restano attivi
         try:
-            python = sys.executable
-            os.execv(python, [python] + sys.argv)
+            self.parent.soft_restart()
         except Exception as e:
-            print("Errore restart:", e)
+            log.exception("Errore restart: %s", e)
 
     def toggle_dark_mode(self):
-        app = QApplication.instance()
-        if not self.dark_mode_enabled:
-            self.apply_dark_style()
-            self.dark_mode_btn.setText("☀️ LIGHT MODE")
-            self.dark_mode_enabled = True
-        else:
-            self.apply_light_style()
-            self.dark_mode_btn.setText("🌙 DARK MODE")
-            self.dark_mode_enabled = False
-            
-    def apply_dark_style(self):
-        dark_palette = QPalette()
-        dark_palette.setColor(QPalette.Window, QColor(20, 30, 40))
-        dark_palette.setColor(QPalette.WindowText, QColor(220, 220, 220))
-        dark_palette.setColor(QPalette.Base, QColor(25, 25, 25))
-        dark_palette.setColor(QPalette.AlternateBase, QColor(45, 45, 45))
-        dark_palette.setColor(QPalette.ToolTipBase, QColor(220, 220, 220))
-        dark_palette.setColor(QPalette.ToolTipText, QColor(220, 220, 220))
-        dark_palette.setColor(QPalette.Text, QColor(220, 220, 220))
-        dark_palette.setColor(QPalette.Button, QColor(50, 50, 50))
-        dark_palette.setColor(QPalette.ButtonText, QColor(220, 220, 220))
-        dark_palette.setColor(QPalette.BrightText, Qt.red)
-        dark_palette.setColor(QPalette.Link, QColor(42, 130, 218))
-        dark_palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
-        dark_palette.setColor(QPalette.HighlightedText, Qt.black)
-        
-        app = QApplication.instance()
-        app.setPalette(dark_palette)
-        
-        dark_stylesheet = """
-            QTabWidget::pane {
-                border: 1px solid #3a5066;
-                background: #1e2a38;
-            }
-            QTabBar::tab {
-                background: #2a3b4d;
-                color: #00ccff;
-                padding: 12px 20px;
-                font-size: 16px;
-                font-weight: bold;
-                border: 1px solid #3a5066;
-                border-bottom: none;
-                border-top-left-radius: 8px;
-                border-top-right-radius: 8px;
-            }
-            QTabBar::tab:selected {
-                background: #1e2a38;
-                color: #00ff88;
-            }
-        """
-        app.setStyleSheet(dark_stylesheet)
-        
-    def apply_light_style(self):
-        app = QApplication.instance()
-        app.setPalette(app.style().standardPalette())
-        
-        light_stylesheet = """
-            QTabWidget::pane {
-                border: 1px solid #3a5066;
-                background: #c8f5ff;
-            }
-            QTabBar::tab {
-                background: #2a3b4d;
-                color: #00ccff;
-                padding: 12px 20px;
-                font-size: 16px;
-                font-weight: bold;
-                border: 1px solid #3a5066;
-                border-bottom: none;
-                border-top-left-radius: 8px;
-                border-top-right-radius: 8px;
-            }
-            QTabBar::tab:selected {
-                background: #c8f5ff;
-                color: #0057a8;
-            }
-        """
-        app.setStyleSheet(light_stylesheet)
+        # Il foglio di stile è già installato: basta cambiare la proprietà "tema"
+        self.dark_mode_enabled = theme.manager().toggle() == "scuro"
+
+    @staticmethod
+    def apply_dark_style():
+        theme.manager().apply("scuro")
+
+    @staticmethod
+    def apply_light_style():
+        theme.manager().apply("chiaro")
+
+
+class LazyTab(QWidget):
+    """Segnaposto che costruisce la tab vera solo alla prima visualizzazione"""
+    def __init__(self, factory, nome, parent=None):
+        super().__init__(parent)
+        self.factory = factory
+        self.nome = nome
+        self.widget = None
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+        self.setLayout(layout)
+
+    def build(self):
+        if self.widget is None:
+            t0 = time.perf_counter()
+            self.widget = self.factory()
+            self.layout().addWidget(self.widget)
+            if timeline.enabled:
+                log.info("Tab %s costruita in %.1f ms", self.nome, (time.perf_counter() - t0) * 1000)
+        return self.widget
+
+    def showEvent(self, event):
+        self.build()
+        super().showEvent(event)
 
 
 class BluecarMonitor(QWidget):
     """Classe principale dell'applicazione Bluecar Monitor"""
-    def __init__(self):
+    def __init__(self, pipeline=None, bt_supervisor=None, fixes=None):
         super().__init__()
         self.setWindowTitle("Bluecar Monitor")
+        theme.manager().mark(self)
         self.setFixedSize(800, 480)
         self.setWindowFlags(Qt.FramelessWindowHint)
         
@@ -1057,21 +698,44 @@ class BluecarMonitor(QWidget):
         palette.setBrush(QPalette.Window, gradient)
         self.setPalette(palette)
 
-        self.battery_value = 80 if test == 1 else 0
-        self.est_range_km = 120 if test == 1 else 0
+        # La GUI è solo un sottoscrittore della pipeline dati
+        self.pipeline = pipeline if pipeline is not None else TripPipeline(test)
+        tel = self.pipeline.snapshot()
+        self.battery_value = tel.carica
+        self.est_range_km = tel.autonomia
         self.wltp_range_km = 160
-        self.avg_speed = 45 if test == 1 else 43
-        self.trip_km = 15.5 if test == 1 else 0.0
+        self.avg_speed = tel.velocita_media
+        self.trip_km = tel.trip_km
+        self.range_band = None
+        self.position = (tel.lat, tel.lon)
+        self.fixes = fixes if fixes is not None else deque(maxlen=MAX_TRACK)   # Fix non ancora passati alla mappa
+        self.last_fix = self.fixes[-1] if self.fixes else None
+        self.t_riavvio = None
+        self.ultimo_riavvio_ms = None
 
         self.signals = DataSignals()
+        self.m_refresh = metrics.histogram("gui_refresh_seconds", "Aggiornamento dei widget per una telemetria")
+        self.m_latenza = metrics.histogram("gui_telemetry_latency_seconds", "Dalla pubblicazione all'aggiornamento dei widget")
+        self.m_accorpate = metrics.counter("gui_telemetry_conflated_total",
+                                           "Telemetrie arrivate mentre un aggiornamento era già in coda")
+        self.ultima_tel = None
+        self.in_coda = False    # Un solo aggiornamento nella coda eventi di Qt, con i valori più recenti
         self.signals.updated.connect(self.refresh_ui)
 
+        # Il Bluetooth vive a livello di finestra: riconnette l'ultimo dispositivo
+        # anche se la tab Media non è ancora stata aperta
+        if bt_supervisor is None:
+            from bluetooth import ConnectionSupervisor
+            self.bt_supervisor = ConnectionSupervisor(self)
+            QTimer.singleShot(0, self.bt_supervisor.reconnect_last)
+        else:
+            self.bt_supervisor = bt_supervisor
+            self.bt_supervisor.setParent(self)
+
         self.init_ui()
 
-        if test == 0:
-            self.start_recalc_thread()
-        else:
-            self.start_test_thread()
+        self.pipeline.subscribe(self.on_telemetry)
+        self.pipeline.start()
 
     def init_ui(self):
         layout = QVBoxLayout()
@@ -1080,93 +744,184 @@ class BluecarMonitor(QWidget):
         
         self.tabs = QTabWidget()
         self.tabs.setFont(QFont("Arial", 14, QFont.Bold))
-        self.tabs.setStyleSheet("""
-            QTabWidget::pane {
-                border: 1px solid #3a5066;
-                background: #1e2a38;
-            }
-            QTabBar::tab {
-                background: #2a3b4d;
-                color: #00ccff;
-                padding: 12px 20px;
-                font-size: 16px;
-                font-weight: bold;
-                border: 1px solid #3a5066;
-                border-bottom: none;
-                border-top-left-radius: 8px;
-                border-top-right-radius: 8px;
-            }
-            QTabBar::tab:selected {
-                background: #1e2a38;
-                color: #00ff88;
-            }
-        """)
+        self.tabs.setObjectName("mainTabs")
 
+        # Solo la tab Trip viene costruita subito, le altre al primo utilizzo
         self.trip_tab = TripTab(self)
-        self.media_tab = MediaTab(self)
-        #self.map_tab = MapTab(self)
-        self.settings_tab = SettingsTab(self)
+        self.media_tab = LazyTab(lambda: MediaTab(self, self.bt_supervisor), "Media")
+        # Mappa nativa (tile MBTiles + traccia GPS); MapTab incorpora invece un'app esterna
+        self.map_tab = LazyTab(self._crea_mappa, "Mappa")
+        #self.map_tab = LazyTab(lambda: MapTab(self), "Mappa")
+        self.settings_tab = LazyTab(lambda: SettingsTab(self), "Impostazioni")
 
         self.tabs.addTab(self.trip_tab, "🚗 Trip")
         self.tabs.addTab(self.media_tab, "🎵 Media")
-        #self.tabs.addTab(self.map_tab, "🗺️ Mappa")
+        self.tabs.addTab(self.map_tab, "🗺️ Mappa")
         self.tabs.addTab(self.settings_tab, "⚙️ Impostazioni")
 
         layout.addWidget(self.tabs)
         self.setLayout(layout)
         self.refresh_ui()
 
+    def _crea_mappa(self):
+        from mapview import MapView
+        return MapView()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.t_riavvio is not None:
+            self.ultimo_riavvio_ms = (time.perf_counter() - self.t_riavvio) * 1000
+            self.t_riavvio = None
+            log.info("Riavvio soft: primo frame in %.1f ms", self.ultimo_riavvio_ms)
+        if timeline.enabled and not timeline.reported:
+            timeline.mark("primo frame")
+            QTimer.singleShot(0, timeline.report)
+
+    def soft_restart(self):
+        """
+        Ricostruisce la finestra nello stesso processo. Pipeline (stato del
+        viaggio compreso) e supervisore Bluetooth passano alla nuova finestra;
+        vengono riaperti solo seriale, CAN o connessione Bluetooth guasti.
+        """
+        global finestra
+        t0 = time.perf_counter()
+        self.pipeline.unsubscribe(self.on_telemetry)
+        self.signals.updated.disconnect()
+        self.pipeline.richiedi_ripristino()
+
+        # La traccia già ricevuta passa alla nuova mappa
+        fixes = deque(maxlen=MAX_TRACK)
+        if self.map_tab.widget is not None:
+            fixes.extend((lat, lon) for lon, lat in self.map_tab.widget.track)
+        fixes.extend(self.fixes)
+
+        nuova = BluecarMonitor(self.pipeline, self.bt_supervisor, fixes)
+        nuova.t_riavvio = t0
+        nuova.bt_supervisor.ripristina()
+        nuova.show()
+        self.hide()
+        self.deleteLater()
+        finestra = nuova
+        return nuova
+
     def refresh_ui(self):
+        t0 = time.perf_counter()
+        self.in_coda = False    # Prima di leggere i valori: una telemetria che arriva ora ne accoda un altro
         self.trip_tab.refresh_ui(self.battery_value, self.est_range_km,
-                                 self.wltp_range_km, self.avg_speed, self.trip_km)
-
-    def start_recalc_thread(self):
-        thread = threading.Thread(target=self.ricalcolo, daemon=True)
-        thread.start()
-
-    def start_test_thread(self):
-        thread = threading.Thread(target=self.simula_dati, daemon=True)
-        thread.start()
-
-    def ricalcolo(self):
-        global last, trip_km
-        while True:
-            if monitorBAT is not None:
-                charge = monitorBAT.get_charge()
-                self.battery_value = charge
-                rimanente = algokm(charge)
-                self.trip_km = trip_km
-                if rimanente == 0.0 and last != 0:
-                    self.est_range_km = last
-                else:
-                    self.est_range_km = rimanente
-                    last = rimanente
-                self.avg_speed = media
-                self.signals.updated.emit()
-            else:
-                time.sleep(1)
-
-    def simula_dati(self):
-        import random
-        while True:
-            self.battery_value = max(5, min(100, self.battery_value + random.randint(-2, 1)))
-            self.est_range_km = max(0, self.est_range_km + random.uniform(-1, 0.5))
-            self.avg_speed = max(0, self.avg_speed + random.uniform(-2, 2))
-            self.trip_km = max(0, self.trip_km + random.uniform(0, 0.2))
-            self.signals.updated.emit()
-            time.sleep(2)
-
-
-if __name__ == "__main__":
+                                 self.wltp_range_km, self.avg_speed, self.trip_km,
+                                 self.range_band, self.pipeline.efficienza(), self.pipeline.percorso_noto())
+        if self.position[0] is not None and self.position != self.last_fix:
+            self.last_fix = self.position
+            self.fixes.append(self.position)
+        if self.map_tab.widget is not None:
+            while self.fixes:
+                self.map_tab.widget.add_fix(*self.fixes.popleft())
+        self.m_refresh.record(time.perf_counter() - t0)
+        if self.ultima_tel is not None:
+            self.m_latenza.record(time.time() - self.ultima_tel)
+            self.ultima_tel = None
+
+    def on_telemetry(self, tel):
+        """Chiamata dal thread della pipeline: aggiorna i valori e notifica la UI"""
+        self.battery_value = tel.carica
+        self.est_range_km = tel.autonomia
+        self.avg_speed = tel.velocita_media
+        self.trip_km = tel.trip_km
+        if tel.banda_max > 0:
+            self.range_band = (tel.banda_min, tel.banda_max)
+        self.position = (tel.lat, tel.lon)
+        self.ultima_tel = tel.timestamp
+        if self.in_coda:
+            # La UI non ha ancora disegnato la precedente: leggerà questi valori
+            self.m_accorpate.inc()
+            return
+        self.in_coda = True
+        self.signals.updated.emit()
+
+
+def bench_riavvio(cicli=10):
+    """Riavvio con os.execv (nuovo processo) vs riavvio soft, fino al primo frame"""
+    import subprocess
+    from PyQt5.QtCore import QEventLoop
+
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    tempi_exec = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-u", os.path.abspath(__file__), "--startup-timeline"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env)
+        for riga in proc.stdout:
+            if "Trip visibile" in riga:
+                tempi_exec.append((time.perf_counter() - t0) * 1000)
+                break
+        proc.kill()
+        proc.wait()
+    if tempi_exec:
+        print(f"Riavvio con exec (processo nuovo): {min(tempi_exec):.0f} ms al primo frame "
+              f"(migliore di {len(tempi_exec)}, senza riconnessione CAN/seriale)")
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    app.setStyle(QStyleFactory.create("Fusion"))
+    theme.manager().install("scuro")
+    pipeline = TripPipeline(1, periodo=0.05, velocita_replay=20)
+    corrente = BluecarMonitor(pipeline)
+    corrente.show()
+    loop = QEventLoop()
+    scadenza = time.perf_counter() + 10
+    while pipeline.cicli == 0 and time.perf_counter() < scadenza:
+        loop.processEvents()    # Primo ciclo dello scenario prima di misurare
+    tempi = []
+    for _ in range(cicli):
+        corrente = corrente.soft_restart()
+        loop = QEventLoop()
+        while corrente.ultimo_riavvio_ms is None:
+            loop.processEvents()
+        tempi.append(corrente.ultimo_riavvio_ms)
+    tempi.sort()
+    print(f"Riavvio soft: mediana {tempi[len(tempi) // 2]:.1f} ms, max {tempi[-1]:.1f} ms al primo frame; "
+          f"trip {pipeline.trip_visualizzato:.2f} km e {pipeline.cicli} cicli pipeline conservati")
+    corrente.bt_supervisor.shutdown()
+    pipeline.stop()
+
+
+def main(condivisa=False, replay=None, velocita_replay=1.0, durata=None, scenario="pendolare", seed=0):
+    """
+    Avvia la dashboard; con condivisa=True legge GPS e CAN dalla memoria condivisa del launcher,
+    con replay rigioca la telemetria registrata da pipeline.py --log. In modalità test guida lo
+    scenario simulato (scenario.py) a velocita_replay. durata in secondi chiude l'app da sola
+    (profilazione headless).
+    """
+    global finestra
+    logconfig.setup("gui")
+    metrics.avvia_server(metrics.PORTA_GUI)
     app = QApplication(sys.argv)
     app.setStyle(QStyleFactory.create("Fusion"))
+    timeline.mark("QApplication")
     
     # non viene piu realmente caricato il light poiché attualmente lo stile é bloccato a dark perché dopo test é stato scoperto che veniva scelto e usato solo lui , é anche piu bellino
-    settings = SettingsTab()
-    settings.apply_light_style()
+    theme.manager().install("scuro")
+    timeline.mark("stile")
     
-    monitor = BluecarMonitor()
-    monitor.show()
-    sys.exit(app.exec_())
+    pipeline = TripPipeline(test, condivisa=condivisa, replay=replay, velocita_replay=velocita_replay,
+                            scenario=scenario, seed=seed)
+    timeline.mark("pipeline")
+    finestra = BluecarMonitor(pipeline)
+    timeline.mark("BluecarMonitor")
+    finestra.show()
+    timeline.mark("show")
+    if durata:
+        QTimer.singleShot(int(durata * 1000), app.quit)
+    ret = app.exec_()
+    finestra.bt_supervisor.shutdown()
+    pipeline.stop()
+    return ret
 
 
+if __name__ == "__main__":
+    if "--bench-restart" in sys.argv:
+        bench_riavvio()
+        sys.exit(0)
+    profiler.da_argv("GUI", principale="qt-main")
+    sys.exit(main("--condivisa" in sys.argv, profiler.opzione("--replay"),
+                  float(profiler.opzione("--velocita", 1)), float(profiler.opzione("--durata", 0)),
+                  profiler.opzione("--scenario", "pendolare"), int(profiler.opzione("--seed", 0))))
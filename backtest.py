@@ -0,0 +1,319 @@
+"""
+Banco di prova offline per gli algoritmi di stima dell'autonomia.
+
+Rigioca le tracce registrate attraverso uno o più stimatori e riporta
+l'errore rispetto all'autonomia reale per ogni livello di carica e il tempo
+di calcolo per viaggio. Le tracce possono essere:
+  - i CSV del RegistroTraccia (logtrip/tracce/trip_*.csv)
+  - i log grezzi della carica CAN (can_logs/battery_*.csv) abbinati alle
+    righe STATS del GPS (gps_logs/stats_*.csv)
+
+Tutti i viaggi vengono concatenati in array NumPy e ogni stimatore lavora
+sull'intero lotto in modo vettoriale; stimatori e blocchi di viaggi vengono
+distribuiti su un pool di processi.
+
+Uso:
+    python backtest.py --tracce logtrip/tracce --can can_logs --gps gps_logs
+    python backtest.py --stimatori lineare,guessometer --processi 4 --json out.json
+"""
+
+import os
+import sys
+import time
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from guessometer import (
+    Guessometer, StoricoConsumi, carica_storico, STORICO_PATH, TRACCE_DIR,
+    V_RIF, AERO_A, AERO_B,
+)
+
+# Colonne del lotto: tempo, carica %, km del viaggio, velocità media km/h
+T, CARICA, KM, VEL = range(4)
+
+
+def carica_tracce(cartella=TRACCE_DIR):
+    """Legge i CSV del RegistroTraccia, un viaggio per file"""
+    viaggi = []
+    for path in sorted(glob.glob(os.path.join(cartella, "*.csv"))):
+        try:
+            dati = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        except ValueError:
+            continue
+        if dati.shape[0] > 1 and dati.shape[1] >= 4:
+            viaggi.append(dati[:, :4])
+    return viaggi
+
+
+def _leggi_stats(path):
+    """Estrae (timestamp, trip km, velocità media km/h) dalle righe STATS"""
+    righe = []
+    with open(path, errors="ignore") as f:
+        for riga in f:
+            parti = riga.strip().split(",")
+            if len(parti) < 6 or parti[0] != "STATS":
+                continue
+            try:
+                righe.append((float(parti[5]), float(parti[2]) / 1000, float(parti[4]) * 3.6))
+            except ValueError:
+                continue
+    return np.array(righe, dtype=float).reshape(-1, 3)
+
+
+def carica_sessioni(can_dir="can_logs", gps_dir="gps_logs"):
+    """
+    Abbina i log CAN della carica alle righe STATS per timestamp e divide
+    le sessioni in viaggi ad ogni reset del contachilometri parziale.
+    """
+    can = []
+    for path in glob.glob(os.path.join(can_dir, "battery_*.csv")):
+        try:
+            dati = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        except ValueError:
+            continue
+        if dati.size:
+            can.append(dati[:, :2])
+    if not can:
+        return []
+    can = np.concatenate(can)
+    can = can[np.argsort(can[:, 0], kind="stable")]
+
+    viaggi = []
+    for path in sorted(glob.glob(os.path.join(gps_dir, "stats_*.csv"))):
+        stats = _leggi_stats(path)
+        if stats.shape[0] < 2:
+            continue
+        # Carica valida all'istante di ogni riga STATS (ultimo frame CAN precedente)
+        idx = np.searchsorted(can[:, 0], stats[:, 0], side="right") - 1
+        validi = idx >= 0
+        stats, idx = stats[validi], idx[validi]
+        traccia = np.column_stack((stats[:, 0], can[idx, 1], stats[:, 1], stats[:, 2]))
+        tagli = np.flatnonzero(np.diff(traccia[:, KM]) < 0) + 1
+        viaggi.extend(v for v in np.split(traccia, tagli) if v.shape[0] > 1)
+    return viaggi
+
+
+class Lotto:
+    """Viaggi concatenati in un unico array con indici di inizio e fine"""
+
+    def __init__(self, viaggi):
+        self.dati = np.concatenate(viaggi) if viaggi else np.empty((0, 4))
+        lunghezze = np.array([v.shape[0] for v in viaggi], dtype=np.int64)
+        self.fini = np.cumsum(lunghezze)
+        self.inizi = self.fini - lunghezze
+        self.id = np.repeat(np.arange(len(viaggi)), lunghezze)
+
+    def __len__(self):
+        return len(self.inizi)
+
+    def colonna(self, c):
+        return self.dati[:, c]
+
+    def per_campione(self, valori):
+        """Espande un valore per viaggio su tutti i suoi campioni"""
+        return valori[self.id]
+
+    def viaggi(self):
+        for a, b in zip(self.inizi, self.fini):
+            yield self.dati[a:b]
+
+
+def autonomia_reale(lotto):
+    """
+    Autonomia "vera" per ogni campione: km ancora percorsi nel viaggio più
+    la carica finale moltiplicata per il km/% medio dell'intero viaggio.
+    NaN per i viaggi in cui la carica non è scesa.
+    """
+    carica, km = lotto.colonna(CARICA), lotto.colonna(KM)
+    ultimo = lotto.fini - 1
+    consumato = carica[lotto.inizi] - carica[ultimo]
+    km_fin = km[ultimo]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kmpp = np.where((consumato > 0) & (km_fin > 0), km_fin / consumato, np.nan)
+    residuo = carica[ultimo] * kmpp
+    return lotto.per_campione(km_fin + residuo) - km
+
+
+# ---------------------------------------------------------------------------
+# Stimatori: funzioni f(lotto, prior) -> stima in km per ogni campione.
+# Devono stare a livello di modulo per poter essere inviate al pool.
+
+def stima_lineare(lotto, prior):
+    """Formula originale di algokm: (trip_km / percento) * attuale"""
+    carica = lotto.colonna(CARICA)
+    percento = lotto.per_campione(carica[lotto.inizi]) - carica
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(percento > 1, lotto.colonna(KM) / percento * carica, 0.0)
+
+
+def stima_guessometer(lotto, prior):
+    """Guessometer in forma vettoriale (stesse formule di Guessometer.update)"""
+    carica, km, v = lotto.colonna(CARICA), lotto.colonna(KM), lotto.colonna(VEL)
+    # Carica iniziale = massimo progressivo nel viaggio (gestisce le ricariche)
+    sfasamento = lotto.id * 1000.0
+    inizio = np.maximum.accumulate(carica + sfasamento) - sfasamento
+
+    fattore = np.where(v > 0, (AERO_A + AERO_B * V_RIF ** 2) / (AERO_A + AERO_B * v * v), 1.0)
+    media = prior[0] * fattore
+    var = prior[1] * fattore * fattore
+
+    consumato = inizio - carica
+    oss_ok = (consumato >= 1) & (km > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        osservato = np.where(oss_ok, km / consumato, 1.0)
+        var_oss = (osservato * 0.5 / consumato) ** 2 + (0.05 * osservato) ** 2
+        precisione = 1.0 / var + 1.0 / var_oss
+        fusa = (media / var + osservato / var_oss) / precisione
+    return np.where(oss_ok, fusa, media) * carica
+
+
+def stima_guessometer_scalare(lotto, prior):
+    """Guessometer campione per campione, come gira in auto (riferimento)"""
+    storico = StoricoConsumi()
+    stime = np.empty(lotto.dati.shape[0])
+    i = 0
+    for viaggio in lotto.viaggi():
+        g = Guessometer(storico)
+        g.prior_media, g.prior_var = prior
+        for _, carica, km, v in viaggio:
+            stime[i] = g.update(carica, km, v).km
+            i += 1
+    return stime
+
+
+STIMATORI = {
+    "lineare": stima_lineare,
+    "guessometer": stima_guessometer,
+    "guessometer_scalare": stima_guessometer_scalare,
+}
+
+
+def _esegui(nome, viaggi, prior):
+    """Lavoro di un processo del pool: uno stimatore su un blocco di viaggi"""
+    lotto = Lotto(viaggi)
+    t0 = time.perf_counter()
+    stime = STIMATORI[nome](lotto, prior)
+    return stime, time.perf_counter() - t0
+
+
+def esegui_backtest(viaggi, nomi, prior, processi=None, blocchi=None):
+    """
+    Esegue gli stimatori indicati su tutti i viaggi.
+    Restituisce {nome: (stime, secondi)} con le stime nell'ordine del lotto.
+    """
+    processi = processi or os.cpu_count() or 1
+    blocchi = blocchi or processi
+    gruppi = [g for g in np.array_split(np.arange(len(viaggi)), blocchi) if g.size]
+    risultati = {}
+    if processi == 1:
+        for nome in nomi:
+            parziali = [_esegui(nome, [viaggi[i] for i in g], prior) for g in gruppi]
+            risultati[nome] = (np.concatenate([p[0] for p in parziali]),
+                               sum(p[1] for p in parziali))
+        return risultati
+
+    with ProcessPoolExecutor(max_workers=processi) as pool:
+        futuri = {nome: [pool.submit(_esegui, nome, [viaggi[i] for i in g], prior)
+                         for g in gruppi] for nome in nomi}
+        for nome, lista in futuri.items():
+            parziali = [f.result() for f in lista]
+            risultati[nome] = (np.concatenate([p[0] for p in parziali]),
+                               sum(p[1] for p in parziali))
+    return risultati
+
+
+def report(lotto, risultati, passo=10):
+    """Errore per fascia di carica e tempi per stimatore"""
+    reale = autonomia_reale(lotto)
+    validi = ~np.isnan(reale)
+    carica = lotto.colonna(CARICA)
+    fasce = np.clip((carica // passo).astype(int), 0, 100 // passo)
+    n_viaggi = len(lotto)
+
+    out = {"viaggi": n_viaggi, "campioni": int(validi.sum()), "stimatori": {}}
+    for nome, (stime, secondi) in risultati.items():
+        errore = stime - reale
+        per_fascia = {}
+        for f in np.unique(fasce[validi]):
+            sel = validi & (fasce == f)
+            per_fascia[f"{f * passo}-{min(100, f * passo + passo - 1)}%"] = {
+                "mae": float(np.mean(np.abs(errore[sel]))),
+                "bias": float(np.mean(errore[sel])),
+                "campioni": int(sel.sum()),
+            }
+        out["stimatori"][nome] = {
+            "mae": float(np.mean(np.abs(errore[validi]))) if validi.any() else None,
+            "secondi": secondi,
+            "ms_per_viaggio": secondi * 1e3 / max(1, n_viaggi),
+            "us_per_campione": secondi * 1e6 / max(1, lotto.dati.shape[0]),
+            "fasce": per_fascia,
+        }
+    return out
+
+
+def stampa_report(out):
+    print(f"Viaggi: {out['viaggi']} | campioni validi: {out['campioni']}")
+    nomi = list(out["stimatori"])
+    print(f"{'':10s}" + "".join(f"{n:>22s}" for n in nomi))
+    fasce = sorted({f for s in out["stimatori"].values() for f in s["fasce"]},
+                   key=lambda f: -int(f.split("-")[0]))
+    for f in fasce:
+        celle = []
+        for n in nomi:
+            dato = out["stimatori"][n]["fasce"].get(f)
+            celle.append(f"{dato['mae']:9.2f} ({dato['bias']:+7.2f})" if dato else " " * 20)
+        print(f"{f:10s}" + "".join(f"{c:>22s}" for c in celle))
+    print()
+    for n, s in out["stimatori"].items():
+        mae = f"{s['mae']:.2f} km" if s["mae"] is not None else "--"
+        print(f"{n:20s} MAE {mae:>10s} | {s['ms_per_viaggio']:8.3f} ms/viaggio | "
+              f"{s['us_per_campione']:8.3f} µs/campione")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest degli stimatori di autonomia")
+    parser.add_argument("--tracce", default=TRACCE_DIR, help="cartella dei CSV del RegistroTraccia")
+    parser.add_argument("--can", default="can_logs", help="cartella dei log CAN della carica")
+    parser.add_argument("--gps", default="gps_logs", help="cartella dei log STATS del GPS")
+    parser.add_argument("--storico", default=STORICO_PATH, help="storico viaggi per il prior")
+    parser.add_argument("--stimatori", default="lineare,guessometer",
+                        help=f"elenco separato da virgole tra: {', '.join(STIMATORI)}")
+    parser.add_argument("--processi", type=int, default=None, help="processi del pool (default: CPU)")
+    parser.add_argument("--passo", type=int, default=10, help="ampiezza delle fasce di carica in %%")
+    parser.add_argument("--json", help="salva il report in JSON")
+    args = parser.parse_args(argv)
+
+    nomi = [n.strip() for n in args.stimatori.split(",") if n.strip()]
+    sconosciuti = [n for n in nomi if n not in STIMATORI]
+    if sconosciuti:
+        parser.error(f"stimatori sconosciuti: {', '.join(sconosciuti)}")
+
+    t0 = time.perf_counter()
+    viaggi = carica_tracce(args.tracce) + carica_sessioni(args.can, args.gps)
+    t_carica = time.perf_counter() - t0
+    if not viaggi:
+        print("Nessuna traccia trovata.")
+        return 1
+
+    prior = StoricoConsumi(carica_storico(args.storico)).prior()
+    t0 = time.perf_counter()
+    risultati = esegui_backtest(viaggi, nomi, prior, args.processi)
+    t_totale = time.perf_counter() - t0
+
+    out = report(Lotto(viaggi), risultati, args.passo)
+    out["secondi_caricamento"] = t_carica
+    out["secondi_totali"] = t_totale
+    stampa_report(out)
+    print(f"\nCaricamento {t_carica:.2f} s | esecuzione {t_totale:.2f} s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(out, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Base dei tempi comune a CAN e GPS.
+
+Ogni lettore marca i dati appena li riceve (subito dopo read_all o
+VIT7_ReceiveMessage) con adesso(): un orologio monotono ad alta risoluzione,
+lo stesso per tutti i thread e per i processi del launcher (perf_counter usa
+CLOCK_MONOTONIC su Linux e QueryPerformanceCounter su Windows), che non salta
+quando Windows o NTP correggono l'ora.
+
+Il GPS ha in più l'ora UTC del fix nella GGA, che non risente dei ritardi
+della seriale e dello scheduling: serve per velocità e distanze. Lo
+StimatoreOffset porta l'ora dei fix sulla base locale, così carica CAN e
+posizione GPS si confrontano sullo stesso asse.
+
+Jitter della velocità su un replay con ritardi di scheduling iniettati:
+    python basetempo.py --bench
+"""
+
+import sys
+import time
+from collections import deque
+
+FINESTRA = 64               # Campioni per la stima dell'offset (~1 min di fix a 1 Hz)
+
+adesso = time.perf_counter
+_PARETE = time.time() - time.perf_counter()
+
+
+def parete(t):
+    """Istante della base locale come epoch (log, righe STATS)"""
+    return t + _PARETE
+
+
+def locale(epoch):
+    """Epoch → base locale"""
+    return epoch - _PARETE
+
+
+def epoca_utc(ora, riferimento):
+    """
+    Ora UTC di una GGA (datetime.time, senza data) come epoch: si sceglie il
+    giorno che la porta più vicino a riferimento, così il passaggio della
+    mezzanotte non fa tornare indietro il tempo.
+    """
+    secondi = ora.hour * 3600 + ora.minute * 60 + ora.second + ora.microsecond / 1e6
+    t = riferimento - riferimento % 86400 + secondi
+    if t - riferimento > 43200:
+        t -= 86400
+    elif riferimento - t > 43200:
+        t += 86400
+    return t
+
+
+class StimatoreOffset:
+    """
+    Offset tra l'orologio di una sorgente (ora UTC dei fix) e la base locale,
+    offset = ricezione - ora della sorgente. Il ritardo di ricezione è sempre
+    positivo, quindi il campione minimo è il più vicino al vero; il minimo è
+    su una finestra scorrevole per seguire la deriva tra i due orologi.
+    """
+
+    def __init__(self, finestra=FINESTRA):
+        self.finestra = finestra
+        self.minimi = deque()   # (indice, campione) con campioni crescenti: minimo scorrevole in O(1)
+        self.n = 0
+        self.offset = None
+
+    def aggiungi(self, t_sorgente, t_locale):
+        """Nuovo campione; restituisce il suo ritardo rispetto al minimo della finestra"""
+        campione = t_locale - t_sorgente
+        while self.minimi and self.minimi[-1][1] >= campione:
+            self.minimi.pop()
+        self.minimi.append((self.n, campione))
+        if self.minimi[0][0] <= self.n - self.finestra:
+            self.minimi.popleft()
+        self.n += 1
+        self.offset = self.minimi[0][1]
+        return campione - self.offset
+
+    def a_locale(self, t_sorgente):
+        return t_sorgente + self.offset
+
+
+def bench(fix=3600, seed=0):
+    """
+    Un'ora a 50 km/h costanti, un fix al secondo, ricevuto con i ritardi di un
+    PC occupato: polling della seriale, scheduling e ogni tanto un blocco da
+    centinaia di ms. Stessa traccia con l'ora nella GGA (velocità dai tempi dei
+    fix) e senza (velocità dall'ora di elaborazione, come prima).
+    """
+    import os
+    import tempfile
+    import numpy as np
+    import gpstrip
+
+    v = 50 / 3.6
+    rng = np.random.default_rng(seed)
+    ritardi = rng.uniform(0, 0.01, fix) + rng.exponential(0.02, fix)
+    blocchi = rng.random(fix) < 0.02
+    ritardi[blocchi] += rng.uniform(0.2, 0.8, blocchi.sum())
+    ricezione = np.maximum.accumulate(np.arange(fix) + ritardi)    # Le frasi non si sorpassano
+    lat = 45.0 + np.arange(fix) * v / 111_195.0
+    inizio = 1_750_000_000.0        # Epoch di un mezzogiorno UTC
+
+    def giro(con_ora):
+        tracker = gpstrip.GPSTracker(porte=False)
+        locale = [0.0]
+        tracker.orologio = lambda: inizio + locale[0]
+        tracker.ricezione = lambda: locale[0]
+        velocita, errori_ts = [], []
+        for i in range(fix):
+            ora = time.strftime("%H%M%S.00", time.gmtime(inizio + i)) if con_ora else "120000.00"
+            locale[0] = ricezione[i]
+            tracker._process_chunk(gpstrip.frase_gga(lat[i], 7.68, ora), ricezione[i])
+            if i > 10:          # Dopo lo smoothing della posizione
+                velocita.append(tracker.speeds.ultimo())
+                errori_ts.append(tracker.stats_log[-1]["timestamp"] - (inizio + i))
+        tracker.stats_file.close()
+        tracker.track.close()
+        return np.array(velocita) * 3.6, np.array(errori_ts), tracker
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            print(f"{fix} fix a 50 km/h; ritardo di ricezione medio {ritardi.mean() * 1000:.0f} ms, "
+                  f"{blocchi.sum()} blocchi da 0.2-0.8 s")
+            for nome, con_ora in (("ora di elaborazione", False), ("ora UTC del fix", True)):
+                kmh, errori_ts, tracker = giro(con_ora)
+                scarto = np.abs(kmh - 50)
+                print(f"  {nome:20s} velocità: dev. std {kmh.std():6.2f} km/h, p99 errore {np.percentile(scarto, 99):6.2f}, "
+                      f"max {scarto.max():6.2f}; timestamp: dev. std {errori_ts.std() * 1000:6.1f} ms")
+            print(f"  offset stimato {(tracker.offset_fix.offset + inizio) * 1000:.1f} ms "
+                  f"(ritardo minimo nell'ultima finestra {ritardi[-FINESTRA:].min() * 1000:.1f} ms)")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        bench()
+    else:
+        print(__doc__)
@@ -0,0 +1,604 @@
+"""
+Benchmark end-to-end con un'auto simulata (solo Linux).
+
+- CAN finto: ReplayCAN con la carica che scende, frame 0x638 a 10 Hz in mezzo
+  a frame di altri ID
+- GPS: frasi NMEA scritte nel lato master di un pty, GPSTracker legge dallo slave
+- GUI: BluecarMonitor sotto la piattaforma offscreen di Qt
+
+Ogni fase gira in un processo separato, così CPU e RSS sono solo suoi:
+  can   frame/s in saturazione, CPU al carico reale del bus, latenza 0x638 → carica
+  gps   latenza scrittura sul pty → snapshot condiviso, frasi/s in raffica
+  gui   latenza publish → widget aggiornati e costo del refresh a 10 Hz
+  e2e   tutto insieme come con il launcher (memoria condivisa): latenza fix GPS
+        → refresh della GUI e CPU per thread (can-rx, gps-reader, gps-stats,
+        pipeline, qt-main)
+  stats età della riga STATS letta da un monitor lento (una lettura al secondo,
+        fix a 10 Hz) sul pty al posto di COM101/COM201: coda FIFO come prima,
+        canale a valore più recente, canale + lettore che tiene solo l'ultima
+
+I risultati vanno in bench_results/<data>_<commit>.json, per il confronto tra commit:
+    python benchsuite.py [--fasi can,gps,gui,e2e] [--durata 10]
+    python benchsuite.py --confronta bench_results/vecchio.json bench_results/nuovo.json
+
+La fase e2e usa i blocchi di memoria condivisa del launcher: non eseguirla
+mentre il launcher è attivo.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import select
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing as mp
+from datetime import datetime
+
+import numpy as np
+
+RISULTATI_DIR = "bench_results"
+FASI = ("can", "gps", "gui", "e2e", "stats")
+SOGLIA_REGRESSIONE = 0.10       # Variazione oltre la quale --confronta segnala un peggioramento
+FRAME_AL_SECONDO = 500          # Carico del bus CAN simulato
+HZ_GPS = 10                     # Frasi al secondo nella fase gps
+HZ_GUI = 10                     # Telemetrie al secondo nella fase gui
+HZ_E2E = 5                      # Fix al secondo nella fase e2e (uno alla volta: stimolo → risposta)
+HZ_STATS = 10                   # Fix al secondo nella fase stats
+PERIODO_MONITOR = 1.0           # Il monitor lento legge una riga STATS al secondo, come la pipeline
+GPS_BENCH_SHM = "bluecar_bench_gps"
+
+
+def _percentili(secondi):
+    """Latenze in ms: n, p50, p90, p99, max"""
+    if not len(secondi):
+        return {"n": 0}
+    ms = np.asarray(secondi) * 1000
+    return {"n": len(ms),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max())}
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+class _Risorse:
+    """CPU e memoria del processo dall'inizio della misura"""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+
+    def risultato(self):
+        import resource
+        durata = time.perf_counter() - self.t0
+        return {"durata_s": durata,
+                "cpu_percento": (time.process_time() - self.cpu0) / durata * 100,
+                "rss_mb": _rss_mb(),
+                "rss_picco_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def _cpu_thread():
+    """Secondi di CPU per thread (per nome), da /proc/self/task"""
+    tick = os.sysconf("SC_CLK_TCK")
+    nomi = {t.native_id: t.name for t in threading.enumerate()}
+    nomi[threading.main_thread().native_id] = "qt-main"
+    cpu = {}
+    for tid in os.listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{tid}/stat") as f:
+                campi = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        nome = nomi.get(int(tid), "altri")
+        cpu[nome] = cpu.get(nome, 0.0) + (int(campi[11]) + int(campi[12])) / tick
+    return cpu
+
+
+def _log_carica(cartella, durata):
+    """Log della carica per ReplayCAN: scende dell'1% a intervalli regolari, mai due valori uguali"""
+    periodo = max(0.2, durata / 90)
+    path = os.path.join(cartella, "battery_bench.csv")
+    with open(path, "w") as f:
+        f.write("timestamp,charge%\n")
+        for i in range(int(durata / periodo) + 2):
+            f.write(f"{i * periodo:.3f},{100 - i}\n")
+    return path
+
+
+def _can_simulato(path, frame_al_secondo):
+    from can_monitor import ReplayCAN
+
+    class CanSimulato(ReplayCAN):
+        """ReplayCAN che annota quando esce il primo 0x638 di ogni nuova carica"""
+
+        def __init__(self):
+            super().__init__(path, 1.0, frame_al_secondo)
+            self.emessi = {}
+
+        def VIT7_ReceiveMessage(self, ref):
+            ret = super().VIT7_ReceiveMessage(ref)
+            if ret == 1:
+                msg = ref._obj
+                if msg.nID == 0x638 and msg.cData[3] not in self.emessi:
+                    self.emessi[msg.cData[3]] = time.perf_counter()
+            return ret
+
+    return CanSimulato()
+
+
+def _pty():
+    """(fd master, percorso slave) di un pty in modo raw"""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    os.close(slave)
+    return master, path
+
+
+def _frasi(n):
+    from gpstrip import frase_gga
+    from tracksimplify import traccia_sintetica
+    return [frase_gga(la, lo) for la, lo in zip(*traccia_sintetica(n))]
+
+
+def _ritmo(hz):
+    """Attende lo slot successivo di una sequenza a hz fissi"""
+    prossimo = time.perf_counter()
+    while True:
+        prossimo += 1.0 / hz
+        yield
+        time.sleep(max(0.0, prossimo - time.perf_counter()))
+
+
+# ---------------------------------------------------------------------------
+# Fasi (ognuna nel proprio processo, con la cartella di lavoro temporanea)
+
+def fase_can(durata):
+    from can_monitor import BatteryMonitor
+    path = _log_carica(".", durata)
+    risultato = {}
+
+    # Saturazione: la FIFO finta ha sempre un frame pronto
+    can = _can_simulato(path, 1e9)
+    monitor = BatteryMonitor(can)
+    risorse = _Risorse()
+    monitor.start()
+    time.sleep(durata / 2)
+    monitor.stop()
+    r = risorse.risultato()
+    risultato["saturazione"] = {"frame_per_s": can.n / r["durata_s"],
+                                "cpu_us_per_frame": r["cpu_percento"] / 100 * r["durata_s"] / max(can.n, 1) * 1e6}
+
+    # Carico reale del bus: CPU e latenza dal frame 0x638 alla carica aggiornata
+    can = _can_simulato(path, FRAME_AL_SECONDO)
+    monitor = BatteryMonitor(can)
+    arrivi = {}
+    monitor.on_change = lambda carica: arrivi.setdefault(carica, time.perf_counter())
+    risorse = _Risorse()
+    monitor.start()
+    time.sleep(durata / 2)
+    monitor.stop()
+    r = risorse.risultato()
+    latenze = [arrivi[c] - can.emessi[c] for c in arrivi if c in can.emessi]
+    risultato["carico_reale"] = {"frame_per_s": can.n / r["durata_s"], **r,
+                                 "latenza_0x638": _percentili(latenze)}
+    return risultato
+
+
+def fase_gps(durata):
+    from gpstrip import GPSTracker
+    from shmtelemetry import SeqlockSnapshot, GPS_CAMPI
+    master, path = _pty()
+    blocco = SeqlockSnapshot(GPS_BENCH_SHM, GPS_CAMPI, create=True)
+    tracker = GPSTracker(snapshot=blocco, sorgente=path)
+    tracker.avvia()
+    n = int(durata / 2 * HZ_GPS)
+    frasi = _frasi(max(n, 20_000))
+    try:
+        # Una frase alla volta, al ritmo di un ricevitore veloce: scrittura → snapshot
+        latenze = []
+        seq = blocco.seq
+        risorse = _Risorse()
+        ritmo = _ritmo(HZ_GPS)
+        for frase in frasi[:n]:
+            next(ritmo)
+            t0 = time.perf_counter()
+            os.write(master, frase)
+            letto = blocco.wait(seq, 1.0)
+            if letto is not None:
+                seq = letto[0]
+                latenze.append(time.perf_counter() - t0)
+        risultato = {"sequenziale": {**risorse.risultato(), "latenza_snapshot": _percentili(latenze)}}
+
+        # Raffica: quante frasi al secondo regge il lettore
+        inizio = tracker.m_gga.value
+        dati = b"".join(frasi)
+        t0 = time.perf_counter()
+        for i in range(0, len(dati), 1024):
+            os.write(master, dati[i:i + 1024])
+        while tracker.m_gga.value - inizio < len(frasi) and time.perf_counter() - t0 < 60:
+            time.sleep(0.005)
+        elaborate = tracker.m_gga.value - inizio
+        risultato["raffica"] = {"frasi_per_s": elaborate / (time.perf_counter() - t0), "frasi": elaborate}
+        return risultato
+    finally:
+        tracker.ferma()
+        blocco.close()
+        os.close(master)
+
+
+def _gui(pipeline):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+    app.setStyle("Fusion")
+    import theme
+    import GUI
+    theme.manager().install("scuro")
+    finestra = GUI.BluecarMonitor(pipeline)
+    finestra.show()
+    for tab in (finestra.media_tab, finestra.map_tab, finestra.settings_tab):
+        tab.build()
+    aggiornamenti = []
+    # Collegato dopo refresh_ui: scatta a widget già aggiornati
+    finestra.signals.updated.connect(lambda: aggiornamenti.append(time.perf_counter()))
+    return app, finestra, aggiornamenti
+
+
+def _exec_finche(app, thread, coda=0.5):
+    """Event loop di Qt finché il thread di stimolo lavora, più coda secondi per le ultime risposte"""
+    from PyQt5.QtCore import QTimer
+    fine = []
+
+    def controlla():
+        if thread.is_alive():
+            return
+        if not fine:
+            fine.append(time.perf_counter())
+        elif time.perf_counter() - fine[0] >= coda:
+            app.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(controlla)
+    timer.start(50)
+    thread.start()
+    app.exec_()
+    timer.stop()
+
+
+def _abbina(stimoli, risposte):
+    """Latenza di ogni stimolo: prima risposta prima dello stimolo successivo"""
+    latenze = []
+    risposte = np.asarray(risposte)
+    for i, t in enumerate(stimoli):
+        fine = stimoli[i + 1] if i + 1 < len(stimoli) else np.inf
+        j = np.searchsorted(risposte, t)
+        if j < len(risposte) and risposte[j] < fine:
+            latenze.append(risposte[j] - t)
+    return latenze
+
+
+def fase_gui(durata):
+    from pipeline import TripPipeline
+    from tracksimplify import traccia_sintetica
+    pipeline = TripPipeline(1)
+    pipeline.running = True     # start() della finestra non fa nulla: pubblica il thread del benchmark
+    app, finestra, aggiornamenti = _gui(pipeline)
+    n = int(durata * HZ_GUI)
+    lat, lon = traccia_sintetica(n)
+    pubblicazioni = []
+
+    def pubblica():
+        ritmo = _ritmo(HZ_GUI)
+        for i in range(n):
+            next(ritmo)
+            pipeline.carica = 100 - i * 50 // n
+            pipeline.trip_visualizzato = i * 0.01
+            pipeline.posizione = (float(lat[i]), float(lon[i]))
+            pubblicazioni.append(time.perf_counter())
+            pipeline.publish()
+
+    risorse = _Risorse()
+    _exec_finche(app, threading.Thread(target=pubblica, name="bench", daemon=True))
+    risultato = {**risorse.risultato(),
+                 "latenza_widget": _percentili(_abbina(pubblicazioni, aggiornamenti)),
+                 "refresh": _percentili([]) if finestra.m_refresh.count == 0 else {
+                     "n": finestra.m_refresh.count,
+                     "p50_ms": finestra.m_refresh.percentile(50) * 1000,
+                     "p99_ms": finestra.m_refresh.percentile(99) * 1000,
+                     "max_ms": finestra.m_refresh.max * 1000}}
+    finestra.bt_supervisor.shutdown()
+    return risultato
+
+
+def fase_e2e(durata):
+    import shmtelemetry
+    from can_monitor import BatteryMonitor
+    from gpstrip import GPSTracker
+    from pipeline import TripPipeline
+    blocchi = shmtelemetry.crea_blocchi()
+    can_blocco = blocchi[shmtelemetry.CAN_SHM]
+    can_blocco.write(time.time(), 100, 0.0, float("nan"))
+
+    can = _can_simulato(_log_carica(".", durata), FRAME_AL_SECONDO)
+    monitor = BatteryMonitor(can)
+    monitor.on_change = lambda carica: can_blocco.write(time.time(), carica, monitor.t_carica, float("nan"))
+    master, path = _pty()
+    tracker = GPSTracker(blocchi[shmtelemetry.GPS_SHM], blocchi[shmtelemetry.CMD_SHM], sorgente=path)
+    pipeline = TripPipeline(0, periodo=0, condivisa=True)
+
+    n = int(durata * HZ_E2E)
+    frasi = _frasi(n)
+    scritture = []
+
+    def guida():
+        ritmo = _ritmo(HZ_E2E)
+        for frase in frasi:
+            next(ritmo)
+            scritture.append(time.perf_counter())
+            os.write(master, frase)
+
+    monitor.start()
+    tracker.avvia()
+    app, finestra, aggiornamenti = _gui(pipeline)     # Avvia anche la pipeline
+    time.sleep(0.5)     # Sottosistemi aperti prima di misurare
+    cpu0 = _cpu_thread()
+    risorse = _Risorse()
+    _exec_finche(app, threading.Thread(target=guida, name="bench", daemon=True), coda=1.5)
+    r = risorse.risultato()
+    cpu1 = _cpu_thread()
+    try:
+        return {**r,
+                "latenza_fix_gui": _percentili(_abbina(scritture, aggiornamenti)),
+                "cpu_thread_percento": {nome: (cpu1[nome] - cpu0.get(nome, 0.0)) / r["durata_s"] * 100
+                                        for nome in sorted(cpu1)}}
+    finally:
+        pipeline.stop()
+        monitor.stop()
+        tracker.ferma()
+        finestra.bt_supervisor.shutdown()
+        pipeline.chiudi_batteria()
+        if pipeline.ser is not None:
+            pipeline.ser.close()
+        os.close(master)
+        for blocco in blocchi.values():
+            blocco.close()
+
+
+class _LatoMonitor:
+    """Lato master del pty visto come la COM201 della pipeline: readline() e in_waiting"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buf = b""
+
+    @property
+    def in_waiting(self):
+        import fcntl
+        import termios
+        n = fcntl.ioctl(self.fd, termios.FIONREAD, b"\0" * 4)
+        return len(self.buf) + int.from_bytes(n, sys.byteorder)
+
+    def readline(self):
+        while b"\n" not in self.buf:
+            if not select.select([self.fd], [], [], 1.0)[0]:
+                break
+            self.buf += os.read(self.fd, 4096)
+        riga, fine, self.buf = self.buf.partition(b"\n")
+        return riga + fine
+
+
+def _stats_con(modo, durata):
+    """
+    Fix a HZ_STATS nel tracker, righe STATS su un pty letto una volta ogni
+    PERIODO_MONITOR. modo: "fifo" (ogni riga in coda e scritta, come prima del
+    canale), "canale" (GPSTracker così com'è, monitor con readline semplice),
+    "ultima" (GPSTracker e lettura della pipeline, che tiene solo l'ultima riga).
+    Il pty non riporta i byte in uscita: out_waiting è quello di una coppia com0com.
+    """
+    import serial
+    from gpstrip import GPSTracker, SER_CFG
+    from pipeline import TripPipeline
+    master, path = _pty()
+    lato = _LatoMonitor(master)
+
+    class NullModem(serial.Serial):
+        """out_waiting come su com0com: byte scritti e non ancora letti dall'altro capo"""
+
+        @property
+        def out_waiting(self):
+            return lato.in_waiting - len(lato.buf)
+
+    tracker = GPSTracker(porte=False)
+    tracker.ser_stats = NullModem(path, **SER_CFG)
+    pipeline = TripPipeline(0)
+    pipeline.ser = lato
+    saltate_prima = pipeline.m_stats_saltate.value
+    attese_prima = tracker.m_attese.value
+
+    if modo == "fifo":
+        fifo = queue.Queue()
+        tracker.canale_stats.pubblica = fifo.put
+
+        def scrittore():
+            while tracker.running:
+                try:
+                    tracker.ser_stats.write(fifo.get(timeout=0.1).encode())
+                except queue.Empty:
+                    pass
+        t_stat = threading.Thread(target=scrittore, name="gps-stats", daemon=True)
+    else:
+        t_stat = tracker.t_stat
+    t_stat.start()
+
+    def ricevitore():
+        ritmo = _ritmo(HZ_STATS)
+        for frase in _frasi(int(durata * HZ_STATS) + HZ_STATS):
+            next(ritmo)
+            if not tracker.running:
+                break
+            tracker._process_chunk(frase)
+    t_fix = threading.Thread(target=ricevitore, name="bench", daemon=True)
+    t_fix.start()
+
+    eta = []
+    fine = time.perf_counter() + durata
+    try:
+        while time.perf_counter() < fine:
+            time.sleep(PERIODO_MONITOR)
+            riga = (pipeline.leggi_stats() if modo == "ultima" else lato.readline().decode().strip())
+            if riga.startswith("STATS"):
+                eta.append(time.time() - float(riga.split(",")[5]))
+    finally:
+        tracker.running = False
+        t_fix.join()
+        t_stat.join()
+        tracker.ser_stats.close()
+        tracker.stats_file.close()
+        tracker.track.close()
+        os.close(master)
+    return {"eta": _percentili(eta),
+            "eta_finale_s": eta[-1] if eta else 0.0,
+            "righe_saltate_lettore": pipeline.m_stats_saltate.value - saltate_prima,
+            "righe_saltate_tracker": tracker.canale_stats.saltati + tracker.m_attese.value - attese_prima}
+
+
+def fase_stats(durata):
+    return {modo: _stats_con(modo, durata) for modo in ("fifo", "canale", "ultima")}
+
+
+_FUNZIONI = {"can": fase_can, "gps": fase_gps, "gui": fase_gui, "e2e": fase_e2e, "stats": fase_stats}
+
+
+def _processo(fase, durata, coda):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            coda.put(_FUNZIONI[fase](durata))
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            coda.put({"errore": repr(e)})
+
+
+def esegui(fasi=FASI, durata=10.0):
+    ctx = mp.get_context("spawn")
+    risultati = {}
+    for fase in fasi:
+        print(f"Fase {fase}...", flush=True)
+        coda = ctx.Queue()
+        p = ctx.Process(target=_processo, args=(fase, durata, coda), name=f"bench-{fase}")
+        p.start()
+        try:
+            risultati[fase] = coda.get(timeout=durata * 3 + 60)
+        except queue.Empty:
+            risultati[fase] = {"errore": "timeout"}
+        p.join(10)
+        if p.is_alive():
+            p.kill()
+    return risultati
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def salva(risultati, durata, cartella=RISULTATI_DIR):
+    commit = _commit()
+    documento = {"commit": commit, "data": datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "piattaforma": platform.platform(),
+                 "cpu": os.cpu_count(), "durata_fase_s": durata, "fasi": risultati}
+    os.makedirs(cartella, exist_ok=True)
+    path = os.path.join(cartella, f"{datetime.now():%Y%m%d_%H%M%S}_{commit or 'nocommit'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(documento, f, indent=1)
+    return path
+
+
+def _appiattisci(dati, prefisso=""):
+    for chiave, valore in dati.items():
+        nome = f"{prefisso}{chiave}"
+        if isinstance(valore, dict):
+            yield from _appiattisci(valore, nome + ".")
+        elif isinstance(valore, (int, float)) and not isinstance(valore, bool):
+            yield nome, valore
+
+
+def _migliore_se_alto(nome):
+    return "per_s" in nome
+
+
+def confronta(vecchio, nuovo):
+    """Stampa le variazioni tra due file di risultati; restituisce il numero di peggioramenti"""
+    with open(vecchio) as f:
+        a = json.load(f)
+    with open(nuovo) as f:
+        b = json.load(f)
+    print(f"{a.get('commit')} ({a.get('data')}) → {b.get('commit')} ({b.get('data')})")
+    va = dict(_appiattisci(a["fasi"]))
+    peggioramenti = 0
+    for nome, valore in _appiattisci(b["fasi"]):
+        ultimo = nome.rsplit(".", 1)[-1]
+        if nome not in va or ultimo in ("n", "durata_s", "frasi") or ultimo.startswith("righe_saltate"):
+            continue
+        prima = va[nome]
+        if prima == 0:
+            continue
+        delta = (valore - prima) / abs(prima)
+        peggio = -delta if _migliore_se_alto(nome) else delta
+        segno = ""
+        if peggio > SOGLIA_REGRESSIONE:
+            segno = "  PEGGIORATO"
+            peggioramenti += 1
+        elif peggio < -SOGLIA_REGRESSIONE:
+            segno = "  migliorato"
+        print(f"  {nome:48s} {prima:12.3f} → {valore:12.3f} ({delta * 100:+6.1f}%){segno}")
+    return peggioramenti
+
+
+def stampa(risultati):
+    for fase, valori in risultati.items():
+        print(f"[{fase}]")
+        for nome, valore in _appiattisci(valori):
+            print(f"  {nome:48s} {valore:12.3f}")
+        if "errore" in valori:
+            print(f"  errore: {valori['errore']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end con auto simulata")
+    parser.add_argument("--fasi", default=",".join(FASI), help="fasi da eseguire, separate da virgola")
+    parser.add_argument("--durata", type=float, default=10.0, help="secondi per fase")
+    parser.add_argument("--out", default=RISULTATI_DIR, help="cartella dei risultati JSON")
+    parser.add_argument("--confronta", nargs=2, metavar=("VECCHIO", "NUOVO"), help="confronta due risultati")
+    args = parser.parse_args(argv)
+
+    if args.confronta:
+        sys.exit(1 if confronta(*args.confronta) else 0)
+    if not sys.platform.startswith("linux"):
+        parser.error("il benchmark usa pty e /proc: solo Linux")
+    fasi = [f.strip() for f in args.fasi.split(",") if f.strip()]
+    sconosciute = [f for f in fasi if f not in _FUNZIONI]
+    if sconosciute:
+        parser.error(f"fasi sconosciute: {', '.join(sconosciute)}")
+    risultati = esegui(fasi, args.durata)
+    stampa(risultati)
+    print(f"Risultati salvati in {salva(risultati, args.durata, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
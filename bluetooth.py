@@ -0,0 +1,487 @@
+"""
+Rilevamento dei dispositivi Bluetooth tramite bluetoothc.exe.
+
+La scansione gira in un QProcess: l'output viene letto man mano che arriva e
+ogni dispositivo trovato viene segnalato subito, senza mai bloccare il thread
+della UI. I dispositivi già visti sono salvati in cache/bt_devices.json per
+essere mostrati immediatamente all'avvio.
+
+La connessione è gestita da ConnectionSupervisor, che possiede il processo
+`bluetoothc dispositivi connetti <id>`, ne segue lo stato tramite i segnali
+di QProcess e riconnette l'ultimo dispositivo (all'avvio e dopo una caduta)
+con back-off esponenziale.
+
+Il comando può essere sostituito con la variabile d'ambiente BLUETOOTHC,
+ad esempio per usare il finto helper su Linux:
+    BLUETOOTHC="python tools/fake_bluetoothc.py" python bluetooth.py --bench
+    BLUETOOTHC="python tools/fake_bluetoothc.py" python bluetooth.py --bench-connessione
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import subprocess
+from collections import deque
+
+from PyQt5.QtCore import QObject, QProcess, QTimer, pyqtSignal
+
+import logconfig
+
+log = logconfig.get("bt")
+
+DEVICE_CACHE = "cache/bt_devices.json"
+LAST_DEVICE = "cache/bt_connection.json"
+SCAN_TIMEOUT_MS = 5000
+CONFIRM_MS = 1500         # Processo vivo da tanto senza errori = connesso
+BACKOFF_MS = (1000, 30000)  # Attesa minima e massima tra due riconnessioni
+
+
+def bluetoothc_cmd(*args):
+    """Comando di bluetoothc (sovrascrivibile con la variabile BLUETOOTHC)"""
+    return shlex.split(os.environ.get("BLUETOOTHC", "bluetoothc.exe")) + list(args)
+
+
+def parse_riga(riga):
+    """
+    Interpreta una riga di `bluetoothc dispositivi`.
+    Restituisce (nome, id) oppure None se la riga non descrive un dispositivo.
+    """
+    riga = riga.strip()
+
+    # Salta righe vuote o di stato
+    if not riga or riga.startswith("Ricerca dispositivi"):
+        return None
+
+    # Formato nome@id
+    if '@' in riga:
+        nome, dev_id = riga.split('@', 1)
+        nome = nome.strip()
+        dev_id = '@' + dev_id.strip()  # Aggiungi @ all'inizio dell'ID
+        if nome and len(dev_id) > 1:
+            return nome, dev_id
+        return None
+
+    # Formato alternativo: ID dispositivo diretto
+    if '\\' in riga and any(keyword in riga for keyword in ['BTHENUM', 'VID', 'PID']):
+        return "Dispositivo Sconosciuto", riga
+
+    return None
+
+
+def rileva_dispositivi(timeout=5):
+    """
+    Versione bloccante: chiama bluetoothc dispositivi e restituisce lista di (nome, id).
+    Usata solo fuori dalla GUI e come riferimento nel benchmark.
+    """
+    dispositivi_rilevati = []
+    try:
+        proc = subprocess.Popen(
+            bluetoothc_cmd("dispositivi"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        try:
+            output, _ = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            output, _ = proc.communicate()
+
+        for riga in output.splitlines():
+            dispositivo = parse_riga(riga)
+            if dispositivo:
+                dispositivi_rilevati.append(dispositivo)
+
+    except FileNotFoundError:
+        log.error("bluetoothc.exe non trovato!")
+    except Exception as e:
+        log.error("Errore rileva_dispositivi: %s", e)
+
+    return dispositivi_rilevati
+
+
+class DeviceCache:
+    """Dispositivi già rilevati, persistiti su disco"""
+
+    def __init__(self, path=DEVICE_CACHE):
+        self.path = path
+        self.devices = {}   # dev_id -> {"nome": ..., "visto": timestamp}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.devices = json.load(f)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.devices, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.error("Errore salvataggio cache Bluetooth: %s", e)
+
+    def items(self):
+        """(nome, id) ordinati dal più recente"""
+        ordinati = sorted(self.devices.items(), key=lambda kv: -kv[1].get("visto", 0))
+        return [(d["nome"], dev_id) for dev_id, d in ordinati]
+
+    def update(self, nome, dev_id):
+        self.devices[dev_id] = {"nome": nome, "visto": time.time()}
+
+
+class DeviceDiscovery(QObject):
+    """Scansione asincrona: emette device_found per ogni riga valida appena letta"""
+
+    device_found = pyqtSignal(str, str)
+    finished = pyqtSignal(list)
+
+    def __init__(self, parent=None, timeout_ms=SCAN_TIMEOUT_MS):
+        super().__init__(parent)
+        self.timeout_ms = timeout_ms
+        self.proc = None
+        self.buffer = ""
+        self.found = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._on_timeout)
+
+    def is_running(self):
+        return self.proc is not None
+
+    def start(self):
+        """Avvia la scansione; ignorata se ce n'è già una in corso"""
+        if self.proc is not None:
+            return False
+        self.buffer = ""
+        self.found = []
+        cmd = bluetoothc_cmd("dispositivi")
+        self.proc = QProcess(self)
+        self.proc.readyReadStandardOutput.connect(self._on_output)
+        self.proc.finished.connect(self._on_finished)
+        self.proc.errorOccurred.connect(self._on_error)
+        self.proc.start(cmd[0], cmd[1:])
+        self.timer.start(self.timeout_ms)
+        return True
+
+    def _on_output(self):
+        if self.proc is None:
+            return
+        self.buffer += bytes(self.proc.readAllStandardOutput()).decode('utf-8', errors='ignore')
+        *righe, self.buffer = self.buffer.split('\n')
+        for riga in righe:
+            self._handle_line(riga)
+
+    def _handle_line(self, riga):
+        dispositivo = parse_riga(riga)
+        if dispositivo and dispositivo not in self.found:
+            self.found.append(dispositivo)
+            self.device_found.emit(*dispositivo)
+
+    def _on_timeout(self):
+        if self.proc is not None:
+            self.proc.kill()
+
+    def _on_error(self, error):
+        if error == QProcess.FailedToStart:
+            log.error("bluetoothc.exe non trovato!")
+            self._done()
+
+    def _on_finished(self, *_):
+        self._on_output()
+        if self.buffer:
+            self._handle_line(self.buffer)
+            self.buffer = ""
+        self._done()
+
+    def _done(self):
+        if self.proc is None:
+            return
+        self.timer.stop()
+        self.proc.deleteLater()
+        self.proc = None
+        log.info("Scansione Bluetooth completata: %d dispositivi", len(self.found))
+        self.finished.emit(list(self.found))
+
+
+def _percentili(valori):
+    if not valori:
+        return None
+    ordinati = sorted(valori)
+    return {
+        "n": len(ordinati),
+        "media_ms": sum(ordinati) / len(ordinati) * 1000,
+        "p95_ms": ordinati[min(len(ordinati) - 1, int(0.95 * len(ordinati)))] * 1000,
+        "max_ms": ordinati[-1] * 1000,
+    }
+
+
+class ConnectionSupervisor(QObject):
+    """
+    Possiede il processo di connessione bluetoothc e ne segue lo stato.
+    Stati: disconnesso, connessione, connesso, attesa (back-off prima di riprovare).
+    """
+
+    state_changed = pyqtSignal(str, str)   # stato, nome dispositivo
+
+    def __init__(self, parent=None, confirm_ms=CONFIRM_MS, backoff_ms=BACKOFF_MS,
+                 path=LAST_DEVICE):
+        super().__init__(parent)
+        self.confirm_ms = confirm_ms
+        self.backoff_min, self.backoff_max = backoff_ms
+        self.path = path
+        self.proc = None
+        self.stato = "disconnesso"
+        self.desiderato = None      # (nome, dev_id) da mantenere connesso
+        self.backoff = self.backoff_min
+        self.t_richiesta = None
+        self.t_caduta = None
+        # Solo le ultime misure: l'auto resta accesa per giorni
+        self.metriche = {"connessione": deque(maxlen=100), "riconnessione": deque(maxlen=100), "cadute": 0}
+
+        self.confirm_timer = QTimer(self)
+        self.confirm_timer.setSingleShot(True)
+        self.confirm_timer.timeout.connect(self._on_confirmed)
+        self.retry_timer = QTimer(self)
+        self.retry_timer.setSingleShot(True)
+        self.retry_timer.timeout.connect(self._spawn)
+
+    def _set_state(self, stato):
+        self.stato = stato
+        nome = self.desiderato[0] if self.desiderato else ""
+        self.state_changed.emit(stato, nome)
+
+    def _load_last(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                dato = json.load(f)
+            return dato["nome"], dato["dev_id"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_last(self):
+        try:
+            if self.desiderato is None:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"nome": self.desiderato[0], "dev_id": self.desiderato[1]}, f)
+        except OSError as e:
+            log.error("Errore salvataggio ultimo dispositivo: %s", e)
+
+    def reconnect_last(self):
+        """All'avvio: riconnette l'ultimo dispositivo usato, se c'è"""
+        ultimo = self._load_last()
+        if ultimo is not None and self.desiderato is None:
+            self.connect_device(*ultimo)
+
+    def ripristina(self):
+        """Riprova subito se la connessione voluta è caduta; non tocca quella attiva"""
+        if self.desiderato is None:
+            self.reconnect_last()
+        elif self.stato in ("disconnesso", "attesa"):
+            self.retry_timer.stop()
+            self._kill()
+            self.backoff = self.backoff_min
+            self._spawn()
+
+    def connect_device(self, nome, dev_id):
+        """Connette il dispositivo (dev_id senza '@' iniziale), chiudendo quello attuale"""
+        self._kill()
+        self.desiderato = (nome, dev_id)
+        self._save_last()
+        self.backoff = self.backoff_min
+        self.t_caduta = None
+        self._spawn()
+
+    def disconnect_device(self):
+        """Disconnessione voluta: nessuna riconnessione automatica"""
+        self.desiderato = None
+        self._save_last()
+        self.retry_timer.stop()
+        self._kill()
+        self._set_state("disconnesso")
+
+    def _spawn(self):
+        if self.desiderato is None:
+            return
+        cmd = bluetoothc_cmd("dispositivi", "connetti", self.desiderato[1])
+        self.proc = QProcess(self)
+        self.proc.setProcessChannelMode(QProcess.MergedChannels)
+        self.proc.readyReadStandardOutput.connect(self._on_output)
+        self.proc.finished.connect(self._on_exit)
+        self.proc.errorOccurred.connect(self._on_error)
+        self.t_richiesta = time.perf_counter()
+        self._set_state("connessione")
+        self.proc.start(cmd[0], cmd[1:])
+        self.confirm_timer.start(self.confirm_ms)
+
+    def _kill(self):
+        """Termina solo il processo posseduto, senza scansionare la tabella dei processi"""
+        self.confirm_timer.stop()
+        proc, self.proc = self.proc, None
+        if proc is not None:
+            proc.finished.disconnect(self._on_exit)
+            proc.errorOccurred.disconnect(self._on_error)
+            proc.kill()
+            proc.waitForFinished(1000)
+            proc.deleteLater()
+
+    def _on_output(self):
+        if self.proc is None:
+            return
+        testo = bytes(self.proc.readAllStandardOutput()).decode('utf-8', errors='ignore')
+        if self.stato == "connessione" and ("Connesso" in testo or "Connected" in testo):
+            self._on_confirmed()
+
+    def _on_confirmed(self):
+        if self.stato != "connessione" or self.proc is None:
+            return
+        self.confirm_timer.stop()
+        adesso = time.perf_counter()
+        self.metriche["connessione"].append(adesso - self.t_richiesta)
+        if self.t_caduta is not None:
+            self.metriche["riconnessione"].append(adesso - self.t_caduta)
+            self.t_caduta = None
+        self.backoff = self.backoff_min
+        self._set_state("connesso")
+        log.info("Connesso a %s (%s)", *self.desiderato)
+
+    def _on_error(self, error):
+        if error == QProcess.FailedToStart:
+            # Helper mancante: riprovare non servirebbe
+            log.error("bluetoothc.exe non trovato!")
+            proc, self.proc = self.proc, None
+            self.confirm_timer.stop()
+            if proc is not None:
+                proc.deleteLater()
+            self._set_state("disconnesso")
+
+    def _on_exit(self, *_):
+        proc, self.proc = self.proc, None
+        self.confirm_timer.stop()
+        if proc is not None:
+            proc.deleteLater()
+        if self.desiderato is None:
+            self._set_state("disconnesso")
+            return
+        # Caduta o tentativo fallito: riprova con back-off
+        if self.stato == "connesso":
+            self.metriche["cadute"] += 1
+            log.warning("Connessione a %s caduta", self.desiderato[0])
+        if self.t_caduta is None:
+            self.t_caduta = time.perf_counter()
+        self._set_state("attesa")
+        log.debug("Nuovo tentativo tra %d ms", self.backoff)
+        self.retry_timer.start(self.backoff)
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+
+    def stats(self):
+        """Latenze di connessione e riconnessione (media, p95, max)"""
+        return {
+            "connessione": _percentili(self.metriche["connessione"]),
+            "riconnessione": _percentili(self.metriche["riconnessione"]),
+            "cadute": self.metriche["cadute"],
+        }
+
+    def shutdown(self):
+        """Chiusura dell'app: termina il processo ma ricorda il dispositivo"""
+        self.retry_timer.stop()
+        self._kill()
+
+
+def bench_connessione(cadute=5):
+    """
+    Con il finto helper (FAKE_BT_DROP_AFTER fa cadere la connessione) misura
+    latenza di connessione e di riconnessione del supervisore.
+    """
+    from PyQt5.QtCore import QCoreApplication, QEventLoop
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+    os.environ.setdefault("FAKE_BT_DROP_AFTER", "0.3")
+    sup = ConnectionSupervisor(confirm_ms=CONFIRM_MS, backoff_ms=(50, 400),
+                               path=os.path.join("cache", "bt_bench.json"))
+    loop = QEventLoop()
+    contatore = {"connesso": 0}
+
+    def on_state(stato, _):
+        if stato == "connesso":
+            contatore["connesso"] += 1
+            if contatore["connesso"] > cadute:
+                loop.quit()
+
+    sup.state_changed.connect(on_state)
+    QTimer.singleShot(60000, loop.quit)
+    sup.connect_device("Fake", "00112233")
+    loop.exec_()
+    sup.disconnect_device()
+    print(json.dumps(sup.stats(), indent=1))
+    del app
+
+
+def bench():
+    """
+    Misura quanto resta bloccato il thread della UI durante una scansione:
+    prima con rileva_dispositivi() sincrono, poi con DeviceDiscovery.
+    """
+    from PyQt5.QtCore import QCoreApplication, QEventLoop
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+
+    t0 = time.perf_counter()
+    sincroni = rileva_dispositivi()
+    bloccato_sync = time.perf_counter() - t0
+
+    # Ticchettio ogni 5 ms: il ritardo massimo tra due tick è lo stallo della UI
+    stallo = {"max": 0.0, "ultimo": time.perf_counter()}
+
+    def tick():
+        adesso = time.perf_counter()
+        stallo["max"] = max(stallo["max"], adesso - stallo["ultimo"])
+        stallo["ultimo"] = adesso
+
+    ticker = QTimer()
+    ticker.timeout.connect(tick)
+    ticker.start(5)
+
+    primo = {}
+    discovery = DeviceDiscovery()
+    discovery.device_found.connect(
+        lambda *_: primo.setdefault("t", time.perf_counter()))
+    loop = QEventLoop()
+    discovery.finished.connect(loop.quit)
+
+    t0 = time.perf_counter()
+    stallo["ultimo"] = t0
+    discovery.start()
+    avvio = time.perf_counter() - t0
+    loop.exec_()
+    totale = time.perf_counter() - t0
+    ticker.stop()
+
+    print(f"Sincrono : {len(sincroni)} dispositivi, UI bloccata {bloccato_sync * 1000:.1f} ms")
+    print(f"Asincrono: {len(discovery.found)} dispositivi in {totale * 1000:.1f} ms, "
+          f"avvio {avvio * 1000:.2f} ms, stallo massimo UI {stallo['max'] * 1000:.1f} ms")
+    if "t" in primo:
+        print(f"           primo dispositivo dopo {(primo['t'] - t0) * 1000:.1f} ms")
+    del app
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        bench()
+    elif "--bench-connessione" in sys.argv:
+        bench_connessione()
+    else:
+        for nome, dev_id in rileva_dispositivi():
+            print(f"{nome} -> {dev_id}")
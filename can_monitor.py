@@ -1,9 +1,38 @@
 # can_monitor.py
+"""
+Monitor della carica batteria dal bus CAN (VIT7_CANbus_DLL, frame 0x638).
+
+    python can_monitor.py [--profile]
+    python can_monitor.py --replay can_logs/battery_20250101_120000.csv [--velocita 60] [--profile]
+
+Il replay rigioca un log della carica senza DLL né adattatore (anche su Linux).
+"""
 import ctypes
 import time
 import threading
-from datetime import datetime
-import os
+from array import array
+from bisect import bisect_right
+
+import metrics
+from limiti import FileGiornaliero
+import logconfig
+import basetempo
+from energia import IntegratoreEnergia, PACCO_ID, decodifica_pacco, codifica_pacco
+import profiler
+
+
+# Struttura dati
+class ReturnData(ctypes.Structure):
+    _fields_ = [
+        ("nType", ctypes.c_int),
+        ("nResult", ctypes.c_int),
+        ("nID", ctypes.c_int),
+        ("nIDE", ctypes.c_int),
+        ("nRTR", ctypes.c_int),
+        ("nDLC", ctypes.c_int),
+        ("cData", ctypes.c_ubyte * 8)
+    ]
+
 
 class CANBusManager:
     """Gestisce la connessione e comunicazione CAN"""
@@ -21,17 +50,6 @@ class CANBusManager:
     
     def _setup_functions(self):
         """Configura le funzioni della DLL"""
-        # Struttura dati
-        class ReturnData(ctypes.Structure):
-            _fields_ = [
-                ("nType", ctypes.c_int),
-                ("nResult", ctypes.c_int),
-                ("nID", ctypes.c_int),
-                ("nIDE", ctypes.c_int),
-                ("nRTR", ctypes.c_int),
-                ("nDLC", ctypes.c_int),
-                ("cData", ctypes.c_ubyte * 8)
-            ]
         self.ReturnData = ReturnData
         
         # Funzioni
@@ -77,14 +95,26 @@ class BatteryMonitor:
         self.current_charge = 0  # 0-100%
         self.running = False
         self.lock = threading.Lock()
+        self.on_change = None    # Callback(charge) a ogni variazione (processo CAN del launcher)
+        self.ricezione = basetempo.adesso
+        self.t_carica = None     # Ricezione dell'ultimo 0x638 sulla base dei tempi comune con il GPS
+        self.energia = IntegratoreEnergia()     # Scritto solo dal thread can-rx
+        self._setup_metrics()
         self._setup_logging()
+
+    def _setup_metrics(self):
+        self.m_frame = metrics.counter("can_frames_total", "Frame dati ricevuti dal bus CAN")
+        self.m_overflow = metrics.counter("can_fifo_overflow_total", "Overflow della FIFO di ricezione")
+        self.m_clear = metrics.counter("can_fifo_clear_total", "Svuotamenti della FIFO per timeout")
+        self.m_carica = metrics.gauge("battery_charge_percent", "Ultima carica letta")
+        self.m_variazioni = metrics.counter("battery_charge_changes_total", "Variazioni della carica")
+        self.m_intervallo = metrics.histogram("can_charge_frame_interval_seconds",
+                                              "Intervallo tra due frame 0x638 (carica)")
+        self.m_pacco = metrics.counter("can_pack_frames_total", f"Frame 0x{PACCO_ID:X} (tensione e corrente)")
         
     def _setup_logging(self):
-        """Configura il sistema di logging"""
-        os.makedirs("can_logs", exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_file = open(f"can_logs/battery_{timestamp}.csv", "a")
-        self.log_file.write("timestamp,charge%\n")
+        """Log delle variazioni di carica, un file al giorno"""
+        self.log_file = FileGiornaliero("can_logs", "battery", "timestamp,charge%")
     
     def start(self):
         """Avvia il monitoraggio"""
@@ -92,7 +122,7 @@ class BatteryMonitor:
             return
             
         self.running = True
-        self.thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self.thread = threading.Thread(target=self._monitor_loop, name="can-rx", daemon=True)
         self.thread.start()
     
     def stop(self):
@@ -106,45 +136,169 @@ class BatteryMonitor:
         """Restituisce la percentuale di carica"""
         with self.lock:
             return self.current_charge
+
+    def get_energy_wh(self):
+        """Wh netti prelevati dal pacco dall'avvio; None se il bus non manda tensione e corrente"""
+        stato = self.energia.stato      # Una lettura sola: tupla sempre completa
+        return stato.wh if stato.frame > 1 else None
+
+    def get_regen_wh(self):
+        """Wh tornati nel pacco in recupero dall'avvio; None senza frame del pacco"""
+        stato = self.energia.stato
+        return stato.wh_recupero if stato.frame > 1 else None
     
     def _monitor_loop(self):
         timeout = 1.0            # svuota FIFO se non arriva nulla per 1 s
         last_msg = time.time()
+        frame_inc = self.m_frame.inc
+        ricezione = self.ricezione
 
         while self.running:
             msg = self.can.ReturnData()
             ret = self.can.VIT7_ReceiveMessage(ctypes.byref(msg))
 
             if ret == 1:
+                t_rx = ricezione()      # Il prima possibile: la DLL non dà l'ora del frame
                 if msg.nType == 4:
-                    self._process_message(msg)
+                    frame_inc()
+                    self._process_message(msg, t_rx)
                     last_msg = time.time()
                 elif msg.nType == -999:      # overflow FIFO
+                    self.m_overflow.inc()
                     self.can.clear_fifo()
             else:
                 # niente ricevuto: se superato il timeout ⇒ pulizia
                 if time.time() - last_msg > timeout:
+                    self.m_clear.inc()
                     self.can.clear_fifo()
                     last_msg = time.time()
                 time.sleep(0.001)
     
-    def _process_message(self, msg):
-        """Elabora un messaggio CAN"""
+    def _process_message(self, msg, t_rx=None):
+        """Elabora un messaggio CAN ricevuto all'istante t_rx della base comune"""
+        if msg.nID == PACCO_ID and msg.nDLC >= 4 and not msg.nRTR:
+            self.m_pacco.inc()
+            self.energia.aggiungi(self.ricezione() if t_rx is None else t_rx, *decodifica_pacco(msg.cData))
+            return
         if (msg.nID == 0x638 and    # ID corretto
             msg.nDLC == 8 and       # DLC corretto
             not msg.nRTR):          # Non è remote frame
             
             charge_byte = msg.cData[3]  # Quarto byte
             charge = min(100, max(0, charge_byte))
+
+            if t_rx is None:
+                t_rx = self.ricezione()
+            if self.t_carica is not None:
+                self.m_intervallo.record(t_rx - self.t_carica)
+            self.t_carica = t_rx
             
             with self.lock:
+                changed = charge != self.current_charge
                 self.current_charge = charge
+
+            # Registra solo le variazioni: serve al backtest offline dell'autonomia
+            if changed:
+                self.m_carica.set(charge)
+                self.m_variazioni.inc()
+                self.log_file.write(f"{basetempo.parete(t_rx):.3f},{charge}\n")
+                self.log_file.flush()
+                if self.on_change is not None:
+                    self.on_change(charge)
             
             
     
     
 
 
+class ReplayCAN:
+    """
+    Bus CAN finto con la stessa interfaccia di CANBusManager: rigioca un log
+    can_logs/battery_*.csv (timestamp,charge%) come frame 0x638 a 10 Hz, in
+    mezzo a frame di altri ID per riprodurre il carico del bus.
+    Al posto del file accetta anche la serie (tempi, cariche) di uno scenario simulato.
+    velocita accelera solo l'andamento della carica, non il numero di frame al secondo.
+    pacco = (tempi, tensioni, Wh prelevati) aggiunge i frame di tensione e corrente,
+    con la corrente media dall'ultimo frame: l'energia torna a qualunque velocità.
+    """
+    PERIODO_638 = 0.1
+    PERIODO_PACCO = 0.02
+
+    def __init__(self, path, velocita=1.0, frame_al_secondo=500, pacco=None):
+        self.ReturnData = ReturnData
+        self.tempi = []
+        self.cariche = []
+        if isinstance(path, str):
+            with open(path) as f:
+                next(f, None)   # Intestazione
+                for riga in f:
+                    t, carica = riga.strip().split(",")
+                    self.tempi.append(float(t))
+                    self.cariche.append(int(carica))
+        else:
+            self.tempi, self.cariche = (list(x) for x in path)
+            path = "serie simulata"
+        if not self.tempi:
+            raise ValueError(f"Log CAN vuoto: {path}")
+        self.velocita = velocita
+        self.passo = 1.0 / frame_al_secondo
+        self.ogni_638 = max(1, round(self.PERIODO_638 * frame_al_secondo))
+        self.ogni_pacco = max(1, round(self.PERIODO_PACCO * frame_al_secondo))
+        self.pacco = None if pacco is None else tuple(array("d", serie) for serie in pacco)    # 8 byte a campione
+        self.pacco_prec = None      # (t, Wh) dell'ultimo frame del pacco
+        self.t_sim = self.tempi[0]  # Tempo del log dell'ultimo frame
+        self.n = 0
+        self.t_avvio = None
+        self.finito = False
+
+    def connect(self):
+        return True
+
+    def disconnect(self):
+        pass
+
+    def clear_fifo(self):
+        return True
+
+    def VIT7_ReceiveMessage(self, ref):
+        adesso = time.perf_counter()
+        if self.t_avvio is None:
+            self.t_avvio = adesso
+        trascorso = adesso - self.t_avvio
+        if trascorso < self.n * self.passo:
+            return 0    # FIFO vuota
+        t = self.tempi[0] + trascorso * self.velocita
+        if t > self.tempi[-1]:
+            self.finito = True
+            return 0
+        self.t_sim = t
+        msg = ref._obj
+        msg.nType, msg.nDLC, msg.nRTR = 4, 8, 0
+        if self.n % self.ogni_638 == 0:
+            msg.nID = 0x638
+            msg.cData[3] = self.cariche[bisect_right(self.tempi, t) - 1]
+        elif self.pacco is not None and self.n % self.ogni_pacco == 1:
+            msg.nID = PACCO_ID
+            msg.cData[:4] = list(codifica_pacco(*self._pacco(t)))
+        else:
+            msg.nID = 0x100 + self.n % 64
+        self.n += 1
+        return 1
+
+
+    def _pacco(self, t):
+        """(tensione, corrente media dal frame precedente) all'istante t del log"""
+        tempi, volt, wh = self.pacco
+        i = min(bisect_right(tempi, t), len(tempi) - 1)
+        energia = wh[i - 1] + (wh[i] - wh[i - 1]) * (t - tempi[i - 1]) / (tempi[i] - tempi[i - 1]) if i else wh[0]
+        precedente = self.pacco_prec
+        self.pacco_prec = (t, energia)
+        if precedente is None or t <= precedente[0]:
+            return volt[i], 0.0
+        potenza = (energia - precedente[1]) * 3600 / (t - precedente[0])
+        return volt[i], potenza / volt[i]
+
+
 # Funzioni pubbliche per semplificare l'uso
 def create_battery_monitor():
     """Factory per creare un monitor batteria pronto all'uso"""
@@ -154,17 +308,27 @@ def create_battery_monitor():
 
 if __name__ == "__main__":
     # Esempio di utilizzo diretto
+    logconfig.setup("can")
+    profiler.da_argv("can_monitor")
+    monitor = None
     try:
-        monitor = create_battery_monitor()
+        metrics.avvia_server(metrics.PORTA_CAN)
+        if profiler.opzione("--replay"):
+            monitor = BatteryMonitor(ReplayCAN(profiler.opzione("--replay"),
+                                               float(profiler.opzione("--velocita", 1))))
+        else:
+            monitor = create_battery_monitor()
         monitor.start()
         
         print("Monitoraggio batteria avviato (CTRL+C per fermare)")
-        while True:
+        while not getattr(monitor.can, "finito", False):
             print(f"\rCarica: {monitor.get_charge()}%", end="")
             time.sleep(1)
+        print()
             
     except KeyboardInterrupt:
         print("\nInterruzione ricevuta...")
     finally:
-        monitor.stop()
-        monitor.can.disconnect()
+        if monitor is not None:
+            monitor.stop()
+            monitor.can.disconnect()
@@ -0,0 +1,443 @@
+"""
+Efficienza di guida del viaggio: consumo per tratto e per fascia di velocità,
+quota di tempo da fermi e energia recuperata in frenata.
+
+La pipeline passa ad AnalisiViaggio un campione per ciclo (ora del fix,
+trip km di gpstrip, Wh del viaggio dal CAN o, senza frame del pacco, dalla
+carica): ogni campione aggiorna pochi accumulatori, quindi il costo è O(1)
+e la memoria cresce solo di una riga per tratto chiuso. A fine viaggio il
+riepilogo finisce in JSON accanto al CSV del RegistroTraccia
+(logtrip/tracce/trip_<data>.efficienza.json).
+
+Il recupero è quello misurato dall'integratore del pacco (energia.py) se il
+monitor lo espone, altrimenti è stimato dall'energia cinetica persa nelle
+decelerazioni. I km "guadagnati" sono il recupero diviso per i Wh/km del
+viaggio.
+
+La stessa analisi, vettorizzata con NumPy su tutti i viaggi registrati,
+ricostruisce i riepiloghi (anche dei viaggi interrotti da un crash):
+    python efficienza.py [logtrip/tracce] [--per km|s] [--lunghezza 1] [--scrivi]
+    python efficienza.py --bench
+"""
+
+import os
+import glob
+import json
+import math
+import time
+import argparse
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from guessometer import TRACCE_DIR, PACCO_WH
+
+FASCE_KMH = (5, 30, 50, 70, 90, 110)    # Limiti delle fasce di velocità; sotto il primo l'auto è ferma
+NOMI_FASCE = ("ferma", "5-30", "30-50", "50-70", "70-90", "90-110", ">110")
+SEGMENTO_KM = 1.0           # Lunghezza dei tratti divisi per distanza
+SEGMENTO_S = 60.0           # Durata dei tratti divisi per tempo
+DT_MAX = 30.0               # Campioni più distanti non si attribuiscono a una fascia (GPS perso, pausa)
+KM_FASCIA_MIN = 0.1         # Sotto questa distanza i Wh/km di una fascia non si mostrano
+# Stima del recupero senza frame del pacco: come VEICOLO in scenario.py
+MASSA_KG = 1200
+CRR = 0.011
+CDA_M2 = 0.70
+RHO_ARIA = 1.2
+G = 9.81
+RECUPERO = 0.55             # Frazione dell'energia di frenata che torna in batteria
+SUFFISSO = ".efficienza.json"
+
+CAMPI_TRATTO = ("inizio", "km", "secondi", "wh", "fermo_s", "recupero_wh")
+Sintesi = namedtuple("Sintesi", "km secondi wh wh_km quota_fermo fermate recupero_wh recupero_km fasce")
+
+
+def wh_da_carica(inizio, carica):
+    """Wh consumati stimati dai punti di carica (risoluzione ~300 Wh), senza frame del pacco"""
+    return (inizio - carica) * PACCO_WH / 100
+
+
+def _recupero_cinetico(v0, v1, metri):
+    """
+    Wh stimati tornati in batteria passando da v0 a v1 m/s in metri: l'energia
+    cinetica persa meno quella che rotolamento e aria avrebbero dissipato
+    comunque (strada in piano), cioè quella tolta dai freni.
+    """
+    vm = (v0 + v1) * 0.5
+    frenata = 0.5 * MASSA_KG * (v0 * v0 - v1 * v1) - (MASSA_KG * G * CRR + 0.5 * RHO_ARIA * CDA_M2 * vm * vm) * metri
+    return max(0.0, frenata) * RECUPERO / 3600.0
+
+
+def _wh_km(wh, km, km_min=KM_FASCIA_MIN):
+    return wh / km if km >= km_min else None
+
+
+class AnalisiViaggio:
+    """
+    Accumulatori incrementali di un viaggio. aggiungi() è chiamata dal solo
+    thread della pipeline; sintesi è una tupla immutabile ripubblicata a ogni
+    campione, che la GUI legge senza lock.
+    """
+
+    def __init__(self, per="km", lunghezza=None, dt_max=DT_MAX):
+        self.per = per                      # "km" o "s": come si dividono i tratti
+        self.lunghezza = lunghezza or (SEGMENTO_KM if per == "km" else SEGMENTO_S)
+        self.dt_max = dt_max
+        self.prec = None                    # (t, km, wh, recupero) dell'ultimo campione
+        self.v = None                       # m/s dell'ultimo passo valido
+        self.fascia = None
+        n = len(NOMI_FASCE)
+        self.km_fasce = [0.0] * n
+        self.wh_fasce = [0.0] * n
+        self.s_fasce = [0.0] * n
+        self.fermate = 0
+        self.recupero_wh = 0.0
+        self.misurato = False               # Recupero dall'integratore del pacco invece che stimato
+        self.buchi = 0
+        self.progresso = 0.0                # km o secondi validi dall'inizio, per chiudere i tratti
+        self.indice = 0                     # floor(progresso / lunghezza) del tratto aperto
+        self.tratti = array("d")            # CAMPI_TRATTO in fila, un gruppo per tratto chiuso
+        self.tratto = None                  # Tratto aperto, stessi campi
+        self.sintesi = None
+
+    def aggiungi(self, t, km, wh, recupero=None):
+        """Campione all'istante t (secondi): trip km e Wh del viaggio, recupero cumulativo se misurato"""
+        prec = self.prec
+        if prec is None:
+            self.prec = (t, km, wh, recupero)
+            return
+        dt = t - prec[0]
+        if dt <= 0:
+            return                          # Stessa riga STATS: si aspetta il fix successivo
+        self.prec = (t, km, wh, recupero)
+        dkm = km - prec[1]
+        if dkm < 0 or dt > self.dt_max:
+            self.buchi += 1                 # Trip azzerato da gpstrip o pausa: si riparte da qui
+            return
+        dwh = wh - prec[2]
+        v = dkm * 1000 / dt
+        if recupero is not None and prec[3] is not None:
+            rec = recupero - prec[3]
+            self.misurato = True
+        else:
+            rec = _recupero_cinetico(self.v, v, dkm * 1000) if self.v is not None else 0.0
+        self.v = v
+
+        i = bisect_right(FASCE_KMH, v * 3.6)
+        self.km_fasce[i] += dkm
+        self.wh_fasce[i] += dwh
+        self.s_fasce[i] += dt
+        if i == 0 and self.fascia is not None and self.fascia != 0:
+            self.fermate += 1
+        self.fascia = i
+        self.recupero_wh += rec
+
+        tratto = self.tratto
+        if tratto is None:
+            tratto = self.tratto = [prec[0], 0.0, 0.0, 0.0, 0.0, 0.0]
+        tratto[1] += dkm
+        tratto[2] += dt
+        tratto[3] += dwh
+        if i == 0:
+            tratto[4] += dt
+        tratto[5] += rec
+        self.progresso += dkm if self.per == "km" else dt
+        indice = math.floor(self.progresso / self.lunghezza)
+        if indice != self.indice:
+            self.tratti.extend(tratto)
+            self.tratto = None
+            self.indice = indice
+        self._pubblica()
+
+    def _pubblica(self):
+        km = sum(self.km_fasce)
+        secondi = sum(self.s_fasce)
+        wh = sum(self.wh_fasce)
+        wh_km = _wh_km(wh, km)
+        self.sintesi = Sintesi(
+            km, secondi, wh, wh_km,
+            self.s_fasce[0] / secondi if secondi > 0 else 0.0, self.fermate,
+            self.recupero_wh, self.recupero_wh / wh_km if wh_km and wh_km > 0 else 0.0,
+            tuple(_wh_km(w, k) for w, k in zip(self.wh_fasce, self.km_fasce)))
+
+    def riepilogo(self):
+        """Dizionario per il JSON del viaggio (stesso formato di analizza())"""
+        n = len(CAMPI_TRATTO)
+        tratti = [self.tratti[i:i + n] for i in range(0, len(self.tratti), n)]
+        if self.tratto is not None:
+            tratti.append(self.tratto)
+        return _riepilogo(self.km_fasce, self.wh_fasce, self.s_fasce, self.fermate, self.recupero_wh,
+                          self.misurato, tratti, self.per, self.lunghezza)
+
+    def salva(self, path):
+        """Scrive il riepilogo in <path senza .csv>.efficienza.json; restituisce il percorso"""
+        destinazione = os.path.splitext(path)[0] + SUFFISSO
+        with open(destinazione, "w") as f:
+            json.dump(self.riepilogo(), f, indent=1)
+        return destinazione
+
+
+def _riepilogo(km_fasce, wh_fasce, s_fasce, fermate, recupero_wh, misurato, tratti, per, lunghezza):
+    km = sum(float(k) for k in km_fasce)
+    secondi = sum(float(x) for x in s_fasce)
+    wh = sum(float(w) for w in wh_fasce)
+    wh_km = _wh_km(wh, km)
+    return {
+        "per": per,
+        "lunghezza": lunghezza,
+        "km": round(km, 3),
+        "secondi": round(secondi, 1),
+        "wh": round(wh, 1),
+        "wh_km": round(wh_km, 1) if wh_km is not None else None,
+        "quota_fermo": round(float(s_fasce[0]) / secondi, 4) if secondi > 0 else 0.0,
+        "fermate": int(fermate),
+        "recupero_wh": round(float(recupero_wh), 1),
+        "recupero_km": round(float(recupero_wh) / wh_km, 2) if wh_km and wh_km > 0 else 0.0,
+        "recupero": "misurato" if misurato else "stimato",
+        "fasce": [{"fascia": nome, "km": round(float(k), 3), "secondi": round(float(s), 1),
+                   "wh": round(float(w), 1), "wh_km": round(w / k, 1) if k >= KM_FASCIA_MIN else None}
+                  for nome, k, w, s in zip(NOMI_FASCE, km_fasce, wh_fasce, s_fasce)],
+        "tratti": [dict(zip(CAMPI_TRATTO, (round(float(x), 3) for x in riga))) for riga in tratti],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Analisi in blocco, vettorizzata (NumPy importato solo qui: la GUI parte senza)
+
+def _passi(t, km, wh, recupero, viaggio, per, lunghezza, dt_max=DT_MAX):
+    """
+    Le stesse regole di AnalisiViaggio.aggiungi su array concatenati di più
+    viaggi (viaggio = indice del viaggio per campione). Restituisce i passi
+    validi: viaggio, fascia, dkm, dwh, dt, recupero, fermata, tratto e inizio
+    del passo; il tratto è numerato da 0 in ogni viaggio.
+    """
+    import numpy as np
+    # Campioni con lo stesso istante non contano (come i doppioni della riga STATS)
+    tieni = np.ones(len(t), dtype=bool)
+    tieni[1:] = (np.diff(t) > 0) | (viaggio[1:] != viaggio[:-1])
+    t, km, wh, recupero, viaggio = t[tieni], km[tieni], wh[tieni], recupero[tieni], viaggio[tieni]
+
+    dt = np.diff(t)
+    dkm = np.diff(km)
+    stesso = viaggio[1:] == viaggio[:-1]
+    valido = stesso & (dkm >= 0) & (dt <= dt_max)
+    dt, dkm, inizio = dt[valido], dkm[valido], t[:-1][valido]
+    dwh = np.diff(wh)[valido]
+    misurato_rec = np.diff(recupero)[valido]
+    vi = viaggio[1:][valido]
+    v = dkm * 1000 / dt
+    fascia = np.searchsorted(FASCE_KMH, v * 3.6, side="right")
+
+    primo = np.ones(len(vi), dtype=bool)    # Primo passo valido del viaggio
+    primo[1:] = vi[1:] != vi[:-1]
+    v_prec = np.concatenate((v[:1], v[:-1]))
+    vm = (v_prec + v) * 0.5
+    frenata = (0.5 * MASSA_KG * (v_prec * v_prec - v * v)
+               - (MASSA_KG * G * CRR + 0.5 * RHO_ARIA * CDA_M2 * vm * vm) * (dkm * 1000))
+    cinetico = np.where(primo, 0.0, np.maximum(0.0, frenata) * RECUPERO / 3600.0)
+    ha_misura = ~np.isnan(misurato_rec)
+    rec = np.where(ha_misura, misurato_rec, cinetico)
+
+    fascia_prec = np.empty_like(fascia)
+    fascia_prec[1:] = fascia[:-1]
+    fermata = (fascia == 0) & ~primo & (fascia_prec != 0)
+
+    # Tratti: come in aggiungi(), dal progresso cumulato prima di ogni passo
+    passo = dkm if per == "km" else dt
+    prima = np.concatenate(([0.0], np.cumsum(passo)[:-1]))
+    inizi = np.flatnonzero(primo)
+    passi_viaggio = np.diff(np.append(inizi, len(vi)))
+    prima -= np.repeat(prima[inizi], passi_viaggio)
+    chiave = vi.astype(np.int64) * (1 << 32) + np.floor(prima / lunghezza).astype(np.int64)
+    _, tratto = np.unique(chiave, return_inverse=True)
+    tratto -= np.repeat(tratto[inizi], passi_viaggio)
+    return vi, fascia, dkm, dwh, dt, rec, ha_misura, fermata, tratto, inizio
+
+
+def _sommario(vi, fascia, dkm, dwh, dt, rec, ha_misura, fermata, tratto, inizio, per, lunghezza):
+    """Riepilogo di un solo viaggio dai passi di _passi()"""
+    import numpy as np
+    n = len(NOMI_FASCE)
+    km_fasce = np.bincount(fascia, dkm, n)
+    wh_fasce = np.bincount(fascia, dwh, n)
+    s_fasce = np.bincount(fascia, dt, n)
+    nt = int(tratto.max()) + 1 if len(tratto) else 0
+    tratti = np.zeros((nt, len(CAMPI_TRATTO)))
+    if nt:
+        primi = np.flatnonzero(np.diff(tratto, prepend=-1))
+        tratti[:, 0] = inizio[primi]
+        tratti[:, 1] = np.bincount(tratto, dkm, nt)
+        tratti[:, 2] = np.bincount(tratto, dt, nt)
+        tratti[:, 3] = np.bincount(tratto, dwh, nt)
+        tratti[:, 4] = np.bincount(tratto, dt * (fascia == 0), nt)
+        tratti[:, 5] = np.bincount(tratto, rec, nt)
+    return _riepilogo(km_fasce, wh_fasce, s_fasce, fermata.sum(), rec.sum(), bool(ha_misura.any()),
+                      tratti, per, lunghezza)
+
+
+def analizza(t, km, wh, recupero=None, per="km", lunghezza=None, dt_max=DT_MAX):
+    """Riepilogo di un viaggio da array completi; uguale a quello di AnalisiViaggio"""
+    import numpy as np
+    lunghezza = lunghezza or (SEGMENTO_KM if per == "km" else SEGMENTO_S)
+    t = np.asarray(t, dtype=float)
+    recupero = np.full(len(t), np.nan) if recupero is None else np.asarray(recupero, dtype=float)
+    passi = _passi(t, np.asarray(km, dtype=float), np.asarray(wh, dtype=float), recupero,
+                   np.zeros(len(t), dtype=np.int64), per, lunghezza, dt_max)
+    return _sommario(*passi, per, lunghezza)
+
+
+def carica_traccia(path):
+    """
+    Colonne (t, carica, trip_km, wh, recupero) di un CSV del RegistroTraccia,
+    None se illeggibile. Le tracce senza Wh dal CAN (o precedenti alla
+    colonna) usano la carica.
+    """
+    import numpy as np
+    try:
+        dati = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)    # Parser in C: "nan" compreso
+    except ValueError:
+        return None
+    if dati.shape[0] < 2 or dati.shape[1] < 4:
+        return None
+    dati = dati[~np.isnan(dati[:, :3]).any(axis=1)]
+    if len(dati) < 2:
+        return None
+    wh = dati[:, 4] if dati.shape[1] > 4 else np.full(len(dati), np.nan)
+    if np.isnan(wh).any():
+        wh = wh_da_carica(dati[0, 1], dati[:, 1])
+    recupero = dati[:, 5] if dati.shape[1] > 5 else np.full(len(dati), np.nan)
+    return dati[:, 0], dati[:, 1], dati[:, 2], wh, recupero
+
+
+def analizza_storico(tracce, per="km", lunghezza=None, dt_max=DT_MAX):
+    """
+    Tutti i viaggi in un colpo: i campioni vengono concatenati con l'indice
+    del viaggio e ogni somma è un bincount. tracce è una lista di
+    (t, km, wh, recupero); restituisce (riepiloghi per viaggio, riepilogo complessivo).
+    """
+    import numpy as np
+    lunghezza = lunghezza or (SEGMENTO_KM if per == "km" else SEGMENTO_S)
+    if not tracce:
+        return [], None
+    lunghezze = [len(tr[0]) for tr in tracce]
+    viaggio = np.repeat(np.arange(len(tracce)), lunghezze)
+    t, km, wh, recupero = (np.concatenate([tr[k] for tr in tracce]).astype(float) for k in range(4))
+    passi = _passi(t, km, wh, recupero, viaggio, per, lunghezza, dt_max)
+    vi = passi[0]
+    confini = np.searchsorted(vi, np.arange(len(tracce) + 1))
+    riepiloghi = [_sommario(*(p[a:b] for p in passi), per, lunghezza)
+                  for a, b in zip(confini[:-1], confini[1:])]
+
+    # Complessivo: fasce e fermate su tutto lo storico, senza i singoli tratti
+    vi, fascia, dkm, dwh, dt, rec, ha_misura, fermata, _, _ = passi
+    n = len(NOMI_FASCE)
+    totale = _riepilogo(np.bincount(fascia, dkm, n), np.bincount(fascia, dwh, n), np.bincount(fascia, dt, n),
+                        fermata.sum(), rec.sum(), bool(ha_misura.any()), np.zeros((0, len(CAMPI_TRATTO))),
+                        per, lunghezza)
+    totale["viaggi"] = len(tracce)
+    return riepiloghi, totale
+
+
+def _stampa(nome, r):
+    wh_km = f"{r['wh_km']:6.1f}" if r["wh_km"] is not None else "    --"
+    fasce = " ".join(f"{f['fascia']}:{f['wh_km']:.0f}" for f in r["fasce"][1:] if f["wh_km"] is not None)
+    print(f"{nome:28s} {r['km']:8.1f} km {wh_km} Wh/km  fermo {r['quota_fermo'] * 100:4.1f}% "
+          f"({r['fermate']:3d} soste)  recupero {r['recupero_wh']:7.0f} Wh ({r['recupero']}, "
+          f"+{r['recupero_km']:.1f} km)  {fasce}")
+
+
+# ---------------------------------------------------------------------------
+
+def _traccia_scenario(sim):
+    """(t, km, wh, recupero) di uno scenario a 1 Hz, come li vedrebbe la pipeline"""
+    import numpy as np
+    km = np.cumsum(sim.v) * (sim.t[1] - sim.t[0]) / 1000
+    return sim.t.astype(float), km, sim.energia.astype(float), np.full(len(sim.t), np.nan)
+
+
+def _recupero_vero(sim):
+    """Wh tornati in batteria nel modello di scenario.py (forze ricostruite da velocità e quota)"""
+    import numpy as np
+    import scenario
+    veicolo = scenario.VEICOLO
+    v = sim.v
+    seno = np.where(v > 0, np.diff(sim.quota, prepend=scenario.QUOTA_PARTENZA) / np.maximum(v, 1e-9), 0.0)
+    forza = (MASSA_KG * np.diff(v, prepend=0.0)
+             + MASSA_KG * G * (CRR * np.sqrt(1 - seno ** 2) * (v > 0) + seno) + 0.5 * RHO_ARIA * CDA_M2 * v * v)
+    return -np.minimum(forza * v, 0.0).sum() * veicolo["recupero"] / 3600
+
+
+def bench(viaggi=400):
+    """
+    Costo per campione dell'analisi in streaming, coincidenza con l'analisi
+    vettorizzata sugli scenari simulati e throughput del blocco su uno
+    storico sintetico.
+    """
+    import scenario
+
+    print("Streaming contro blocco sugli scenari (tratti da 1 km):")
+    for nome in scenario.SCENARI:
+        sim = scenario.genera(nome, seed=1)
+        t, km, wh, rec = _traccia_scenario(sim)
+        analisi = AnalisiViaggio()
+        t0 = time.perf_counter()
+        for campione in zip(t.tolist(), km.tolist(), wh.tolist()):
+            analisi.aggiungi(*campione)
+        costo = (time.perf_counter() - t0) / len(t)
+        streaming = analisi.riepilogo()
+        blocco = analizza(t, km, wh)
+        uguali = json.dumps(streaming) == json.dumps(blocco)
+        _stampa(nome, blocco)
+        print(f"{'':28s} {costo * 1e6:5.2f} µs/campione, {len(blocco['tratti'])} tratti, "
+              f"streaming {'uguale' if uguali else 'DIVERSO'} dal blocco; recupero nel modello "
+              f"{_recupero_vero(sim):.0f} Wh")
+
+    # Storico: gli scenari ripetuti con semi diversi
+    storico = []
+    nomi = list(scenario.SCENARI)
+    for i in range(viaggi):
+        storico.append(_traccia_scenario(scenario.genera(nomi[i % len(nomi)], seed=i)) if i < len(nomi) * 4
+                       else storico[i % (len(nomi) * 4)])
+    campioni = sum(len(tr[0]) for tr in storico)
+    tempi = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        riepiloghi, totale = analizza_storico(storico)
+        tempi.append(time.perf_counter() - t0)
+    print(f"\nStorico di {viaggi} viaggi, {campioni} campioni: {min(tempi):.3f} s "
+          f"({campioni / min(tempi) / 1e6:.2f} M campioni/s)")
+    _stampa("complessivo", totale)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Efficienza di guida dei viaggi registrati")
+    parser.add_argument("cartella", nargs="?", default=TRACCE_DIR, help="CSV del RegistroTraccia")
+    parser.add_argument("--per", choices=("km", "s"), default="km", help="tratti per distanza o per tempo")
+    parser.add_argument("--lunghezza", type=float, help="km o secondi per tratto")
+    parser.add_argument("--scrivi", action="store_true", help="riscrive il JSON accanto a ogni traccia")
+    parser.add_argument("--bench", action="store_true")
+    args = parser.parse_args(argv)
+    if args.bench:
+        bench()
+        return
+
+    percorsi, tracce = [], []
+    for path in sorted(glob.glob(os.path.join(args.cartella, "trip_*.csv"))):
+        traccia = carica_traccia(path)
+        if traccia is not None:
+            t, _, km, wh, recupero = traccia
+            percorsi.append(path)
+            tracce.append((t, km, wh, recupero))
+    riepiloghi, totale = analizza_storico(tracce, args.per, args.lunghezza)
+    for path, r in zip(percorsi, riepiloghi):
+        _stampa(os.path.basename(path), r)
+        if args.scrivi:
+            with open(os.path.splitext(path)[0] + SUFFISSO, "w") as f:
+                json.dump(r, f, indent=1)
+    if totale is not None:
+        _stampa(f"complessivo ({totale['viaggi']} viaggi)", totale)
+    else:
+        print(f"Nessuna traccia in {args.cartella}")
+
+
+if __name__ == "__main__":
+    main()
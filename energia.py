@@ -0,0 +1,161 @@
+"""
+Energia prelevata dal pacco, integrata dai frame CAN di tensione e corrente.
+
+La carica di 0x638 ha la risoluzione dell'1% (~300 Wh, 1-2 km): a inizio
+viaggio il km/% resta fermo per minuti e poi salta. Tensione e corrente del
+pacco arrivano invece molte volte al secondo; integrandole frame per frame
+(trapezi sull'istante di ricezione di basetempo) si ha il consumo in Wh e
+quindi i Wh/km già dopo poche centinaia di metri.
+
+L'integrazione gira nel thread can-rx, unico scrittore: a ogni frame
+pubblica un nuovo Energia (tupla immutabile) con una sola assegnazione, così
+pipeline e GUI lo leggono senza lock e senza mai vedere metà aggiornamento.
+
+Il frame del pacco non è ancora stato verificato sul bus come 0x638: ID e
+scale sono in PACCO_ID, PACCO_V_SCALA e PACCO_A_SCALA, da confermare con uno
+sniffer. Senza quei frame tutto continua a funzionare con la sola carica.
+
+Costo per frame e precisione rispetto alla carica sugli scenari simulati:
+    python energia.py --bench
+"""
+
+import sys
+import time
+from collections import namedtuple
+
+PACCO_ID = 0x63A            # Tensione (byte 0-1) e corrente (byte 2-3) del pacco, big endian
+PACCO_V_SCALA = 0.1         # V per bit, senza segno
+PACCO_A_SCALA = 0.1         # A per bit, con segno: positiva in scarica, negativa in recupero
+DT_MAX = 1.0                # Oltre questo silenzio del frame non si integra (bus fermo, riconnessione)
+
+Energia = namedtuple("Energia", "t wh wh_scarica wh_recupero frame buchi")
+
+
+def decodifica_pacco(dati):
+    """(volt, ampere) dal campo dati di un frame PACCO_ID"""
+    volt = (dati[0] << 8 | dati[1]) * PACCO_V_SCALA
+    grezza = dati[2] << 8 | dati[3]
+    if grezza & 0x8000:
+        grezza -= 0x10000
+    return volt, grezza * PACCO_A_SCALA
+
+
+def codifica_pacco(volt, ampere):
+    """Byte 0-3 di un frame PACCO_ID (replay e benchmark)"""
+    v = max(0, min(0xFFFF, round(volt / PACCO_V_SCALA)))
+    a = max(-0x8000, min(0x7FFF, round(ampere / PACCO_A_SCALA))) & 0xFFFF
+    return bytes((v >> 8, v & 0xFF, a >> 8, a & 0xFF))
+
+
+class IntegratoreEnergia:
+    """Wh netti dall'accensione, un trapezio per frame; stato è sempre coerente"""
+
+    def __init__(self, dt_max=DT_MAX):
+        self.dt_max = dt_max
+        self.t = None
+        self.potenza = 0.0
+        self.stato = Energia(None, 0.0, 0.0, 0.0, 0, 0)
+
+    def aggiungi(self, t, volt, ampere):
+        """Frame ricevuto all'istante t (secondi sulla base comune)"""
+        potenza = volt * ampere
+        s = self.stato
+        wh, scarica, recupero, buchi = s.wh, s.wh_scarica, s.wh_recupero, s.buchi
+        if self.t is not None:
+            dt = t - self.t
+            if 0 < dt <= self.dt_max:
+                e = (potenza + self.potenza) * dt / 7200.0      # W·s → Wh, media dei due estremi
+                wh += e
+                if e >= 0:
+                    scarica += e
+                else:
+                    recupero -= e
+            elif dt > self.dt_max:
+                buchi += 1
+        self.t = t
+        self.potenza = potenza
+        self.stato = Energia(t, wh, scarica, recupero, s.frame + 1, buchi)
+
+
+def _frame_pacco(sim, hz):
+    """(t, volt, ampere) campionati a hz come li manderebbe il BMS, dalla potenza a 1 Hz dello scenario"""
+    import numpy as np
+    from scenario import tensione_pacco
+    potenza = np.diff(sim.energia, prepend=0.0) * 3600 / (sim.t[1] - sim.t[0])
+    t = np.arange(0, sim.t[-1] + 1, 1.0 / hz)
+    i = np.minimum(np.searchsorted(sim.t, t, side="right") - 1, len(sim.t) - 1)
+    volt = tensione_pacco(sim.carica[i])
+    return t, volt, potenza[i] / volt
+
+
+def bench(hz=10):
+    """
+    Costo per frame nel thread CAN e, sugli scenari simulati, errore del
+    consumo integrato e del km/% che ne deriva rispetto alla sola carica.
+    """
+    import os
+    import tempfile
+    import numpy as np
+    import scenario
+    from can_monitor import BatteryMonitor, ReturnData
+    from guessometer import PACCO_WH
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            # Costo: _process_message con frame del pacco, 0x638 e altri ID (come sul bus)
+            monitor = BatteryMonitor(None)
+            n = 200_000
+            for nome, ident, dati in (("altro ID", 0x101, bytes(8)),
+                                      ("0x638", 0x638, bytes((0, 0, 0, 80, 0, 0, 0, 0))),
+                                      (f"0x{PACCO_ID:X}", PACCO_ID, codifica_pacco(380.0, 25.0) + bytes(4))):
+                msg = ReturnData()
+                msg.nID, msg.nDLC, msg.nRTR, msg.nType = ident, 8, 0, 4
+                msg.cData[:] = list(dati)
+                tempi = []
+                for _ in range(3):
+                    t0 = time.perf_counter()
+                    for i in range(n):
+                        monitor._process_message(msg, i * 0.01)
+                    tempi.append(time.perf_counter() - t0)
+                print(f"{nome:9s} {min(tempi) / n * 1e6:5.2f} µs/frame")
+            monitor.stop()
+
+            print(f"\nFrame del pacco a {hz} Hz, carica intera da 0x638; errore rispetto all'energia simulata:")
+            for nome in scenario.SCENARI:
+                sim = scenario.genera(nome, seed=1)
+                integratore = IntegratoreEnergia()
+                t, volt, ampere = _frame_pacco(sim, hz)
+                wh_frame = np.empty(len(t))
+                for k, (ti, v, a) in enumerate(zip(t, volt, ampere)):
+                    integratore.aggiungi(ti, *decodifica_pacco(codifica_pacco(v, a)))
+                    wh_frame[k] = integratore.stato.wh
+                passo = sim.t[1] - sim.t[0]
+                vero = sim.energia                                  # Wh alla fine di ogni passo
+                integrato = np.interp(sim.t + passo, t, wh_frame)
+                soc = np.round(sim.carica)
+                da_carica = (soc[0] - soc) * PACCO_WH / 100
+                km = np.cumsum(sim.v) * passo / 1000
+
+                # km/% del viaggio fin qui, misurato ogni minuto, contro quello con la carica esatta
+                minuti = np.arange(60, len(sim.t), 60)
+                vero_kmpp = km[minuti] / (sim.carica[0] - sim.carica[minuti])
+                consumato = soc[0] - soc[minuti]
+                con_carica = np.where(consumato >= 1, km[minuti] / np.maximum(consumato, 1), np.nan)
+                con_wh = km[minuti] / (integrato[minuti] / (PACCO_WH / 100))
+                errore = lambda misura: np.nanmean(np.abs(misura - vero_kmpp) / vero_kmpp) * 100
+                print(f"  {nome:10s} {vero[-1]:6.0f} Wh: integrato {integrato[-1] - vero[-1]:+5.1f} Wh "
+                      f"(max {np.abs(integrato - vero).max():4.1f}), dalla carica max "
+                      f"{np.abs(da_carica - vero).max():4.0f} Wh; km/% fin qui: carica "
+                      f"{errore(con_carica):5.1f}% ({np.isnan(con_carica).sum():2d} min senza misura), "
+                      f"Wh {errore(con_wh):4.1f}%")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        bench()
+    else:
+        print(__doc__)
@@ -0,0 +1,427 @@
+"""
+Esportazione dei viaggi registrati in GPX, GeoJSON e CSV.
+
+Per ogni traccia (logtrip/tracks/track_*.csv) si scrivono i punti con ora,
+velocità e carica della batteria; la carica viene dai registri del viaggio
+(logtrip/tracce/trip_*.csv) che si sovrappongono alla traccia, presa
+dall'ultimo campione non successivo al fix. Tutto scorre a blocchi di
+BLOCCO righe: traccia e registri si leggono in avanti insieme e ogni blocco
+si formatta con un solo modello ripetuto, quindi la memoria non dipende
+dalla lunghezza del viaggio e tutti i formati escono da un solo passaggio.
+I file si scrivono accanto come .tmp e si rinominano solo a esportazione
+finita.
+
+L'esportazione di tutte le tracce si divide tra processi (una traccia per
+lavoro, le più lunghe per prime).
+
+    python esporta.py                                   # tutte le tracce, tutti i formati
+    python esporta.py logtrip/tracks/track_20250101_120000.csv --formati gpx
+    python esporta.py --uscita /tmp/viaggi --processi 4
+    python esporta.py --bench
+"""
+
+import os
+import sys
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import logconfig
+from guessometer import TRACCE_DIR
+from trackstore import list_tracks
+
+log = logconfig.get("esporta")
+
+EXPORT_DIR = "logtrip/export"
+FORMATI = ("gpx", "geojson", "csv")
+BLOCCO = 4096               # Righe lette e scritte per volta
+TOLLERANZA_S = 60           # Carica più vecchia di così rispetto al fix: non si conosce
+INTERRUZIONE_S = 30         # Buco tra due fix oltre cui il GPX apre un nuovo segmento
+
+
+def _righe_valide(righe, colonne):
+    """Righe numeriche di un blocco con qualche riga rotta (intestazione ripetuta, ultima riga a metà)"""
+    valide = []
+    for riga in righe:
+        try:
+            valori = [float(x) for x in riga.split(",")[:colonne]]
+        except ValueError:
+            continue
+        if len(valori) == colonne:
+            valide.append(valori)
+    return np.array(valide, dtype=float).reshape(-1, colonne)
+
+
+def blocchi(path, colonne, blocco=BLOCCO):
+    """Array (n, colonne) di al più blocco righe alla volta, dopo l'intestazione"""
+    with open(path) as f:
+        next(f, None)
+        while True:
+            righe = list(itertools.islice(f, blocco))
+            if not righe:
+                return
+            try:
+                dati = np.loadtxt(righe, delimiter=",", usecols=range(colonne), ndmin=2)
+            except ValueError:
+                dati = _righe_valide(righe, colonne)
+            if len(dati):
+                yield dati
+
+
+def intervallo(path):
+    """(primo, ultimo) timestamp del CSV leggendo solo l'inizio e la fine del file, o None"""
+    try:
+        with open(path, "rb") as f:
+            f.readline()
+            primo = f.readline()
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            coda = f.read().splitlines()
+    except OSError:
+        return None
+    tempi = []
+    for riga in [primo] + coda[::-1]:
+        try:
+            tempi.append(float(riga.split(b",", 1)[0]))
+        except ValueError:
+            continue
+        if len(tempi) == 2:
+            return tempi[0], tempi[1]
+    return None
+
+
+def registri_per(traccia, registri):
+    """Registri [(path, (inizio, fine))] che si sovrappongono alla traccia, in ordine di tempo"""
+    estremi = intervallo(traccia)
+    if estremi is None:
+        return []
+    a, b = estremi
+    return [p for p, (inizio, fine) in sorted(registri, key=lambda r: r[1])
+            if inizio <= b + TOLLERANZA_S and fine >= a - TOLLERANZA_S]
+
+
+def intervalli_registri(tracce_dir=TRACCE_DIR):
+    import glob
+    registri = []
+    for path in sorted(glob.glob(os.path.join(tracce_dir, "trip_*.csv"))):
+        estremi = intervallo(path)
+        if estremi is not None:
+            registri.append((path, estremi))
+    return registri
+
+
+class SerieCarica:
+    """Carica dei registri del viaggio letta in avanti, a blocchi, per istanti crescenti"""
+
+    def __init__(self, registri, blocco=BLOCCO):
+        self.sorgente = itertools.chain.from_iterable(blocchi(p, 2, blocco) for p in registri)
+        self.t = np.empty(0)
+        self.carica = np.empty(0)
+        self.finita = False
+
+    def valori(self, t):
+        """Carica a ciascun istante di t (crescenti), nan se non c'è un campione abbastanza recente"""
+        while not self.finita and (not len(self.t) or self.t[-1] < t[-1]):
+            dati = next(self.sorgente, None)
+            if dati is None:
+                self.finita = True
+                break
+            self.t = np.concatenate((self.t, dati[:, 0]))
+            self.carica = np.concatenate((self.carica, dati[:, 1]))
+        i = np.searchsorted(self.t, t, side="right") - 1
+        if not len(self.t):
+            return np.full(len(t), np.nan)
+        j = np.maximum(i, 0)
+        carica = np.where((i >= 0) & (t - self.t[j] <= TOLLERANZA_S), self.carica[j], np.nan)
+        # Del passato serve solo l'ultimo campione usato, per il prossimo blocco
+        self.t, self.carica = self.t[j[-1]:], self.carica[j[-1]:]
+        return carica
+
+
+class Blocco:
+    """Punti di un blocco con le colonne che servono a più formati, calcolate una volta"""
+
+    def __init__(self, t, lat, lon, velocita, carica):
+        self.t, self.lat, self.lon = t, lat, lon
+        self.velocita = velocita                    # m/s, come nella traccia
+        self.kmh = velocita * 3.6
+        self.ore = np.datetime_as_string(np.round(t * 1000).astype("datetime64[ms]"), unit="ms")
+        # La carica ha pochi valori per blocco: si formattano quelli e si indicizza
+        self.livelli, self.indici = np.unique(carica, return_inverse=True)
+
+    def carica(self, formato, mancante):
+        testi = [mancante if x != x else formato % x for x in self.livelli.tolist()]
+        return np.array(testi, dtype=object)[self.indici]
+
+
+def _formatta(modello, *colonne):
+    """Un blocco di righe con un solo modello ripetuto (la formattazione resta in C)"""
+    valori = np.empty((len(colonne[0]), len(colonne)), dtype=object)
+    for k, colonna in enumerate(colonne):
+        valori[:, k] = colonna
+    return (modello * len(valori)) % tuple(valori.ravel().tolist())
+
+
+class Scrittore:
+    """File d'uscita scritto in .tmp e rinominato a esportazione finita"""
+
+    testa = coda = ""
+
+    def __init__(self, path, nome):
+        self.path = path
+        self.tmp = path + ".tmp"
+        self.file = open(self.tmp, "w", encoding="utf-8", newline="\n")
+        self.file.write(self.testa.format(nome=nome))
+
+    def chiudi(self):
+        self.file.write(self.coda)
+        self.file.close()
+        os.replace(self.tmp, self.path)
+
+    def annulla(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+
+class ScrittoreCSV(Scrittore):
+    testa = "timestamp,ora_utc,lat,lon,velocita_kmh,carica\n"
+    modello = "%.1f,%sZ,%.7f,%.7f,%.1f,%s\n"
+
+    def scrivi(self, b):
+        self.file.write(_formatta(self.modello, b.t, b.ore, b.lat, b.lon, b.kmh, b.carica("%g", "nan")))
+
+
+class ScrittoreGPX(Scrittore):
+    """GPX 1.1: velocità nell'estensione Garmin (m/s), carica in un'estensione propria"""
+    testa = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<gpx version="1.1" creator="HeyBluecar" xmlns="http://www.topografix.com/GPX/1/1" '
+             'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2" '
+             'xmlns:bluecar="urn:heybluecar:gpx:1">\n<trk><name>{nome}</name>\n<trkseg>\n')
+    coda = "</trkseg>\n</trk>\n</gpx>\n"
+    modello = ('%s<trkpt lat="%.7f" lon="%.7f"><time>%sZ</time><extensions><gpxtpx:TrackPointExtension>'
+               '<gpxtpx:speed>%.2f</gpxtpx:speed></gpxtpx:TrackPointExtension>%s</extensions></trkpt>\n')
+
+    def __init__(self, path, nome):
+        super().__init__(path, nome)
+        self.t_prec = None
+
+    def scrivi(self, b):
+        # Segnale perso: nuovo segmento, così i programmi non tirano una retta sul buco
+        buco = np.diff(b.t, prepend=b.t[0] if self.t_prec is None else self.t_prec) > INTERRUZIONE_S
+        self.t_prec = b.t[-1]
+        segmento = np.where(buco, "</trkseg>\n<trkseg>\n", "")
+        estensione = b.carica("<bluecar:carica>%g</bluecar:carica>", "")
+        self.file.write(_formatta(self.modello, segmento, b.lat, b.lon, b.ore, b.velocita, estensione))
+
+
+class ScrittoreGeoJSON(Scrittore):
+    """FeatureCollection di punti (RFC 7946, lon prima di lat) con ora, velocità e carica"""
+    testa = '{{"type":"FeatureCollection","name":"{nome}","features":[\n'
+    coda = "\n]}\n"
+    modello = (',\n{"type":"Feature","geometry":{"type":"Point","coordinates":[%.7f,%.7f]},'
+               '"properties":{"time":"%sZ","velocita_kmh":%.1f,"carica":%s}}')
+
+    def __init__(self, path, nome):
+        super().__init__(path, nome)
+        self.primo = True
+
+    def scrivi(self, b):
+        testo = _formatta(self.modello, b.lon, b.lat, b.ore, b.kmh, b.carica("%g", "null"))  # NaN non è JSON
+        if self.primo:
+            testo = testo[2:]
+            self.primo = False
+        self.file.write(testo)
+
+
+SCRITTORI = {"gpx": ScrittoreGPX, "geojson": ScrittoreGeoJSON, "csv": ScrittoreCSV}
+
+
+def esporta(traccia, formati=FORMATI, uscita=EXPORT_DIR, registri=None, blocco=BLOCCO):
+    """
+    Una traccia in tutti i formati indicati con un solo passaggio.
+    registri: CSV del viaggio da cui prendere la carica (default: quelli
+    sovrapposti alla traccia in logtrip/tracce). Restituisce (punti, file).
+    """
+    if registri is None:
+        registri = registri_per(traccia, intervalli_registri())
+    nome = os.path.splitext(os.path.basename(traccia))[0]
+    os.makedirs(uscita, exist_ok=True)
+    scrittori = []
+    punti = 0
+    try:
+        for formato in formati:
+            scrittori.append(SCRITTORI[formato](os.path.join(uscita, f"{nome}.{formato}"), nome))
+        serie = SerieCarica(registri, blocco)
+        for dati in blocchi(traccia, 4, blocco):
+            t, lat, lon, velocita = dati.T
+            b = Blocco(t, lat, lon, velocita, serie.valori(t))
+            for scrittore in scrittori:
+                scrittore.scrivi(b)
+            punti += len(t)
+    except BaseException:
+        for scrittore in scrittori:
+            scrittore.annulla()
+        raise
+    for scrittore in scrittori:
+        scrittore.chiudi()
+    return punti, [s.path for s in scrittori]
+
+
+def _lavoro(traccia, formati, uscita, registri, blocco):
+    """Una traccia in un processo del pool; gli errori restano su quella traccia"""
+    try:
+        return esporta(traccia, formati, uscita, registri, blocco)
+    except (OSError, ValueError) as e:
+        log.error("Traccia %s non esportata: %s", traccia, e)
+        return 0, []
+
+
+def esporta_tutte(tracce=None, formati=FORMATI, uscita=EXPORT_DIR, tracce_dir=TRACCE_DIR,
+                  processi=None, blocco=BLOCCO):
+    """Tutte le tracce (default: logtrip/tracks) divise tra processi; restituisce (punti, file)"""
+    tracce = list_tracks() if tracce is None else list(tracce)
+    registri = intervalli_registri(tracce_dir)
+    # Le più lunghe per prime: l'ultima a finire non è una traccia enorme partita tardi
+    tracce.sort(key=lambda p: os.path.getsize(p), reverse=True)
+    lavori = [(p, formati, uscita, registri_per(p, registri), blocco) for p in tracce]
+    processi = min(processi or os.cpu_count() or 1, len(lavori) or 1)
+    if processi == 1:
+        risultati = [_lavoro(*l) for l in lavori]
+    else:
+        with ProcessPoolExecutor(max_workers=processi) as pool:
+            risultati = [f.result() for f in as_completed([pool.submit(_lavoro, *l) for l in lavori])]
+    return sum(r[0] for r in risultati), [p for r in risultati for p in r[1]]
+
+
+# ---------------------------------------------------------------------------
+
+def _storico_sintetico(cartella, viaggi, punti, seed=0):
+    """
+    viaggi tracce da punti fix a 1 Hz (più o meno 50%) con i registri del
+    viaggio accanto, un campione di carica al secondo come la pipeline.
+    """
+    rng = np.random.default_rng(seed)
+    tracks = os.path.join(cartella, "tracks")
+    tracce = os.path.join(cartella, "tracce")
+    os.makedirs(tracks)
+    os.makedirs(tracce)
+    t0 = 1.75e9
+    totale = 0
+    for k in range(viaggi):
+        n = int(punti * rng.uniform(0.5, 1.5))
+        t = t0 + np.arange(n, dtype=float)
+        t[n // 2:] += 120 * (k % 3 == 0)        # Ogni tanto una galleria: segnale perso per 2 minuti
+        v = np.clip(13 + np.cumsum(rng.normal(0, 0.3, n)), 0, 36)
+        rotta = np.cumsum(rng.normal(0, 0.05, n))
+        lat = 45.07 + np.cumsum(v * np.cos(rotta)) / 111195
+        lon = 7.68 + np.cumsum(v * np.sin(rotta)) / 78600
+        km = np.cumsum(v) / 1000
+        carica = np.round(90 - km * 0.6)
+        nome = time.strftime("%Y%m%d_%H%M%S", time.gmtime(t0))
+        with open(os.path.join(tracks, f"track_{nome}.csv"), "w") as f:
+            f.write("timestamp,lat,lon,velocita\n")
+            f.write(("%.1f,%.7f,%.7f,%.2f\n" * n) % tuple(np.column_stack((t, lat, lon, v)).ravel().tolist()))
+        with open(os.path.join(tracce, f"trip_{nome}.csv"), "w") as f:
+            f.write("timestamp,carica,trip_km,velocita_media,wh,recupero_wh\n")
+            f.write(("%.3f,%d,%.3f,%.2f,nan,nan\n" * n)
+                    % tuple(np.column_stack((t + 0.4, carica, km, v * 3.6)).ravel().tolist()))
+        t0 = t[-1] + 3600
+        totale += n
+    return tracks, tracce, totale
+
+
+def _picco_mb(traccia, registri, uscita):
+    import tracemalloc
+    tracemalloc.start()
+    esporta(traccia, FORMATI, uscita, registri)
+    picco = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return picco / 2**20
+
+
+def _verifica(file, punti):
+    """Rilegge le uscite di una traccia: stesso numero di punti in ogni formato"""
+    import csv
+    import json
+    import xml.etree.ElementTree as ET
+    trovati = {}
+    for path in file:
+        formato = path.rsplit(".", 1)[1]
+        if formato == "gpx":
+            trovati[formato] = sum(1 for _, e in ET.iterparse(path) if e.tag.endswith("}trkpt"))
+        elif formato == "geojson":
+            with open(path, encoding="utf-8") as f:
+                trovati[formato] = len(json.load(f)["features"])
+        else:
+            with open(path, encoding="utf-8") as f:
+                trovati[formato] = sum(1 for _ in csv.reader(f)) - 1
+    return all(n == punti for n in trovati.values()), trovati
+
+
+def bench(viaggi=120, punti=20000, processi=None):
+    """Storico sintetico grande: punti/s per formato, tutti insieme, in parallelo; memoria per traccia"""
+    import tempfile
+    processi = processi or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        tracks, tracce, totale = _storico_sintetico(tmp, viaggi, punti)
+        lista = list_tracks(tracks)
+        mb = sum(os.path.getsize(p) for p in lista) / 2**20
+        print(f"Storico: {viaggi} viaggi, {totale} punti ({mb:.0f} MiB di tracce), "
+              f"generato in {time.perf_counter() - t0:.1f} s; {os.cpu_count()} CPU")
+
+        uscita = os.path.join(tmp, "export")
+        prove = [((f,), 1) for f in FORMATI] + [(FORMATI, 1)]
+        prove.append((FORMATI, max(2, processi)))     # Anche su una CPU sola, per provare il pool
+        for formati, n in prove:
+            t0 = time.perf_counter()
+            fatti, file = esporta_tutte(lista, formati, uscita, tracce, processi=n)
+            secondi = time.perf_counter() - t0
+            scritti = sum(os.path.getsize(p) for p in file) / 2**20
+            print(f"  {'+'.join(formati):16s} {n:2d} processi: {fatti / secondi / 1e6:5.2f} M punti/s "
+                  f"({secondi:5.1f} s, {scritti:6.0f} MiB scritti, {scritti / secondi:5.0f} MiB/s)")
+
+        registri = intervalli_registri(tracce)
+        traccia = lista[0]
+        ok, trovati = _verifica([os.path.join(uscita, os.path.splitext(os.path.basename(traccia))[0] + "." + f)
+                                 for f in FORMATI], sum(len(b) for b in blocchi(traccia, 4)))
+        print(f"Verifica di {os.path.basename(traccia)}: {trovati} {'ok' if ok else 'PUNTI DIVERSI'}")
+
+        # Memoria: la stessa per un viaggio da 20k o da 1M di punti
+        for n in (20000, 1000000):
+            cartella = os.path.join(tmp, f"lungo_{n}")
+            tr, rg, _ = _storico_sintetico(cartella, 1, n)
+            traccia = list_tracks(tr)[0]
+            picco = _picco_mb(traccia, registri_per(traccia, intervalli_registri(rg)), os.path.join(cartella, "out"))
+            print(f"  Picco di memoria Python per una traccia di ~{n} punti, tutti i formati: {picco:.1f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Esporta i viaggi registrati in GPX, GeoJSON e CSV")
+    parser.add_argument("tracce", nargs="*", help="track_*.csv da esportare (default: tutte)")
+    parser.add_argument("--formati", nargs="+", choices=FORMATI, default=list(FORMATI))
+    parser.add_argument("--uscita", default=EXPORT_DIR)
+    parser.add_argument("--registri", default=TRACCE_DIR, help="cartella dei CSV del viaggio (carica)")
+    parser.add_argument("--processi", type=int, default=None, help="processi del pool (default: CPU)")
+    parser.add_argument("--bench", action="store_true")
+    args = parser.parse_args(argv)
+    if args.bench:
+        bench(processi=args.processi)
+        return 0
+    t0 = time.perf_counter()
+    punti, file = esporta_tutte(args.tracce or None, args.formati, args.uscita, args.registri, args.processi)
+    if not file:
+        print("Nessuna traccia esportata.")
+        return 1
+    print(f"{len(file)} file, {punti} punti in {time.perf_counter() - t0:.1f} s → {args.uscita}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,22 +9,40 @@ Prerequisiti Windows:
 2. Collegare il vostro software di navigazione a COM200
    e il monitor delle statistiche a COM201.
 
+Replay senza ricevitore né porte (anche su Linux), eventualmente profilato:
+    python gpstrip.py --replay traccia.nmea [--velocita 10] [--profile]
+    python gpstrip.py --replay logtrip/tracks/track_20250101_120000.csv
+
 """
 
+import sys
 import serial
 import threading
 import time
 import pynmea2
 from math import radians, sin, cos, sqrt, atan2
-from queue import Queue
 from collections import deque
 import numpy as np
+from trackstore import TrackWriter
+from limiti import CodaLimitata, CanaleUltimo, MediaMobile, FileGiornaliero
+import metrics
+import logconfig
+import profiler
+import basetempo
+
+log = logconfig.get("gps")
 
 BAUDRATE = 9600
 SOURCE = 'COM4'
 GPS_OUT = 'COM100'
 STATS_PT = 'COM101'
 
+# Limiti di memoria per le esecuzioni di giorni
+GPS_CODA_MAX = 256          # Frasi da rispedire su COM100
+VELOCITA_MAX = 1000         # Velocità nella media mobile
+BUFFER_MAX = 4096           # Byte senza fine riga oltre i quali il frammento è spazzatura
+STATS_OUT_MAX = 1024        # Byte non letti su COM101 (~1 s di righe a 10 Hz) oltre i quali il monitor è fermo
+
 SER_CFG = dict(
     baudrate=BAUDRATE,
     bytesize=serial.EIGHTBITS,
@@ -33,21 +51,84 @@ SER_CFG = dict(
     timeout=0
 )
 
+
+def frase_gga(lat, lon, ora="120000.00", quota=240.0, qualita=1):
+    """
+    Frase $GPGGA con checksum, terminata da CRLF (replay, scenari, benchmark);
+    qualita=0 è un fix assente (galleria): niente posizione né quota.
+    """
+    if qualita:
+        ns, ew = ("N" if lat >= 0 else "S"), ("E" if lon >= 0 else "W")
+        lat, lon = abs(lat), abs(lon)
+        corpo = (f"GPGGA,{ora},{int(lat):02d}{(lat % 1) * 60:08.5f},{ns},"
+                 f"{int(lon):03d}{(lon % 1) * 60:08.5f},{ew},{qualita},08,0.9,{quota:.1f},M,47.0,M,,")
+    else:
+        corpo = f"GPGGA,{ora},,,,,0,00,99.9,,M,,M,,"
+    cs = 0
+    for c in corpo:
+        cs ^= ord(c)
+    return f"${corpo}*{cs:02X}\r\n".encode()
+
+
+class _SenzaRegistro:
+    """Al posto del log STATS e della traccia quando non si registra: stessa interfaccia, nessun file"""
+
+    def write(self, *args):
+        pass
+
+    def flush(self):
+        pass
+
+    def new_trip(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_SENZA_REGISTRO = _SenzaRegistro()
+
+
 class GPSTracker:
-    def __init__(self):
-        self.gps_q = Queue()
-        self.stats_q = Queue()
+    def __init__(self, snapshot=None, comandi=None, porte=True, sorgente=None, registri=None):
+        self.gps_q = CodaLimitata("gps_mirror_queue", GPS_CODA_MAX)
+        # Righe STATS: al monitor serve l'ultima, non quelle che non ha fatto in tempo a leggere
+        self.canale_stats = CanaleUltimo("gps_stats")
+        self.stats_pendente = None
+        self.reset_da_inviare = False
         self.last_pos = None
         self.last_valid_pos = None
         self.tot_dist = self.trip_dist = 0.0
-        self.speeds = []
-        self.trip_speeds = []
-        self.last_t = time.time()
+        self.speeds = MediaMobile(VELOCITA_MAX)
+        self.trip_speeds = MediaMobile(VELOCITA_MAX)
+        self.orologio = time.time   # Il simulatore di scenari lo sostituisce con il tempo simulato
+        self.ricezione = basetempo.adesso   # Base monotona comune con il CAN (anche questa simulabile)
+        self.offset_fix = basetempo.StimatoreOffset()
+        self.ultima_ora = None      # Ora UTC (epoch) dell'ultima GGA con fix
+        self.last_fix = None        # Ora UTC del fix in last_pos, None se la GGA non l'aveva
+        self.last_t = self.orologio()
         self.running = True
         self.signal_lost_time = None
-        self.error_count = 0
-        self.stats_log = []
+        self.stats_log = deque(maxlen=100)
         self.position_history = deque(maxlen=10)
+        self.buffer = b''
+        # registri: log STATS in gps_logs/ e traccia in logtrip/tracks/; di default solo con le
+        # seriali vere, così replay, benchmark, scenari e prove di durata non lasciano file
+        if registri is None:
+            registri = porte and sorgente is None
+        self.stats_file = self.track = _SENZA_REGISTRO
+        if registri:
+            self._setup_stats_log()
+            self.track = TrackWriter()
+        self._setup_metrics()
+
+        # Con il launcher le statistiche vanno in memoria condivisa invece che su COM101
+        self.snapshot = snapshot
+        self.comandi = comandi
+        self.reset_visti = 0
+        if comandi is not None:
+            _, valori = comandi.read()
+            self.reset_visti = valori[0] if valori else 0
 
         # Configurazione
         self.config = {
@@ -57,17 +138,49 @@ class GPSTracker:
             'reuse_position_max_age': 5  # Secondi massimi per riusare posizione
         }
 
+        # porte=False: nessuna seriale, i dati arrivano da _process_chunk (replay, benchmark)
+        # sorgente: solo la porta del ricevitore (es. pty di prova su Linux), niente COM100/COM101
+        self.ser_src = self.ser_gps = self.ser_stats = None
+        if sorgente is not None:
+            self.ser_src = serial.Serial(sorgente, **SER_CFG)
+        elif porte:
+            self._apri_porte()
+
+        self.t_read = threading.Thread(target=self._reader, name="gps-reader", daemon=True)
+        self.t_write = threading.Thread(target=self._gps_writer, name="gps-writer", daemon=True)
+        self.t_stat = threading.Thread(target=self._stats_srv, name="gps-stats", daemon=True)
+
+    def _apri_porte(self):
+        snapshot = self.snapshot
         try:
             self.ser_src = serial.Serial(SOURCE, **SER_CFG)
             self.ser_gps = serial.Serial(GPS_OUT, **SER_CFG)
-            self.ser_stats = serial.Serial(STATS_PT, **SER_CFG)
-            print(f"Porte seriali aperte: {SOURCE}, {GPS_OUT}, {STATS_PT}")
+            self.ser_stats = serial.Serial(STATS_PT, **SER_CFG) if snapshot is None else None
+            log.info("Porte seriali aperte: %s", ", ".join((SOURCE, GPS_OUT) + ((STATS_PT,) if snapshot is None else ())))
         except Exception as e:
             raise SystemExit(f"Impossibile aprire le seriali: {e}")
 
-        self.t_read = threading.Thread(target=self._reader, daemon=True)
-        self.t_write = threading.Thread(target=self._gps_writer, daemon=True)
-        self.t_stat = threading.Thread(target=self._stats_srv, daemon=True)
+    def _setup_metrics(self):
+        self.m_byte = metrics.counter("gps_bytes_total", "Byte NMEA letti dal ricevitore")
+        self.m_frasi = metrics.counter("gps_sentences_total", "Frasi NMEA complete")
+        self.m_gga = metrics.counter("gps_gga_total", "Frasi GGA elaborate")
+        self.m_errori = metrics.counter("gps_parse_errors_total", "Frasi GGA non interpretabili")
+        self.m_segnale_basso = metrics.counter("gps_low_quality_total", "GGA senza fix valido")
+        self.m_fix = metrics.counter("gps_fix_total", "Fix accettati per il calcolo della distanza")
+        self.m_scartati = metrics.counter("gps_fix_rejected_total", "Fix scartati (fermo o velocità impossibile)")
+        self.m_segnale_perso = metrics.gauge("gps_signal_lost", "1 se il segnale GPS è perso")
+        self.m_gga_tempo = metrics.histogram("gps_gga_seconds", "Parsing GGA + aggiornamento statistiche")
+        self.m_ritardo = metrics.histogram("gps_fix_delay_seconds",
+                                           "Ricezione del fix oltre il ritardo minimo stimato (seriale + scheduling)")
+        self.m_righe = metrics.counter("gps_stats_lines_total", "Righe STATS inviate")
+        self.m_attese = metrics.counter("gps_stats_backpressure_total",
+                                        f"Righe STATS mai inviate: COM101 aveva più di {STATS_OUT_MAX} byte in uscita")
+        self.m_invio = metrics.histogram("gps_stats_write_seconds", "Scrittura di una riga STATS su COM101")
+        self.m_buffer = metrics.counter("gps_buffer_overflow_total", f"Frammenti NMEA oltre {BUFFER_MAX} byte scartati")
+
+    def _setup_stats_log(self):
+        """Registra le righe STATS su file per il backtest offline dell'autonomia (un file al giorno)"""
+        self.stats_file = FileGiornaliero("gps_logs", "stats")
 
     @staticmethod
     def haversine(lat1, lon1, lat2, lon2):
@@ -105,7 +218,7 @@ class GPSTracker:
 
     def _handle_low_signal_quality(self):
         """Gestisce situazioni di segnale scarso"""
-        current_time = time.time()
+        current_time = self.orologio()
         if (self.last_valid_pos and 
             current_time - self.last_t < self.config['reuse_position_max_age']):
             # Usa l'ultima posizione valida per brevi periodi
@@ -113,8 +226,8 @@ class GPSTracker:
 
     def _format_stats_message(self, timestamp, lat, lon):
         """Formatta il messaggio di statistiche"""
-        avg_speed = np.mean(self.speeds) if self.speeds else 0
-        trip_avg_speed = np.mean(self.trip_speeds) if self.trip_speeds else 0
+        avg_speed = self.speeds.media()
+        trip_avg_speed = self.trip_speeds.media()
         signal_status = "VALID" if self.signal_lost_time is None else "LOST"
 
         return ("STATS,{:.2f},{:.2f},{:.2f},{:.2f},{:.3f},{:.6f},{:.6f},{}\n"
@@ -126,22 +239,41 @@ class GPSTracker:
                        lat, lon,
                        signal_status))
 
-    def _update_stats(self, lat, lon):
-        now = time.time()
+    def _ora_fix(self, msg, t_rx):
+        """
+        Ora UTC del fix come epoch, None se la GGA non ce l'ha o non avanza (ricevitori
+        o tracce sintetiche con l'ora fissa); aggiorna l'offset verso la base locale.
+        """
+        if msg.timestamp is None:
+            return None
+        t_fix = basetempo.epoca_utc(msg.timestamp, self.orologio())
+        precedente, self.ultima_ora = self.ultima_ora, t_fix
+        if precedente is not None and t_fix <= precedente:
+            return None
+        self.m_ritardo.record(self.offset_fix.aggiungi(t_fix, t_rx))
+        return t_fix
+
+    def _update_stats(self, lat, lon, t_fix=None):
+        now = self.orologio()
+        if t_fix is not None:
+            # Istante del fix, non dell'elaborazione: ora attuale meno l'età del fix sulla base locale
+            now -= self.ricezione() - self.offset_fix.a_locale(t_fix)
         
         if not self._is_valid_position(lat, lon):
             # Segnale perso - gestione speciale
             if self.signal_lost_time is None:
                 self.signal_lost_time = now
-                print("Segnale GPS perso")
+                self.m_segnale_perso.set(1)
+                log.warning("Segnale GPS perso")
             elif now - self.signal_lost_time > self.config['signal_timeout']:
                 self.last_pos = None  # Reset per evitare calcoli errati
             return
         
         # Reset timer perdita segnale
         if self.signal_lost_time is not None:
-            print(f"Segnale GPS recuperato dopo {now - self.signal_lost_time:.1f}s")
+            log.info("Segnale GPS recuperato dopo %.1fs", now - self.signal_lost_time)
             self.signal_lost_time = None
+            self.m_segnale_perso.set(0)
         
         # Applica smoothing alla posizione
         lat, lon = self._smooth_position(lat, lon)
@@ -149,12 +281,16 @@ class GPSTracker:
         if self.last_pos:
             # Calcola distanza e velocità
             d = self.haversine(*self.last_pos, lat, lon)
-            dt = max(0.1, now - self.last_t)  # Evita divisioni per zero
+            dt = now - self.last_t
+            if t_fix is not None and self.last_fix is not None and 0 < t_fix - self.last_fix <= self.config['signal_timeout']:
+                dt = t_fix - self.last_fix      # Ora dei fix: niente jitter della seriale e dello scheduling
+            dt = max(0.1, dt)  # Evita divisioni per zero
             
             # Filtra movimenti minimi e outlier
             if (d > self.config['min_distance'] and 
                 d/dt < self.config['max_speed']):
                 
+                self.m_fix.inc()
                 self.tot_dist += d
                 self.trip_dist += d
                 current_speed = d / dt
@@ -163,71 +299,89 @@ class GPSTracker:
                 
                 # Aggiorna ultima posizione valida
                 self.last_valid_pos = (lat, lon)
-                
-                # Mantieni liste di dimensioni ragionevoli
-                if len(self.speeds) > 1000:
-                    self.speeds = self.speeds[-500:]
-                if len(self.trip_speeds) > 1000:
-                    self.trip_speeds = self.trip_speeds[-500:]
+            else:
+                self.m_scartati.inc()
         
         self.last_pos = (lat, lon)
         self.last_t = now
+        self.last_fix = t_fix
+
+        # Traccia del viaggio per la mappa e l'esportazione
+        self.track.write(now, lat, lon, self.trip_speeds.ultimo())
         
         # Invia statistiche
         msg = self._format_stats_message(now, lat, lon)
-        self.stats_q.put(msg)
+        self.stats_file.write(msg)      # Bufferizzato, il flush lo fa il thread delle statistiche
+        self.canale_stats.pubblica(msg)
+        if self.snapshot is not None:
+            self.snapshot.write(now, self.tot_dist, self.trip_dist,
+                                self.speeds.media(), self.trip_speeds.media(),
+                                lat, lon, 1.0 if self.signal_lost_time is None else 0.0)
         
-        # Log per debugging (mantieni solo ultimi 100 record)
-        if len(self.stats_log) < 100:
-            self.stats_log.append({
-                'timestamp': now,
-                'position': (lat, lon),
-                'distance': self.tot_dist,
-                'signal_status': 'VALID' if self.signal_lost_time is None else 'LOST'
-            })
+        # Log per debugging (solo gli ultimi 100 record)
+        self.stats_log.append({
+            'timestamp': now,
+            'position': (lat, lon),
+            'distance': self.tot_dist,
+            'signal_status': 'VALID' if self.signal_lost_time is None else 'LOST'
+        })
 
     def _reader(self):
-        buffer = b''
         while self.running:
             try:
                 raw = self.ser_src.read_all()
                 if raw:
-                    buffer += raw
-                    lines = buffer.split(b'\r\n')
-                    buffer = lines[-1]  # Mantieni l'ultimo frammento incompleto
-                    
-                    for line in lines[:-1]:
-                        if len(line) > 6 and line[3:6] == b'GGA':
-                            try:
-                                decoded_line = line.decode(errors='ignore').strip()
-                                msg = pynmea2.parse(decoded_line)
-                                
-                                if (hasattr(msg, "latitude") and 
-                                    hasattr(msg, "longitude") and 
-                                    hasattr(msg, "gps_qual")):
-                                    
-                                    # Controlla qualità del segnale
-                                    if (msg.gps_qual is not None and 
-                                        msg.gps_qual > 0 and 
-                                        msg.latitude is not None and 
-                                        msg.longitude is not None):
-                                        
-                                        self._update_stats(msg.latitude, msg.longitude)
-                                    else:
-                                        # Segnale di bassa qualità
-                                        self._handle_low_signal_quality()
-                                        
-                            except (pynmea2.ParseError, ValueError, UnicodeDecodeError) as e:
-                                if self.error_count < 10:  # Limita messaggi di errore
-                                    print(f"[parse error] {e}")
-                                self.error_count += 1
-                                
+                    self._process_chunk(raw, self.ricezione())
             except Exception as e:
-                print(f"[reader error] {e}")
+                log.error("Errore lettura GPS: %s", e)
                 time.sleep(1)  # Pausa più lunga in caso di errore grave
                 
             time.sleep(0.01)
 
+    def _process_chunk(self, raw, t_rx=None):
+        """Divide i byte ricevuti in frasi NMEA ed elabora le GGA; t_rx: ricezione sulla base locale"""
+        if t_rx is None:
+            t_rx = self.ricezione()
+        self.m_byte.inc(len(raw))
+        self.buffer += raw
+        lines = self.buffer.split(b'\r\n')
+        self.buffer = lines[-1]  # Mantieni l'ultimo frammento incompleto
+        if len(self.buffer) > BUFFER_MAX:
+            # Flusso senza CRLF (baud rate sbagliato, rumore): il buffer non deve crescere per sempre
+            self.m_buffer.inc()
+            self.buffer = b''
+        self.m_frasi.inc(len(lines) - 1)
+        
+        for line in lines[:-1]:
+            if len(line) > 6 and line[3:6] == b'GGA':
+                t0 = time.perf_counter()
+                self.m_gga.inc()
+                try:
+                    decoded_line = line.decode(errors='ignore').strip()
+                    msg = pynmea2.parse(decoded_line)
+                    
+                    if (hasattr(msg, "latitude") and 
+                        hasattr(msg, "longitude") and 
+                        hasattr(msg, "gps_qual")):
+                        
+                        # Controlla qualità del segnale
+                        if (msg.gps_qual is not None and 
+                            msg.gps_qual > 0 and 
+                            msg.latitude is not None and 
+                            msg.longitude is not None):
+                            
+                            self._update_stats(msg.latitude, msg.longitude, self._ora_fix(msg, t_rx))
+                        else:
+                            # Segnale di bassa qualità
+                            self.m_segnale_basso.inc()
+                            self._handle_low_signal_quality()
+                            
+                except (pynmea2.ParseError, ValueError, UnicodeDecodeError) as e:
+                    # Le ripetizioni sono limitate da logconfig; il contatore le conta tutte
+                    self.m_errori.inc()
+                    log.warning("Frase GGA non valida: %s", e)
+                self.m_gga_tempo.record(time.perf_counter() - t0)
+
     def _gps_writer(self):
         while self.running:
             try:
@@ -237,71 +391,164 @@ class GPSTracker:
                         self.ser_gps.write(data)
                 time.sleep(0.001)  # Pausa più breve per migliore responsività
             except Exception as e:
-                print(f"[gps_writer error] {e}")
+                log.error("Errore scrittura COM100: %s", e)
                 time.sleep(0.1)
 
+    def _porta_libera(self):
+        """
+        False se COM101 ha ancora byte da trasmettere: il monitor non sta
+        leggendo e una scrittura in più finirebbe solo in coda (o bloccherebbe).
+        """
+        try:
+            return self.ser_stats.out_waiting <= STATS_OUT_MAX
+        except (AttributeError, OSError, serial.SerialException):
+            return True     # Driver che non lo dice (pty): la scrittura bloccante fa da freno
+
+    def _invia(self, testo):
+        t0 = time.perf_counter()
+        self.ser_stats.write(testo.encode())
+        self.m_invio.record(time.perf_counter() - t0)
+
     def _stats_srv(self):
         while self.running:
             try:
-                # Invia messaggi statistici
-                while not self.stats_q.empty():
-                    msg = self.stats_q.get_nowait().encode()
-                    if self.ser_stats and self.ser_stats.is_open:
-                        self.ser_stats.write(msg)
+                # Aspetta la prossima riga; ogni 100 ms comunque flush e comandi
+                nuova = self.canale_stats.prendi(0.1)
+                if nuova is not None:
+                    if self.stats_pendente is not None:
+                        self.m_attese.inc()     # Superata prima che la porta si liberasse
+                    self.stats_pendente = nuova[0]
+                if self.ser_stats and self.ser_stats.is_open:
+                    if self.stats_pendente is not None or self.reset_da_inviare:
+                        if self._porta_libera():
+                            if self.reset_da_inviare:
+                                self._invia("TRIP RESET\n")
+                                self.reset_da_inviare = False
+                            if self.stats_pendente is not None:
+                                self._invia(self.stats_pendente)
+                                self.stats_pendente = None
+                                self.m_righe.inc()
+                else:
+                    self.stats_pendente = None
+                self.stats_file.flush()
+                self.track.flush()
                 
                 # Gestisci comandi di reset
-                cmd = self.ser_stats.read_all().decode().strip().upper()
-                if 'R' in cmd:
+                cmd = self.ser_stats.read_all().decode().strip().upper() if self.ser_stats else ""
+                if 'R' in cmd or self._reset_condiviso():
                     self.trip_dist = 0
-                    self.trip_speeds = []
-                    self.stats_q.put("TRIP RESET\n")
-                    print("Reset viaggio effettuato")
+                    self.trip_speeds = MediaMobile(VELOCITA_MAX)    # Oggetto nuovo: il reader può scrivere intanto
+                    self.track.new_trip()
+                    self.reset_da_inviare = self.ser_stats is not None
+                    log.info("Reset viaggio effettuato")
                     
             except Exception as e:
-                print(f"[stats_srv error] {e}")
+                log.error("Errore server statistiche: %s", e)
                 time.sleep(0.5)
-                
-            time.sleep(0.1)
+
+    def _reset_condiviso(self):
+        """Reset del viaggio richiesto dalla GUI tramite il blocco comandi condiviso"""
+        if self.comandi is None:
+            return False
+        _, valori = self.comandi.read()
+        if valori is None or valori[0] == self.reset_visti:
+            return False
+        self.reset_visti = valori[0]
+        return True
 
     def start(self):
-        print("Tracker GPS avviato.")
-        print("Stats disponibili su COM101, dati GPS mirroring su COM100.")
+        log.info("Tracker GPS avviato.")
+        log.info("Stats disponibili su %s, dati GPS mirroring su %s.",
+                 STATS_PT if self.snapshot is None else "memoria condivisa", GPS_OUT)
         print("Premere Ctrl+C per fermare.")
         
-        self.t_read.start()
-        self.t_write.start()
-        self.t_stat.start()
+        self.avvia()
         
         try:
             while self.running:
                 # Log periodico dello stato
                 if int(time.time()) % 30 == 0:  # Ogni 30 secondi
                     status = "OK" if self.signal_lost_time is None else f"NO SIGNAL ({time.time() - self.signal_lost_time:.0f}s)"
-                    print(f"Stato: {status} | Distanza totale: {self.tot_dist:.1f}m | Viaggio: {self.trip_dist:.1f}m")
+                    log.info("Stato: %s | Distanza totale: %.1fm | Viaggio: %.1fm", status, self.tot_dist, self.trip_dist)
                 time.sleep(1)
                 
         except KeyboardInterrupt:
             self.running = False
-            print("\nInterruzione da tastiera ricevuta...")
+            log.info("Interruzione da tastiera ricevuta...")
             
         finally:
-            print("Chiusura in corso...")
+            log.info("Chiusura in corso...")
+            self.stats_file.close()
+            self.track.close()
             for s in (self.ser_src, self.ser_gps, self.ser_stats):
                 if s and s.is_open:
                     try:
                         s.close()
                     except Exception as e:
-                        print(f"Errore chiusura porta: {e}")
+                        log.error("Errore chiusura porta: %s", e)
             
             # Statistiche finali
-            print(f"\nStatistiche finali:")
-            print(f"Distanza totale percorsa: {self.tot_dist:.2f} metri")
-            print(f"Distanza ultimo viaggio: {self.trip_dist:.2f} metri")
-            print(f"Velocità media: {np.mean(self.speeds) if self.speeds else 0:.2f} m/s")
-            print("Chiuso.")
+            log.info("Statistiche finali: distanza totale %.2f m, ultimo viaggio %.2f m, velocità media %.2f m/s",
+                     self.tot_dist, self.trip_dist, self.speeds.media())
+            log.info("Chiuso.")
+
+    def avvia(self):
+        """Avvia i thread di lettura, mirror e statistiche senza bloccare"""
+        self.t_read.start()
+        self.t_write.start()
+        self.t_stat.start()
+
+    def ferma(self):
+        """Ferma i thread avviati da avvia() e chiude file e porte"""
+        self.running = False
+        for t in (self.t_read, self.t_write, self.t_stat):
+            if t.is_alive():
+                t.join()
+        self.stats_file.close()
+        self.track.close()
+        for s in (self.ser_src, self.ser_gps, self.ser_stats):
+            if s and s.is_open:
+                s.close()
+
+    def replay(self, path, velocita=1.0):
+        """
+        Rigioca un file NMEA o una traccia CSV di trackstore al posto del ricevitore.
+        velocita = fix al secondo relativi al ricevitore (1 Hz); 0 = il più veloce possibile,
+        utile per profilare il parsing ma con distanze scartate (dt quasi nullo).
+        """
+        if path.endswith(".csv"):
+            from trackstore import load_track
+            _, lat, lon, _ = load_track(path)
+            righe = [frase_gga(la, lo) for la, lo in zip(lat, lon)]
+        else:
+            with open(path, "rb") as f:
+                righe = [r + b"\r\n" for r in f.read().replace(b"\r\n", b"\n").split(b"\n") if r]
+        log.info("Replay di %s: %d frasi", path, len(righe))
+        self.t_stat.start()
+        try:
+            for riga in righe:
+                if not self.running:
+                    break
+                self._process_chunk(riga)
+                if velocita and riga[3:6] == b"GGA":
+                    time.sleep(1.0 / velocita)
+        except KeyboardInterrupt:
+            log.info("Interruzione da tastiera ricevuta...")
+        finally:
+            self.running = False
+            self.t_stat.join()
+            self.stats_file.close()
+            self.track.close()
+            log.info("Replay terminato: distanza %.1f m", self.tot_dist)
 
 if __name__ == "__main__":
+    logconfig.setup("gps")
+    profiler.da_argv("gpstrip")
+    if profiler.opzione("--replay"):
+        GPSTracker(porte=False).replay(profiler.opzione("--replay"), float(profiler.opzione("--velocita", 1)))
+        sys.exit(0)
     try:
+        metrics.avvia_server(metrics.PORTA_GPS)
         GPSTracker().start()
     except Exception as e:
         print(f"Errore durante l'avvio: {e}")
@@ -0,0 +1,211 @@
+"""
+Guessometer statistico per la stima dell'autonomia residua.
+
+Combina il km/% del viaggio in corso con lo storico dei viaggi passati
+(logtrip/oldtrip.txt), pesato con decadimento esponenziale, e con il profilo
+di velocità. Restituisce una stima con banda di confidenza che è stabile già
+dal primo minuto di viaggio.
+La temperatura esterna non entra nella stima: nessun frame CAN decodificato
+né altro sensore la fornisce. L'effetto del freddo arriva solo attraverso il
+consumo misurato (km/% e Wh del viaggio) e lo storico recente.
+Con i Wh integrati dal CAN (energia.py) il consumo del viaggio si vede
+prima che la carica scenda di un punto.
+
+Lo storico viene ridotto a pochi accumulatori al caricamento, quindi ogni
+aggiornamento costa O(1).
+
+Backtest offline sulle tracce registrate (backtest.py):
+    python backtest.py --tracce logtrip/tracce
+"""
+
+import os
+import time
+from math import sqrt
+from datetime import datetime
+from collections import namedtuple
+
+STORICO_PATH = "logtrip/oldtrip.txt"
+TRACCE_DIR = "logtrip/tracce"
+
+WLTP_KM = 160.0          # Autonomia WLTP a batteria piena
+Z_BANDA = 1.645          # Banda di confidenza al 90%
+V_RIF = 45.0             # Velocità media (km/h) a cui si riferisce lo storico
+AERO_A, AERO_B = 1.0, 1.5e-4   # Consumo per km ∝ A + B*v^2
+PACCO_WH = 30000.0       # Energia utile del pacco (Bluecar 30 kWh)
+WH_MIN, KM_MIN = 20.0, 0.2     # Sotto queste soglie i Wh/km del viaggio sono solo rumore
+PERCENTO_TARATURA = 5    # Punti consumati oltre i quali i Wh per punto si misurano sul viaggio
+
+Stima = namedtuple("Stima", "km km_min km_max km_per_percento wh_km", defaults=(None,))
+
+
+def carica_storico(path=STORICO_PATH):
+    """
+    Legge logtrip/oldtrip.txt e restituisce una lista di (fine, km, percento).
+    Le righe non valide vengono ignorate.
+    """
+    viaggi = []
+    if not os.path.exists(path):
+        return viaggi
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        for riga in f:
+            parti = [p.strip() for p in riga.split("|")]
+            if len(parti) != 4:
+                continue
+            try:
+                fine = datetime.strptime(parti[1], "%Y-%m-%d %H:%M")
+                km = float(parti[2].split()[0])
+                percento = float(parti[3].split("%")[0])
+            except (ValueError, IndexError):
+                continue
+            viaggi.append((fine, km, percento))
+    return viaggi
+
+
+class StoricoConsumi:
+    """
+    Accumulatori pesati del km/% dei viaggi passati.
+    Ogni viaggio pesa quanto i punti percentuali consumati, con dimezzamento
+    del peso ogni `emivita_giorni` giorni.
+    """
+
+    def __init__(self, viaggi=(), emivita_giorni=60.0, adesso=None):
+        self.emivita_giorni = emivita_giorni
+        self.riferimento = adesso or datetime.now()
+        self.sw = self.swx = self.swx2 = self.sw2 = 0.0
+        for fine, km, percento in viaggi:
+            self.aggiungi(fine, km, percento)
+
+    def _peso_tempo(self, quando):
+        giorni = (self.riferimento - quando).total_seconds() / 86400.0
+        return 0.5 ** (max(0.0, giorni) / self.emivita_giorni)
+
+    def aggiungi(self, fine, km, percento):
+        """Aggiunge un viaggio concluso, in O(1)"""
+        if km <= 0 or percento < 1:
+            return
+        if fine > self.riferimento:
+            # Sposta il riferimento in avanti scalando gli accumulatori
+            giorni = (fine - self.riferimento).total_seconds() / 86400.0
+            decad = 0.5 ** (giorni / self.emivita_giorni)
+            self.sw *= decad
+            self.swx *= decad
+            self.swx2 *= decad
+            self.sw2 *= decad * decad
+            self.riferimento = fine
+        w = self._peso_tempo(fine) * percento
+        x = km / percento
+        self.sw += w
+        self.swx += w * x
+        self.swx2 += w * x * x
+        self.sw2 += w * w
+
+    def prior(self):
+        """
+        Restituisce (media, varianza predittiva) del km/% per il prossimo viaggio.
+        Senza storico usa il valore WLTP con un'incertezza ampia.
+        """
+        if self.sw <= 0:
+            media = WLTP_KM / 100.0
+            return media, (0.25 * media) ** 2
+        media = self.swx / self.sw
+        var = max(self.swx2 / self.sw - media * media, 0.0)
+        n_eff = self.sw * self.sw / self.sw2 if self.sw2 > 0 else 1.0
+        # Varianza fra viaggi + incertezza sulla media, con un minimo del 5%
+        var_pred = var + var / n_eff
+        return media, max(var_pred, (0.05 * media) ** 2)
+
+
+def fattore_velocita(v_kmh, v_rif=V_RIF, a=AERO_A, b=AERO_B):
+    """
+    Correzione del km/% per la velocità media: il consumo per km cresce
+    come a + b*v^2 (resistenza aerodinamica). Vale 1 alla velocità di riferimento.
+    """
+    if not v_kmh or v_kmh <= 0:
+        return 1.0
+    return (a + b * v_rif * v_rif) / (a + b * v_kmh * v_kmh)
+
+
+class Guessometer:
+    """Stima dell'autonomia con aggiornamento O(1) per campione"""
+
+    def __init__(self, storico=None):
+        self.storico = storico if storico is not None else StoricoConsumi(carica_storico())
+        self.prior_media, self.prior_var = self.storico.prior()
+        self.reset()
+
+    def reset(self, carica_iniziale=None):
+        """Azzera il viaggio in corso"""
+        self.inizio = carica_iniziale
+        self.ultima = None
+
+    def chiudi_viaggio(self, fine, km, percento):
+        """Registra il viaggio concluso nello storico e aggiorna il prior"""
+        self.storico.aggiungi(fine, km, percento)
+        self.prior_media, self.prior_var = self.storico.prior()
+        self.reset()
+
+    def update(self, attuale, trip_km, velocita_media=None, wh=None):
+        """
+        Aggiorna la stima con un nuovo campione.
+        attuale: carica in %, trip_km: km del viaggio, velocita_media in km/h,
+        wh: energia prelevata dal pacco nel viaggio (None senza frame del pacco).
+        """
+        if self.inizio is None or attuale > self.inizio:
+            # Primo campione o ricarica in corso: il viaggio riparte da qui
+            self.inizio = attuale
+
+        fattore = fattore_velocita(velocita_media)
+        media = self.prior_media * fattore
+        var = self.prior_var * fattore * fattore
+
+        consumato = self.inizio - attuale
+        if consumato >= 1 and trip_km > 0:
+            osservato = trip_km / consumato
+            # Quantizzazione della carica (mezzo punto) + rumore di misura del 5%
+            var_oss = (osservato * 0.5 / consumato) ** 2 + (0.05 * osservato) ** 2
+            precisione = 1.0 / var + 1.0 / var_oss
+            media = (media / var + osservato / var_oss) / precisione
+            var = 1.0 / precisione
+
+        wh_km = None
+        if wh is not None and wh > WH_MIN and trip_km > KM_MIN:
+            # Consumo misurato: km/% = Wh per punto / Wh/km, senza la quantizzazione della carica
+            wh_km = wh / trip_km
+            wh_punto = wh / consumato if consumato >= PERCENTO_TARATURA else PACCO_WH / 100
+            osservato = wh_punto / wh_km
+            var_oss = (0.05 * osservato) ** 2       # Capacità utile e taratura del sensore di corrente
+            precisione = 1.0 / var + 1.0 / var_oss
+            media = (media / var + osservato / var_oss) / precisione
+            var = 1.0 / precisione
+
+        km = media * attuale
+        delta = Z_BANDA * sqrt(var) * attuale
+        self.ultima = Stima(km, max(0.0, km - delta), km + delta, media, wh_km)
+        return self.ultima
+
+
+class RegistroTraccia:
+    """Registra i campioni del viaggio in CSV per il backtest offline"""
+
+    def __init__(self, cartella=TRACCE_DIR):
+        os.makedirs(cartella, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(cartella, f"trip_{timestamp}.csv")
+        self.file = open(self.path, "a")
+        self.file.write("timestamp,carica,trip_km,velocita_media,wh,recupero_wh\n")
+
+    def scrivi(self, carica, trip_km, velocita_media, wh=None, recupero_wh=None, t=None):
+        """t è l'ora del fix (default: adesso); Wh del viaggio e recupero dal CAN, nan se mancano"""
+        wh = float("nan") if wh is None else wh
+        recupero_wh = float("nan") if recupero_wh is None else recupero_wh
+        self.file.write(f"{time.time() if t is None else t:.3f},{carica},{trip_km:.3f},{velocita_media:.2f},"
+                        f"{wh:.2f},{recupero_wh:.2f}\n")
+        self.file.flush()
+
+    def chiudi(self):
+        self.file.close()
+
+
+if __name__ == "__main__":
+    g = Guessometer()
+    print(f"Prior: {g.prior_media:.3f} km/% (±{sqrt(g.prior_var):.3f})")
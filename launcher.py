@@ -0,0 +1,360 @@
+"""
+Launcher del Bluecar: GPS (gpstrip), monitor CAN e GUI come processi separati
+e sorvegliati.
+
+- Ogni processo che termina viene riavviato con back-off esponenziale
+  (1 s → 30 s, azzerato dopo un minuto di funzionamento regolare); la
+  chiusura normale della GUI ferma tutto.
+- La telemetria passa per la memoria condivisa (shmtelemetry, seqlock):
+  niente coppia com0com COM101/COM201 tra gpstrip e GUI, e il ciclo di
+  ricezione CAN non contende più il GIL con il thread della UI.
+- La porta COM100 verso il software di navigazione resta invariata.
+
+    python launcher.py                        # GPS + CAN + GUI
+    python launcher.py --solo gps,gui
+    python launcher.py --bench [--durata 5]   # latenza e CPU: layout attuale vs launcher
+"""
+
+import os
+import sys
+import time
+import queue
+import ctypes
+import argparse
+import threading
+import multiprocessing as mp
+
+import shmtelemetry
+import metrics
+import logconfig
+
+log = logconfig.get("launcher")
+from shmtelemetry import SeqlockSnapshot, GPS_SHM, CAN_SHM, CMD_SHM, GPS_CAMPI, CAN_CAMPI, CMD_CAMPI
+
+BACKOFF = (1.0, 30.0)
+STABILE_S = 60.0        # Dopo questo tempo di funzionamento il back-off si azzera
+HEARTBEAT_S = 1.0       # Il processo CAN riscrive la carica anche senza variazioni
+CONTROLLO_S = 0.5
+
+
+# ---------------------------------------------------------------------------
+# Processi
+
+def worker_gps():
+    from gpstrip import GPSTracker
+    logconfig.setup("gps")
+    metrics.avvia_server(metrics.PORTA_GPS)
+    GPSTracker(SeqlockSnapshot(GPS_SHM, GPS_CAMPI), SeqlockSnapshot(CMD_SHM, CMD_CAMPI)).start()
+
+
+def worker_can():
+    from can_monitor import create_battery_monitor
+    logconfig.setup("can")
+    metrics.avvia_server(metrics.PORTA_CAN)
+    blocco = SeqlockSnapshot(CAN_SHM, CAN_CAMPI)
+    lock = threading.Lock()     # Un solo scrittore per blocco: callback e battito si alternano
+
+    def scrivi(carica):
+        with lock:
+            wh = monitor.get_energy_wh()
+            blocco.write(time.time(), carica, monitor.t_carica or 0.0, float("nan") if wh is None else wh)
+
+    monitor = create_battery_monitor()
+    monitor.on_change = scrivi
+    monitor.start()
+    try:
+        while monitor.thread.is_alive():
+            scrivi(monitor.get_charge())
+            time.sleep(HEARTBEAT_S)
+    finally:
+        monitor.running = False
+        monitor.can.disconnect()
+    sys.exit(1)
+
+
+def worker_gui():
+    import GUI
+    sys.exit(GUI.main(condivisa=True))
+
+
+WORKERS = {"gps": worker_gps, "can": worker_can, "gui": worker_gui}
+
+
+class Processo:
+    """Un processo sorvegliato con il suo back-off"""
+
+    def __init__(self, nome, target, ctx):
+        self.nome = nome
+        self.target = target
+        self.ctx = ctx
+        self.proc = None
+        self.backoff = BACKOFF[0]
+        self.avviato = None
+        self.riavvio_alle = None
+        self.riavvii = 0
+
+    def start(self):
+        self.proc = self.ctx.Process(target=self.target, name=f"bluecar-{self.nome}")
+        self.proc.start()
+        self.avviato = time.monotonic()
+        self.riavvio_alle = None
+
+    def vivo(self):
+        return self.proc is not None and self.proc.is_alive()
+
+    def termina(self, timeout=5.0):
+        if self.proc is None:
+            return
+        if self.proc.is_alive():
+            self.proc.terminate()
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            self.proc.kill()
+            self.proc.join()
+
+
+class Launcher:
+    def __init__(self, nomi=("gps", "can", "gui")):
+        self.ctx = mp.get_context("spawn")
+        self.processi = [Processo(n, WORKERS[n], self.ctx) for n in nomi]
+        self.blocchi = None
+
+    def start(self):
+        self.blocchi = shmtelemetry.crea_blocchi()
+        for p in self.processi:
+            p.start()
+            log.info("Avviato %s (pid %d)", p.nome, p.proc.pid)
+
+    def controlla(self):
+        """Un giro di sorveglianza; False quando il launcher deve fermarsi"""
+        adesso = time.monotonic()
+        for p in self.processi:
+            if p.vivo():
+                if adesso - p.avviato > STABILE_S:
+                    p.backoff = BACKOFF[0]
+                continue
+            if p.riavvio_alle is None:
+                codice = p.proc.exitcode
+                if p.nome == "gui" and codice == 0:
+                    log.info("GUI chiusa: arresto")
+                    return False
+                p.riavvio_alle = adesso + p.backoff
+                log.warning("%s terminato (codice %s), riavvio tra %.0f s", p.nome, codice, p.backoff)
+                p.backoff = min(p.backoff * 2, BACKOFF[1])
+            elif adesso >= p.riavvio_alle:
+                p.riavvii += 1
+                p.start()
+                log.info("Riavviato %s (pid %d, riavvio n. %d)", p.nome, p.proc.pid, p.riavvii)
+        return True
+
+    def run(self):
+        self.start()
+        try:
+            while self.controlla():
+                time.sleep(CONTROLLO_S)
+        except KeyboardInterrupt:
+            print("\nInterruzione ricevuta...")
+        finally:
+            self.stop()
+
+    def stop(self):
+        for p in self.processi:
+            p.termina()
+        if self.blocchi is not None:
+            for blocco in self.blocchi.values():
+                blocco.close()
+            self.blocchi = None
+
+
+# ---------------------------------------------------------------------------
+# Benchmark: layout attuale (seriale virtuale + CAN in un thread della GUI)
+# contro launcher (memoria condivisa + CAN in un processo a sé)
+
+BENCH_HZ = 20           # Fix al secondo prodotti dal GPS simulato
+CAN_FPS = 2000          # Frame CAN al secondo sul bus simulato
+UI_TICK_S = 0.010
+
+
+class _Frame(ctypes.Structure):
+    _fields_ = [("nType", ctypes.c_int), ("nResult", ctypes.c_int), ("nID", ctypes.c_int),
+                ("nIDE", ctypes.c_int), ("nRTR", ctypes.c_int), ("nDLC", ctypes.c_int),
+                ("cData", ctypes.c_ubyte * 8)]
+
+
+def _can_finto(durata, scrivi):
+    """Stesso schema di BatteryMonitor._monitor_loop, con frame generati a CAN_FPS"""
+    fine = time.monotonic() + durata
+    prossimo = time.monotonic()
+    n = 0
+    carica = 80
+    while time.monotonic() < fine:
+        if time.monotonic() < prossimo:
+            time.sleep(0.001)
+            continue
+        prossimo += 1.0 / CAN_FPS
+        msg = _Frame()
+        msg.nType, msg.nDLC = 4, 8
+        n += 1
+        msg.nID = 0x638 if n % 100 == 0 else 0x100 + n % 64
+        if msg.nID == 0x638 and msg.nDLC == 8 and not msg.nRTR:
+            msg.cData[3] = carica - (n // 20000)
+            scrivi(min(100, max(0, msg.cData[3])))
+
+
+def _stats_riga(ts):
+    return f"STATS,1000.00,500.00,12.00,11.00,{ts:.6f},45.070000,7.680000,VALID\n".encode()
+
+
+def _gps_seriale(master_fd, durata, cpu_q):
+    """gpstrip attuale: _update_stats mette in coda, _stats_srv svuota ogni 0.1 s sulla seriale"""
+    coda = queue.Queue()
+    cpu0 = time.process_time()
+    fine = time.monotonic() + durata
+
+    def stats_srv():
+        while time.monotonic() < fine + 0.2:
+            while not coda.empty():
+                os.write(master_fd, coda.get_nowait())
+            time.sleep(0.1)
+
+    t = threading.Thread(target=stats_srv, daemon=True)
+    t.start()
+    while time.monotonic() < fine:
+        coda.put(_stats_riga(time.monotonic()))
+        time.sleep(1.0 / BENCH_HZ)
+    t.join()
+    cpu_q.put(time.process_time() - cpu0)
+
+
+def _gps_condiviso(durata, cpu_q):
+    blocco = SeqlockSnapshot(GPS_SHM, GPS_CAMPI)
+    cpu0 = time.process_time()
+    fine = time.monotonic() + durata
+    while time.monotonic() < fine:
+        blocco.write(time.monotonic(), 1000.0, 500.0, 12.0, 11.0, 45.07, 7.68, 1.0)
+        time.sleep(1.0 / BENCH_HZ)
+    cpu_q.put(time.process_time() - cpu0)
+
+
+def _can_condiviso(durata, cpu_q):
+    blocco = SeqlockSnapshot(CAN_SHM, CAN_CAMPI)
+    cpu0 = time.process_time()
+    _can_finto(durata, lambda c: blocco.write(time.time(), c, time.perf_counter(), float("nan")))
+    cpu_q.put(time.process_time() - cpu0)
+
+
+def _fase_gui(durata, porta, con_can):
+    """Processo GUI: thread pipeline che legge STATS, eventuale thread CAN, tick della UI"""
+    latenze = []
+    ritardi = []
+    fine = time.monotonic() + durata
+
+    def lettore():
+        while time.monotonic() < fine:
+            riga = porta.readline()
+            if riga.startswith(b"STATS"):
+                latenze.append((time.monotonic() - float(riga.split(b",")[5])) * 1000)
+
+    thread = [threading.Thread(target=lettore, daemon=True)]
+    if con_can:
+        stato = {}
+        thread.append(threading.Thread(target=_can_finto, args=(durata, lambda c: stato.update(c=c)),
+                                       daemon=True))
+    cpu0 = time.process_time()
+    for t in thread:
+        t.start()
+    prossimo = time.monotonic() + UI_TICK_S
+    while time.monotonic() < fine:
+        sum(i * i for i in range(3000))      # Lavoro di disegno simulato
+        attesa = prossimo - time.monotonic()
+        if attesa > 0:
+            time.sleep(attesa)
+        ritardi.append(max(0.0, time.monotonic() - prossimo) * 1000)
+        prossimo += UI_TICK_S
+    for t in thread:
+        t.join(2)
+    return latenze, ritardi, time.process_time() - cpu0
+
+
+def _percentile(valori, p):
+    valori = sorted(valori)
+    return valori[min(len(valori) - 1, int(len(valori) * p / 100))] if valori else float("nan")
+
+
+def _stampa(nome, latenze, ritardi, cpu_gui, cpu_altri, durata):
+    print(f"{nome}:")
+    print(f"  latenza STATS  p50 {_percentile(latenze, 50):6.2f} ms  p99 {_percentile(latenze, 99):6.2f} ms "
+          f"({len(latenze)} campioni)")
+    print(f"  ritardo tick UI p50 {_percentile(ritardi, 50):6.2f} ms  p99 {_percentile(ritardi, 99):6.2f} ms")
+    print(f"  CPU processo GUI {cpu_gui / durata * 100:5.1f}%   CPU totale {(cpu_gui + cpu_altri) / durata * 100:5.1f}%")
+
+
+def bench(durata=5.0):
+    import serial
+
+    # Layout attuale: coppia pty al posto di com0com, CAN come thread nel processo GUI
+    if hasattr(os, "openpty") and "fork" in mp.get_all_start_methods():
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        ctx = mp.get_context("fork")
+        cpu_q = ctx.Queue()
+        gps = ctx.Process(target=_gps_seriale, args=(master, durata, cpu_q))
+        porta = serial.Serial(os.ttyname(slave), 9600, timeout=1)
+        gps.start()
+        latenze, ritardi, cpu_gui = _fase_gui(durata, porta, con_can=True)
+        cpu_altri = cpu_q.get(timeout=10)
+        gps.join()
+        porta.close()
+        os.close(master)
+        os.close(slave)
+        _stampa("Layout attuale (seriale virtuale, CAN nel processo GUI)", latenze, ritardi, cpu_gui,
+                cpu_altri, durata)
+    else:
+        print("Layout attuale non riproducibile qui (servono pty e fork)")
+
+    # Launcher: memoria condivisa, CAN in un processo separato
+    blocchi = shmtelemetry.crea_blocchi()
+    try:
+        ctx = mp.get_context("spawn")
+        cpu_q = ctx.Queue()
+        figli = [ctx.Process(target=_gps_condiviso, args=(durata, cpu_q)),
+                 ctx.Process(target=_can_condiviso, args=(durata, cpu_q))]
+        for f in figli:
+            f.start()
+        porta = shmtelemetry.StatsPort()
+        # Si misura solo dopo l'avvio (import compresi) dei processi spawn
+        while not (blocchi[GPS_SHM].seq and blocchi[CAN_SHM].seq):
+            time.sleep(0.01)
+        latenze, ritardi, cpu_gui = _fase_gui(durata, porta, con_can=False)
+        cpu_altri = sum(cpu_q.get(timeout=10) for _ in figli)
+        for f in figli:
+            f.join()
+        porta.close()
+        _stampa("Launcher (memoria condivisa, CAN in un processo a sé)", latenze, ritardi, cpu_gui,
+                cpu_altri, durata)
+    finally:
+        for blocco in blocchi.values():
+            blocco.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Launcher dei processi del Bluecar")
+    parser.add_argument("--solo", help="processi da avviare, separati da virgola (gps,can,gui)")
+    parser.add_argument("--bench", action="store_true", help="confronto con il layout attuale")
+    parser.add_argument("--durata", type=float, default=5.0, help="secondi per fase del benchmark")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        bench(args.durata)
+        return
+    nomi = tuple(args.solo.split(",")) if args.solo else tuple(WORKERS)
+    sconosciuti = [n for n in nomi if n not in WORKERS]
+    if sconosciuti:
+        parser.error(f"processi sconosciuti: {', '.join(sconosciuti)}")
+    logconfig.setup("launcher")
+    Launcher(nomi).run()
+
+
+if __name__ == "__main__":
+    main()
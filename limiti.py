@@ -0,0 +1,186 @@
+"""
+Strutture a memoria limitata per i processi che girano per giorni.
+
+Ogni coda o buffer che cresce con il tempo ha un limite esplicito, una
+politica di overflow e un contatore nel registro delle metriche:
+- CodaLimitata: FIFO tra due thread che non blocca mai chi scrive; piena,
+  scarta il più vecchio (statistiche: conta l'ultima) o il nuovo
+- MediaMobile: media delle ultime n velocità con somma incrementale, al
+  posto delle liste che crescevano fino a 1000 e venivano ricopiate
+- FileGiornaliero: log CSV con un file al giorno, invece di un handle
+  aperto per sempre su un file che cresce senza fine
+- CanaleUltimo: solo il valore più recente, per i dati di stato (righe
+  STATS) dove a un lettore lento serve l'ultimo valore, non la coda arretrata
+
+Prova di durata (24 ore simulate, RSS e tracemalloc):
+    python soak.py
+"""
+
+import os
+import math
+import time
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+import metrics
+
+SCARTA_VECCHI = "vecchi"
+SCARTA_NUOVI = "nuovi"
+
+
+class CodaLimitata:
+    """FIFO limitata (un produttore, un consumatore) con la stessa interfaccia di Queue usata qui"""
+
+    def __init__(self, nome, massimo, politica=SCARTA_VECCHI):
+        self.nome = nome
+        self.massimo = massimo
+        self.politica = politica
+        self.coda = deque()
+        self.scartati = 0
+        self.m_scartati = metrics.counter(f"{nome}_dropped_total",
+                                          f"Elementi scartati da {nome} (piena, politica: {politica})")
+
+    def put(self, elemento):
+        """Accoda senza bloccare; False se l'elemento nuovo è stato scartato"""
+        if len(self.coda) >= self.massimo:
+            self.scartati += 1
+            self.m_scartati.inc()
+            if self.politica == SCARTA_NUOVI:
+                return False
+            try:
+                self.coda.popleft()
+            except IndexError:
+                pass    # Svuotata dal consumatore nel frattempo
+        self.coda.append(elemento)
+        return True
+
+    put_nowait = put
+
+    def get_nowait(self):
+        try:
+            return self.coda.popleft()
+        except IndexError:
+            raise queue.Empty from None
+
+    def empty(self):
+        return not self.coda
+
+    def qsize(self):
+        return len(self.coda)
+
+    def __len__(self):
+        return len(self.coda)
+
+
+class MediaMobile:
+    """Media delle ultime n misure in O(1), memoria costante"""
+
+    def __init__(self, n):
+        self.valori = deque(maxlen=n)
+        self.somma = 0.0
+        self.fino_al_ricalcolo = n
+
+    def append(self, valore):
+        if len(self.valori) == self.valori.maxlen:
+            self.somma -= self.valori[0]
+        self.valori.append(valore)
+        self.somma += valore
+        self.fino_al_ricalcolo -= 1
+        if self.fino_al_ricalcolo == 0:
+            # Dopo giorni di somme e sottrazioni l'errore di arrotondamento si accumula
+            self.somma = math.fsum(self.valori)
+            self.fino_al_ricalcolo = self.valori.maxlen
+
+    def media(self):
+        return self.somma / len(self.valori) if self.valori else 0.0
+
+    def ultimo(self, default=0.0):
+        return self.valori[-1] if self.valori else default
+
+    def clear(self):
+        self.valori.clear()
+        self.somma = 0.0
+
+    def __len__(self):
+        return len(self.valori)
+
+
+class FileGiornaliero:
+    """Log di testo in <cartella>/<prefisso>_<data>_<ora>.csv; a mezzanotte si passa a un file nuovo"""
+
+    def __init__(self, cartella, prefisso, intestazione=None):
+        self.cartella = cartella
+        self.prefisso = prefisso
+        self.intestazione = intestazione
+        self.file = None
+        self.path = None
+        self.mezzanotte = 0.0
+        self.m_rotazioni = metrics.counter(f"{prefisso}_log_rotations_total", f"Nuovi file {prefisso}_*.csv")
+        os.makedirs(cartella, exist_ok=True)
+        self._apri()
+
+    def _apri(self):
+        adesso = datetime.now()
+        self.path = os.path.join(self.cartella, f"{self.prefisso}_{adesso:%Y%m%d_%H%M%S}.csv")
+        self.file = open(self.path, "a")
+        if self.intestazione:
+            self.file.write(self.intestazione + "\n")
+        domani = (adesso + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.mezzanotte = domani.timestamp()
+
+    def write(self, riga):
+        if time.time() >= self.mezzanotte:
+            self.file.close()
+            self._apri()
+            self.m_rotazioni.inc()
+        self.file.write(riga)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class CanaleUltimo:
+    """
+    Un valore alla volta: chi pubblica sovrascrive, chi legge riceve il più
+    recente e quanti aggiornamenti sono stati sovrascritti senza essere letti.
+    Un solo lettore; la memoria non dipende da quanto il lettore è lento.
+    """
+
+    def __init__(self, nome):
+        self.nome = nome
+        self.cond = threading.Condition()
+        self.valore = None
+        self.seq = 0            # Valori pubblicati
+        self.letti = 0          # seq dell'ultimo valore consegnato
+        self.saltati = 0
+        self.m_saltati = metrics.counter(f"{nome}_conflated_total",
+                                         f"Valori di {nome} sovrascritti prima di essere letti")
+
+    def pubblica(self, valore):
+        with self.cond:
+            self.valore = valore
+            self.seq += 1
+            self.cond.notify()
+
+    def prendi(self, timeout=0):
+        """(valore, saltati) se c'è un valore nuovo, atteso al massimo timeout secondi; altrimenti None"""
+        with self.cond:
+            if self.seq == self.letti and not (
+                    timeout and self.cond.wait_for(lambda: self.seq != self.letti, timeout)):
+                return None
+            saltati = self.seq - self.letti - 1
+            self.letti = self.seq
+            valore = self.valore
+        if saltati:
+            self.saltati += saltati
+            self.m_saltati.inc(saltati)
+        return valore, saltati
+
+    def __len__(self):
+        return int(self.seq != self.letti)
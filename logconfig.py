@@ -0,0 +1,560 @@
+"""
+Logging strutturato e asincrono per GUI, GPS, CAN, Bluetooth e pipeline.
+
+I thread di lavoro non scrivono mai su console o file: il record viene messo
+in una coda (QueueHandler) e un QueueListener lo scrive dal proprio thread
+su file a rotazione (logs/<processo>.log, una riga JSON per evento) e sulla
+console.
+
+- Un logger per sottosistema (gps, can, bt, gui, pipeline, launcher), con
+  livello configurabile dalla variabile BLUECAR_LOG:
+      BLUECAR_LOG="gps=DEBUG,bt=WARNING" python GUI.py
+      BLUECAR_LOG="WARNING" python launcher.py     (livello di tutti)
+- Messaggi ripetuti limitati: al massimo RIPETIZIONI_MAX per modello di
+  messaggio ogni FINESTRA_S secondi; il primo della finestra successiva
+  riporta quanti ne sono stati soppressi. Per questo i messaggi vanno scritti
+  con gli argomenti separati: log.warning("Frase non valida: %s", e)
+- Gli ultimi RING eventi restano in memoria e vengono salvati in
+  logs/postmortem_<processo>_<data>.jsonl a ogni eccezione non gestita
+  (anche nei thread) o con dump_postmortem()
+- Nel thread chiamante si controllano solo livello e ripetizioni e si mette
+  in coda una tupla; LogRecord, formattazione e I/O sono del listener, che
+  scrive nel buffer dei file e fa il flush quando la coda si svuota.
+
+Benchmark del costo di una chiamata rispetto a print(), anche verso una
+console lenta come quella di Windows (simulata):
+    python logconfig.py --bench [--console-us 100]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import tempfile
+import threading
+from collections import deque
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import metrics
+
+LOG_DIR = "logs"
+RADICE = "bluecar"
+SOTTOSISTEMI = ("gps", "can", "bt", "gui", "pipeline", "launcher")
+LIVELLO_DEFAULT = logging.INFO
+
+MAX_BYTES = 1_000_000       # Rotazione del file del processo
+BACKUP = 5
+CODA_MAX = 10_000           # Record in attesa di scrittura; oltre vengono scartati e contati
+RIPETIZIONI_MAX = 10
+FINESTRA_S = 60.0
+RING = 2000                 # Eventi conservati per il post-mortem
+CONSOLE_US = 100            # Costo simulato di una scrittura sulla console di Windows (bench)
+
+_stato = {}
+_registratori = {}
+
+
+class Registratore:
+    """
+    Logger di un sottosistema con la stessa interfaccia di base di
+    logging.Logger. Il chiamante controlla livello e ripetizioni e mette in
+    coda solo una tupla: il LogRecord lo costruisce il listener. Con
+    un'eccezione da allegare, o prima di setup(), si passa dal logging standard.
+    """
+
+    __slots__ = ("logger", "name")
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.name = logger.name
+
+    def isEnabledFor(self, livello):
+        return self.logger.isEnabledFor(livello)
+
+    def setLevel(self, livello):
+        self.logger.setLevel(livello)
+
+    def _log(self, livello, msg, args, exc_info=None):
+        if not self.logger.isEnabledFor(livello):
+            return
+        coda = _stato.get("coda")
+        if coda is None or exc_info:
+            self.logger.log(livello, msg, *args, exc_info=exc_info)
+            return
+        t = time.time()
+        soppressi = _stato["limite"].consenti(self.name, msg, t)
+        if soppressi is None:
+            return
+        if coda.qsize() >= CODA_MAX:
+            _stato["handler"].m_persi.inc()
+            return
+        coda.put_nowait((t, livello, self.name, threading.current_thread().name, msg, args, soppressi))
+
+    def debug(self, msg, *args, exc_info=None):
+        self._log(logging.DEBUG, msg, args, exc_info)
+
+    def info(self, msg, *args, exc_info=None):
+        self._log(logging.INFO, msg, args, exc_info)
+
+    def warning(self, msg, *args, exc_info=None):
+        self._log(logging.WARNING, msg, args, exc_info)
+
+    def error(self, msg, *args, exc_info=None):
+        self._log(logging.ERROR, msg, args, exc_info)
+
+    def exception(self, msg, *args, exc_info=True):
+        self._log(logging.ERROR, msg, args, exc_info)
+
+    def critical(self, msg, *args, exc_info=None):
+        self._log(logging.CRITICAL, msg, args, exc_info)
+
+
+def get(sottosistema):
+    """Logger del sottosistema (bluecar.<sottosistema>)"""
+    nome = f"{RADICE}.{sottosistema}"
+    registratore = _registratori.get(nome)
+    if registratore is None:
+        registratore = _registratori.setdefault(nome, Registratore(logging.getLogger(nome)))
+    return registratore
+
+
+def _record(t, livello, nome, thread, msg, args, soppressi):
+    """LogRecord di una tupla messa in coda da Registratore, con ora e thread del chiamante"""
+    record = logging.LogRecord(nome, livello, None, 0, msg, args, None)
+    record.created = t
+    record.msecs = (t - int(t)) * 1000
+    record.threadName = thread
+    if soppressi:
+        record.soppressi = soppressi
+    return record
+
+
+class LimiteRipetizioni(logging.Filter):
+    """Al massimo `massimo` record per modello di messaggio ogni `finestra` secondi"""
+
+    def __init__(self, massimo=RIPETIZIONI_MAX, finestra=FINESTRA_S):
+        super().__init__()
+        self.massimo = massimo
+        self.finestra = finestra
+        self.conteggi = {}      # (logger, modello) -> [inizio finestra, emessi, soppressi]
+        self.m_soppressi = metrics.counter("log_suppressed_total", "Messaggi ripetuti non scritti")
+
+    def consenti(self, nome, modello, t):
+        """
+        None se il messaggio va soppresso, altrimenti quanti ne sono stati
+        soppressi nella finestra precedente. Senza lock: con più thread in gara
+        i conteggi possono sbagliare di qualche unità, ma nessuno aspetta.
+        """
+        chiave = (nome, modello)
+        c = self.conteggi.get(chiave)
+        if c is None or t - c[0] >= self.finestra:
+            if c is None and len(self.conteggi) > 1000:
+                self.conteggi.clear()       # Messaggi già formattati: chiavi sempre nuove
+            self.conteggi[chiave] = [t, 1, 0]
+            return c[2] if c is not None else 0
+        if c[1] < self.massimo:
+            c[1] += 1
+            return 0
+        c[2] += 1
+        self.m_soppressi.inc()
+        return None
+
+    def filter(self, record):
+        soppressi = self.consenti(record.name, record.msg, record.created)
+        if soppressi:
+            record.soppressi = soppressi
+        return soppressi is not None
+
+
+class _CodaHandler(QueueHandler):
+    """
+    Mette in coda il record così com'è: messaggio, eccezione e I/O vengono
+    formattati dal thread del listener. Gli argomenti devono quindi essere
+    valori che nessuno modifica subito dopo la chiamata (numeri, stringhe,
+    eccezioni).
+    """
+
+    def __init__(self, coda, massimo=CODA_MAX):
+        super().__init__(coda)
+        self.massimo = massimo
+        self.m_persi = metrics.counter("log_dropped_total", "Record scartati a coda piena")
+
+    def prepare(self, record):
+        return record
+
+    def handle(self, record):
+        # La coda è già thread-safe: niente lock dell'handler tra i thread che scrivono
+        if self.filter(record):
+            self.emit(record)
+            return True
+        return False
+
+    def enqueue(self, record):
+        # SimpleQueue non ha limite: il controllo della lunghezza costa meno dei lock di Queue
+        if self.queue.qsize() >= self.massimo:
+            self.m_persi.inc()
+        else:
+            self.queue.put_nowait(record)
+
+
+class _Listener(QueueListener):
+    """Costruisce i record delle tuple in coda; flush dei file solo quando la coda è vuota"""
+
+    def start(self):
+        super().start()
+        self._thread.name = "log"
+
+    def prepare(self, record):
+        return _record(*record) if type(record) is tuple else record
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            self._flush()
+
+    def stop(self):
+        super().stop()
+        self._flush()
+
+    def _flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+
+class _FileRotante(RotatingFileHandler):
+    """
+    RotatingFileHandler che formatta ogni record una volta sola (l'originale
+    lo rifà per decidere la rotazione, con seek e tell) e lascia il flush al
+    listener.
+    """
+
+    def __init__(self, path, maxBytes, backupCount):
+        super().__init__(path, maxBytes=maxBytes, backupCount=backupCount, encoding="utf-8")
+        self.scritti = self.stream.tell()
+
+    def emit(self, record):
+        try:
+            riga = self.format(record) + "\n"
+            if self.scritti and self.scritti + len(riga) >= self.maxBytes:
+                self.doRollover()
+                self.scritti = 0
+            self.stream.write(riga)
+            self.scritti += len(riga)
+        except Exception:
+            self.handleError(record)
+
+
+class _Console(logging.StreamHandler):
+    """StreamHandler senza flush a ogni riga: lo fa il listener a coda vuota"""
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+def _sottosistema(record):
+    nome = record.name
+    return nome[len(RADICE) + 1:] if nome.startswith(RADICE + ".") else nome
+
+
+class FormatoJSON(logging.Formatter):
+    """Un evento per riga: t, livello, sottosistema, thread, msg (+ campi extra)"""
+
+    def format(self, record):
+        evento = {
+            "t": round(record.created, 3),
+            "livello": record.levelname,
+            "sottosistema": _sottosistema(record),
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        campi = getattr(record, "campi", None)
+        if campi:
+            evento.update(campi)
+        soppressi = getattr(record, "soppressi", 0)
+        if soppressi:
+            evento["soppressi"] = soppressi
+        if record.exc_info:
+            evento["eccezione"] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+class FormatoConsole(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(sottosistema)s] %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        record.sottosistema = _sottosistema(record)
+        testo = super().format(record)
+        soppressi = getattr(record, "soppressi", 0)
+        if soppressi:
+            testo += f" (altri {soppressi} messaggi uguali soppressi)"
+        return testo
+
+
+class RingBuffer(logging.Handler):
+    """Ultimi eventi in memoria, per il dump post-mortem"""
+
+    def __init__(self, n=RING):
+        super().__init__()
+        self.eventi = deque(maxlen=n)
+        self.setFormatter(FormatoJSON())
+
+    def emit(self, record):
+        self.eventi.append(record)
+
+    def dump(self, path):
+        formato = self.formatter
+        with open(path, "w", encoding="utf-8") as f:
+            for record in list(self.eventi):
+                f.write(formato.format(record) + "\n")
+        return path
+
+
+def livelli(testo):
+    """'gps=DEBUG,bt=WARNING' -> {'gps': 10, 'bt': 30}; un livello da solo vale per tutti ('*')"""
+    risultato = {}
+    for parte in filter(None, (p.strip() for p in testo.split(","))):
+        nome, _, livello = parte.rpartition("=")
+        valore = logging.getLevelName(livello.strip().upper())
+        if not isinstance(valore, int):
+            print(f"Livello di log sconosciuto: {parte}")
+            continue
+        risultato[nome.strip() or "*"] = valore
+    return risultato
+
+
+def setup(processo, cartella=LOG_DIR, console=True, config=None):
+    """Configura il logging del processo (una volta sola); restituisce il QueueListener"""
+    if _stato:
+        return _stato["listener"]
+    config = livelli(os.environ.get("BLUECAR_LOG", "") if config is None else config)
+
+    # File e riga del chiamante non servono: evitano di risalire lo stack a ogni chiamata
+    logging._srcfile = None
+    logging.logProcesses = logging.logMultiprocessing = False
+
+    os.makedirs(cartella, exist_ok=True)
+    coda = queue.SimpleQueue()
+    file = _FileRotante(os.path.join(cartella, f"{processo}.log"), MAX_BYTES, BACKUP)
+    file.setFormatter(FormatoJSON())
+    ring = RingBuffer()
+    handlers = [file, ring]
+    if console:
+        terminale = _Console(sys.stdout)
+        terminale.setFormatter(FormatoConsole())
+        handlers.append(terminale)
+    listener = _Listener(coda, *handlers)
+
+    handler = _CodaHandler(coda)
+    limite = LimiteRipetizioni()
+    handler.addFilter(limite)
+    radice = logging.getLogger(RADICE)
+    radice.addHandler(handler)
+    radice.propagate = False
+    radice.setLevel(config.pop("*", LIVELLO_DEFAULT))
+    for nome, livello in config.items():
+        get(nome).setLevel(livello)
+
+    _stato.update(processo=processo, cartella=cartella, listener=listener, ring=ring,
+                  handler=handler, limite=limite, coda=coda,
+                  excepthook=sys.excepthook, threadhook=threading.excepthook)
+    sys.excepthook = _eccezione
+    threading.excepthook = _eccezione_thread
+    listener.start()
+    atexit.register(shutdown)
+    return listener
+
+
+def set_livello(sottosistema, livello):
+    """Cambia il livello di un sottosistema a processo avviato"""
+    get(sottosistema).setLevel(livello)
+
+
+def dump_postmortem(motivo="richiesta"):
+    """Salva gli ultimi eventi su file; restituisce il percorso (None se il logging non è attivo)"""
+    if not _stato:
+        return None
+    listener = _stato["listener"]
+    # Svuota la coda prima del dump, così ci sono anche gli ultimi eventi
+    attivo = listener._thread is not None
+    if attivo:
+        listener.stop()
+    try:
+        path = os.path.join(_stato["cartella"],
+                            f"postmortem_{_stato['processo']}_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+        _stato["ring"].dump(path)
+        print(f"Post-mortem ({motivo}) salvato in {path}", file=sys.stderr)
+        return path
+    except OSError as e:
+        print(f"Impossibile salvare il post-mortem: {e}", file=sys.stderr)
+        return None
+    finally:
+        if attivo:
+            listener.start()
+
+
+def _eccezione(tipo, valore, tb):
+    if not issubclass(tipo, KeyboardInterrupt):
+        logging.getLogger(RADICE).critical("Eccezione non gestita", exc_info=(tipo, valore, tb))
+        dump_postmortem("eccezione")
+    _stato["excepthook"](tipo, valore, tb)
+
+
+def _eccezione_thread(args):
+    if args.exc_type is not SystemExit:
+        nome = args.thread.name if args.thread is not None else "?"
+        logging.getLogger(RADICE).critical("Eccezione non gestita nel thread %s", nome,
+                                           exc_info=(args.exc_type, args.exc_value, args.exc_traceback))
+        dump_postmortem("eccezione nel thread")
+    _stato["threadhook"](args)
+
+
+def shutdown():
+    """Scrive gli eventi in coda e chiude i file"""
+    if not _stato:
+        return
+    listener = _stato["listener"]
+    if listener._thread is not None:
+        listener.stop()
+    for h in listener.handlers:
+        h.close()
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+
+def _per_chiamata(fn, n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t0) / n
+
+
+def _concorrente(fn, n, thread=4):
+    """Tempo totale di `thread` thread che chiamano fn n volte ciascuno"""
+    lavoratori = [threading.Thread(target=lambda: [fn(i) for i in range(n)]) for _ in range(thread)]
+    t0 = time.perf_counter()
+    for t in lavoratori:
+        t.start()
+    for t in lavoratori:
+        t.join()
+    return time.perf_counter() - t0
+
+
+class _ConsoleLenta:
+    """
+    Console simulata per il bench: ogni riga completa costa `us` microsecondi
+    di attesa, una riga alla volta, come WriteConsole su Windows (l'attesa
+    rilascia il GIL, come la vera scrittura).
+    """
+
+    def __init__(self, us):
+        self.attesa = us / 1e6
+        self.lock = threading.Lock()
+        self.righe = 0
+
+    def write(self, testo):
+        if "\n" in testo:
+            with self.lock:
+                time.sleep(self.attesa)
+                self.righe += 1
+        return len(testo)
+
+    def flush(self):
+        pass
+
+
+def bench(n=50_000, console_us=CONSOLE_US):
+    with tempfile.TemporaryDirectory() as tmp:
+        # La console di Windows è molto più lenta; qui print va su un file con buffer a riga,
+        # come stdout su un terminale, quindi è il caso migliore per print
+        console = open(os.path.join(tmp, "console.txt"), "w", buffering=1, encoding="utf-8")
+        setup("bench", cartella=tmp, console=False, config="gps=INFO")
+        log = get("gps")
+        e = ValueError("checksum errato")
+
+        def con_print(i):
+            print(f"[parse error] {e} #{i}", file=console)
+
+        def con_log(i):
+            log.warning("Frase GGA non valida: %s #%d", e, i)
+
+        def disattivato(i):
+            log.debug("Frase %d", i)
+
+        listener = _stato["listener"]
+        limite = _stato["limite"]
+        limite.massimo = float("inf")   # Prima il costo pieno: nessun messaggio soppresso
+        k = min(n, CODA_MAX - 1)
+        risultati = [
+            ("print (file a riga)", _per_chiamata(con_print, n)),
+            ("log.warning, listener attivo", _per_chiamata(con_log, k)),
+        ]
+        listener.stop()
+        # Solo il costo del chiamante: il listener fermo non contende il GIL
+        risultati.append(("log.warning, listener fermo", _per_chiamata(con_log, k)))
+        t0 = time.perf_counter()
+        listener.start()
+        listener.stop()             # Attende che il listener abbia scritto tutto
+        scrittura = (time.perf_counter() - t0) / k
+        listener.start()
+        limite.massimo = RIPETIZIONI_MAX
+        risultati += [
+            ("log.debug disattivato", _per_chiamata(disattivato, n)),
+            ("log.warning soppresso", _per_chiamata(lambda i: log.warning("Ripetuto %s", e), n)),
+        ]
+        print(f"Costo per chiamata nel thread chiamante ({n} chiamate):")
+        for nome, t in risultati:
+            print(f"  {nome:30s} {t * 1e6:7.2f} µs")
+        print(f"  (scrittura su file nel thread del listener: {scrittura * 1e6:.2f} µs per evento)")
+
+        # Quattro thread insieme: print serializza sul file, il log solo sulla coda
+        m = 2000
+        limite.massimo = float("inf")
+        t_print = _concorrente(con_print, m)
+        t_log = _concorrente(con_log, m)
+        print(f"4 thread x {m} messaggi: print {t_print * 1000:.1f} ms, log {t_log * 1000:.1f} ms")
+
+        # Console lenta: print aspetta la console nel thread che scrive, il log solo la coda
+        lenta = _ConsoleLenta(console_us)
+        terminale = _Console(lenta)
+        terminale.setFormatter(FormatoConsole())
+        listener.stop()
+        listener.handlers += (terminale,)
+        listener.start()
+        riga = _per_chiamata(lambda i: lenta.write("x\n"), 200)
+
+        def print_lenta(i):
+            print(f"[parse error] {e} #{i}", file=lenta)
+
+        m = 1000
+        singolo = [_per_chiamata(print_lenta, m), _per_chiamata(con_log, m)]
+        listener.stop()
+        listener.start()
+        t_print = _concorrente(print_lenta, m)
+        t0 = time.perf_counter()
+        t_log = _concorrente(con_log, m)
+        listener.stop()             # Fino all'ultima riga sulla console
+        t_svuotata = time.perf_counter() - t0
+        print(f"Console lenta simulata ({console_us} µs richiesti, {riga * 1e6:.0f} µs misurati per riga):")
+        print(f"  1 thread, per chiamata: print {singolo[0] * 1e6:.1f} µs, log {singolo[1] * 1e6:.1f} µs")
+        print(f"  4 thread x {m} messaggi: print {t_print * 1000:.1f} ms, log {t_log * 1000:.1f} ms "
+              f"(console aggiornata dopo {t_svuotata * 1000:.1f} ms)")
+        listener.handlers = listener.handlers[:-1]
+        shutdown()
+        console.close()
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        us = sys.argv[sys.argv.index("--console-us") + 1] if "--console-us" in sys.argv else CONSOLE_US
+        bench(console_us=float(us))
+    else:
+        print(__doc__)
@@ -0,0 +1,511 @@
+"""
+Luoghi noti: dove iniziano e finiscono i viaggi e dove si è ricaricato.
+
+Un indice a griglia (celle di CELLA_GRADI) raggruppa in un unico luogo i
+punti entro RAGGIO_M; ogni luogo conta partenze, arrivi e ricariche, e per
+ogni coppia origine → destinazione si tengono gli accumulatori dei viaggi
+(km, Wh, punti di carica). Le domande della pipeline costano poche decine
+di µs anche con decine di migliaia di luoghi:
+- ricarica_vicina(lat, lon): il punto di ricarica noto più vicino
+- consumo_verso(lat, lon, da): consumo tipico per arrivare lì (da lì, se noto)
+
+La pipeline lo aggiorna a ogni ciclo con la posizione delle righe STATS e la
+carica di 0x638: una ricarica è la carica che sale di SOGLIA_RICARICA punti
+con l'auto ferma, oppure tra la fine di un viaggio e l'inizio del successivo.
+L'indice è salvato in logtrip/luoghi.json a ogni fine viaggio e si può
+ricostruire dalle tracce registrate (logtrip/tracks e logtrip/tracce):
+    python luoghi.py --ricostruisci
+    python luoghi.py --ricarica 45.07 7.68
+    python luoghi.py --verso 45.11 7.64 [--da 45.07 7.68]
+    python luoghi.py --bench
+"""
+
+import os
+import json
+import math
+import time
+import glob
+import argparse
+from collections import namedtuple
+
+import logconfig
+from guessometer import TRACCE_DIR, PACCO_WH
+
+log = logconfig.get("luoghi")
+
+INDICE_PATH = "logtrip/luoghi.json"
+CELLA_GRADI = 0.01          # Lato della cella (~1,1 km in latitudine, ~0,8 km in longitudine a 45°)
+RAGGIO_M = 200              # Punti più vicini di così sono lo stesso luogo (parcheggi diversi dello stesso posto)
+SOGLIA_RICARICA = 2         # Punti di carica in più per contare una ricarica (1 punto può essere recupero)
+FERMO_KM = 0.02             # Trip km in più tra due cicli sotto cui l'auto è ferma
+SCANSIONE_MAX = 256         # Fino a tante ricariche note la lista si scorre tutta (più veloce della griglia)
+ANELLI_MAX = 8              # Anelli di celle esplorati prima di ripiegare sulla lista
+M_GRADO = math.pi * 6371000 / 180
+TOLLERANZA_FIX_S = 30       # Ricostruzione: un campione senza fix entro questo tempo non ha posizione
+
+Consumo = namedtuple("Consumo", "viaggi km wh wh_km percento da_origine")
+
+
+def distanza_m(lat1, lon1, lat2, lon2):
+    """Distanza equirettangolare in metri (errore trascurabile sotto le decine di km)"""
+    dx = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) * 0.5))
+    return math.hypot(lat2 - lat1, dx) * M_GRADO
+
+
+class IndiceLuoghi:
+    """Luoghi in una griglia (cella → id dei luoghi); un solo scrittore, il thread della pipeline"""
+
+    def __init__(self, path=INDICE_PATH, cella=CELLA_GRADI, raggio=RAGGIO_M):
+        self.path = path
+        self.cella = cella
+        self.raggio = raggio
+        self.luoghi = []            # {"lat", "lon", "visite", "partenze", "arrivi", "ricariche", "ultimo"}
+        self.griglia = {}           # (riga, colonna) → [id]
+        self.ricariche = []         # id dei luoghi con almeno una ricarica
+        self.griglia_ricariche = {}  # Come griglia, solo con i luoghi in self.ricariche
+        self.tratte = {}            # (origine, destinazione) → [viaggi, km, wh, percento]
+        self.arrivi = {}            # destinazione → [viaggi, km, wh, percento], da qualunque origine
+        self.ultimo = None          # Fine dell'ultimo viaggio: {"lat", "lon", "carica", "t"}
+
+        # Stato del viaggio in corso (non persistito)
+        self.origine = None
+        self.carica_partenza = None
+        self.km_fermo = None        # Trip km dell'ultimo ciclo, per riconoscere l'auto ferma
+        self.minimo_fermo = None    # Carica minima da quando l'auto è ferma
+        self.ricarica_contata = False
+
+    # -- Griglia -----------------------------------------------------------
+
+    def _cella(self, lat, lon):
+        return math.floor(lat / self.cella), math.floor(lon / self.cella)
+
+    def _vicini(self, lat, lon, anelli=1):
+        """id dei luoghi nelle celle entro `anelli` da quella del punto"""
+        r, c = self._cella(lat, lon)
+        griglia = self.griglia
+        for dr in range(-anelli, anelli + 1):
+            for dc in range(-anelli, anelli + 1):
+                yield from griglia.get((r + dr, c + dc), ())
+
+    def _piu_vicino(self, lat, lon, raggio):
+        """(id, distanza) del luogo più vicino entro raggio metri, o (None, raggio)"""
+        migliore, d_min = None, raggio
+        for i in self._vicini(lat, lon, 1 + int(raggio / (self.cella * M_GRADO * 0.5))):
+            luogo = self.luoghi[i]
+            d = distanza_m(lat, lon, luogo["lat"], luogo["lon"])
+            if d <= d_min:
+                migliore, d_min = i, d
+        return migliore, d_min
+
+    def _inserisci(self, i, griglia=None):
+        luogo = self.luoghi[i]
+        (self.griglia if griglia is None else griglia).setdefault(
+            self._cella(luogo["lat"], luogo["lon"]), []).append(i)
+
+    def luogo(self, lat, lon, t=None):
+        """id del luogo entro il raggio, creato se non c'è; la posizione è la media delle visite"""
+        i, _ = self._piu_vicino(lat, lon, self.raggio)
+        if i is None:
+            i = len(self.luoghi)
+            self.luoghi.append({"lat": lat, "lon": lon, "visite": 1, "partenze": 0, "arrivi": 0,
+                                "ricariche": 0, "ultimo": t})
+            self._inserisci(i)
+            return i
+        luogo = self.luoghi[i]
+        vecchia = self._cella(luogo["lat"], luogo["lon"])
+        n = luogo["visite"] = luogo["visite"] + 1
+        luogo["lat"] += (lat - luogo["lat"]) / n
+        luogo["lon"] += (lon - luogo["lon"]) / n
+        if t is not None:
+            luogo["ultimo"] = t
+        nuova = self._cella(luogo["lat"], luogo["lon"])
+        if nuova != vecchia:
+            for griglia in (self.griglia, self.griglia_ricariche) if luogo["ricariche"] else (self.griglia,):
+                griglia[vecchia].remove(i)
+                griglia.setdefault(nuova, []).append(i)
+        return i
+
+    # -- Eventi ------------------------------------------------------------
+
+    def partenza(self, lat, lon, carica, t=None):
+        """Inizio di un viaggio; se la carica è salita dalla fine del precedente lì si è ricaricato"""
+        i = self.luogo(lat, lon, t)
+        self.luoghi[i]["partenze"] += 1
+        if self.ultimo is not None and carica - self.ultimo["carica"] >= SOGLIA_RICARICA:
+            self.ricarica(self.ultimo["lat"], self.ultimo["lon"], t)
+        self.origine = i
+        self.carica_partenza = carica
+        self.km_fermo = None
+        return i
+
+    def ricarica(self, lat, lon, t=None):
+        i = self.luogo(lat, lon, t)
+        luogo = self.luoghi[i]
+        if luogo["ricariche"] == 0:
+            self.ricariche.append(i)
+            self._inserisci(i, self.griglia_ricariche)
+        luogo["ricariche"] += 1
+        return i
+
+    def campione(self, lat, lon, carica, trip_km, t=None):
+        """Un ciclo della pipeline: carica che sale di SOGLIA_RICARICA punti da fermi → ricarica"""
+        if self.km_fermo is None or trip_km - self.km_fermo > FERMO_KM:
+            self.minimo_fermo = carica
+            self.ricarica_contata = False
+        elif carica < self.minimo_fermo:
+            self.minimo_fermo = carica
+        elif not self.ricarica_contata and carica - self.minimo_fermo >= SOGLIA_RICARICA and lat is not None:
+            self.ricarica(lat, lon, t)
+            self.ricarica_contata = True
+        self.km_fermo = trip_km
+
+    def arrivo(self, lat, lon, carica, km, wh=None, t=None):
+        """Fine del viaggio partito con partenza(); wh None → dai punti di carica consumati"""
+        i = self.luogo(lat, lon, t)
+        self.luoghi[i]["arrivi"] += 1
+        if self.carica_partenza is not None:
+            percento = self.carica_partenza - carica
+            if wh is None:
+                wh = percento * PACCO_WH / 100
+            accumulatori = [self.arrivi.setdefault(i, [0, 0.0, 0.0, 0.0])]
+            if self.origine is not None:
+                accumulatori.append(self.tratte.setdefault((self.origine, i), [0, 0.0, 0.0, 0.0]))
+            for acc in accumulatori:
+                acc[0] += 1
+                acc[1] += km
+                acc[2] += wh
+                acc[3] += percento
+        self.ultimo = {"lat": lat, "lon": lon, "carica": carica, "t": t}
+        self.origine = None
+        self.carica_partenza = None
+        return i
+
+    # -- Domande -----------------------------------------------------------
+
+    def ricarica_vicina(self, lat, lon):
+        """(luogo, distanza in m) del punto di ricarica noto più vicino, o None"""
+        if not self.ricariche:
+            return None
+        migliore, d_min = None, math.inf
+        luoghi = self.luoghi
+        if len(self.ricariche) > SCANSIONE_MAX:
+            r, c = self._cella(lat, lon)
+            lato_m = self.cella * M_GRADO * math.cos(math.radians(min(abs(lat), 89.0)))   # Lato minore della cella
+            griglia = self.griglia_ricariche
+            for k in range(ANELLI_MAX + 1):
+                # Anello k: celle a distanza di Chebyshev esattamente k
+                for dr in range(-k, k + 1):
+                    for dc in range(-k, k + 1, 1 if abs(dr) == k else 2 * k):
+                        for i in griglia.get((r + dr, c + dc), ()):
+                            luogo = luoghi[i]
+                            d = distanza_m(lat, lon, luogo["lat"], luogo["lon"])
+                            if d < d_min:
+                                migliore, d_min = i, d
+                if migliore is not None and d_min <= k * lato_m:
+                    return luoghi[migliore], d_min      # Gli anelli successivi sono tutti più lontani
+        for i in self.ricariche:
+            luogo = luoghi[i]
+            d = distanza_m(lat, lon, luogo["lat"], luogo["lon"])
+            if d < d_min:
+                migliore, d_min = i, d
+        return luoghi[migliore], d_min
+
+    def consumo_verso(self, lat, lon, da=None):
+        """
+        Consumo medio dei viaggi passati finiti entro il raggio di (lat, lon):
+        solo quelli partiti vicino a da=(lat, lon) se ce ne sono. None se la
+        destinazione non è nota.
+        """
+        destinazione, _ = self._piu_vicino(lat, lon, self.raggio)
+        if destinazione is None:
+            return None
+        acc, da_origine = None, False
+        if da is not None:
+            origine, _ = self._piu_vicino(da[0], da[1], self.raggio)
+            acc = self.tratte.get((origine, destinazione)) if origine is not None else None
+            da_origine = acc is not None
+        if acc is None:
+            acc = self.arrivi.get(destinazione)
+        if acc is None:
+            return None
+        n, km, wh, percento = acc
+        return Consumo(n, km / n, wh / n, wh / km if km > 0 else None, percento / n, da_origine)
+
+    def __len__(self):
+        return len(self.luoghi)
+
+    # -- Persistenza -------------------------------------------------------
+
+    def salva(self, path=None):
+        path = path or self.path
+        documento = {
+            "cella": self.cella,
+            "raggio": self.raggio,
+            "luoghi": self.luoghi,
+            "tratte": [[o, d, *acc] for (o, d), acc in self.tratte.items()],
+            "arrivi": [[d, *acc] for d, acc in self.arrivi.items()],
+            "ultimo": self.ultimo,
+        }
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(documento, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.error("Indice dei luoghi non salvato: %s", e)
+
+    @classmethod
+    def carica(cls, path=INDICE_PATH):
+        """Indice salvato in path, vuoto se manca o non è leggibile"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                documento = json.load(f)
+        except (OSError, ValueError):
+            return cls(path)
+        indice = cls(path, documento.get("cella", CELLA_GRADI), documento.get("raggio", RAGGIO_M))
+        indice.luoghi = documento["luoghi"]
+        for i, luogo in enumerate(indice.luoghi):
+            indice._inserisci(i)
+            if luogo["ricariche"]:
+                indice.ricariche.append(i)
+                indice._inserisci(i, indice.griglia_ricariche)
+        indice.tratte = {(o, d): acc for o, d, *acc in documento["tratte"]}
+        indice.arrivi = {d: acc for d, *acc in documento["arrivi"]}
+        indice.ultimo = documento.get("ultimo")
+        return indice
+
+
+# ---------------------------------------------------------------------------
+# Ricostruzione dalle tracce registrate
+
+def _carica_viaggi(cartella):
+    """(t, carica, trip_km, wh) di ogni CSV del RegistroTraccia, in ordine di inizio"""
+    from efficienza import carica_traccia
+    viaggi = []
+    for path in glob.glob(os.path.join(cartella, "trip_*.csv")):
+        traccia = carica_traccia(path)
+        if traccia is not None:
+            viaggi.append(traccia[:4])
+    viaggi.sort(key=lambda v: v[0][0])
+    return viaggi
+
+
+def viaggi_con_posizione(tracks_dir=None, tracce_dir=TRACCE_DIR):
+    """
+    Campioni dei viaggi registrati con la posizione presa dai fix di
+    logtrip/tracks (vettoriale: ricerca binaria sull'ora di tutti i campioni
+    in un colpo). Restituisce ([(t, carica, km, wh, lat, lon)], fix letti);
+    lat e lon sono nan dove nessun fix è entro TOLLERANZA_FIX_S.
+    """
+    import numpy as np
+    from trackstore import TRACKS_DIR, list_tracks, load_track
+
+    fix = []
+    for traccia in list_tracks(tracks_dir or TRACKS_DIR):
+        try:
+            t, lat, lon, _ = load_track(traccia)
+        except ValueError as e:
+            log.warning("Traccia %s saltata: %s", traccia, e)
+            continue
+        if len(t):
+            fix.append((t, lat, lon))
+    viaggi = _carica_viaggi(tracce_dir)
+    if not fix or not viaggi:
+        return [], 0
+    t_fix, lat_fix, lon_fix = (np.concatenate(x) for x in zip(*fix))
+    ordine = np.argsort(t_fix, kind="stable")
+    t_fix, lat_fix, lon_fix = t_fix[ordine], lat_fix[ordine], lon_fix[ordine]
+
+    t = np.concatenate([v[0] for v in viaggi])
+    j = np.clip(np.searchsorted(t_fix, t), 1, len(t_fix) - 1)
+    j -= (t - t_fix[j - 1]) < (t_fix[j] - t)
+    valida = np.abs(t_fix[j] - t) <= TOLLERANZA_FIX_S
+    lat = np.where(valida, lat_fix[j], np.nan)
+    lon = np.where(valida, lon_fix[j], np.nan)
+    confini = np.cumsum([0] + [len(v[0]) for v in viaggi])
+    return [(*v, lat[a:b], lon[a:b]) for v, a, b in zip(viaggi, confini[:-1], confini[1:])], len(t_fix)
+
+
+def ricostruisci(tracks_dir=None, tracce_dir=TRACCE_DIR, path=INDICE_PATH):
+    """Indice da zero con tutte le tracce: gli eventi passano agli stessi metodi usati in viaggio"""
+    import numpy as np
+
+    indice = IndiceLuoghi(path)
+    viaggi, n_fix = viaggi_con_posizione(tracks_dir, tracce_dir)
+    for tv, carica, km, wh, la, lo in viaggi:
+        con_fix = np.flatnonzero(~np.isnan(la))
+        if not len(con_fix):
+            continue
+        a, b = con_fix[0], con_fix[-1]
+        indice.partenza(la[a], lo[a], carica[a], tv[a])
+
+        # Ricariche da fermi: gruppi di campioni senza movimento, carica sopra il minimo del gruppo
+        gruppo = np.concatenate(([0], np.cumsum(np.diff(km) > FERMO_KM)))
+        sfalsata = carica - gruppo * 1000.0      # I gruppi successivi sono sempre più bassi: il minimo si azzera
+        sopra = (sfalsata - np.minimum.accumulate(sfalsata) >= SOGLIA_RICARICA) & ~np.isnan(la)
+        _, primi = np.unique(gruppo[sopra], return_index=True)
+        for i in np.flatnonzero(sopra)[primi]:
+            indice.ricarica(la[i], lo[i], tv[i])
+
+        indice.arrivo(la[b], lo[b], carica[b], km[b] - km[a], wh[b] - wh[a], tv[b])
+    return indice, n_fix
+
+
+# ---------------------------------------------------------------------------
+
+def _storico_sintetico(cartella, punti=1_000_000, seed=0):
+    """
+    Viaggi a 1 Hz tra una trentina di luoghi abituali (casa, lavoro, colonnine)
+    in un raggio di 30 km, scritti come tracce e CSV del RegistroTraccia.
+    Restituisce le colonnine (lat, lon) vere.
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    posti = np.column_stack((45.07 + rng.uniform(-0.27, 0.27, 30), 7.68 + rng.uniform(-0.38, 0.38, 30)))
+    colonnine = set(rng.choice(len(posti), 5, replace=False).tolist())
+    os.makedirs(os.path.join(cartella, "tracks"))
+    os.makedirs(os.path.join(cartella, "tracce"))
+    t, carica, dove, scritti, n = 1_750_000_000.0, 90.0, 0, 0, 0
+    while scritti < punti:
+        verso = int(rng.integers(len(posti)))
+        if verso == dove:
+            continue
+        a, b = posti[dove], posti[verso]
+        metri = distanza_m(*a, *b) * 1.3
+        passi = max(60, int(metri / 12))        # ~43 km/h
+        f = np.linspace(0, 1, passi)
+        lat = a[0] + (b[0] - a[0]) * f + rng.normal(0, 1e-5, passi)
+        lon = a[1] + (b[1] - a[1]) * f + rng.normal(0, 1e-5, passi)
+        tv = t + np.arange(passi)
+        km = f * metri / 1000
+        wh = km * rng.uniform(130, 200)
+        cv = np.round(carica - wh / PACCO_WH * 100)
+        nome = f"{n:05d}"
+        np.savetxt(os.path.join(cartella, "tracks", f"track_{nome}.csv"),
+                   np.column_stack((tv, lat, lon, np.full(passi, 12.0))),
+                   fmt=("%.1f", "%.7f", "%.7f", "%.2f"), delimiter=",", header="timestamp,lat,lon,velocita",
+                   comments="")
+        np.savetxt(os.path.join(cartella, "tracce", f"trip_{nome}.csv"),
+                   np.column_stack((tv, cv, km, np.full(passi, 43.0), wh, np.full(passi, np.nan))),
+                   fmt=("%.3f", "%d", "%.3f", "%.2f", "%.2f", "%.2f"), delimiter=",",
+                   header="timestamp,carica,trip_km,velocita_media,wh,recupero_wh", comments="")
+        carica -= wh[-1] / PACCO_WH * 100
+        if verso in colonnine and carica < 60:
+            carica = 95.0                       # Ricarica tra un viaggio e l'altro
+        t = tv[-1] + rng.uniform(600, 20000)
+        dove = verso
+        scritti += passi
+        n += 1
+    return [tuple(posti[i]) for i in sorted(colonnine)], scritti, n
+
+
+def _percentili_us(funzione, domande):
+    import numpy as np
+    tempi = np.empty(len(domande))
+    for k, d in enumerate(domande):
+        t0 = time.perf_counter()
+        funzione(*d)
+        tempi[k] = time.perf_counter() - t0
+    return np.percentile(tempi, 50) * 1e6, np.percentile(tempi, 99) * 1e6, tempi.max() * 1e6
+
+
+def bench(punti=1_000_000, luoghi_extra=50_000):
+    """Ricostruzione da un milione di fix, costo per ciclo in viaggio e latenza delle domande"""
+    import tempfile
+    import numpy as np
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        colonnine, scritti, viaggi = _storico_sintetico(tmp, punti)
+        print(f"Storico sintetico: {viaggi} viaggi, {scritti} fix ({time.perf_counter() - t0:.1f} s per scriverlo)")
+        t0 = time.perf_counter()
+        indice, n_fix = ricostruisci(os.path.join(tmp, "tracks"), os.path.join(tmp, "tracce"),
+                                     os.path.join(tmp, "luoghi.json"))
+        durata = time.perf_counter() - t0
+        print(f"Ricostruzione: {durata:.2f} s ({n_fix / durata / 1e6:.2f} M fix/s), {len(indice)} luoghi, "
+              f"{len(indice.ricariche)} con ricariche, {len(indice.tratte)} tratte")
+        trovate = sum(any(distanza_m(*c, indice.luoghi[i]["lat"], indice.luoghi[i]["lon"]) < RAGGIO_M
+                          for i in indice.ricariche) for c in colonnine)
+        print(f"  colonnine riconosciute {trovate}/{len(colonnine)}")
+        t0 = time.perf_counter()
+        indice.salva()
+        salvataggio = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        ricaricato = IndiceLuoghi.carica(indice.path)
+        print(f"  salvataggio {salvataggio * 1000:.1f} ms, caricamento {(time.perf_counter() - t0) * 1000:.1f} ms "
+              f"({os.path.getsize(indice.path) / 1024:.0f} KiB)")
+        assert len(ricaricato) == len(indice) and ricaricato.tratte == indice.tratte
+
+    # Costo in viaggio: un ciclo della pipeline
+    cicli = 200_000
+    t0 = time.perf_counter()
+    for k in range(cicli):
+        indice.campione(45.0 + k * 1e-6, 7.6, 80, k * 0.01, k)
+    print(f"\ncampione(): {(time.perf_counter() - t0) / cicli * 1e6:.2f} µs per ciclo della pipeline")
+
+    # Domande, con altri luoghi sparsi per avere una griglia densa come dopo anni di uso
+    rng = np.random.default_rng(1)
+    extra = list(zip((45.07 + rng.uniform(-1, 1, luoghi_extra)).tolist(),
+                     (7.68 + rng.uniform(-1.4, 1.4, luoghi_extra)).tolist()))
+    for lat, lon in extra:
+        indice.luogo(lat, lon)
+    domande = [(float(a), float(b)) for a, b in zip(45.07 + rng.uniform(-0.5, 0.5, 10_000),
+                                                    7.68 + rng.uniform(-0.7, 0.7, 10_000))]
+
+    def lineare(lat, lon):
+        return min(distanza_m(lat, lon, indice.luoghi[i]["lat"], indice.luoghi[i]["lon"]) for i in indice.ricariche)
+
+    print(f"Domande su {len(indice)} luoghi ({len(indice.griglia)} celle):")
+    for passo in (None, 10):
+        if passo:       # Molte ricariche (es. colonnine pubbliche usate): ricerca ad anelli sulla griglia
+            for lat, lon in extra[::passo]:
+                indice.ricarica(lat, lon)
+        p50, p99, massimo = _percentili_us(indice.ricarica_vicina, domande)
+        errate = sum(abs(indice.ricarica_vicina(*d)[1] - lineare(*d)) > 1e-6 for d in domande[:2000])
+        rif50, _, _ = _percentili_us(lineare, domande[:2000])
+        print(f"  ricarica_vicina con {len(indice.ricariche):5d} ricariche: p50 {p50:6.1f} µs  p99 {p99:6.1f} µs  "
+              f"max {massimo:7.1f} µs (scansione lineare p50 {rif50:7.1f} µs, risposte diverse {errate})")
+    destinazioni = [(indice.luoghi[d]["lat"], indice.luoghi[d]["lon"], (indice.luoghi[o]["lat"], indice.luoghi[o]["lon"]))
+                    for o, d in list(indice.tratte)[:2000]]
+    p50, p99, massimo = _percentili_us(indice.consumo_verso, destinazioni)
+    print(f"  consumo_verso    p50 {p50:6.1f} µs  p99 {p99:6.1f} µs  max {massimo:7.1f} µs")
+    esempio = indice.consumo_verso(*destinazioni[0])
+    print(f"  es. {esempio.viaggi} viaggi, {esempio.km:.1f} km, {esempio.wh_km:.0f} Wh/km, "
+          f"{esempio.percento:.1f}% a viaggio")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Indice dei luoghi di partenza, arrivo e ricarica")
+    parser.add_argument("--indice", default=INDICE_PATH)
+    parser.add_argument("--ricostruisci", action="store_true", help="da logtrip/tracks e logtrip/tracce")
+    parser.add_argument("--ricarica", nargs=2, type=float, metavar=("LAT", "LON"))
+    parser.add_argument("--verso", nargs=2, type=float, metavar=("LAT", "LON"))
+    parser.add_argument("--da", nargs=2, type=float, metavar=("LAT", "LON"))
+    parser.add_argument("--bench", action="store_true")
+    args = parser.parse_args(argv)
+    if args.bench:
+        bench()
+        return
+    if args.ricostruisci:
+        indice, n_fix = ricostruisci(path=args.indice)
+        indice.salva()
+        print(f"{len(indice)} luoghi da {n_fix} fix, {len(indice.ricariche)} con ricariche → {args.indice}")
+    else:
+        indice = IndiceLuoghi.carica(args.indice)
+    if args.ricarica:
+        trovata = indice.ricarica_vicina(*args.ricarica)
+        print("Nessuna ricarica nota" if trovata is None else
+              f"Ricarica a {trovata[1] / 1000:.2f} km: {trovata[0]['lat']:.5f}, {trovata[0]['lon']:.5f} "
+              f"({trovata[0]['ricariche']} ricariche)")
+    if args.verso:
+        consumo = indice.consumo_verso(*args.verso, da=args.da)
+        print("Destinazione mai raggiunta" if consumo is None else
+              f"{consumo.viaggi} viaggi{' da qui' if consumo.da_origine else ''}: {consumo.km:.1f} km, "
+              f"{consumo.wh:.0f} Wh, {consumo.percento:.1f}% di carica")
+    if not (args.ricostruisci or args.ricarica or args.verso):
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
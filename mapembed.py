@@ -0,0 +1,289 @@
+"""
+Avvio e incorporamento non bloccante dell'app di navigazione nella tab Mappa.
+
+La ricerca della finestra è una macchina a stati guidata da un QTimer: ad
+ogni tick si fa una sola scansione delle finestre e si torna subito al loop
+degli eventi, invece di ciclare con time.sleep() sul thread della UI.
+Il processo è posseduto direttamente (QProcess) e viene chiuso per handle.
+
+La parte specifica di Windows sta dietro WindowFinder; FakeWindowFinder
+permette di provare tutto su Linux:
+    python mapembed.py --bench
+"""
+
+import os
+import sys
+import time
+import shlex
+from abc import ABC, abstractmethod
+
+from PyQt5.QtCore import QObject, QProcess, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QWidget, QLabel
+
+import logconfig
+
+MAP_EXE = os.environ.get("BLUECAR_MAP_EXE", "mspaint.exe")
+POLL_MS = 150
+FIND_TIMEOUT_MS = 5000
+
+
+class WindowFinder(ABC):
+    """Interfaccia: trova la finestra di un processo e la incapsula in un QWidget"""
+
+    @abstractmethod
+    def find(self, pid):
+        """Una sola scansione, non bloccante: restituisce l'handle o None"""
+
+    @abstractmethod
+    def wrap(self, handle):
+        """Restituisce un QWidget che contiene la finestra esterna"""
+
+
+class Win32WindowFinder(WindowFinder):
+    """Ricerca tramite EnumWindows e incorporamento con QWindow.fromWinId"""
+
+    def __init__(self):
+        import win32gui
+        import win32process
+        self.win32gui = win32gui
+        self.win32process = win32process
+
+    def find(self, pid):
+        found = []
+
+        def enum_cb(hwnd, _):
+            try:
+                if not self.win32gui.IsWindowVisible(hwnd):
+                    return
+                _, wid_pid = self.win32process.GetWindowThreadProcessId(hwnd)
+                if wid_pid == pid:
+                    found.append(hwnd)
+            except Exception:
+                pass
+
+        try:
+            self.win32gui.EnumWindows(enum_cb, None)
+        except Exception:
+            pass
+        return found[0] if found else None
+
+    def wrap(self, handle):
+        from PyQt5.QtGui import QWindow
+        app_window = QWindow.fromWinId(handle)
+        return QWidget.createWindowContainer(app_window)
+
+
+class FakeWindowFinder(WindowFinder):
+    """Finestra "trovata" dopo un ritardo, con costo di scansione simulato"""
+
+    def __init__(self, delay=1.0, scan_cost=0.002):
+        self.delay = delay
+        self.scan_cost = scan_cost
+        self.visti = {}
+
+    def find(self, pid):
+        adesso = time.perf_counter()
+        self.visti.setdefault(pid, adesso)
+        time.sleep(self.scan_cost)
+        return pid if adesso - self.visti[pid] >= self.delay else None
+
+    def wrap(self, handle):
+        return QLabel(f"Finestra finta del processo {handle}")
+
+
+def default_finder():
+    """Win32WindowFinder se pywin32 è disponibile, altrimenti None (niente embedding)"""
+    try:
+        return Win32WindowFinder()
+    except Exception:
+        return None
+
+
+class StallMeter(QObject):
+    """
+    Misura i blocchi del thread della UI: un timer ogni `tick_ms` registra
+    il ritardo rispetto al tick atteso.
+    """
+
+    def __init__(self, parent=None, tick_ms=10):
+        super().__init__(parent)
+        self.tick_ms = tick_ms
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._tick)
+        self.reset()
+
+    def reset(self):
+        self.ultimo = time.perf_counter()
+        self.max_ms = 0.0
+        self.totale_ms = 0.0
+
+    def start(self):
+        self.reset()
+        self.timer.start(self.tick_ms)
+
+    def stop(self):
+        self.timer.stop()
+        self._tick()
+
+    def _tick(self):
+        adesso = time.perf_counter()
+        ritardo = (adesso - self.ultimo) * 1000 - self.tick_ms
+        self.ultimo = adesso
+        if ritardo > 0:
+            self.max_ms = max(self.max_ms, ritardo)
+            self.totale_ms += ritardo
+
+
+class WindowEmbedder(QObject):
+    """
+    Macchina a stati: fermo → avvio → ricerca → incorporata | fallita.
+    Emette window_ready(QWidget) sul thread della UI quando la finestra è pronta.
+    """
+
+    state_changed = pyqtSignal(str)
+    window_ready = pyqtSignal(QWidget)
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None, finder=None, poll_ms=POLL_MS, timeout_ms=FIND_TIMEOUT_MS,
+                 instrument=False):
+        super().__init__(parent)
+        self.finder = finder
+        self.poll_ms = poll_ms
+        self.timeout_ms = timeout_ms
+        self.process = None
+        self.stato = "fermo"
+        self.t_avvio = None
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self._poll)
+        self.stall = StallMeter(self) if instrument else None
+
+    def _set_state(self, stato):
+        self.stato = stato
+        self.state_changed.emit(stato)
+
+    def start(self, cmd=MAP_EXE):
+        """Avvia il processo (chiudendo quello precedente) e cerca la sua finestra"""
+        self.close()
+        argv = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+        self.process = QProcess(self)
+        self.process.started.connect(self._on_started)
+        self.process.errorOccurred.connect(self._on_error)
+        self.process.finished.connect(self._on_finished)
+        self.t_avvio = time.perf_counter()
+        if self.stall is not None:
+            self.stall.start()
+        self._set_state("avvio")
+        self.process.start(argv[0], argv[1:])
+
+    def _on_started(self):
+        if self.finder is None:
+            # Nessun embedding possibile: l'app resta in una finestra propria
+            self._finish("incorporata")
+            return
+        self._set_state("ricerca")
+        self.poll_timer.start(self.poll_ms)
+
+    def _poll(self):
+        if self.process is None:
+            self.poll_timer.stop()
+            return
+        pid = int(self.process.processId())
+        handle = self.finder.find(pid) if pid else None
+        if handle:
+            self.poll_timer.stop()
+            try:
+                widget = self.finder.wrap(handle)
+            except Exception as e:
+                self._fail(f"incorporamento fallito: {e}")
+                return
+            self._finish("incorporata")
+            self.window_ready.emit(widget)
+        elif (time.perf_counter() - self.t_avvio) * 1000 > self.timeout_ms:
+            self._fail("finestra non trovata")
+
+    def _on_error(self, error):
+        if error == QProcess.FailedToStart:
+            self._fail("avvio del processo fallito")
+
+    def _on_finished(self, *_):
+        if self.stato in ("avvio", "ricerca"):
+            self._fail("processo terminato prima di mostrare la finestra")
+        else:
+            self._set_state("fermo")
+
+    def _fail(self, motivo):
+        self.poll_timer.stop()
+        self._finish("fallita")
+        self.failed.emit(motivo)
+
+    def _finish(self, stato):
+        self._set_state(stato)
+        if self.stall is not None:
+            self.stall.stop()
+            logconfig.get("gui").info("Avvio mappa: %s in %.0f ms, stallo UI max %.1f ms, totale %.1f ms",
+                                      stato, (time.perf_counter() - self.t_avvio) * 1000,
+                                      self.stall.max_ms, self.stall.totale_ms)
+
+    def close(self):
+        """Chiude il processo posseduto, senza scansionare la tabella dei processi"""
+        self.poll_timer.stop()
+        process, self.process = self.process, None
+        if process is not None:
+            process.finished.disconnect(self._on_finished)
+            process.errorOccurred.disconnect(self._on_error)
+            process.kill()
+            process.waitForFinished(1000)
+            process.deleteLater()
+        if self.stato != "fermo":
+            self._set_state("fermo")
+
+
+def find_blocking(finder, pid, timeout=5.0):
+    """Vecchio algoritmo (ciclo con sleep sul thread della UI), solo per confronto"""
+    end = time.time() + timeout
+    while time.time() < end:
+        handle = finder.find(pid)
+        if handle:
+            return handle
+        time.sleep(0.15)
+    return None
+
+
+def bench(delay=1.0):
+    """Stallo della UI durante l'avvio della mappa: vecchio ciclo bloccante vs macchina a stati"""
+    from PyQt5.QtCore import QEventLoop
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    cmd = [sys.executable, "-c", "import time; time.sleep(60)"]
+
+    # Prima: ricerca bloccante sul thread della UI
+    meter = StallMeter()
+    meter.start()
+    t0 = time.perf_counter()
+    find_blocking(FakeWindowFinder(delay), 1234)
+    QApplication.processEvents()
+    meter.stop()
+    print(f"Bloccante : {(time.perf_counter() - t0) * 1000:.0f} ms, "
+          f"stallo UI max {meter.max_ms:.1f} ms")
+
+    # Dopo: macchina a stati
+    embedder = WindowEmbedder(finder=FakeWindowFinder(delay), instrument=True)
+    loop = QEventLoop()
+    embedder.window_ready.connect(lambda _: loop.quit())
+    embedder.failed.connect(lambda _: loop.quit())
+    t0 = time.perf_counter()
+    embedder.start(cmd)
+    loop.exec_()
+    # Il resoconto di _finish va nel log, che qui non è configurato: si stampa da embedder.stall
+    print(f"Macchina a stati: {embedder.stato} in {(time.perf_counter() - t0) * 1000:.0f} ms, "
+          f"stallo UI max {embedder.stall.max_ms:.1f} ms, totale {embedder.stall.totale_ms:.1f} ms")
+    embedder.close()
+    del app
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        bench()
+    else:
+        print(__doc__)
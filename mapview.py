@@ -0,0 +1,447 @@
+"""
+Mappa nativa Qt per la tab Mappa, senza applicazioni esterne.
+
+Disegna le tile raster di un file MBTiles locale (con cache LRU di dimensione
+fissa) e la traccia live del GPSTracker. La traccia vive in un layer
+trasparente grande quanto la vista: ogni nuovo fix aggiunge un solo segmento
+al layer e invalida solo il suo rettangolo; gli aggiornamenti sono
+raggruppati e ridisegnati al massimo a 30 fps. Il layer viene ricostruito
+per intero solo quando la vista si sposta o cambia zoom.
+Le tracce salvate (show_stored) vengono disegnate con i punti del livello di
+dettaglio dello zoom corrente (tracksimplify.TrackLOD), non con tutti i fix,
+e solo con i segmenti che toccano la vista, uno per coppia di celle grandi
+quanto la penna: agli zoom alti il livello tiene ancora gran parte dei fix
+(rumore nelle soste compreso), ma i segmenti a schermo dipendono dai pixel.
+
+Benchmark offscreen (genera un MBTiles sintetico se non indicato), con una
+traccia salvata sintetica di N fix (0 per saltarla):
+    QT_QPA_PLATFORM=offscreen python mapview.py --bench [--mbtiles mappa.mbtiles] [--stored N]
+"""
+
+import os
+import sys
+import time
+import math
+import sqlite3
+from collections import OrderedDict, deque
+
+import numpy as np
+from PyQt5.QtCore import Qt, QRect, QPointF, QLineF, QTimer
+from PyQt5.QtGui import QPainter, QPen, QColor, QImage, QPainterPath
+from PyQt5.QtWidgets import QWidget
+
+import logconfig
+from tracksimplify import R_TERRA, mercator
+
+log = logconfig.get("mapview")
+
+MBTILES_PATH = "maps/bluecar.mbtiles"
+TILE = 256
+FPS = 30
+CACHE_TILES = 96          # 96 tile 256x256 ARGB ≈ 24 MB
+MAX_TRACK = 20000         # Punti della traccia live tenuti in memoria
+
+
+def lonlat_to_world(lon, lat, zoom):
+    """Coordinate Web Mercator in pixel del mondo al livello di zoom indicato"""
+    scala = TILE * (1 << zoom)
+    x = (lon + 180.0) / 360.0 * scala
+    s = math.sin(math.radians(max(-85.0511, min(85.0511, lat))))
+    y = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * scala
+    return x, y
+
+
+class MBTilesSource:
+    """Lettura delle tile raster (PNG/JPEG) da un file MBTiles"""
+
+    def __init__(self, path=MBTILES_PATH):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        meta = dict(self.db.execute("SELECT name, value FROM metadata").fetchall())
+        self.formato = meta.get("format", "png")
+        self.minzoom = int(meta.get("minzoom", 0))
+        self.maxzoom = int(meta.get("maxzoom", 18))
+
+    def tile(self, z, x, y):
+        """Restituisce i byte della tile (schema XYZ) o None"""
+        tms_y = (1 << z) - 1 - y   # MBTiles usa lo schema TMS
+        riga = self.db.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+            (z, x, tms_y)).fetchone()
+        return riga[0] if riga else None
+
+    def close(self):
+        self.db.close()
+
+
+class TileCache:
+    """Cache LRU di QImage decodificate, con numero massimo di tile"""
+
+    def __init__(self, source, max_tiles=CACHE_TILES):
+        self.source = source
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self.hit = self.miss = 0
+
+    def get(self, z, x, y):
+        chiave = (z, x, y)
+        img = self.tiles.get(chiave)
+        if img is not None or chiave in self.tiles:
+            self.tiles.move_to_end(chiave)
+            self.hit += 1
+            return img
+        self.miss += 1
+        dati = self.source.tile(z, x, y) if self.source is not None else None
+        img = QImage.fromData(dati) if dati else None
+        if img is not None and img.isNull():
+            img = None
+        if img is not None:
+            img = img.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        self.tiles[chiave] = img
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return img
+
+    def memoria(self):
+        """Byte occupati dalle immagini in cache"""
+        return sum(img.byteCount() for img in self.tiles.values() if img is not None)
+
+
+class MapView(QWidget):
+    """Vista mappa con tile MBTiles e traccia GPS incrementale"""
+
+    def __init__(self, parent=None, mbtiles=MBTILES_PATH, zoom=15, follow=True):
+        super().__init__(parent)
+        source = None
+        if mbtiles and os.path.exists(mbtiles):
+            try:
+                source = MBTilesSource(mbtiles)
+            except sqlite3.Error as e:
+                log.error("Errore apertura MBTiles %s: %s", mbtiles, e)
+        self.cache = TileCache(source)
+        self.zoom = zoom
+        self.follow = follow
+        self.center = None          # (x, y) pixel del mondo al centro della vista
+        self.track = deque(maxlen=MAX_TRACK)   # (lon, lat)
+        self.track_px = deque(maxlen=MAX_TRACK)
+        self.dirty = QRect()
+        self.frames = 0
+        self.pen = QPen(QColor(0, 204, 255), 4, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+        self.layer = None           # Traccia già disegnata, in coordinate schermo
+        self.stored = None          # (lat, lon, TrackLOD) di una traccia salvata
+        self.stored_px = None       # (zoom, x, y) pixel del mondo del livello LOD di quello zoom
+        self.stored_pen = QPen(QColor(255, 170, 0, 180), 3, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self.frame_timer = QTimer(self)
+        self.frame_timer.timeout.connect(self._flush)
+        self.frame_timer.start(int(1000 / FPS))
+
+    # -- Coordinate --------------------------------------------------------
+
+    def to_screen(self, wx, wy):
+        cx, cy = self.center
+        return wx - cx + self.width() / 2, wy - cy + self.height() / 2
+
+    def set_zoom(self, zoom):
+        self.zoom = zoom
+        self.track_px = deque((lonlat_to_world(lon, lat, zoom) for lon, lat in self.track),
+                              maxlen=MAX_TRACK)
+        if self.track_px:
+            self.center = self.track_px[-1]
+        self.invalidate()
+
+    def invalidate(self):
+        """Ridisegno completo al prossimo frame (spostamento, zoom, resize)"""
+        self.layer = None
+        self.dirty = self.rect()
+
+    def resizeEvent(self, event):
+        self.invalidate()
+        super().resizeEvent(event)
+
+    # -- Dati --------------------------------------------------------------
+
+    def add_fix(self, lat, lon):
+        """Aggiunge un fix alla traccia invalidando solo la zona cambiata"""
+        p = lonlat_to_world(lon, lat, self.zoom)
+        self.track.append((lon, lat))
+        self.track_px.append(p)
+        if self.center is None:
+            self.center = p
+            self.invalidate()
+            return
+        if self.follow:
+            sx, sy = self.to_screen(*p)
+            margine = min(self.width(), self.height()) / 4
+            if not (margine < sx < self.width() - margine and margine < sy < self.height() - margine):
+                # Uscita dalla zona centrale: ricentra e ridisegna tutto
+                self.center = p
+                self.invalidate()
+                return
+        if len(self.track_px) >= 2 and self.layer is not None:
+            a = QPointF(*self.to_screen(*self.track_px[-2]))
+            b = QPointF(*self.to_screen(*p))
+            painter = QPainter(self.layer)
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(self.pen)
+            painter.drawLine(a, b)
+            painter.end()
+            # Segmento nuovo + vecchio e nuovo indicatore di posizione
+            w = 8
+            segmento = QRect(int(min(a.x(), b.x())) - w, int(min(a.y(), b.y())) - w,
+                             int(abs(a.x() - b.x())) + 2 * w, int(abs(a.y() - b.y())) + 2 * w)
+            self.dirty = self.dirty.united(segmento)
+
+    def clear_track(self):
+        self.track.clear()
+        self.track_px.clear()
+        self.invalidate()
+
+    def show_stored(self, lat, lon, lod):
+        """Mostra una traccia salvata (array NumPy) sotto quella live"""
+        self.stored = (lat, lon, lod) if len(lat) else None
+        self.stored_px = None
+        if self.stored is not None and self.center is None:
+            idx = lod.level(self.zoom)
+            self.center = lonlat_to_world(lon[idx[-1]], lat[idx[-1]], self.zoom)
+        self.invalidate()
+
+    def _flush(self):
+        """Ridisegna al massimo FPS volte al secondo solo la zona sporca"""
+        if not self.dirty.isEmpty():
+            self.update(self.dirty.intersected(self.rect()))
+            self.dirty = QRect()
+
+    # -- Disegno -----------------------------------------------------------
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        zona = event.rect()
+        painter.fillRect(zona, QColor(10, 15, 25))
+        if self.center is None:
+            painter.setPen(QColor(160, 160, 160))
+            painter.drawText(self.rect(), Qt.AlignCenter, "In attesa del segnale GPS...")
+            painter.end()
+            return
+        if self.layer is None:
+            self._rebuild_layer()
+        painter.setClipRect(zona)
+        self._paint_tiles(painter, zona)
+        painter.drawImage(zona, self.layer, zona)
+        self._paint_position(painter)
+        painter.end()
+        self.frames += 1
+
+    def _paint_tiles(self, painter, zona):
+        cx, cy = self.center
+        ox, oy = cx - self.width() / 2, cy - self.height() / 2
+        n = 1 << self.zoom
+        x0 = int((ox + zona.left()) // TILE)
+        x1 = int((ox + zona.right()) // TILE)
+        y0 = int((oy + zona.top()) // TILE)
+        y1 = int((oy + zona.bottom()) // TILE)
+        for ty in range(max(0, y0), min(n - 1, y1) + 1):
+            for tx in range(x0, x1 + 1):
+                img = self.cache.get(self.zoom, tx % n, ty)
+                if img is not None:
+                    painter.drawImage(QPointF(tx * TILE - ox, ty * TILE - oy), img)
+
+    def _rebuild_layer(self):
+        """Ridisegna tutta la traccia nel layer (solo dopo spostamenti o zoom)"""
+        self.layer = QImage(self.size(), QImage.Format_ARGB32_Premultiplied)
+        self.layer.fill(Qt.transparent)
+        cx, cy = self.center
+        dx, dy = self.width() / 2 - cx, self.height() / 2 - cy
+        if self.stored is not None:
+            self._paint_stored(dx, dy)
+        if len(self.track_px) < 2:
+            return
+        path = QPainterPath()
+        primo = True
+        for wx, wy in self.track_px:
+            if primo:
+                path.moveTo(wx + dx, wy + dy)
+                primo = False
+            else:
+                path.lineTo(wx + dx, wy + dy)
+        painter = QPainter(self.layer)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(self.pen)
+        painter.drawPath(path)
+        painter.end()
+
+    def _stored_world(self):
+        """Pixel del mondo dei punti LOD della traccia salvata (una volta per zoom)"""
+        if self.stored_px is None or self.stored_px[0] != self.zoom:
+            lat, lon, lod = self.stored
+            idx = lod.level(self.zoom)
+            x, y = mercator(lat[idx], lon[idx])
+            scala = TILE * (1 << self.zoom) / (2 * math.pi * R_TERRA)
+            self.stored_px = (self.zoom, (x + math.pi * R_TERRA) * scala,
+                              (math.pi * R_TERRA - y) * scala)
+        return self.stored_px[1], self.stored_px[2]
+
+    def _paint_stored(self, dx, dy):
+        """
+        Disegna solo i segmenti del livello LOD il cui rettangolo tocca la vista,
+        uno per coppia di celle della penna; restituisce i segmenti disegnati
+        """
+        wx, wy = self._stored_world()
+        if len(wx) < 2:
+            return 0
+        m = self.stored_pen.widthF()
+        x0, y0 = -dx - m, -dy - m
+        x1, y1 = x0 + self.width() + 2 * m, y0 + self.height() + 2 * m
+        ax, bx, ay, by = wx[:-1], wx[1:], wy[:-1], wy[1:]
+        segmenti = np.flatnonzero((np.minimum(ax, bx) <= x1) & (np.maximum(ax, bx) >= x0) &
+                                  (np.minimum(ay, by) <= y1) & (np.maximum(ay, by) >= y0))
+        if not len(segmenti):
+            return 0
+        # Un segmento per coppia di celle grandi quanto la penna: il livello LOD
+        # tiene il rumore del GPS nelle soste, che ripassa migliaia di volte sugli
+        # stessi pixel. Solo per i segmenti con entrambi gli estremi nella vista:
+        # quelli che ne escono si disegnano sempre
+        colonne = int((x1 - x0) // m) + 1
+        righe = int((y1 - y0) // m) + 1
+        ia = ((wx[segmenti] - x0) // m).astype(np.int64)
+        ja = ((wy[segmenti] - y0) // m).astype(np.int64)
+        ib = ((wx[segmenti + 1] - x0) // m).astype(np.int64)
+        jb = ((wy[segmenti + 1] - y0) // m).astype(np.int64)
+        dentro = ((ia >= 0) & (ia < colonne) & (ja >= 0) & (ja < righe) &
+                  (ib >= 0) & (ib < colonne) & (jb >= 0) & (jb < righe))
+        celle = colonne * righe
+        ca = ia[dentro] * righe + ja[dentro]
+        cb = ib[dentro] * righe + jb[dentro]
+        _, primi = np.unique(np.minimum(ca, cb) * celle + np.maximum(ca, cb), return_index=True)
+        segmenti = np.sort(np.concatenate((segmenti[dentro][primi], segmenti[~dentro])))
+        # Segmenti separati e non un unico QPainterPath: il contorno di un percorso
+        # che si sovrappone a se stesso costa molto più di tanti tratti semplici
+        linee = [QLineF(xa, ya, xb, yb) for xa, ya, xb, yb in
+                 zip((wx[segmenti] + dx).tolist(), (wy[segmenti] + dy).tolist(),
+                     (wx[segmenti + 1] + dx).tolist(), (wy[segmenti + 1] + dy).tolist())]
+        painter = QPainter(self.layer)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(self.stored_pen)
+        painter.drawLines(linee)
+        painter.end()
+        return len(segmenti)
+
+    def _paint_position(self, painter):
+        ultimo = QPointF(*self.to_screen(*self.track_px[-1])) if self.track_px else None
+        if ultimo is None:
+            return
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setBrush(QColor(0, 255, 136))
+        painter.setPen(Qt.NoPen)
+        painter.drawEllipse(ultimo, 6, 6)
+
+
+def crea_mbtiles_sintetico(path, zoom, x0, y0, n=8):
+    """MBTiles con n×n tile PNG colorate, per il benchmark"""
+    from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    db.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+               "tile_row INTEGER, tile_data BLOB)")
+    db.executemany("INSERT INTO metadata VALUES (?, ?)",
+                   [("format", "png"), ("minzoom", str(zoom)), ("maxzoom", str(zoom))])
+    for i in range(n):
+        for j in range(n):
+            img = QImage(TILE, TILE, QImage.Format_RGB32)
+            img.fill(QColor(30 + 10 * i, 40 + 10 * j, 60))
+            dati = QByteArray()
+            buf = QBuffer(dati)
+            buf.open(QIODevice.WriteOnly)
+            img.save(buf, "PNG")
+            x, y = x0 + i, y0 + j
+            db.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                       (zoom, x, (1 << zoom) - 1 - y, bytes(dati)))
+    db.commit()
+    db.close()
+
+
+def bench(mbtiles=None, fix=3000, stored=1_000_000):
+    """Tempo di disegno per frame, pieno e incrementale, e memoria della cache"""
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    lat, lon, zoom = 45.07, 7.68, 15
+    if mbtiles is None:
+        mbtiles = os.path.join("cache", "bench.mbtiles")
+        os.makedirs("cache", exist_ok=True)
+        wx, wy = lonlat_to_world(lon, lat, zoom)
+        crea_mbtiles_sintetico(mbtiles, zoom, int(wx // TILE) - 4, int(wy // TILE) - 4)
+
+    view = MapView(mbtiles=mbtiles, zoom=zoom)
+    view.frame_timer.stop()
+    view.resize(800, 480)
+    view.show()
+    QApplication.processEvents()
+
+    view.add_fix(lat, lon)
+    view.repaint()
+
+    tempi = []
+    for i in range(fix):
+        # Giro circolare di ~300 m di raggio
+        a = i / fix * 2 * math.pi
+        view.add_fix(lat + 0.0027 * math.sin(a), lon + 0.0038 * (1 - math.cos(a)))
+        if not view.dirty.isEmpty():
+            t0 = time.perf_counter()
+            view.repaint(view.dirty.intersected(view.rect()))
+            tempi.append(time.perf_counter() - t0)
+            view.dirty = QRect()
+    # Frame completo con tutta la traccia (ricostruzione del layer compresa)
+    t0 = time.perf_counter()
+    for _ in range(30):
+        view.invalidate()
+        view.repaint()
+    pieno = (time.perf_counter() - t0) / 30
+
+    tempi.sort()
+    media = sum(tempi) / len(tempi) if tempi else 0.0
+    print(f"Frame completo 800x480 : {pieno * 1000:7.2f} ms ({1 / pieno:6.0f} fps max)")
+    print(f"Frame incrementale     : media {media * 1000:6.3f} ms, "
+          f"p99 {tempi[int(len(tempi) * 0.99)] * 1000 if tempi else 0:6.3f} ms su {len(tempi)} fix")
+    print(f"Cache tile             : {len(view.cache.tiles)} tile, "
+          f"{view.cache.memoria() / 1e6:.1f} MB, hit {view.cache.hit} miss {view.cache.miss}")
+    print(f"Punti traccia          : {len(view.track)} (max {MAX_TRACK})")
+
+    if stored:
+        from tracksimplify import TrackLOD, traccia_sintetica
+        lat, lon = traccia_sintetica(stored)
+        lod = TrackLOD(lat, lon)
+        vista = MapView(mbtiles=mbtiles, zoom=zoom, follow=False)
+        vista.frame_timer.stop()
+        vista.resize(800, 480)
+        vista.show()
+        QApplication.processEvents()
+        vista.show_stored(lat, lon, lod)
+        centro = stored // 2
+        print(f"Traccia salvata di {stored} fix, vista 800x480 sul fix centrale:")
+        for z in range(12, 19):
+            vista.set_zoom(z)
+            vista.center = lonlat_to_world(lon[centro], lat[centro], z)
+            vista.invalidate()
+            vista.repaint()         # Prima volta: conversione del livello in pixel
+            t0 = time.perf_counter()
+            vista.invalidate()
+            vista.repaint()
+            t = time.perf_counter() - t0
+            cx, cy = vista.center
+            segmenti = vista._paint_stored(vista.width() / 2 - cx, vista.height() / 2 - cy)
+            print(f"  zoom {z:2d}: livello {len(lod.level(z)):7d} punti, {segmenti:5d} segmenti disegnati, "
+                  f"frame completo {t * 1000:6.2f} ms")
+    del app
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        path = sys.argv[sys.argv.index("--mbtiles") + 1] if "--mbtiles" in sys.argv else None
+        stored = int(sys.argv[sys.argv.index("--stored") + 1]) if "--stored" in sys.argv else 1_000_000
+        bench(path, stored=stored)
+    else:
+        print(__doc__)
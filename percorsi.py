@@ -0,0 +1,466 @@
+"""
+Percorsi già fatti: riconoscimento del viaggio in corso e consumo previsto
+per il resto della strada.
+
+Il km/% lineare di algokm non sa che tra poco c'è una salita o un tratto
+di autostrada; se la strada è già stata percorsa, il profilo di energia dei
+viaggi passati lo sa. La Libreria tiene i viaggi registrati ricampionati
+ogni PASSO_KM (posizione, km e Wh dall'inizio) con un indice a griglia
+precalcolato: per cella, una fetta dei punti ordinati per cella.
+
+L'Inseguitore aggancia ogni fix ai percorsi vicini e ne segue l'avanzamento:
+un candidato resta valido finché i km fatti sul percorso corrispondono ai
+km percorsi (questo scarta anche il senso opposto). Il lavoro per fix è
+limitato da MAX_CANDIDATI e da un budget di tempo (BUDGET_S): finito il
+budget i candidati rimasti aspettano il fix successivo. La previsione è la
+media del resto dei percorsi agganciati che finiscono nello stesso posto,
+scalata per quanto il viaggio di oggi consuma rispetto a loro nel tratto in
+comune.
+
+La libreria cresce a ogni fine viaggio (logtrip/percorsi.npz) e si può
+ricostruire dalle tracce registrate:
+    python percorsi.py --costruisci
+    python percorsi.py --bench
+"""
+
+import os
+import copy
+import math
+import argparse
+from array import array
+from collections import namedtuple
+
+import metrics
+import logconfig
+import basetempo
+from luoghi import distanza_m, M_GRADO
+from guessometer import TRACCE_DIR
+
+log = logconfig.get("percorsi")
+
+LIBRERIA_PATH = "logtrip/percorsi.npz"
+PASSO_KM = 0.05             # Un punto della libreria ogni 50 m di percorso
+CELLA_GRADI = 0.002         # Lato della cella (~220 m in latitudine); RAGGIO_M deve starci dentro
+RAGGIO_M = 60               # Fix entro questa distanza da un punto: è sul percorso (GPS + metà passo)
+AVANTI_KM = 0.3             # Oltre l'avanzamento atteso (tagli di curva, fix distanziati)
+INDIETRO_KM = 0.05
+SCARTO_KM, SCARTO_REL = 0.15, 0.15   # Differenza ammessa tra km avanzati sul percorso e km percorsi
+MANCATI_MAX = 5             # Fix consecutivi fuori dal percorso prima di abbandonarlo
+AGGANCIO_KM = 0.5           # Strada in comune prima di usare un percorso per la previsione
+DESTINAZIONE_M = 300        # Percorsi che finiscono entro questa distanza vanno nella stessa media
+FATTORE_MIN, FATTORE_MAX = 0.7, 1.4
+WH_FATTORE_MIN = 300        # Wh del tratto in comune sotto cui il confronto con oggi è rumore (1 punto di carica)
+MAX_CANDIDATI = 64
+BUDGET_S = 0.002            # Tempo massimo di aggancio per fix
+KM_MIN_PERCORSO = 1.0       # Viaggi più corti non entrano nella libreria
+MAX_PERCORSI = 1000         # Oltre, si dimenticano i più vecchi
+MAX_PUNTI_VIAGGIO = 20000   # Punti registrati del viaggio in corso (500 km): memoria limitata
+
+Previsione = namedtuple("Previsione", "percorsi km wh fattore lat lon percorso i")
+
+
+class Libreria:
+    """Percorsi ricampionati, concatenati in array NumPy, con indice a griglia"""
+
+    def __init__(self, path=LIBRERIA_PATH):
+        import numpy as np
+        self.path = path
+        self.lat = self.lon = self.km = self.wh = np.empty(0)
+        self.inizi = np.zeros(1, dtype=np.int64)    # Primo punto di ogni percorso, più la fine
+        self.ordine = np.empty(0, dtype=np.int64)   # Punti ordinati per cella
+        self.celle = {}                             # Chiave della cella → (inizio, fine) in ordine
+
+    def __len__(self):
+        return len(self.inizi) - 1
+
+    @staticmethod
+    def ricampiona(lat, lon, km, wh):
+        """(lat, lon, km, wh) ogni PASSO_KM, km e Wh da zero; None se il viaggio è troppo corto"""
+        import numpy as np
+        km = np.maximum.accumulate(np.asarray(km, dtype=float))
+        km, u = np.unique(km, return_index=True)    # np.interp vuole ascisse crescenti
+        if len(km) < 2 or km[-1] - km[0] < KM_MIN_PERCORSO:
+            return None
+        lat, lon, wh = (np.asarray(x, dtype=float)[u] for x in (lat, lon, wh))
+        passi = np.append(np.arange(km[0], km[-1], PASSO_KM), km[-1])
+        return (np.interp(passi, km, lat), np.interp(passi, km, lon),
+                passi - km[0], np.interp(passi, km, wh) - wh[0])
+
+    def estendi(self, viaggi):
+        """Aggiunge i viaggi [(lat, lon, km, wh)] e ricostruisce l'indice; restituisce quanti sono entrati"""
+        import numpy as np
+        nuovi = [r for r in (self.ricampiona(*v) for v in viaggi) if r is not None]
+        if not nuovi:
+            return 0
+        self.lat, self.lon, self.km, self.wh = (np.concatenate([vecchio] + [r[k] for r in nuovi])
+                                                for k, vecchio in enumerate((self.lat, self.lon, self.km, self.wh)))
+        self.inizi = np.concatenate((self.inizi, self.inizi[-1] + np.cumsum([len(r[0]) for r in nuovi])))
+        if len(self) > MAX_PERCORSI:
+            taglio = self.inizi[len(self) - MAX_PERCORSI]
+            self.lat, self.lon, self.km, self.wh = (x[taglio:] for x in (self.lat, self.lon, self.km, self.wh))
+            self.inizi = self.inizi[len(self) - MAX_PERCORSI:] - taglio
+        self._indicizza()
+        return len(nuovi)
+
+    def _indicizza(self):
+        import numpy as np
+        riga = np.floor(self.lat / CELLA_GRADI).astype(np.int64)
+        colonna = np.floor(self.lon / CELLA_GRADI).astype(np.int64)
+        chiavi = (riga << 32) + (colonna & 0xFFFFFFFF)
+        self.ordine = np.argsort(chiavi, kind="stable")
+        uniche, inizio = np.unique(chiavi[self.ordine], return_index=True)
+        fine = np.append(inizio[1:], len(chiavi))
+        self.celle = dict(zip(uniche.tolist(), zip(inizio.tolist(), fine.tolist())))
+
+    def vicini(self, lat, lon, raggio=RAGGIO_M):
+        """(id dei punti, distanze in m) entro raggio: le 3x3 celle attorno al punto"""
+        import numpy as np
+        riga = math.floor(lat / CELLA_GRADI)
+        colonna = math.floor(lon / CELLA_GRADI)
+        fette = [self.celle.get(((riga + dr) << 32) + ((colonna + dc) & 0xFFFFFFFF))
+                 for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+        fette = [self.ordine[a:b] for a, b in filter(None, fette)]
+        if not fette:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        ids = np.concatenate(fette)
+        d = np.hypot(self.lat[ids] - lat, (self.lon[ids] - lon) * math.cos(math.radians(lat))) * M_GRADO
+        dentro = d <= raggio
+        return ids[dentro], d[dentro]
+
+    def percorso_di(self, ids):
+        import numpy as np
+        return np.searchsorted(self.inizi, ids, side="right") - 1
+
+    def salva(self, path=None):
+        import numpy as np
+        path = path or self.path
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, lat=self.lat, lon=self.lon, km=self.km, wh=self.wh, inizi=self.inizi)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.error("Libreria dei percorsi non salvata: %s", e)
+
+    @classmethod
+    def carica(cls, path=LIBRERIA_PATH):
+        """Libreria salvata in path, vuota se manca o non è leggibile"""
+        import numpy as np
+        libreria = cls(path)
+        try:
+            with np.load(path) as dati:
+                libreria.lat, libreria.lon, libreria.km, libreria.wh, libreria.inizi = (
+                    dati[k] for k in ("lat", "lon", "km", "wh", "inizi"))
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(path):
+                log.error("Libreria dei percorsi non leggibile (%s): si riparte vuota", e)
+            return cls(path)
+        libreria._indicizza()
+        return libreria
+
+
+class Aggancio:
+    """Un percorso della libreria che il viaggio sta seguendo"""
+
+    def __init__(self, i, km, wh):
+        self.i = i              # Punto della libreria raggiunto
+        self.i0 = i             # Punto dell'aggancio
+        self.km0 = km           # Trip km e Wh del viaggio all'aggancio
+        self.wh0 = wh
+        self.mancati = 0
+
+
+class Inseguitore:
+    """
+    Aggancio incrementale del viaggio in corso ai percorsi della libreria.
+    Tutti i metodi vanno chiamati dal thread della pipeline; libreria e
+    candidati si sostituiscono con un solo assegnamento, mai modificati sul posto
+    da fine_viaggio.
+    """
+
+    def __init__(self, libreria, budget=BUDGET_S):
+        self.libreria = libreria
+        self.budget = budget
+        self.candidati = {}     # Percorso → Aggancio
+        self.km_prec = None
+        self.wh = 0.0
+        self.traccia = tuple(array("f") for _ in range(4))     # lat, lon, km, wh per la libreria
+        self.m_tempo = metrics.histogram("route_match_seconds", "Aggancio di un fix ai percorsi noti")
+        self.m_budget = metrics.counter("route_match_over_budget_total",
+                                        "Fix in cui il budget è finito prima di tutti i candidati")
+
+    def _registra(self, lat, lon, km, wh):
+        lati, loni, kmi, whi = self.traccia
+        if len(kmi) < MAX_PUNTI_VIAGGIO and (not kmi or km - kmi[-1] >= PASSO_KM / 2):
+            lati.append(lat)
+            loni.append(lon)
+            kmi.append(km)
+            whi.append(wh)
+
+    def aggiungi(self, lat, lon, km, wh):
+        """Un fix del viaggio: posizione, trip km e Wh del viaggio"""
+        t0 = basetempo.adesso()
+        self._registra(lat, lon, km, wh)
+        self.wh = wh
+        dkm = km - self.km_prec if self.km_prec is not None else 0.0
+        self.km_prec = km
+        libreria = self.libreria
+        if not len(libreria):
+            return
+        ids, dist = libreria.vicini(lat, lon)
+        vicini = {}             # Percorso → [(distanza, punto)]
+        for i, p, d in zip(ids.tolist(), libreria.percorso_di(ids).tolist(), dist.tolist()):
+            vicini.setdefault(p, []).append((d, i))
+
+        km_lib = libreria.km
+        candidati = self.candidati
+        finito = False
+        for p, agg in list(candidati.items()):
+            if basetempo.adesso() - t0 > self.budget:
+                finito = True
+                break
+            punti = vicini.pop(p, ())
+            prec = km_lib[agg.i]
+            atteso = prec + dkm
+            avanti = [(d, i) for d, i in punti if prec - INDIETRO_KM <= km_lib[i] <= atteso + AVANTI_KM]
+            if avanti:
+                agg.i = min(avanti)[1]
+                agg.mancati = 0
+                fatto = km - agg.km0
+                if abs(km_lib[agg.i] - km_lib[agg.i0] - fatto) <= SCARTO_KM + SCARTO_REL * fatto:
+                    continue
+            else:
+                agg.mancati += 1
+                if agg.mancati <= MANCATI_MAX:
+                    continue
+            del candidati[p]
+
+        for p, punti in vicini.items():
+            if finito or len(candidati) >= MAX_CANDIDATI or basetempo.adesso() - t0 > self.budget:
+                finito = finito or len(candidati) < MAX_CANDIDATI
+                break
+            candidati[p] = Aggancio(min(punti)[1], km, wh)
+        if finito:
+            self.m_budget.inc()
+        self.m_tempo.record(basetempo.adesso() - t0)
+
+    def previsione(self):
+        """Previsione per il resto del percorso riconosciuto, o None"""
+        libreria = self.libreria
+        km_lib, wh_lib, inizi = libreria.km, libreria.wh, libreria.inizi
+        validi = [(float(km_lib[a.i] - km_lib[a.i0]), p, a) for p, a in self.candidati.items() if a.mancati == 0]
+        validi = [v for v in validi if v[0] >= AGGANCIO_KM]
+        if not validi:
+            return None
+        _, migliore, agg = max(validi, key=lambda v: v[0])
+        fine = inizi[migliore + 1] - 1
+        lat, lon = float(libreria.lat[fine]), float(libreria.lon[fine])
+        gruppo = [(p, a) for _, p, a in validi
+                  if distanza_m(lat, lon, libreria.lat[inizi[p + 1] - 1], libreria.lon[inizi[p + 1] - 1]) <= DESTINAZIONE_M]
+        resto_km = resto_wh = fatto_lib = fatto = 0.0
+        for p, a in gruppo:
+            ultimo = inizi[p + 1] - 1
+            resto_km += km_lib[ultimo] - km_lib[a.i]
+            resto_wh += wh_lib[ultimo] - wh_lib[a.i]
+            fatto_lib += wh_lib[a.i] - wh_lib[a.i0]
+            fatto += self.wh - a.wh0
+        n = len(gruppo)
+        fattore = 1.0
+        if fatto_lib / n >= WH_FATTORE_MIN:
+            fattore = min(FATTORE_MAX, max(FATTORE_MIN, fatto / fatto_lib))
+        return Previsione(n, float(resto_km / n), float(resto_wh / n * fattore), fattore, lat, lon,
+                          migliore, agg.i)
+
+    def autonomia(self, previsione, wh_residui, wh_km_oltre=None):
+        """
+        km percorribili con wh_residui: lungo il profilo del percorso
+        riconosciuto e, se avanza energia, oltre la destinazione a wh_km_oltre.
+        """
+        import numpy as np
+        if wh_residui >= previsione.wh:
+            oltre = (wh_residui - previsione.wh) / wh_km_oltre if wh_km_oltre else 0.0
+            return previsione.km + oltre
+        libreria = self.libreria
+        a, b = previsione.i, libreria.inizi[previsione.percorso + 1]
+        km = libreria.km[a:b] - libreria.km[a]
+        wh = libreria.wh[a:b] - libreria.wh[a]
+        scala = previsione.wh / wh[-1] if wh[-1] > 0 else 1.0
+        return float(np.interp(wh_residui, np.maximum.accumulate(wh * scala), km))
+
+    def fine_viaggio(self, salva=True):
+        """Il viaggio registrato entra nella libreria; si riparte da zero"""
+        # estendi riassegna gli array senza toccarli: una copia superficiale basta
+        # perché chi tiene ancora la libreria vecchia la veda intera
+        libreria = copy.copy(self.libreria)
+        entrato = libreria.estendi([self.traccia]) > 0
+        if entrato:
+            self.libreria = libreria
+            if salva:
+                libreria.salva()
+        self.candidati = {}
+        self.km_prec = None
+        self.traccia = tuple(array("f") for _ in range(4))
+        return entrato
+
+
+def costruisci(tracks_dir=None, tracce_dir=TRACCE_DIR, path=LIBRERIA_PATH):
+    """Libreria da zero con i viaggi registrati (posizioni dai fix di logtrip/tracks)"""
+    import numpy as np
+    from luoghi import viaggi_con_posizione
+    libreria = Libreria(path)
+    viaggi, _ = viaggi_con_posizione(tracks_dir, tracce_dir)
+    completi = []
+    for _, _, km, wh, lat, lon in viaggi:
+        con_fix = ~np.isnan(lat)
+        completi.append((lat[con_fix], lon[con_fix], km[con_fix], wh[con_fix]))
+    libreria.estendi(completi)
+    return libreria
+
+
+# ---------------------------------------------------------------------------
+
+def _strade(n, rng):
+    """n strade sintetiche: polilinea ogni 10 m con quota e limite di velocità"""
+    import numpy as np
+    strade = []
+    for _ in range(n):
+        passi = int(rng.uniform(4000, 30000) / 10)
+        rotta = rng.uniform(0, 2 * math.pi) + np.cumsum(rng.normal(0, 0.02, passi))
+        lat0, lon0 = 45.07 + rng.uniform(-0.3, 0.3), 7.68 + rng.uniform(-0.4, 0.4)
+        lat = lat0 + np.cumsum(10 * np.cos(rotta)) / M_GRADO
+        lon = lon0 + np.cumsum(10 * np.sin(rotta)) / (M_GRADO * math.cos(math.radians(lat0)))
+        s = np.arange(passi) * 10.0
+        quota = sum(rng.uniform(5, 60) * np.sin(2 * math.pi * s / rng.uniform(800, 6000) + rng.uniform(0, 6.3))
+                    for _ in range(3))
+        limite = np.repeat(rng.choice([50, 70, 90, 110, 130], passi // 100 + 1) / 3.6, 100)[:passi]
+        strade.append((lat, lon, quota, limite))
+    return strade
+
+
+def _percorri(strada, rng):
+    """Un passaggio a 1 Hz: (lat, lon, km, wh) con velocità, stile di guida e GPS diversi ogni volta"""
+    import numpy as np
+    import scenario
+    veicolo = scenario.VEICOLO
+    lat, lon, quota, limite = strada
+    nodi = np.arange(len(lat)) * 10.0
+    v = np.maximum(3.0, limite * rng.uniform(0.85, 1.0) * (1 + rng.normal(0, 0.03, len(lat))))
+    t_nodi = np.concatenate(([0.0], np.cumsum(10 / v[:-1])))
+    s = np.interp(np.arange(0, t_nodi[-1], 1.0), t_nodi, nodi)
+    rumore = rng.normal(0, 3 / M_GRADO, (2, len(s)))
+    la = np.interp(s, nodi, lat) + rumore[0]
+    lo = np.interp(s, nodi, lon) + rumore[1] / math.cos(math.radians(lat[0]))
+    ds = np.diff(s, prepend=0.0)
+    dv = np.diff(ds, prepend=ds[0])
+    dq = np.diff(np.interp(s, nodi, quota), prepend=quota[0])
+    m = veicolo["massa_kg"]
+    ruote = (m * scenario.G * (veicolo["crr"] * ds + dq) + 0.5 * scenario.RHO_ARIA * veicolo["cda_m2"] * ds ** 3
+             + m * ds * dv)
+    stile = rng.uniform(0.9, 1.15)
+    batteria = np.where(ruote > 0, ruote / veicolo["rendimento"] * stile, ruote * veicolo["recupero"])
+    return la, lo, s / 1000, np.cumsum(batteria + veicolo["servizi_w"]) / 3600
+
+
+def bench(strade=60, passaggi=7, prove=60, ignote=15, seed=0):
+    """
+    Libreria di centinaia di percorsi su strade sintetiche con salite e
+    limiti diversi; nuovi passaggi sulle stesse strade (e su strade mai
+    fatte) agganciati fix per fix: tempo per fix, riconoscimento ed errore
+    sul consumo del resto della strada contro l'estrapolazione lineare.
+    """
+    import tempfile
+    import time
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    lista = _strade(strade + ignote, rng)
+    viaggi, strada_di = [], []
+    for k in range(strade):
+        for _ in range(passaggi):
+            viaggi.append(_percorri(lista[k], rng))
+            strada_di.append(k)
+    strada_di = np.array(strada_di)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        libreria = Libreria(os.path.join(tmp, "percorsi.npz"))
+        t0 = time.perf_counter()
+        libreria.estendi(viaggi)
+        costruzione = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        libreria.salva()
+        salvataggio = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        libreria = Libreria.carica(libreria.path)
+        caricamento = time.perf_counter() - t0
+        print(f"Libreria: {len(libreria)} percorsi, {len(libreria.lat)} punti, {len(libreria.celle)} celle; "
+              f"costruzione {costruzione * 1000:.0f} ms, salvataggio {salvataggio * 1000:.0f} ms, "
+              f"caricamento con indice {caricamento * 1000:.0f} ms "
+              f"({os.path.getsize(libreria.path) / 2**20:.1f} MiB)")
+
+    tempi, riconosciuti, km_riconoscimento, giusti = [], 0, [], 0
+    fuori_budget = metrics.counter("route_match_over_budget_total").value
+    errori = {q: ([], []) for q in (0.25, 0.5, 0.75)}
+    falsi, strade_false = 0, set()
+    for j in range(prove + ignote):
+        nota = j < prove
+        k = j % strade if nota else strade + j - prove
+        lat, lon, km, wh = _percorri(lista[k], rng)
+        inseguitore = Inseguitore(libreria)
+        quando = {int(q * len(km)): q for q in errori}
+        primo = None
+        for n in range(len(km)):
+            t0 = time.perf_counter()
+            inseguitore.aggiungi(float(lat[n]), float(lon[n]), float(km[n]), float(wh[n]))
+            previsione = inseguitore.previsione()
+            tempi.append(time.perf_counter() - t0)
+            if previsione is None:
+                continue
+            if not nota:
+                falsi += 1
+                strade_false.add(k)
+                continue
+            if primo is None:
+                primo = km[n]
+                giusti += strada_di[previsione.percorso] == k
+            if n in quando:
+                vero = wh[-1] - wh[n]
+                lineare = wh[n] / km[n] * (km[-1] - km[n])
+                errori[quando[n]][0].append(abs(previsione.wh - vero) / vero * 100)
+                errori[quando[n]][1].append(abs(lineare - vero) / vero * 100)
+        if nota and primo is not None:
+            riconosciuti += 1
+            km_riconoscimento.append(primo)
+
+    tempi = np.array(tempi) * 1e6
+    fuori_budget = metrics.counter("route_match_over_budget_total").value - fuori_budget
+    print(f"Aggancio + previsione per fix ({len(tempi)} fix): p50 {np.percentile(tempi, 50):.0f} µs, "
+          f"p99 {np.percentile(tempi, 99):.0f} µs, max {tempi.max():.0f} µs (budget {BUDGET_S * 1e6:.0f} µs "
+          f"per l'aggancio, superato in {fuori_budget} fix)")
+    print(f"Strade note: riconosciute {riconosciuti}/{prove} dopo {np.median(km_riconoscimento):.2f} km (mediana), "
+          f"percorso giusto {giusti}/{riconosciuti}; strade mai fatte: {falsi} fix con previsione "
+          f"su {len(strade_false)}/{ignote} strade (dove si sovrappongono a una strada nota)")
+    print("Errore sul consumo del resto della strada (media |errore|):")
+    for q, (percorso, lineare) in errori.items():
+        print(f"  a {q * 100:3.0f}% della strada: percorso noto {np.mean(percorso):5.1f}%, "
+              f"lineare {np.mean(lineare):5.1f}% ({len(percorso)} viaggi)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Libreria dei percorsi già fatti")
+    parser.add_argument("--libreria", default=LIBRERIA_PATH)
+    parser.add_argument("--costruisci", action="store_true", help="da logtrip/tracks e logtrip/tracce")
+    parser.add_argument("--bench", action="store_true")
+    args = parser.parse_args(argv)
+    if args.bench:
+        bench()
+    elif args.costruisci:
+        libreria = costruisci(path=args.libreria)
+        libreria.salva()
+        print(f"{len(libreria)} percorsi, {len(libreria.lat)} punti → {args.libreria}")
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,662 @@
+"""
+Pipeline dei dati del Bluecar indipendente da Qt.
+
+CAN → BatteryMonitor, STATS (COM201) → algokm → Guessometer, e pubblicazione
+della telemetria a tutti i sottoscrittori registrati. La GUI è solo uno dei
+sottoscrittori: se si blocca o va in crash la pipeline continua a girare e
+a registrare il viaggio.
+
+Modalità headless:
+    python pipeline.py                      # telemetria su stdout
+    python pipeline.py --udp 127.0.0.1:5005 --log telemetria.jsonl
+    python pipeline.py --test                       # scenario simulato (scenario.py), tempo reale
+    python pipeline.py --test autostrada --seed 2 --velocita 30
+    python pipeline.py --test --periodo 0 --velocita 50 --durata 10   # benchmark della pipeline
+    python pipeline.py --replay telemetria.jsonl --velocita 10   # rigioca un --log
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+from datetime import datetime
+from collections import namedtuple
+
+try:
+    import serial
+except Exception:
+    serial = None
+
+# Import del monitor della batteria (se presente)
+try:
+    from can_monitor import create_battery_monitor
+except Exception:
+    create_battery_monitor = None
+
+from guessometer import Guessometer, RegistroTraccia, PACCO_WH
+import efficienza
+import luoghi
+import percorsi
+import shmtelemetry
+import metrics
+import logconfig
+import basetempo
+
+log = logconfig.get("pipeline")
+
+STATS_PORT = 'COM201'
+
+Telemetria = namedtuple(
+    "Telemetria", "timestamp carica autonomia banda_min banda_max velocita_media trip_km lat lon",
+    defaults=(None, None))
+
+
+class TripPipeline:
+    """Stato del viaggio, ricalcolo dell'autonomia e pubblicazione della telemetria"""
+
+    def __init__(self, test=0, periodo=1.0, condivisa=False, replay=None, velocita_replay=1.0,
+                 scenario="pendolare", seed=0):
+        self.test = test            # 1 = scenario simulato (scenario.py) al posto di CAN e ricevitore
+        self.scenario = scenario    # Nome, file JSON, Simulazione o Guida già configurata
+        self.seed = seed
+        self.guida = None
+        self.periodo = periodo      # Attesa tra due ricalcoli (0 = più veloce possibile)
+        self.condivisa = condivisa  # Dati da memoria condivisa (launcher) invece di seriale/CAN
+        self.replay = replay        # Telemetria registrata con --log al posto di CAN/seriale
+        self.velocita_replay = velocita_replay
+        self.replay_file = None
+        self.replay_t = None
+        self.running = False
+        self.thread = None
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+        # Stato del viaggio
+        self.inizializzato = 0
+        self.inizio = 100
+        self.media = 0
+        self.last = 0
+        self.trip_km = 0.0
+        self.start_time = None
+        self.banda = (0.0, 0.0)
+        self.wh_inizio = None       # Energia integrata dal CAN all'inizio del viaggio
+        self.wh_km = None           # Consumo del viaggio, None senza frame del pacco
+        self.guesso = Guessometer()
+        self.registro = None
+        self.analisi = None         # Efficienza del viaggio, accanto al registro
+        self.wh_viaggio = None
+        self.t_fix = None           # Ora dell'ultimo fix nella riga STATS
+        self.fix = None             # Ultima posizione valida delle righe STATS (self.posizione parte finta in test)
+        self.luoghi = None          # Indice dei luoghi di partenza, arrivo e ricarica
+        self.percorsi = None        # Aggancio del viaggio ai percorsi già fatti
+        self.previsione = None      # percorsi.Previsione per il resto della strada, o None
+
+        # Ultima telemetria pubblicata (valori di partenza come la vecchia GUI)
+        self.carica = 80 if test == 1 else 0
+        self.autonomia = 120 if test == 1 else 0
+        self.velocita = 45 if test == 1 else 43
+        self.trip_visualizzato = 15.5 if test == 1 else 0.0
+        self.posizione = (45.0703, 7.6869) if test == 1 else (None, None)
+        self.cicli = 0
+
+        self.ser = None
+        self.monitorBAT = None
+        self.sottosistemi_aperti = False
+        self.ripristino_richiesto = False
+        self.reset_richiesto = False
+
+        self.m_cicli = metrics.counter("pipeline_cycles_total", "Telemetrie pubblicate")
+        self.m_ricalcolo = metrics.histogram("pipeline_ricalcolo_seconds", "Lettura carica + stima autonomia")
+        self.m_publish = metrics.histogram("pipeline_publish_seconds", "Consegna della telemetria ai sottoscrittori")
+        self.m_errori_sub = metrics.counter("pipeline_subscriber_errors_total", "Eccezioni dei sottoscrittori")
+        self.m_stats_saltate = metrics.counter("pipeline_stats_skipped_total",
+                                               "Righe STATS più vecchie dell'ultima, scartate senza elaborarle")
+        self.m_stats_eta = metrics.histogram("pipeline_stats_age_seconds",
+                                             "Età della riga STATS usata nel ricalcolo (orologio di gpstrip)")
+        self.m_sfasamento = metrics.histogram("pipeline_can_gps_skew_seconds",
+                                              "Fix GPS meno ultima carica CAN usati nello stesso ricalcolo")
+        self.sfasamento = None      # Secondi tra il fix GPS e il frame 0x638 dell'ultimo ricalcolo
+
+    # -- Sottosistemi ------------------------------------------------------
+
+    def apri_seriale(self):
+        """Apre la seriale delle statistiche di viaggio (gpstrip)"""
+        if self.condivisa:
+            try:
+                self.ser = shmtelemetry.StatsPort()
+                return True
+            except FileNotFoundError as e:
+                log.error("Telemetria GPS condivisa non disponibile: %s", e)
+                self.ser = None
+                return False
+        if serial is None:
+            return False
+        try:
+            self.ser = serial.Serial(STATS_PORT, 9600, timeout=1)
+            return True
+        except Exception as e:
+            log.error("Errore connessione seriale: %s", e)
+            self.ser = None
+            return False
+
+    def apri_batteria(self):
+        """Crea e avvia il monitor della batteria sul bus CAN"""
+        if self.condivisa:
+            try:
+                self.monitorBAT = shmtelemetry.BatteryReader()
+                return True
+            except FileNotFoundError as e:
+                log.error("Telemetria CAN condivisa non disponibile: %s", e)
+                self.monitorBAT = None
+                return False
+        if create_battery_monitor is None:
+            return False
+        try:
+            self.monitorBAT = create_battery_monitor()
+            self.monitorBAT.start()
+            return True
+        except Exception as e:
+            log.error("Errore inizializzazione monitor batteria: %s", e)
+            self.monitorBAT = None
+            return False
+
+    # -- Sottoscrittori ----------------------------------------------------
+
+    def subscribe(self, callback):
+        """Registra una funzione chiamata con ogni Telemetria pubblicata"""
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def snapshot(self):
+        """Telemetria corrente, senza attendere il prossimo ciclo"""
+        return Telemetria(time.time(), self.carica, self.autonomia,
+                          self.banda[0], self.banda[1], self.velocita,
+                          self.trip_visualizzato, *self.posizione)
+
+    def publish(self):
+        t0 = time.perf_counter()
+        tel = self.snapshot()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(tel)
+            except Exception as e:
+                # Un sottoscrittore rotto non deve fermare la pipeline
+                self.m_errori_sub.inc()
+                log.exception("Errore sottoscrittore %r: %s", callback, e)
+        self.cicli += 1
+        self.m_cicli.inc()
+        self.m_publish.record(time.perf_counter() - t0)
+
+    # -- Calcolo -----------------------------------------------------------
+
+    def algokm(self, attuale):
+        """
+        Calcola l'autonomia residua basata sul consumo della batteria e le statistiche del viaggio.
+        """
+        trip_speed_kmh = 0
+
+        if (self.inizializzato == 0) and attuale > 0:
+            if self.ser is not None:
+                try:
+                    self.ser.write(b'R')
+                except Exception:
+                    pass
+            self.inizializzato = 1
+            self.inizio = attuale
+            self.start_time = datetime.now()
+            self.guesso.reset(attuale)
+            self.wh_inizio = self.energia_totale()
+
+        time.sleep(self.periodo)
+
+        nuovo_fix = None
+        if self.ser is not None:
+            try:
+                line = self.leggi_stats()
+                if line.startswith("STATS"):
+                    parts = line.split(',')
+                    self.trip_km = float(parts[2]) / 1000
+                    trip_speed_kmh = float(parts[4]) * 3.6
+                    t_fix = self.t_fix = float(parts[5])    # Ora del fix sull'orologio di gpstrip
+                    if self.test == 0:      # Nello scenario il tracker ha l'orologio simulato
+                        self.m_stats_eta.record(time.time() - t_fix)
+                        t_carica = getattr(self.monitorBAT, "t_carica", None)
+                        if t_carica is not None:
+                            self.sfasamento = t_fix - basetempo.parete(t_carica)
+                            self.m_sfasamento.record(self.sfasamento)
+                    if len(parts) > 8 and parts[8] == "VALID":
+                        self.posizione = self.fix = nuovo_fix = (float(parts[6]), float(parts[7]))
+            except Exception:
+                pass
+
+        self.media = trip_speed_kmh
+        self.wh_viaggio = self.energia_viaggio()
+        stima = self.guesso.update(attuale, self.trip_km, self.media, wh=self.wh_viaggio)
+        if nuovo_fix is not None and self.inizializzato:
+            stima = self.segui_percorso(stima, attuale, nuovo_fix)
+        self.banda = (stima.km_min, stima.km_max)
+        self.wh_km = stima.wh_km
+
+        return round(stima.km, 1)
+
+    def segui_percorso(self, stima, attuale, fix):
+        """
+        Aggancia il fix ai percorsi già fatti; se la strada è riconosciuta,
+        l'autonomia segue il profilo di consumo di quei viaggi fino alla
+        destinazione (oltre, il consumo del viaggio) e la banda si sposta con lei.
+        """
+        if self.percorsi is None:
+            return stima
+        wh = self.wh_viaggio if self.wh_viaggio is not None else efficienza.wh_da_carica(self.inizio, attuale)
+        self.percorsi.aggiungi(*fix, self.trip_km, wh)
+        previsione = self.previsione = self.percorsi.previsione()
+        if previsione is None:
+            return stima
+        wh_km = stima.wh_km or (previsione.wh / previsione.km if previsione.km > 0 else None)
+        km = self.percorsi.autonomia(previsione, attuale * PACCO_WH / 100, wh_km)
+        spostamento = km - stima.km
+        return stima._replace(km=km, km_min=max(0.0, stima.km_min + spostamento),
+                              km_max=max(0.0, stima.km_max + spostamento))
+
+    def percorso_noto(self):
+        """(km alla destinazione, carica prevista all'arrivo, viaggi usati) o None"""
+        previsione = self.previsione
+        if previsione is None:
+            return None
+        return previsione.km, self.carica - previsione.wh / PACCO_WH * 100, previsione.percorsi
+
+    def energia_totale(self):
+        """Wh integrati dal monitor CAN (None senza frame del pacco o con monitor che non li conosce)"""
+        lettura = getattr(self.monitorBAT, "get_energy_wh", None)
+        return lettura() if lettura is not None else None
+
+    def energia_viaggio(self):
+        """Wh prelevati dall'inizio del viaggio"""
+        totale = self.energia_totale()
+        if totale is None:
+            return None
+        if self.wh_inizio is None:
+            self.wh_inizio = totale     # Primi frame del pacco arrivati a viaggio iniziato
+        return totale - self.wh_inizio
+
+    def recupero_totale(self):
+        """Wh recuperati misurati dal monitor CAN, cumulativi (None se non li conosce)"""
+        lettura = getattr(self.monitorBAT, "get_regen_wh", None)
+        return lettura() if lettura is not None else None
+
+    def efficienza(self):
+        """Sintesi dell'efficienza del viaggio in corso (efficienza.Sintesi) o None"""
+        analisi = self.analisi
+        return analisi.sintesi if analisi is not None else None
+
+    def leggi_stats(self):
+        """
+        Riga STATS più recente. Sulla seriale quelle già arrivate e non lette sono
+        vecchie: si legge tutto quello che è in attesa e si tiene solo l'ultima.
+        """
+        line = self.ser.readline()
+        saltate = getattr(self.ser, "saltati", 0)   # StatsPort: già accorpate dal seqlock
+        while getattr(self.ser, "in_waiting", 0):
+            successiva = self.ser.readline()
+            if successiva.startswith(b"STATS"):
+                if line.startswith(b"STATS"):
+                    saltate += 1
+                line = successiva
+        if saltate:
+            self.m_stats_saltate.inc(saltate)
+        return line.decode().strip()
+
+    def ricalcolo(self):
+        """Un ciclo: legge la carica, ricalcola l'autonomia e pubblica"""
+        t0 = time.perf_counter()
+        charge = self.monitorBAT.get_charge()
+        self.carica = charge
+        rimanente = self.algokm(charge)
+        self.trip_visualizzato = self.trip_km
+        if rimanente == 0.0 and self.last != 0:
+            self.autonomia = self.last
+        else:
+            self.autonomia = rimanente
+            self.last = rimanente
+        self.velocita = self.media
+        if self.inizializzato:
+            recupero = self.recupero_totale()
+            if self.registro is None:
+                self.registro = RegistroTraccia()
+                # Nello scenario accelerato un ciclo copre più secondi simulati
+                dt_max = efficienza.DT_MAX * (max(1.0, self.velocita_replay) if self.test else 1.0)
+                self.analisi = efficienza.AnalisiViaggio(dt_max=dt_max)
+            self.registro.scrivi(charge, self.trip_km, self.media, self.wh_viaggio, recupero, self.t_fix)
+            if self.t_fix is not None:
+                wh = self.wh_viaggio if self.wh_viaggio is not None else efficienza.wh_da_carica(self.inizio, charge)
+                self.analisi.aggiungi(self.t_fix, self.trip_km, wh, recupero)
+            if self.luoghi is not None and self.fix is not None:
+                if self.luoghi.origine is None:
+                    self.luoghi.partenza(*self.fix, charge, self.t_fix)
+                self.luoghi.campione(*self.fix, charge, self.trip_km, self.t_fix)
+        self.m_ricalcolo.record(time.perf_counter() - t0)
+        self.publish()
+
+    def apri_scenario(self):
+        """Modalità test: lo scenario simulato passa da GPSTracker e BatteryMonitor veri"""
+        import scenario
+        try:
+            if isinstance(self.scenario, scenario.Guida):
+                guida = self.scenario
+            else:
+                sim = self.scenario
+                if not isinstance(sim, scenario.Simulazione):
+                    sim = scenario.genera(sim, self.seed)
+                guida = scenario.Guida(sim, self.velocita_replay)
+            self.guida = guida.start()
+        except Exception as e:
+            log.error("Scenario %s non avviato: %s", self.scenario, e)
+            self.guida = None
+            return False
+        self.monitorBAT = self.guida.monitor
+        self.ser = self.guida.stats_port()
+        return True
+
+    def riproduci(self):
+        """Un ciclo del replay: pubblica la prossima Telemetria registrata rispettando i tempi"""
+        if self.replay_file is None:
+            self.replay_file = open(self.replay, encoding="utf-8")
+        riga = self.replay_file.readline()
+        if not riga:
+            # Fine del file: si ricomincia, così il replay può girare quanto serve
+            self.replay_file.seek(0)
+            self.replay_t = None
+            return
+        dati = json.loads(riga)
+        if self.replay_t is not None and self.velocita_replay > 0:
+            time.sleep(max(0.0, dati["timestamp"] - self.replay_t) / self.velocita_replay)
+        self.replay_t = dati["timestamp"]
+        self.carica = dati["carica"]
+        self.autonomia = dati["autonomia"]
+        self.banda = (dati["banda_min"], dati["banda_max"])
+        self.velocita = dati["velocita_media"]
+        self.trip_visualizzato = dati["trip_km"]
+        self.posizione = (dati.get("lat"), dati.get("lon"))
+        self.publish()
+
+    def apri_sottosistemi(self):
+        """Apre seriale e CAN; chiamata dal thread della pipeline per non ritardare la GUI"""
+        if self.replay is None and not self.sottosistemi_aperti:
+            if self.luoghi is None:
+                self.luoghi = luoghi.IndiceLuoghi.carica()
+            if self.percorsi is None:
+                self.percorsi = percorsi.Inseguitore(percorsi.Libreria.carica())
+            if self.test == 1:
+                self.apri_scenario()
+            else:
+                self.apri_seriale()
+                self.apri_batteria()
+        self.sottosistemi_aperti = True
+
+    def seriale_ok(self):
+        return self.ser is not None and self.ser.is_open
+
+    def batteria_ok(self):
+        if self.monitorBAT is None:
+            return False
+        # Con il launcher il processo CAN è sorvegliato da lui: basta il lettore
+        thread = getattr(self.monitorBAT, "thread", None)
+        return self.condivisa or (thread is not None and thread.is_alive())
+
+    def ripristina_sottosistemi(self):
+        """Riapre solo i sottosistemi guasti; restituisce quelli riaperti"""
+        riaperti = []
+        if self.test != 0:
+            return riaperti
+        if not self.seriale_ok():
+            if self.ser is not None:
+                try:
+                    self.ser.close()
+                except Exception:
+                    pass
+            if self.apri_seriale():
+                riaperti.append("seriale")
+        if not self.batteria_ok():
+            self.chiudi_batteria()
+            if self.apri_batteria():
+                riaperti.append("CAN")
+        return riaperti
+
+    def chiudi_batteria(self):
+        if self.monitorBAT is None:
+            return
+        try:
+            self.monitorBAT.stop()
+            if not self.condivisa:
+                self.monitorBAT.can.disconnect()
+        except Exception as e:
+            log.error("Errore chiusura monitor batteria: %s", e)
+        self.monitorBAT = None
+
+    def richiedi_ripristino(self):
+        """Il ripristino avviene sul thread della pipeline, senza bloccare chi lo chiede"""
+        self.ripristino_richiesto = True
+
+    def richiedi_reset(self):
+        """
+        Il reset del viaggio tocca registro, analisi e stato che il ciclo sta
+        usando: lo fa il thread della pipeline all'inizio del ciclo successivo.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.reset_richiesto = True
+        else:
+            self.reset_trip()
+
+    def _loop(self):
+        self.apri_sottosistemi()
+        while self.running:
+            try:
+                self._ciclo()
+            except Exception:
+                # Un errore in un ciclo non deve fermare per sempre la registrazione del viaggio
+                log.exception("Errore nel ciclo della pipeline, si continua")
+                time.sleep(1)
+        # Viaggio e sottosistemi li chiude il thread che li usa
+        self.chiudi_viaggio()
+        self.rilascia_sottosistemi()
+
+    def _ciclo(self):
+        if self.reset_richiesto:
+            self.reset_richiesto = False
+            self.reset_trip()
+        if self.ripristino_richiesto:
+            self.ripristino_richiesto = False
+            riaperti = self.ripristina_sottosistemi()
+            if riaperti:
+                log.info("Sottosistemi riaperti: %s", ", ".join(riaperti))
+        if self.replay is not None:
+            self.riproduci()
+        elif self.monitorBAT is not None:
+            self.ricalcolo()
+        else:
+            time.sleep(1)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name="pipeline", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            if self.thread.is_alive():
+                log.warning("Pipeline ancora in un ciclo: viaggio e sottosistemi li chiude lei uscendo")
+            return
+        self.chiudi_viaggio()
+        self.rilascia_sottosistemi()
+
+    def rilascia_sottosistemi(self):
+        """Chiude replay, seriale e scenario: solo dal thread della pipeline (o a pipeline ferma)"""
+        if self.replay_file is not None:
+            self.replay_file.close()
+            self.replay_file = None
+        if self.guida is not None:
+            self.ser.close()
+            self.ser = None
+            self.monitorBAT = None
+            self.guida.stop()
+            self.guida = None
+
+    # -- Viaggio -----------------------------------------------------------
+
+    def reset_trip(self):
+        """Chiude il viaggio corrente registrandolo nello storico (thread della pipeline: richiedi_reset)"""
+        end_time = datetime.now()
+        if self.start_time is not None and self.trip_km > 0:
+            percent_consumed = self.inizio - self.carica
+            self.log_trip(self.start_time, end_time, self.trip_km, percent_consumed)
+            self.guesso.chiudi_viaggio(end_time, self.trip_km, percent_consumed)
+        else:
+            self.guesso.reset()
+        self.chiudi_viaggio()
+        self.inizializzato = 0
+        self.trip_km = 0.0
+        self.trip_visualizzato = 0.0
+        self.autonomia = 0
+        self.banda = (0.0, 0.0)
+        self.start_time = None
+
+    def chiudi_viaggio(self):
+        """Arrivo, libreria dei percorsi e registro: solo dal thread della pipeline (o a pipeline ferma)"""
+        self.registra_arrivo()
+        self.chiudi_registro()
+
+    def registra_arrivo(self):
+        """Fine del viaggio nell'indice dei luoghi e nella libreria dei percorsi, salvati subito su disco"""
+        if self.percorsi is not None:
+            self.percorsi.fine_viaggio()
+            self.previsione = None
+        if self.luoghi is None or self.luoghi.origine is None or self.fix is None:
+            return
+        self.luoghi.arrivo(*self.fix, self.carica, self.trip_km, self.wh_viaggio, self.t_fix)
+        self.luoghi.salva()
+
+    def chiudi_registro(self):
+        """Chiude il CSV del viaggio e salva accanto il riepilogo dell'efficienza"""
+        if self.registro is None:
+            return
+        self.registro.chiudi()
+        try:
+            self.analisi.salva(self.registro.path)
+        except OSError as e:
+            log.error("Riepilogo efficienza non salvato: %s", e)
+        self.registro = None
+        self.analisi = None
+
+    def log_trip(self, start, end, km, percent):
+        os.makedirs("logtrip", exist_ok=True)
+        with open("logtrip/oldtrip.txt", "a") as f:
+            line = f"{start.strftime('%Y-%m-%d %H:%M')} | {end.strftime('%Y-%m-%d %H:%M')} | {km:.2f} km | {percent:.1f}% consumati\n"
+            f.write(line)
+
+
+# ---------------------------------------------------------------------------
+# Sottoscrittori per la modalità headless
+
+def stdout_subscriber(tel):
+    print(f"{datetime.fromtimestamp(tel.timestamp):%H:%M:%S} | carica {tel.carica}% | "
+          f"autonomia {tel.autonomia:.1f} km ({tel.banda_min:.0f}-{tel.banda_max:.0f}) | "
+          f"{tel.velocita_media:.1f} km/h | trip {tel.trip_km:.2f} km", flush=True)
+
+
+class SocketPublisher:
+    """Invia ogni Telemetria come datagramma UDP JSON (non blocca mai la pipeline)"""
+
+    def __init__(self, host, port):
+        self.addr = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def __call__(self, tel):
+        try:
+            self.sock.sendto(json.dumps(tel._asdict()).encode(), self.addr)
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+class LogPublisher:
+    """Scrive ogni Telemetria come riga JSON su file"""
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def __call__(self, tel):
+        self.file.write(json.dumps(tel._asdict()) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pipeline Bluecar senza interfaccia grafica")
+    parser.add_argument("--test", nargs="?", const="pendolare", metavar="SCENARIO",
+                        help="scenario simulato invece di CAN/seriale (nome o file JSON, vedi scenario.py)")
+    parser.add_argument("--seed", type=int, default=0, help="seme dello scenario simulato")
+    parser.add_argument("--udp", help="pubblica la telemetria in UDP su host:porta")
+    parser.add_argument("--log", help="registra la telemetria in JSON lines su file")
+    parser.add_argument("--quiet", action="store_true", help="non stampare su stdout")
+    parser.add_argument("--periodo", type=float, default=1.0, help="secondi tra due ricalcoli")
+    parser.add_argument("--durata", type=float, default=0, help="secondi di esecuzione (0 = infinito)")
+    parser.add_argument("--replay", help="rigioca la telemetria registrata con --log")
+    parser.add_argument("--velocita", type=float, default=1.0,
+                        help="velocità del replay (0 = senza attese) o dello scenario simulato")
+    args = parser.parse_args(argv)
+    logconfig.setup("pipeline", console=not args.quiet)
+
+    pipeline = TripPipeline(test=1 if args.test else 0, periodo=args.periodo,
+                            replay=args.replay, velocita_replay=args.velocita,
+                            scenario=args.test or "pendolare", seed=args.seed)
+    chiudere = []
+    if not args.quiet:
+        pipeline.subscribe(stdout_subscriber)
+    if args.udp:
+        host, port = args.udp.rsplit(":", 1)
+        pub = SocketPublisher(host, int(port))
+        pipeline.subscribe(pub)
+        chiudere.append(pub)
+    if args.log:
+        pub = LogPublisher(args.log)
+        pipeline.subscribe(pub)
+        chiudere.append(pub)
+
+    t0 = time.perf_counter()
+    pipeline.start()
+    try:
+        while args.durata <= 0 or time.perf_counter() - t0 < args.durata:
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        print("\nInterruzione ricevuta...")
+    finally:
+        pipeline.stop()
+        trascorso = time.perf_counter() - t0
+        for pub in chiudere:
+            pub.close()
+        pipeline.chiudi_batteria()
+        print(f"Cicli: {pipeline.cicli} in {trascorso:.2f} s "
+              f"({pipeline.cicli / max(trascorso, 1e-9):.1f} cicli/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
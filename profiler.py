@@ -0,0 +1,256 @@
+"""
+Profiler a campionamento per GUI, GPS e CAN.
+
+Un thread daemon legge le pile di tutti i thread (sys._current_frames) alla
+frequenza scelta e conta le pile uguali per thread: nessun hook sulle
+chiamate, quindi il codice profilato gira alla velocità normale. All'uscita
+scrive in profiles/:
+- <nome>_<data>.collapsed      pile compresse (flamegraph.pl, inferno, speedscope)
+- <nome>_<data>.speedscope.json  un profilo per thread, da aprire su speedscope.app
+
+La foglia di ogni pila riporta la riga, così l'attesa (time.sleep, read)
+si distingue dal lavoro vero nella stessa funzione. Si vedono solo le pile
+Python: il tempo passato nel codice C (event loop di Qt, DLL CAN) appare
+sulla riga Python che lo ha chiamato, es. app.exec_() per il thread Qt.
+
+Uso dagli script:
+    python GUI.py --profile                    (100 Hz)
+    python gpstrip.py --profile=500 --replay traccia.nmea
+    python can_monitor.py --profile --replay can_logs/battery_20250101_120000.csv
+    QT_QPA_PLATFORM=offscreen python GUI.py --profile --replay telemetria.jsonl --durata 60
+
+Costo del campionamento su un carico GPS:
+    python profiler.py --bench
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from collections import Counter
+from datetime import datetime
+
+PROFILES_DIR = "profiles"
+HZ_DEFAULT = 100
+
+
+def opzione(nome, default=None, argv=None):
+    """Valore di --nome=valore o --nome valore sulla riga di comando; default se assente"""
+    argv = sys.argv if argv is None else argv
+    for i, arg in enumerate(argv):
+        if arg.startswith(nome + "="):
+            return arg.split("=", 1)[1]
+        if arg == nome and i + 1 < len(argv) and not argv[i + 1].startswith("--"):
+            return argv[i + 1]
+    return default
+
+
+def _nome_frame(code, riga=None):
+    file = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({file}:{code.co_firstlineno if riga is None else riga})"
+
+
+class SamplingProfiler:
+    """Campiona le pile di tutti i thread; aggregazione per (thread, pila)"""
+
+    def __init__(self, hz=HZ_DEFAULT, principale="main"):
+        self.hz = hz
+        self.intervallo = 1.0 / hz
+        self.principale = principale    # Nome mostrato per il thread principale (es. qt-main)
+        self.campioni = Counter()       # (thread, (code, ..., (code, riga))) -> campioni
+        self.n = 0
+        self.costo = 0.0                # Secondi spesi a campionare
+        self.t0 = self.t1 = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self.t0 = time.perf_counter()
+        self.thread = threading.Thread(target=self._loop, name="profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.t1 = time.perf_counter()
+
+    def _nomi(self):
+        nomi = {t.ident: t.name for t in threading.enumerate()}
+        nomi[threading.main_thread().ident] = self.principale
+        return nomi
+
+    def _loop(self):
+        proprio = threading.get_ident()
+        nomi = self._nomi()
+        aggiornati = time.perf_counter()
+        prossimo = aggiornati
+        while self.running:
+            inizio = time.perf_counter()
+            if inizio - aggiornati > 1.0:
+                nomi = self._nomi()
+                aggiornati = inizio
+            for ident, frame in sys._current_frames().items():
+                if ident == proprio:
+                    continue
+                if ident not in nomi:
+                    nomi = self._nomi()     # Thread appena avviato
+                pila = [(frame.f_code, frame.f_lineno)]
+                frame = frame.f_back
+                while frame is not None:
+                    pila.append(frame.f_code)
+                    frame = frame.f_back
+                pila.reverse()
+                self.campioni[(nomi.get(ident, f"thread-{ident}"), tuple(pila))] += 1
+            self.n += 1
+            fine = time.perf_counter()
+            self.costo += fine - inizio
+            prossimo += self.intervallo
+            if prossimo < fine:
+                prossimo = fine     # In ritardo (GIL occupato): niente raffica di recupero
+            time.sleep(prossimo - fine)
+
+    def _righe(self):
+        """(thread, [frame leggibili], campioni)"""
+        for (thread, pila), n in self.campioni.items():
+            frame = [_nome_frame(c) for c in pila[:-1]] + [_nome_frame(*pila[-1])]
+            yield thread, frame, n
+
+    def collapsed(self):
+        righe = [";".join([thread] + frame) + f" {n}" for thread, frame, n in self._righe()]
+        return "\n".join(sorted(righe)) + "\n"
+
+    def speedscope(self, nome="bluecar"):
+        indici = {}
+        frames = []
+        profili = {}
+        for thread, pila, n in self._righe():
+            campione = []
+            for f in pila:
+                if f not in indici:
+                    indici[f] = len(frames)
+                    nome_f, _, luogo = f.rpartition(" (")
+                    file, _, riga = luogo[:-1].rpartition(":")
+                    frames.append({"name": nome_f, "file": file, "line": int(riga)})
+                campione.append(indici[f])
+            p = profili.setdefault(thread, {"samples": [], "weights": []})
+            p["samples"].append(campione)
+            p["weights"].append(n * self.intervallo)
+        durata = (self.t1 or time.perf_counter()) - self.t0
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": nome,
+            "exporter": "bluecar profiler.py",
+            "shared": {"frames": frames},
+            "profiles": [{"type": "sampled", "name": thread, "unit": "seconds",
+                          "startValue": 0, "endValue": durata, **p}
+                         for thread, p in sorted(profili.items())],
+        }
+
+    def riepilogo(self, righe=8):
+        """Campioni per thread e funzioni foglia più frequenti"""
+        per_thread = Counter()
+        foglie = Counter()
+        for (thread, pila), n in self.campioni.items():
+            per_thread[thread] += n
+            foglie[(thread, _nome_frame(*pila[-1]))] += n
+        durata = (self.t1 or time.perf_counter()) - self.t0
+        testo = [f"{self.n} campioni in {durata:.1f} s a {self.hz} Hz, "
+                 f"costo campionamento {self.costo / max(durata, 1e-9) * 100:.2f}% del tempo"]
+        for thread, n in per_thread.most_common():
+            testo.append(f"  {thread:14s} {n / max(self.n, 1) * 100:5.1f}% dei campioni")
+        testo.append("Foglie più frequenti:")
+        for (thread, foglia), n in foglie.most_common(righe):
+            testo.append(f"  {n:6d}  [{thread}] {foglia}")
+        return "\n".join(testo)
+
+    def salva(self, nome, cartella=PROFILES_DIR):
+        os.makedirs(cartella, exist_ok=True)
+        base = os.path.join(cartella, f"{nome}_{datetime.now():%Y%m%d_%H%M%S}")
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(self.speedscope(nome), f)
+        return base
+
+
+def da_argv(nome, principale="main", argv=None):
+    """
+    Avvia il profiler se la riga di comando contiene --profile[=hz]; i file
+    vengono scritti all'uscita del processo. None se il flag non c'è.
+    """
+    argv = sys.argv if argv is None else argv
+    hz = None
+    for arg in argv:
+        if arg == "--profile":
+            hz = HZ_DEFAULT
+        elif arg.startswith("--profile="):
+            hz = float(arg.split("=", 1)[1])
+    if hz is None:
+        return None
+    profiler = SamplingProfiler(hz, principale).start()
+
+    def chiudi():
+        profiler.stop()
+        base = profiler.salva(nome)
+        print(profiler.riepilogo())
+        print(f"Profilo salvato in {base}.collapsed e {base}.speedscope.json")
+
+    atexit.register(chiudi)
+    return profiler
+
+
+def bench(frasi=20_000):
+    """Stesso carico GPS senza profiler e con profiler a varie frequenze"""
+    import tempfile
+    import gpstrip
+    from tracksimplify import traccia_sintetica
+
+    dati = b"".join(gpstrip.frase_gga(la, lo) for la, lo in zip(*traccia_sintetica(frasi)))
+    cwd = os.getcwd()
+
+    def carico():
+        tracker = gpstrip.GPSTracker(porte=False)
+        t0 = time.perf_counter()
+        for i in range(0, len(dati), 4096):
+            tracker._process_chunk(dati[i:i + 4096])
+        dt = time.perf_counter() - t0
+        tracker.stats_file.close()
+        tracker.track.close()
+        return dt
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            # Giri alternati: il riscaldamento non favorisce nessuna configurazione
+            tempi = {hz: [] for hz in (0, 100, 500, 1000)}
+            campioni = {}
+            for _ in range(3):
+                for hz in tempi:
+                    p = SamplingProfiler(hz).start() if hz else None
+                    tempi[hz].append(carico())
+                    if p is not None:
+                        p.stop()
+                        campioni[hz] = (p.n, p.costo / max(p.n, 1))
+            base = min(tempi[0])
+            print(f"Senza profiler: {base * 1e6 / frasi:.1f} µs/frase")
+            for hz in (100, 500, 1000):
+                t = min(tempi[hz])
+                n, costo = campioni[hz]
+                print(f"{hz:5d} Hz: {t * 1e6 / frasi:.1f} µs/frase (overhead {(t - base) / base * 100:+.1f}%), "
+                      f"{n} campioni, {costo * 1e6:.0f} µs per campione")
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        bench()
+    else:
+        print(__doc__)
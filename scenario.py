@@ -0,0 +1,469 @@
+"""
+Simulatore deterministico di scenari di guida.
+
+Da una descrizione dello scenario (tratti di strada, profilo di velocità,
+modello di consumo, perdite del segnale GPS) genera a 1 Hz una traccia GPS
+e una curva della batteria coerenti tra loro: la carica scende con l'energia
+spesa per muovere l'auto lungo quella traccia (rotolamento, aria, pendenza,
+accelerazioni, recupero in frenata, servizi di bordo). Con lo stesso seme
+l'uscita è identica.
+
+I dati passano dai componenti veri:
+- frasi $GPGGA (senza fix in galleria) → GPSTracker._process_chunk
+- carica → ReplayCAN → BatteryMonitor (0x638 in mezzo al traffico del bus)
+- tensione e corrente del pacco → ReplayCAN → energia.IntegratoreEnergia
+e TripPipeline in modalità test usa Guida al posto dei valori casuali.
+
+Scenario da file JSON (campi come in SCENARI, tutti facoltativi tranne i tratti):
+    {"partenza": [45.07, 7.68], "ora": "2025-06-02T07:30:00", "carica": 90,
+     "veicolo": {"servizi_w": 1500}, "perdite": {"ogni_km": 10, "secondi": [2, 8]},
+     "tratti": [{"tipo": "urbano", "km": 3},
+                {"tipo": "autostrada", "km": 2, "galleria": true, "pendenza": 1.5},
+                {"tipo": "stop_and_go", "minuti": 5, "v": 10}]}
+
+Uso:
+    python scenario.py --elenco
+    python scenario.py pendolare --seed 3 --out sim     # sim/pendolare_3.nmea e sim/pendolare_3_can.csv
+    python scenario.py mio_scenario.json --ore 4        # tratti ripetuti fino a 4 ore di guida
+    python gpstrip.py --replay sim/pendolare_3.nmea
+    python can_monitor.py --replay sim/pendolare_3_can.csv
+    python pipeline.py --test pendolare --seed 3 --velocita 20
+
+Velocità di generazione e coerenza con GPSTracker:
+    python scenario.py --bench
+"""
+
+import os
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import logconfig
+
+log = logconfig.get("scenario")
+
+PASSO = 1.0                 # Secondi tra due fix (ricevitore a 1 Hz)
+R_TERRA = 6371000           # Stesso raggio di GPSTracker.haversine
+G = 9.81
+RHO_ARIA = 1.2
+QUOTA_PARTENZA = 240.0
+RUMORE_GPS_M = 1.0          # Deviazione standard dell'errore di posizione
+
+# Bluecar: 30 kWh, ~1,1 t a vuoto
+VEICOLO = {
+    "massa_kg": 1200,
+    "crr": 0.011,
+    "cda_m2": 0.70,
+    "rendimento": 0.88,     # Batteria → ruote
+    "recupero": 0.55,       # Frazione dell'energia di frenata che torna in batteria
+    "servizi_w": 400,
+    "capacita_kwh": 30.0,
+    "acc_max": 1.5,         # m/s²
+    "dec_max": 2.5,
+}
+V_PACCO = (330.0, 410.0)    # Tensione a vuoto del pacco a 0% e a 100% (modello lineare)
+
+# Crociera e oscillazione in km/h, fermate al km, sosta in s, curvatura in gradi ogni 100 m
+TIPI = {
+    "urbano":      {"v": 45, "oscillazione": 6, "fermate_km": 1.2, "sosta": (8, 40), "curve": 30},
+    "stop_and_go": {"v": 15, "oscillazione": 5, "fermate_km": 6.0, "sosta": (3, 15), "curve": 5},
+    "extraurbano": {"v": 80, "oscillazione": 6, "fermate_km": 0.1, "sosta": (10, 30), "curve": 10},
+    "autostrada":  {"v": 120, "oscillazione": 5, "fermate_km": 0.0, "sosta": (0, 0), "curve": 2},
+}
+
+SCENARI = {
+    "citta": {
+        "carica": 80,
+        "tratti": [{"tipo": "urbano", "km": 5},
+                   {"tipo": "stop_and_go", "minuti": 10},
+                   {"tipo": "urbano", "km": 4}],
+    },
+    "pendolare": {
+        "carica": 90,
+        "perdite": {"ogni_km": 10, "secondi": (2, 8)},
+        "tratti": [{"tipo": "urbano", "km": 3},
+                   {"tipo": "extraurbano", "km": 12, "pendenza": 1.0},
+                   {"tipo": "autostrada", "km": 10},
+                   {"tipo": "autostrada", "km": 2, "galleria": True},
+                   {"tipo": "autostrada", "km": 13, "pendenza": -0.5},
+                   {"tipo": "stop_and_go", "minuti": 8},
+                   {"tipo": "urbano", "km": 2}],
+    },
+    "autostrada": {
+        "carica": 100,
+        "tratti": [{"tipo": "extraurbano", "km": 5},
+                   {"tipo": "autostrada", "km": 100},
+                   {"tipo": "extraurbano", "km": 5}],
+    },
+    "montagna": {
+        "carica": 85,
+        "perdite": {"ogni_km": 4, "secondi": (5, 20)},
+        "tratti": [{"tipo": "extraurbano", "km": 6, "pendenza": 6, "v": 60, "curve": 40},
+                   {"tipo": "extraurbano", "km": 1.5, "pendenza": 5, "v": 60, "galleria": True},
+                   {"tipo": "extraurbano", "km": 8, "pendenza": 6, "v": 55, "curve": 45},
+                   {"tipo": "extraurbano", "km": 15, "pendenza": -5.5, "v": 60, "curve": 40}],
+    },
+}
+
+
+def carica_scenario(scenario):
+    """Descrizione dello scenario da nome, file JSON o dict"""
+    if isinstance(scenario, dict):
+        return scenario
+    if scenario in SCENARI:
+        return SCENARI[scenario]
+    if os.path.exists(scenario):
+        with open(scenario, encoding="utf-8") as f:
+            return json.load(f)
+    raise ValueError(f"Scenario sconosciuto: {scenario} (disponibili: {', '.join(SCENARI)})")
+
+
+class Simulazione:
+    """Serie allineate a 1 Hz: tempo, posizione, velocità, fix, energia e carica"""
+
+    def __init__(self, nome, seed, inizio, t, lat, lon, quota, v, fix, energia, carica):
+        self.nome = nome
+        self.seed = seed
+        self.inizio = inizio        # datetime UTC del primo fix
+        self.t = t                  # s dall'inizio
+        self.lat = lat              # Posizione riportata dal ricevitore (con rumore)
+        self.lon = lon
+        self.quota = quota
+        self.v = v                  # m/s
+        self.fix = fix              # False in galleria e nelle perdite di segnale
+        self.energia = energia      # Wh prelevati dalla batteria (netti)
+        self.carica = carica        # % con decimali; il CAN riporta l'intero
+
+    @property
+    def durata(self):
+        return float(self.t[-1]) if len(self.t) else 0.0
+
+    @property
+    def km(self):
+        return float(self.v.sum()) * PASSO / 1000
+
+    def riepilogo(self):
+        km = self.km
+        return {"scenario": self.nome, "seed": self.seed, "fix": len(self.t),
+                "durata_min": self.durata / 60, "km": km,
+                "velocita_media_kmh": km / max(self.durata, 1e-9) * 3600,
+                "wh_km": float(self.energia[-1]) / max(km, 1e-9) if len(self.t) else 0.0,
+                "carica_iniziale": float(self.carica[0]) if len(self.t) else 0.0,
+                "carica_finale": float(self.carica[-1]) if len(self.t) else 0.0,
+                "secondi_senza_fix": int((~self.fix).sum())}
+
+    def frasi_nmea(self):
+        """Una $GPGGA per fix, con l'ora UTC simulata"""
+        from gpstrip import frase_gga
+        frasi = []
+        for i in range(len(self.t)):
+            ora = (self.inizio + timedelta(seconds=float(self.t[i]))).strftime("%H%M%S.00")
+            if self.fix[i]:
+                frasi.append(frase_gga(self.lat[i], self.lon[i], ora, self.quota[i]))
+            else:
+                frasi.append(frase_gga(None, None, ora, qualita=0))
+        return frasi
+
+    def pacco_can(self):
+        """(tempi, tensione, Wh prelevati) per i frame di tensione e corrente di ReplayCAN"""
+        # energia[i] è l'energia alla fine del passo i
+        tempi = np.concatenate(([0.0], self.t + PASSO))
+        carica = np.concatenate((self.carica[:1], self.carica))
+        return tempi, tensione_pacco(carica), np.concatenate(([0.0], self.energia))
+
+    def cariche_can(self):
+        """(tempi, cariche intere) ai soli cambi, come un log can_logs/battery_*.csv"""
+        intere = np.clip(np.round(self.carica), 0, 100).astype(int)
+        cambi = np.flatnonzero(np.diff(intere)) + 1
+        indici = np.concatenate(([0], cambi, [len(intere) - 1]))
+        return [float(x) for x in self.t[indici]], [int(x) for x in intere[indici]]
+
+    def scrivi(self, cartella):
+        """File .nmea (per gpstrip --replay) e _can.csv (per can_monitor --replay)"""
+        os.makedirs(cartella, exist_ok=True)
+        base = os.path.join(cartella, f"{os.path.basename(str(self.nome)).removesuffix('.json')}_{self.seed}")
+        with open(base + ".nmea", "wb") as f:
+            f.writelines(self.frasi_nmea())
+        with open(base + "_can.csv", "w") as f:
+            f.write("timestamp,charge%\n")
+            for t, carica in zip(*self.cariche_can()):
+                f.write(f"{t:.3f},{carica}\n")
+        return base + ".nmea", base + "_can.csv"
+
+
+def tensione_pacco(carica):
+    """Tensione a vuoto (V) per una carica in %"""
+    vuoto, pieno = V_PACCO
+    return vuoto + (pieno - vuoto) * np.asarray(carica) / 100
+
+
+def _profilo(tratti, veicolo, perdite, rng, durata_max=None):
+    """Velocità, accelerazione, pendenza, direzione e fix a ogni passo (ciclo a tempo discreto)"""
+    v_serie, a_serie, pend_serie, rotta_serie, fix_serie = [], [], [], [], []
+    v = 0.0
+    rotta = rng.uniform(0, 2 * math.pi)
+    acc, dec = veicolo["acc_max"], veicolo["dec_max"]
+    dec_comoda = dec * 0.6
+    ogni_km = (perdite or {}).get("ogni_km")
+    durata_perdita = (perdite or {}).get("secondi", (2, 8))
+    prossima_perdita = rng.expovariate(1 / ogni_km) * 1000 if ogni_km else math.inf
+    perdita = 0.0
+    percorso = 0.0
+    giri = 0
+    while True:
+        for tratto in tratti:
+            par = {**TIPI[tratto.get("tipo", "urbano")], **tratto}
+            crociera = par["v"] / 3.6
+            sigma = par["oscillazione"] / 3.6
+            lunghezza = par["km"] * 1000 if "km" in par else math.inf
+            fine = par["minuti"] * 60 if "minuti" in par else math.inf
+            pendenza = par.get("pendenza", 0.0)
+            galleria = bool(par.get("galleria", False))
+            curve = math.radians(par["curve"])
+            fermate = par["fermate_km"]
+            fermata = rng.expovariate(fermate) * 1000 if fermate else math.inf
+            sosta = 0.0
+            rumore = 0.0
+            fatto = trascorso = 0.0
+            while fatto < lunghezza and trascorso < fine:
+                rumore = 0.9 * rumore + rng.gauss(0, sigma * 0.44)     # AR(1), varianza stazionaria sigma²
+                obiettivo = max(0.0, crociera + rumore)
+                if sosta > 0:
+                    obiettivo = 0.0
+                    sosta -= PASSO
+                    if sosta <= 0:
+                        fermata = fatto + rng.expovariate(fermate) * 1000
+                manca = fermata - fatto
+                if sosta <= 0 and manca < v * v / (2 * dec_comoda) + v * PASSO:
+                    # Frenata verso la fermata (semaforo, coda)
+                    obiettivo = 0.0
+                    if v < 1.0 or manca < 2.0:
+                        v, obiettivo = 0.0, 0.0
+                        sosta = rng.uniform(*par["sosta"])
+                        fermata = math.inf
+                a = min(acc, max(-dec, (obiettivo - v) / PASSO))
+                v_nuova = max(0.0, v + a * PASSO)
+                a = (v_nuova - v) / PASSO
+                v = v_nuova
+                passo = v * PASSO
+                fatto += passo
+                percorso += passo
+                trascorso += PASSO
+                rotta += rng.gauss(0, curve) * passo / 100
+
+                # Perdite di segnale brevi (alberi, palazzi) oltre alle gallerie
+                if percorso >= prossima_perdita:
+                    perdita = rng.uniform(*durata_perdita)
+                    prossima_perdita = percorso + rng.expovariate(1 / ogni_km) * 1000
+                fix = not galleria and perdita <= 0
+                perdita -= PASSO
+
+                v_serie.append(v)
+                a_serie.append(a)
+                pend_serie.append(pendenza)
+                rotta_serie.append(rotta)
+                fix_serie.append(fix)
+                if durata_max is not None and len(v_serie) * PASSO >= durata_max:
+                    return v_serie, a_serie, pend_serie, rotta_serie, fix_serie
+        giri += 1
+        if durata_max is None or giri > 10_000:
+            return v_serie, a_serie, pend_serie, rotta_serie, fix_serie
+
+
+def genera(scenario="pendolare", seed=0, ore=None):
+    """
+    Simulazione dello scenario (nome, file JSON o dict). Con ore i tratti si
+    ripetono, senza soste tra un giro e l'altro, fino alla durata richiesta.
+    """
+    desc = carica_scenario(scenario)
+    nome = scenario if isinstance(scenario, str) else desc.get("nome", "scenario")
+    veicolo = {**VEICOLO, **desc.get("veicolo", {})}
+    rng = random.Random(seed)
+    v, a, pendenza, rotta, fix = (np.asarray(x) for x in _profilo(
+        desc["tratti"], veicolo, desc.get("perdite"), rng, ore * 3600 if ore else None))
+    n = len(v)
+    t = np.arange(n) * PASSO
+
+    # Posizione: integrazione della velocità lungo la rotta (quota dalla pendenza)
+    theta = np.arctan(pendenza / 100)
+    piano = v * PASSO * np.cos(theta)
+    lat0, lon0 = desc.get("partenza", (45.0703, 7.6869))
+    m_grado = math.pi * R_TERRA / 180
+    lat_vera = lat0 + np.cumsum(piano * np.cos(rotta)) / m_grado
+    lon_vera = lon0 + np.cumsum(piano * np.sin(rotta) / (m_grado * np.cos(np.radians(lat_vera))))
+    quota = QUOTA_PARTENZA + np.cumsum(v * PASSO * np.sin(theta))
+    rumore = np.random.default_rng(seed).normal(0, RUMORE_GPS_M / m_grado, (2, n))
+    lat = lat_vera + rumore[0]
+    lon = lon_vera + rumore[1] / np.cos(np.radians(lat_vera))
+
+    # Potenza alla batteria: trazione (con rendimento) o recupero in frenata, più i servizi
+    m = veicolo["massa_kg"]
+    forza = (m * a + m * G * (veicolo["crr"] * np.cos(theta) * (v > 0) + np.sin(theta))
+             + 0.5 * RHO_ARIA * veicolo["cda_m2"] * v * v)
+    ruote = forza * v
+    potenza = np.where(ruote > 0, ruote / veicolo["rendimento"], ruote * veicolo["recupero"])
+    potenza += veicolo["servizi_w"]
+    energia = np.cumsum(potenza) * PASSO / 3600
+    carica = np.clip(desc.get("carica", 90) - energia / (veicolo["capacita_kwh"] * 1000) * 100, 0, 100)
+
+    inizio = datetime.fromisoformat(desc.get("ora", "2025-06-02T07:30:00"))
+    return Simulazione(nome, seed, inizio, t, lat, lon, quota, v, fix.astype(bool), energia, carica)
+
+
+class Guida:
+    """
+    Porta una Simulazione dentro GPSTracker e BatteryMonitor veri, a velocita
+    secondi simulati per secondo reale. GPSTracker usa l'orologio simulato, così
+    velocità e distanze non dipendono dall'accelerazione. Le statistiche escono
+    da un blocco di memoria condivisa privato, letto con stats_port() come la
+    seriale STATS. consumatore_stats=False non avvia il server delle righe STATS,
+    come una COM101 che nessuno legge (prova di durata).
+    """
+
+    def __init__(self, sim, velocita=1.0, frame_al_secondo=500, consumatore_stats=True):
+        from gpstrip import GPSTracker
+        from can_monitor import BatteryMonitor, ReplayCAN
+        import shmtelemetry
+        self.sim = sim
+        self.velocita = velocita
+        self.consumatore_stats = consumatore_stats
+        self.frasi = sim.frasi_nmea()
+        nome = f"bluecar_sim_{os.getpid()}_{id(self) & 0xffff:x}"
+        self.nome_gps, self.nome_cmd = nome + "_gps", nome + "_cmd"
+        self.blocchi = (shmtelemetry.SeqlockSnapshot(self.nome_gps, shmtelemetry.GPS_CAMPI, create=True),
+                        shmtelemetry.SeqlockSnapshot(self.nome_cmd, shmtelemetry.CMD_CAMPI, create=True))
+        self.tracker = GPSTracker(*self.blocchi, porte=False)
+        self.t_sim = sim.inizio.timestamp()
+        self.tracker.orologio = self.tracker.ricezione = lambda: self.t_sim
+        self.monitor = BatteryMonitor(ReplayCAN(sim.cariche_can(), velocita, frame_al_secondo,
+                                                pacco=sim.pacco_can()))
+        # Anche il CAN sull'orologio simulato: l'energia si integra sui secondi simulati
+        inizio = sim.inizio.timestamp()
+        self.monitor.ricezione = lambda: inizio + self.monitor.can.t_sim
+        self.monitor.energia.dt_max *= max(1.0, velocita)     # Frame reali più radi in secondi simulati
+        self.running = False
+        self.finito = False
+        self.thread = None
+
+    def stats_port(self):
+        import shmtelemetry
+        return shmtelemetry.StatsPort(self.nome_gps, self.nome_cmd)
+
+    def start(self):
+        self.running = True
+        self.monitor.start()
+        if self.consumatore_stats:
+            self.tracker.t_stat.start()
+        self.thread = threading.Thread(target=self._loop, name="scenario", daemon=True)
+        self.thread.start()
+        log.info("Scenario %s (seed %s): %.1f km in %.0f min, x%g", self.sim.nome, self.sim.seed,
+                 self.sim.km, self.sim.durata / 60, self.velocita)
+        return self
+
+    def _loop(self):
+        inizio = time.perf_counter()
+        base = self.sim.inizio.timestamp()
+        for t, frase in zip(self.sim.t, self.frasi):
+            attesa = t / self.velocita - (time.perf_counter() - inizio)
+            if attesa > 0:
+                time.sleep(attesa)
+            if not self.running:
+                return
+            self.t_sim = base + float(t)
+            self.tracker._process_chunk(frase)
+        self.finito = True
+        log.info("Scenario concluso: %.1f km percorsi secondo GPSTracker", self.tracker.tot_dist / 1000)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.monitor.stop()
+        self.tracker.ferma()
+        for blocco in self.blocchi:
+            blocco.close()
+
+
+def bench(ore=10):
+    """Generazione di molte ore di guida e coerenza con la distanza misurata da GPSTracker"""
+    import tempfile
+    for nome in SCENARI:
+        t0 = time.perf_counter()
+        sim = genera(nome, seed=1, ore=ore)
+        dt = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        frasi = sim.frasi_nmea()
+        dt_nmea = time.perf_counter() - t0
+        print(f"{nome:11s} {ore} h ({len(sim.t)} fix, {sim.km:7.1f} km) generate in {dt:.2f} s + NMEA "
+              f"{dt_nmea:.2f} s: {sim.durata / (dt + dt_nmea):,.0f}x il tempo reale")
+
+    # Stesso seme, stessa uscita
+    a = b"".join(genera("pendolare", 7).frasi_nmea())
+    b = b"".join(genera("pendolare", 7).frasi_nmea())
+    c = b"".join(genera("pendolare", 8).frasi_nmea())
+    print(f"Determinismo: seed 7 {hashlib.sha256(a).hexdigest()[:12]} = {hashlib.sha256(b).hexdigest()[:12]}"
+          f" ({'uguali' if a == b else 'DIVERSI'}), seed 8 {hashlib.sha256(c).hexdigest()[:12]}")
+
+    # Le frasi passano da GPSTracker con l'orologio simulato, senza attese
+    from gpstrip import GPSTracker
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for nome in SCENARI:
+                sim = genera(nome, seed=1)
+                tracker = GPSTracker(porte=False)
+                orologio = [sim.inizio.timestamp()]
+                tracker.orologio = tracker.ricezione = lambda: orologio[0]
+                t0 = time.perf_counter()
+                for t, frase in zip(sim.t, sim.frasi_nmea()):
+                    orologio[0] = sim.inizio.timestamp() + float(t)
+                    tracker._process_chunk(frase)
+                dt = time.perf_counter() - t0
+                tracker.stats_file.close()
+                tracker.track.close()
+                r = sim.riepilogo()
+                print(f"{nome:11s} {r['km']:6.1f} km simulati, {tracker.tot_dist / 1000:6.1f} km da GPSTracker "
+                      f"({(tracker.tot_dist / 1000 - r['km']) / r['km'] * 100:+.1f}%), {r['wh_km']:.0f} Wh/km, "
+                      f"carica {r['carica_iniziale']:.0f}→{r['carica_finale']:.1f}%, "
+                      f"{r['secondi_senza_fix']} s senza fix, {len(sim.t) / dt:,.0f} fix/s")
+        finally:
+            os.chdir(cwd)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulatore di scenari di guida")
+    parser.add_argument("scenario", nargs="?", default="pendolare", help="nome o file JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ore", type=float, help="ripete i tratti fino a questa durata")
+    parser.add_argument("--out", default="sim", help="cartella dei file generati")
+    parser.add_argument("--elenco", action="store_true", help="scenari disponibili")
+    parser.add_argument("--bench", action="store_true", help="velocità di generazione e coerenza")
+    args = parser.parse_args(argv)
+    if args.bench:
+        bench()
+        return
+    if args.elenco:
+        for nome, desc in SCENARI.items():
+            r = genera(nome).riepilogo()
+            tipi = ", ".join(t.get("tipo", "urbano") + (" (galleria)" if t.get("galleria") else "")
+                             for t in desc["tratti"])
+            print(f"{nome:11s} {r['km']:6.1f} km, {r['durata_min']:5.1f} min, {r['wh_km']:4.0f} Wh/km: {tipi}")
+        return
+    sim = genera(args.scenario, args.seed, args.ore)
+    for chiave, valore in sim.riepilogo().items():
+        print(f"{chiave:20s} {valore:.2f}" if isinstance(valore, float) else f"{chiave:20s} {valore}")
+    nmea, can = sim.scrivi(args.out)
+    print(f"Scritti {nmea} e {can}")
+
+
+if __name__ == "__main__":
+    main()
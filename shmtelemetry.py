@@ -0,0 +1,189 @@
+"""
+Telemetria condivisa tra processi tramite memoria condivisa.
+
+Ogni blocco ha un solo scrittore e un numero qualsiasi di lettori, con
+protocollo seqlock: lo scrittore porta il contatore a dispari, scrive i
+campi e lo riporta a pari; il lettore copia i campi e riprova se il
+contatore era dispari o è cambiato nel frattempo. Nessun lock condiviso,
+nessuna coda: il lettore vede sempre l'ultimo valore completo.
+
+Blocchi usati dal launcher:
+- GPS: scritto da gpstrip (GPSTracker), stessi campi della riga STATS
+- CAN: scritto dal processo del monitor batteria
+- CMD: comandi dalla GUI verso gpstrip (contatore dei reset del viaggio)
+
+StatsPort e BatteryReader hanno la stessa interfaccia della seriale STATS e
+di BatteryMonitor, così TripPipeline non cambia il suo algoritmo.
+"""
+
+import time
+import struct
+from multiprocessing import shared_memory
+
+GPS_SHM = "bluecar_gps"
+CAN_SHM = "bluecar_can"
+CMD_SHM = "bluecar_cmd"
+
+GPS_CAMPI = ("timestamp", "tot_dist", "trip_dist", "avg_speed", "trip_avg_speed", "lat", "lon", "valido")
+CAN_CAMPI = ("timestamp", "carica", "t_frame", "wh")   # t_frame: ultimo 0x638 sulla base di basetempo; wh: NaN senza frame del pacco
+CMD_CAMPI = ("reset",)
+
+POLL_S = 0.002          # Attesa tra due controlli del contatore in wait()
+
+
+class SeqlockSnapshot:
+    """Blocco di memoria condivisa: contatore uint64 + campi float64"""
+
+    def __init__(self, nome, campi, create=False):
+        self.nome = nome
+        self.campi = tuple(campi)
+        self.formato = struct.Struct(f"<{len(self.campi)}d")
+        self.size = 8 + self.formato.size
+        self.creato = create
+        if create:
+            try:
+                # Un blocco rimasto da un'esecuzione interrotta viene ricreato
+                vecchio = shared_memory.SharedMemory(name=nome)
+                vecchio.close()
+                vecchio.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=nome, create=True, size=self.size)
+            self.shm.buf[:self.size] = bytes(self.size)
+        else:
+            # I processi del launcher condividono il resource_tracker del padre:
+            # il blocco viene rimosso solo quando il launcher lo chiude
+            self.shm = shared_memory.SharedMemory(name=nome)
+        self.buf = self.shm.buf
+        # Uno scrittore riavviato riprende dal contatore esistente (pari)
+        self.seq_locale = (self.seq + 1) & ~1
+
+    @property
+    def seq(self):
+        return struct.unpack_from("<Q", self.buf, 0)[0]
+
+    def write(self, *valori):
+        """Solo dal processo scrittore del blocco"""
+        seq = self.seq_locale + 1
+        struct.pack_into("<Q", self.buf, 0, seq)              # dispari: scrittura in corso
+        self.formato.pack_into(self.buf, 8, *valori)
+        struct.pack_into("<Q", self.buf, 0, seq + 1)
+        self.seq_locale = seq + 1
+
+    def read(self):
+        """(seq, valori) dell'ultima scrittura completa; valori None se mai scritto"""
+        while True:
+            prima = struct.unpack_from("<Q", self.buf, 0)[0]
+            if prima & 1:
+                time.sleep(0)
+                continue
+            valori = self.formato.unpack_from(self.buf, 8)
+            if struct.unpack_from("<Q", self.buf, 0)[0] == prima:
+                return prima, (valori if prima else None)
+
+    def read_dict(self):
+        seq, valori = self.read()
+        return None if valori is None else dict(zip(self.campi, valori))
+
+    def wait(self, seq_visto, timeout):
+        """Attende una scrittura successiva a seq_visto; restituisce (seq, valori) o None"""
+        scadenza = time.monotonic() + timeout
+        while True:
+            seq, valori = self.read()
+            if seq != seq_visto and valori is not None:
+                return seq, valori
+            if time.monotonic() >= scadenza:
+                return None
+            time.sleep(POLL_S)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.creato:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def crea_blocchi():
+    """Crea i blocchi del launcher (GPS, CAN, CMD)"""
+    return {
+        GPS_SHM: SeqlockSnapshot(GPS_SHM, GPS_CAMPI, create=True),
+        CAN_SHM: SeqlockSnapshot(CAN_SHM, CAN_CAMPI, create=True),
+        CMD_SHM: SeqlockSnapshot(CMD_SHM, CMD_CAMPI, create=True),
+    }
+
+
+class StatsPort:
+    """
+    Sostituto della seriale STATS (COM201): readline() restituisce l'ultima riga
+    STATS e in saltati quante ne sono state scritte dopo la lettura precedente
+    senza essere lette (ogni scrittura fa avanzare seq di 2).
+    """
+
+    def __init__(self, gps=GPS_SHM, cmd=CMD_SHM, timeout=1.0):
+        self.gps = SeqlockSnapshot(gps, GPS_CAMPI)
+        self.cmd = SeqlockSnapshot(cmd, CMD_CAMPI)
+        self.timeout = timeout
+        self.visto = 0
+        self.saltati = 0
+        _, valori = self.cmd.read()
+        self.reset = int(valori[0]) if valori else 0
+        self.is_open = True
+
+    def readline(self):
+        letto = self.gps.wait(self.visto, self.timeout)
+        if letto is None:
+            self.saltati = 0
+            return b""
+        self.saltati = max(0, (letto[0] - self.visto) // 2 - 1) if self.visto else 0
+        self.visto, v = letto
+        ts, tot, trip, avg, trip_avg, lat, lon, valido = v
+        return ("STATS,{:.2f},{:.2f},{:.2f},{:.2f},{:.3f},{:.6f},{:.6f},{}\n"
+                .format(tot, trip, avg, trip_avg, ts, lat, lon, "VALID" if valido else "LOST")).encode()
+
+    def write(self, data):
+        """b'R' azzera il viaggio, come sulla seriale"""
+        if b"R" in data.upper():
+            self.reset += 1
+            self.cmd.write(self.reset)
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+        self.gps.close()
+        self.cmd.close()
+
+
+class BatteryReader:
+    """Sostituto di BatteryMonitor che legge la carica scritta dal processo CAN"""
+
+    def __init__(self, can=CAN_SHM):
+        self.blocco = SeqlockSnapshot(can, CAN_CAMPI)
+
+    def get_charge(self):
+        _, valori = self.blocco.read()
+        return int(valori[1]) if valori else 0
+
+    def get_energy_wh(self):
+        """Wh integrati dal processo CAN, None se il bus non manda tensione e corrente"""
+        _, valori = self.blocco.read()
+        return valori[3] if valori and valori[3] == valori[3] else None
+
+    @property
+    def t_carica(self):
+        """Ricezione dell'ultimo 0x638 nel processo CAN (basetempo.adesso è comune ai processi)"""
+        _, valori = self.blocco.read()
+        return valori[2] if valori and valori[2] else None
+
+    def eta(self):
+        """Secondi dall'ultima scrittura del processo CAN (None se mai scritto)"""
+        _, valori = self.blocco.read()
+        return None if valori is None else time.time() - valori[0]
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.blocco.close()
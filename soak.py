@@ -0,0 +1,183 @@
+"""
+Prova di durata: molte ore di guida simulata (scenario.py) fatte passare ad
+alta velocità da GPSTracker, BatteryMonitor e TripPipeline veri, e dalla GUI
+offscreen con --gui, misurando a intervalli regolari di tempo simulato RSS,
+oggetti vivi e memoria Python allocata (tracemalloc).
+
+Dopo il riscaldamento la memoria deve restare piatta: a fine prova si
+confrontano due snapshot di tracemalloc, si stampano le righe di codice che
+hanno allocato di più nel frattempo e i contatori di overflow delle code
+limitate. Esce con codice 1 se la crescita supera le soglie.
+
+    python soak.py [--ore 24] [--velocita 2000] [--scenario pendolare] [--gui]
+    python soak.py --ore 6 --stallo-stats     # COM101 mai letta: le righe STATS si sovrascrivono
+"""
+
+import os
+import gc
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+import metrics
+import logconfig
+
+RISCALDAMENTO = 0.2         # Frazione della prova prima dello snapshot di riferimento
+TRACCIA_GUI = 500           # Punti della traccia sulla mappa durante la prova (MAX_TRACK è 20000)
+SOGLIA_PYTHON_MB = 1.0      # Crescita ammessa della memoria Python dopo il riscaldamento
+SOGLIA_RSS_MB_ORA = 0.5     # Pendenza ammessa dell'RSS (MB per ora simulata)
+CAMPIONI = 24
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource     # Senza /proc: picco, non valore corrente
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+class Prova:
+    """Campionamento della memoria mentre lo scenario scorre"""
+
+    def __init__(self, guida, pipeline, campioni=CAMPIONI):
+        self.guida = guida
+        self.pipeline = pipeline
+        self.inizio = guida.sim.inizio.timestamp()
+        self.durata = guida.sim.durata
+        self.passo = self.durata / campioni
+        self.prossimo = 0.0
+        self.righe = []         # (ore simulate, RSS MB, Python MB, oggetti, STATS non lette, cicli pipeline)
+        self.riferimento = None
+        self.finale = None
+        self.t0 = time.perf_counter()
+
+    def _non_lette(self):
+        canale = self.guida.tracker.canale_stats
+        return canale.seq - canale.letti
+
+    def controlla(self):
+        """True a prova finita"""
+        simulato = self.guida.t_sim - self.inizio
+        finito = self.guida.finito
+        if simulato >= self.prossimo or finito:
+            gc.collect()
+            self.righe.append((simulato / 3600, _rss_mb(), tracemalloc.get_traced_memory()[0] / 2**20,
+                               len(gc.get_objects()), self._non_lette(), self.pipeline.cicli))
+            r = self.righe[-1]
+            print(f"  {r[0]:6.2f} h  RSS {r[1]:7.1f} MB  Python {r[2]:6.2f} MB  oggetti {r[3]:8d}  "
+                  f"STATS non lette {r[4]:6d}  cicli {r[5]:8d}  ({time.perf_counter() - self.t0:5.1f} s)", flush=True)
+            self.prossimo += self.passo
+            if self.riferimento is None and simulato >= self.durata * RISCALDAMENTO:
+                # Lo snapshot stesso occupa memoria: la pendenza parte dal campione successivo
+                self.riferimento = (len(self.righe), _snapshot())
+        if finito and self.finale is None:
+            self.finale = _snapshot()
+        return finito
+
+    def esito(self):
+        print()
+        i, riferimento = self.riferimento
+        diff = self.finale.compare_to(riferimento, "lineno")
+        crescita = sum(d.size_diff for d in diff) / 2**20
+        print(f"Memoria Python dopo il riscaldamento: {crescita:+.3f} MB "
+              f"({len(self.righe) - i} campioni). Righe che hanno allocato di più:")
+        for d in diff[:8]:
+            print(f"  {d.size_diff / 1024:+9.1f} KiB {d.count_diff:+7d} blocchi  {d.traceback}")
+
+        dopo = np.array(self.righe[i:])
+        pendenza = float(np.polyfit(dopo[:, 0], dopo[:, 1], 1)[0]) if len(dopo) > 2 else 0.0
+        oggetti = int(dopo[-1, 3] - dopo[0, 3])
+        print(f"RSS: {dopo[0, 1]:.1f} → {dopo[-1, 1]:.1f} MB, pendenza {pendenza:+.3f} MB/ora simulata; "
+              f"oggetti {oggetti:+d}")
+
+        print("Code limitate e scarti:")
+        for nome, valore in sorted(metrics.registry.snapshot().items()):
+            if nome.endswith(("_dropped_total", "_overflow_total", "_conflated_total", "_rotations_total")):
+                print(f"  {nome:40s} {valore}")
+
+        ok = crescita <= SOGLIA_PYTHON_MB and pendenza <= SOGLIA_RSS_MB_ORA
+        print(f"Esito: {'memoria piatta' if ok else 'CRESCITA OLTRE LE SOGLIE'} "
+              f"(soglie {SOGLIA_PYTHON_MB} MB Python, {SOGLIA_RSS_MB_ORA} MB/ora RSS)")
+        return ok
+
+
+def esegui(ore=24, velocita=2000, nome="pendolare", seed=0, gui=False, stallo_stats=False):
+    import scenario
+    from pipeline import TripPipeline
+
+    tracemalloc.start()
+    sim = scenario.genera(nome, seed, ore=ore)
+    guida = scenario.Guida(sim, velocita, consumatore_stats=not stallo_stats)
+    pipeline = TripPipeline(1, periodo=0, scenario=guida)
+    prova = Prova(guida, pipeline)
+    print(f"Scenario {nome}: {ore} h simulate ({sim.km:.0f} km) a x{velocita:g}"
+          f"{', GUI offscreen' if gui else ''}{', COM101 bloccata' if stallo_stats else ''}")
+
+    if gui:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtCore import QTimer
+        from PyQt5.QtWidgets import QApplication
+        import theme
+        import mapview
+        import GUI
+        # Limite ridotto, così la traccia della mappa arriva al tetto durante la prova
+        mapview.MAX_TRACK = GUI.MAX_TRACK = TRACCIA_GUI
+        app = QApplication.instance() or QApplication(sys.argv)
+        app.setStyle("Fusion")
+        theme.manager().install("scuro")
+        finestra = GUI.BluecarMonitor(pipeline)     # Avvia anche la pipeline
+        finestra.show()
+        finestra.map_tab.build()
+        timer = QTimer()
+        timer.timeout.connect(lambda: prova.controlla() and app.quit())
+        timer.start(100)
+        app.exec_()
+        timer.stop()
+        finestra.bt_supervisor.shutdown()
+    else:
+        pipeline.start()
+        while not prova.controlla():
+            time.sleep(0.1)
+    pipeline.stop()
+    pipeline.chiudi_batteria()
+    return prova.esito()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prova di durata con memoria sotto controllo")
+    parser.add_argument("--ore", type=float, default=24, help="ore di guida simulate")
+    parser.add_argument("--velocita", type=float, default=2000, help="secondi simulati per secondo reale")
+    parser.add_argument("--scenario", default="pendolare")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gui", action="store_true", help="anche la GUI (offscreen) come sottoscrittore")
+    parser.add_argument("--stallo-stats", action="store_true", help="nessuno legge le righe STATS")
+    args = parser.parse_args(argv)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            logconfig.setup("soak", console=False)
+            ok = esegui(args.ore, args.velocita, args.scenario, args.seed, args.gui, args.stallo_stats)
+        finally:
+            logconfig.shutdown()
+            os.chdir(cwd)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Temi dell'interfaccia (chiaro/scuro) con un unico foglio di stile.
+
+Tutte le regole stanno in un solo stylesheet installato una volta sola a
+livello di QApplication: i widget vengono selezionati per objectName o per
+la proprietà dinamica "ruolo", invece di avere ognuno il proprio
+setStyleSheet. Le regole che cambiano col tema sono condizionate dalla
+proprietà "tema" della finestra principale, quindi cambiare tema significa
+cambiare quella proprietà e ripolire i widget: Qt non deve riinterpretare
+il foglio di stile.
+
+Benchmark offscreen di avvio e cambio tema:
+    QT_QPA_PLATFORM=offscreen python theme.py --bench
+"""
+
+import sys
+import time
+
+from PyQt5.QtGui import QPalette, QColor
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication, QWidget
+
+TEMI = ("chiaro", "scuro")
+
+# Pulsanti: (sfondo alto, sfondo basso, colore testo, bordo, hover alto, hover basso, bordo hover, premuto alto, premuto basso)
+_PULSANTI = {
+    "pericolo": ("#ff5555", "#cc3333", "white", "#ff7777", "#ff7777", "#dd5555", "#ff9999", "#cc3333", "#aa2222"),
+    "azione": ("#00cc66", "#00aa44", "white", "#00ee77", "#00ee77", "#00cc66", "#00ff88", "#00aa44", "#008833"),
+    "secondario": ("#3a5066", "#2a3b4d", "#00ccff", "#4a6580", "#4a6580", "#3a5066", "#5a7590", "#2a3b4d", "#1e2a38"),
+}
+
+# Extra per ruolo del pulsante (raggio e padding)
+_FORMA_PULSANTI = {
+    "pericolo": "border-radius: 8px; padding: 5px;",
+    "azione": "border-radius: 8px; padding: 5px;",
+    "secondario": "border-radius: 8px; padding: 5px;",
+    "impostazioni": "border-radius: 10px; padding: 5px;",
+    "volume": "border-radius: 40px;",
+}
+
+_ETICHETTE = {
+    "titolo": "#00ccff",
+    "valore": "#00ff88",
+    "testo": "#e0e0e0",
+    "secondario": "#a0a0a0",
+    "infoTitolo": "#ffffff",
+    "infoTesto": "#e0ffe0",
+}
+
+# Colori delle tab che dipendono dal tema: (sfondo pannello, testo tab selezionata)
+_TAB = {
+    "chiaro": ("#c8f5ff", "#0057a8"),
+    "scuro": ("#1e2a38", "#00ff88"),
+}
+
+_cache = {}
+
+
+def _gradiente(alto, basso):
+    return f"qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1, stop: 0 {alto}, stop: 1 {basso})"
+
+
+def _regole_pulsanti():
+    regole = []
+    for ruolo, forma in _FORMA_PULSANTI.items():
+        colori = _PULSANTI["secondario" if ruolo in ("impostazioni", "volume") else ruolo]
+        a, b, testo, bordo, ha, hb, hbordo, pa, pb = colori
+        sel = f'QPushButton[ruolo="{ruolo}"]'
+        regole.append(f"""
+{sel} {{
+    background: {_gradiente(a, b)};
+    color: {testo};
+    border: 2px solid {bordo};
+    {forma}
+    font-weight: bold;
+}}
+{sel}:hover {{
+    background: {_gradiente(ha, hb)};
+    border: 2px solid {hbordo};
+}}
+{sel}:pressed {{
+    background: {_gradiente(pa, pb)};
+}}""")
+    return "".join(regole)
+
+
+def _regole_tema(tema):
+    pannello, selezionata = _TAB[tema]
+    return f"""
+QWidget[tema="{tema}"] QTabWidget::pane {{
+    border: 1px solid #3a5066;
+    background: {pannello};
+}}
+QWidget[tema="{tema}"] QTabBar::tab:selected {{
+    background: {pannello};
+    color: {selezionata};
+}}"""
+
+
+def stylesheet():
+    """Foglio di stile completo (tutti i temi), costruito una volta sola"""
+    if "qss" in _cache:
+        return _cache["qss"]
+    etichette = "".join(
+        f'\nQLabel[ruolo="{ruolo}"] {{ color: {colore}; background: transparent; }}'
+        for ruolo, colore in _ETICHETTE.items())
+    qss = f"""
+QTabBar::tab {{
+    background: #2a3b4d;
+    color: #00ccff;
+    padding: 12px 20px;
+    font-size: 16px;
+    font-weight: bold;
+    border: 1px solid #3a5066;
+    border-bottom: none;
+    border-top-left-radius: 8px;
+    border-top-right-radius: 8px;
+}}
+QFrame#batteryFrame, QFrame#rangeFrame {{
+    background: {_gradiente("#2a3b4d", "#1e2a38")};
+    border: 2px solid #3a5066;
+    border-radius: 12px;
+}}
+QFrame#batteryFrame {{ padding: 5px; }}
+QFrame#rangeFrame {{ padding: 10px; }}
+QFrame#infoFrame {{
+    background: {_gradiente("#006633", "#004422")};
+    border: 2px solid #008855;
+    border-radius: 12px;
+    padding: 10px;
+}}
+QProgressBar#batteryProgress {{
+    background: #1a2530;
+    border: 2px solid #3a5066;
+    border-radius: 8px;
+    text-align: center;
+    color: white;
+    font-weight: bold;
+}}
+QProgressBar#batteryProgress::chunk {{
+    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+        stop: 0 #00ff88, stop: 0.5 #00cc66, stop: 1 #00aa44);
+    border-radius: 6px;
+    margin: 2px;
+}}
+QLabel#carImage {{ background: transparent; }}
+QLabel#carPlaceholder {{
+    background: {_gradiente("#3a5066", "#2a3b4d")};
+    color: #00ccff;
+    border: 2px solid #4a6580;
+    border-radius: 12px;
+    font-weight: bold;
+    font-size: 14px;
+}}
+QListWidget#devicesList {{
+    background: #1a2530;
+    color: #e0e0e0;
+    border: 2px solid #3a5066;
+    border-radius: 8px;
+    padding: 5px;
+}}
+QListWidget#devicesList::item {{
+    padding: 6px;
+    border-bottom: 1px solid #2a3b4d;
+}}
+QListWidget#devicesList::item:selected {{
+    background: {_gradiente("#00ccff", "#0088cc")};
+    color: white;
+    border-radius: 4px;
+}}
+QMdiArea#mapArea {{
+    background-color: #000000;
+    border: none;
+}}
+QLabel#diagnostica {{
+    background: #1a2530;
+    color: #00ff88;
+    border: 2px solid #3a5066;
+    border-radius: 8px;
+    padding: 8px;
+}}
+QMdiArea#mapArea QMdiSubWindow {{
+    background: transparent;
+    border: none;
+}}{etichette}{_regole_pulsanti()}{"".join(_regole_tema(t) for t in TEMI)}
+"""
+    _cache["qss"] = qss
+    return qss
+
+
+def palette(tema):
+    """Palette dell'applicazione per il tema, creata una volta sola"""
+    chiave = ("palette", tema)
+    if chiave in _cache:
+        return _cache[chiave]
+    if tema == "scuro":
+        pal = QPalette()
+        pal.setColor(QPalette.Window, QColor(20, 30, 40))
+        pal.setColor(QPalette.WindowText, QColor(220, 220, 220))
+        pal.setColor(QPalette.Base, QColor(25, 25, 25))
+        pal.setColor(QPalette.AlternateBase, QColor(45, 45, 45))
+        pal.setColor(QPalette.ToolTipBase, QColor(220, 220, 220))
+        pal.setColor(QPalette.ToolTipText, QColor(220, 220, 220))
+        pal.setColor(QPalette.Text, QColor(220, 220, 220))
+        pal.setColor(QPalette.Button, QColor(50, 50, 50))
+        pal.setColor(QPalette.ButtonText, QColor(220, 220, 220))
+        pal.setColor(QPalette.BrightText, Qt.red)
+        pal.setColor(QPalette.Link, QColor(42, 130, 218))
+        pal.setColor(QPalette.Highlight, QColor(42, 130, 218))
+        pal.setColor(QPalette.HighlightedText, Qt.black)
+    else:
+        pal = QApplication.instance().style().standardPalette()
+    _cache[chiave] = pal
+    return pal
+
+
+class ThemeManager:
+    """Installa il foglio di stile una volta e cambia tema con una proprietà"""
+
+    def __init__(self, app=None):
+        self.app = app or QApplication.instance()
+        self.tema = None
+        self.installato = False
+        self.ultimo_polish_ms = 0.0
+
+    def install(self, tema="chiaro"):
+        if not self.installato:
+            self.app.setStyleSheet(stylesheet())
+            self.installato = True
+        self.apply(tema)
+
+    def apply(self, tema, finestre=None):
+        """Cambia tema: palette in cache + proprietà "tema" + ripolitura dei widget"""
+        if tema not in TEMI:
+            raise ValueError(f"Tema sconosciuto: {tema}")
+        if not self.installato:
+            self.install(tema)
+            return
+        t0 = time.perf_counter()
+        self.tema = tema
+        self.app.setPalette(palette(tema))
+        for finestra in finestre or self.app.topLevelWidgets():
+            self.mark(finestra)
+            self.repolish(finestra)
+        self.ultimo_polish_ms = (time.perf_counter() - t0) * 1000
+
+    def mark(self, finestra):
+        """Imposta la proprietà del tema su una finestra (anche prima che sia creata tutta)"""
+        finestra.setProperty("tema", self.tema)
+
+    def toggle(self):
+        self.apply("scuro" if self.tema != "scuro" else "chiaro")
+        return self.tema
+
+    @staticmethod
+    def repolish(radice):
+        style = radice.style()
+        for w in [radice] + radice.findChildren(QWidget):
+            style.unpolish(w)
+            style.polish(w)
+        radice.update()
+
+
+_manager = None
+
+
+def manager():
+    """ThemeManager condiviso dell'applicazione"""
+    global _manager
+    if _manager is None:
+        _manager = ThemeManager()
+    return _manager
+
+
+def set_ruolo(widget, ruolo):
+    """Assegna il ruolo usato dal foglio di stile (QLabel/QPushButton)"""
+    widget.setProperty("ruolo", ruolo)
+    return widget
+
+
+def _vecchio_qss(tema):
+    """Foglio di stile delle tab come lo impostava la vecchia apply_*_style"""
+    pannello, selezionata = _TAB[tema]
+    return f"""
+QTabWidget::pane {{ border: 1px solid #3a5066; background: {pannello}; }}
+QTabBar::tab {{ background: #2a3b4d; color: #00ccff; padding: 12px 20px; font-size: 16px;
+    font-weight: bold; border: 1px solid #3a5066; border-bottom: none;
+    border-top-left-radius: 8px; border-top-right-radius: 8px; }}
+QTabBar::tab:selected {{ background: {pannello}; color: {selezionata}; }}
+"""
+
+
+def bench(cicli=20):
+    """Avvio della finestra e cambio tema: proprietà + ripolitura vs app.setStyleSheet"""
+    app = QApplication.instance() or QApplication(sys.argv)
+    app.setStyle("Fusion")
+    import GUI
+    from pipeline import TripPipeline
+
+    t0 = time.perf_counter()
+    temi = manager()
+    temi.install("chiaro")
+    t_qss = time.perf_counter() - t0
+
+    pipeline = TripPipeline(1)
+    pipeline.running = True     # start() della finestra non avvia lo scenario: solo grafica
+    t0 = time.perf_counter()
+    monitor = GUI.BluecarMonitor(pipeline)
+    monitor.show()
+    app.processEvents()
+    t_avvio = time.perf_counter() - t0
+    for tab in (monitor.media_tab, monitor.map_tab, monitor.settings_tab):
+        tab.build()
+    app.processEvents()
+    n = len(monitor.findChildren(QWidget))
+    print(f"Foglio di stile installato in {t_qss * 1000:.1f} ms, "
+          f"finestra ({n} widget) visibile in {t_avvio * 1000:.1f} ms")
+
+    t0 = time.perf_counter()
+    for _ in range(cicli):
+        temi.toggle()
+        app.processEvents()
+    t_nuovo = (time.perf_counter() - t0) / cicli
+    print(f"Cambio tema con proprietà: {t_nuovo * 1000:.1f} ms "
+          f"(di cui ripolitura {temi.ultimo_polish_ms:.1f} ms)")
+
+    # Vecchio metodo: ogni cambio sostituisce lo stylesheet dell'applicazione
+    t0 = time.perf_counter()
+    for i in range(cicli):
+        app.setStyleSheet(_vecchio_qss(TEMI[i % 2]) + stylesheet())
+        app.processEvents()
+    t_vecchio = (time.perf_counter() - t0) / cicli
+    print(f"Cambio tema con app.setStyleSheet: {t_vecchio * 1000:.1f} ms")
+
+    monitor.bt_supervisor.shutdown()
+    pipeline.running = False
+    monitor.close()
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        bench()
+    else:
+        print(__doc__)
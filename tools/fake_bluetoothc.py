@@ -0,0 +1,45 @@
+"""
+Finto bluetoothc.exe per provare la GUI su Linux.
+
+    BLUETOOTHC="python tools/fake_bluetoothc.py" python GUI.py
+
+`dispositivi` stampa alcuni dispositivi con un ritardo tra una riga e l'altra
+(FAKE_BT_DELAY, default 0.5 s); `dispositivi connetti <id>` resta in vita
+come il vero helper finché non viene terminato, oppure esce con errore dopo
+FAKE_BT_DROP_AFTER secondi per simulare una caduta della connessione.
+"""
+
+import os
+import sys
+import time
+
+DISPOSITIVI = [
+    "Telefono di Daniele@BTHENUM\\{0000110a}_LOCALMFG&0002\\7&1A2B3C4D&0&001122334455_C00000000",
+    "Cuffie BT@BTHENUM\\{0000110b}_LOCALMFG&0002\\7&5E6F7A8B&0&66778899AABB_C00000000",
+    "Tablet@BTHENUM\\{0000110a}_VID&0001004c_PID&7205\\8&2C3D4E5F&0&CCDDEEFF0011_C00000000",
+]
+
+
+def main(argv):
+    delay = float(os.environ.get("FAKE_BT_DELAY", "0.5"))
+    if argv[:1] == ["dispositivi"] and len(argv) == 1:
+        print("Ricerca dispositivi...", flush=True)
+        for riga in DISPOSITIVI:
+            time.sleep(delay)
+            print(riga, flush=True)
+        return 0
+    if argv[:2] == ["dispositivi", "connetti"] and len(argv) == 3:
+        time.sleep(delay)
+        print(f"Connesso a {argv[2]}", flush=True)
+        drop_after = float(os.environ.get("FAKE_BT_DROP_AFTER", "0"))
+        inizio = time.time()
+        while not drop_after or time.time() - inizio < drop_after:
+            time.sleep(0.05)
+        print("Connessione persa", flush=True)
+        return 2
+    print("uso: bluetoothc dispositivi [connetti <id>]", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,116 @@
+"""
+Archivio delle tracce GPS dei viaggi (logtrip/tracks/track_*.csv).
+
+GPSTracker scrive una riga per ogni fix valido tramite TrackWriter; per il
+disegno e l'esportazione si usano i livelli di dettaglio di TrackLOD, salvati
+accanto alla traccia (<traccia>.lod.npz) e ricalcolati solo se la traccia è
+più recente.
+
+    python trackstore.py logtrip/tracks/track_20250101_120000.csv [zoom]
+"""
+
+import os
+import sys
+import glob
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import logconfig
+from tracksimplify import TrackLOD
+
+log = logconfig.get("trackstore")
+
+TRACKS_DIR = "logtrip/tracks"
+
+
+class TrackWriter:
+    """Registra timestamp,lat,lon,velocità; un file per viaggio"""
+
+    def __init__(self, cartella=TRACKS_DIR):
+        self.cartella = cartella
+        self.lock = threading.Lock()
+        self.file = None
+        self.path = None
+
+    def _apri(self):
+        os.makedirs(self.cartella, exist_ok=True)
+        self.path = os.path.join(self.cartella, f"track_{datetime.now():%Y%m%d_%H%M%S}.csv")
+        self.file = open(self.path, "a")
+        if self.file.tell() == 0:   # Stesso secondo del viaggio precedente (reset subito dopo il primo fix)
+            self.file.write("timestamp,lat,lon,velocita\n")
+
+    def write(self, t, lat, lon, speed):
+        with self.lock:
+            if self.file is None:
+                self._apri()
+            self.file.write(f"{t:.1f},{lat:.7f},{lon:.7f},{speed:.2f}\n")
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def new_trip(self):
+        """Chiude la traccia corrente: il prossimo fix apre un nuovo file"""
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def load_track(path):
+    """Restituisce (t, lat, lon, velocita) come array NumPy"""
+    dati = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+    if dati.size == 0:
+        vuoto = np.empty(0)
+        return vuoto, vuoto, vuoto, vuoto
+    return dati[:, 0], dati[:, 1], dati[:, 2], dati[:, 3]
+
+
+def get_lod(path, lat=None, lon=None):
+    """TrackLOD della traccia, dalla cache su disco se aggiornata"""
+    cache = os.path.splitext(path)[0] + ".lod.npz"
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        try:
+            return TrackLOD.load(cache)
+        except Exception as e:
+            log.warning("Cache LOD non leggibile (%s): %s", cache, e)
+    if lat is None:
+        _, lat, lon, _ = load_track(path)
+    lod = TrackLOD(lat, lon)
+    try:
+        lod.save(cache)
+    except OSError as e:
+        log.warning("Impossibile salvare la cache LOD %s: %s", cache, e)
+    return lod
+
+
+def simplified(path, zoom):
+    """Punti (lat, lon) della traccia da disegnare o esportare allo zoom indicato"""
+    _, lat, lon, _ = load_track(path)
+    idx = get_lod(path, lat, lon).level(zoom)
+    return lat[idx], lon[idx]
+
+
+def list_tracks(cartella=TRACKS_DIR):
+    return sorted(glob.glob(os.path.join(cartella, "track_*.csv")))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        for p in list_tracks():
+            print(p)
+        sys.exit(0)
+    path = sys.argv[1]
+    _, lat, lon, _ = load_track(path)
+    lod = get_lod(path, lat, lon)
+    zooms = [int(sys.argv[2])] if len(sys.argv) > 2 else sorted(lod.levels)
+    print(f"{path}: {len(lat)} fix")
+    for z in zooms:
+        print(f"  zoom {z:2d}: {len(lod.level(z))} punti")